@@ -8,7 +8,7 @@ import threading
 
 from DIRAC import S_OK, S_ERROR, gLogger, gConfig
 from DIRAC.Core.DISET.RPCClient                     import RPCClient
-from DIRAC.Core.Utilities                           import DEncode
+from DIRAC.Core.Utilities                           import DEncode, Time
 from DIRAC.RequestManagementSystem.Client.Request   import Request
 from DIRAC.RequestManagementSystem.Client.Operation import Operation
 from DIRAC.RequestManagementSystem.Client.ReqClient import ReqClient
@@ -24,11 +24,18 @@ class DataStoreClient(object):
      - It allows to reduce the interactions with the server by building and list of
     pending Registers to be sent that are sent in a bundle using the commit method.
      - In case the DataStore is down Registers are sent as DISET requests.
+     - Bundles are bounded in number of records and in size, and are sent in a columnar
+    encoding where the key values are sent only once per bundle.
   """
   def __init__( self, setup = False, retryGraceTime = 0 ):
     self.__setup = setup
     self.__maxRecordsInABundle = 5000
+    self.__maxBundleSize = 1024 * 1024
     self.__registersList = []
+    self.__registersSize = []
+    self.__oldestRegisterTime = 0
+    self.__numKeysByType = {}
+    self.__columnarEnabled = True
     self.__maxTimeRetrying = retryGraceTime
     self.__lastSuccessfulCommit = time.time()
     self.__failoverEnabled = not gConfig.getValue( '/LocalSite/DisableFailover', False )
@@ -64,10 +71,25 @@ class DataStoreClient(object):
     if gConfig.getValue( '/LocalSite/DisableAccounting', False ):
       return S_OK()
 
-    self.__registersList.append( copy.deepcopy( register.getValues() ) )
+    values = copy.deepcopy( register.getValues() )
+    self.__registersListLock.acquire()
+    try:
+      if not self.__registersList:
+        self.__oldestRegisterTime = time.time()
+      self.__registersList.append( values )
+      self.__registersSize.append( _estimateRegisterSize( values ) )
+      self.__numKeysByType[ values[0] ] = len( register.keyFieldsList )
+    finally:
+      self.__registersListLock.release()
 
     return S_OK()
 
+  def setMaxBundleSize( self, maxBundleSize ):
+    """
+    Set the approximate maximum size in bytes of a bundle of registers sent in one call
+    """
+    self.__maxBundleSize = maxBundleSize
+
   def disableFailover( self ):
     self.__failoverEnabled = False
 
@@ -87,34 +109,73 @@ class DataStoreClient(object):
     # to take the same data second time
     self.__registersListLock.acquire()
     registersList = self.__registersList
+    registersSize = self.__registersSize
     self.__registersList = []
+    self.__registersSize = []
     self.__registersListLock.release()
 
     try:
       while registersList:
-        registersToSend = registersList[ :self.__maxRecordsInABundle ]
-        retVal = rpcClient.commitRegisters( registersToSend )
+        bundleLength = self.__getBundleLength( registersSize )
+        registersToSend = registersList[ :bundleLength ]
+        retVal = self.__sendBundle( rpcClient, registersToSend )
         if retVal[ 'OK' ]:
           self.__lastSuccessfulCommit = time.time()
         else:
           gLogger.error( 'Error sending accounting record', retVal['Message'] )
           if self.__failoverEnabled and time.time() - self.__lastSuccessfulCommit > self.__maxTimeRetrying:
             gLogger.verbose( "Sending accounting records to failover" )
-            result = _sendToFailover( retVal[ 'rpcStub' ] )
+            rpcStub = retVal[ 'rpcStub' ]
+            if rpcStub[1] == 'commitColumnarRegisters':
+              # The request may be forwarded to a DataStore not supporting the columnar encoding
+              rpcStub = ( rpcStub[0], 'commitRegisters', ( registersToSend, ) )
+            result = _sendToFailover( rpcStub )
             if not result[ 'OK' ]:
               return result
           else:
             return S_ERROR( "Cannot commit data to DataStore service" )
         sent += len( registersToSend )
-        del registersList[ :self.__maxRecordsInABundle ]
+        del registersList[ :bundleLength ]
+        del registersSize[ :bundleLength ]
     except Exception as e:  # pylint: disable=broad-except
       gLogger.exception( "Error committing", lException = e )
       return S_ERROR( "Error committing %s" % repr( e ).replace( ',)', ')' ) )
     finally:
       # if something is left because of an error return it to the main list
-      self.__registersList.extend(registersList)
+      if registersList:
+        self.__registersListLock.acquire()
+        if not self.__registersList:
+          self.__oldestRegisterTime = time.time()
+        self.__registersList.extend( registersList )
+        self.__registersSize.extend( registersSize )
+        self.__registersListLock.release()
 
     return S_OK( sent )
+
+  def __sendBundle( self, rpcClient, registersToSend ):
+    """
+    Send a bundle of registers, in the columnar encoding if the DataStore supports it
+    """
+    if self.__columnarEnabled:
+      retVal = rpcClient.commitColumnarRegisters( _encodeRegistersByColumns( registersToSend, self.__numKeysByType ) )
+      if retVal[ 'OK' ] or 'Unknown method' not in retVal[ 'Message' ]:
+        return retVal
+      # Not supported by the DataStore, the plain encoding is used from now on
+      gLogger.info( "DataStore not supporting the columnar encoding, sending the records as a list" )
+      self.__columnarEnabled = False
+    return rpcClient.commitRegisters( registersToSend )
+
+  def __getBundleLength( self, registersSize ):
+    """
+    Number of registers to send in the next bundle to respect the limits in records and size
+    """
+    bundleSize = 0
+    maxLength = min( len( registersSize ), self.__maxRecordsInABundle )
+    for i in xrange( maxLength ):
+      bundleSize += registersSize[i]
+      if bundleSize > self.__maxBundleSize:
+        return max( 1, i )
+    return maxLength
   
   def delayedCommit( self ):
     """
@@ -147,6 +208,69 @@ class DataStoreClient(object):
     """
     return self.__getRPCClient().ping()
 
+def _estimateRegisterSize( values ):
+  """ Approximate size of the encoded register
+  """
+  return 40 + len( values[0] ) + sum( [ len( str( value ) ) + 2 for value in values[3] ] )
+
+def _encodeRegistersByColumns( registersList, numKeysByType ):
+  """ Encode a list of registers grouping them by type, in columns. The values of the
+      key fields are sent only once per bundle and referenced by their index
+
+      :return: { typeName : { 'NumKeys' : number of key fields,
+                              'KeyValues' : [ [ distinct values ] per key field ],
+                              'Keys' : [ [ index in KeyValues per record ] per key field ],
+                              'Values' : [ [ value per record ] per value field ],
+                              'StartTime' : [ epoch per record ],
+                              'EndTime' : [ epoch per record ] } }
+  """
+  encoded = {}
+  keyIndexes = {}
+  for typeName, startTime, endTime, valuesList in registersList:
+    typeData = encoded.get( typeName )
+    if typeData is None:
+      numKeys = numKeysByType.get( typeName, 0 )
+      typeData = { 'NumKeys' : numKeys,
+                   'KeyValues' : [ [] for _i in range( numKeys ) ],
+                   'Keys' : [ [] for _i in range( numKeys ) ],
+                   'Values' : [ [] for _i in range( len( valuesList ) - numKeys ) ],
+                   'StartTime' : [],
+                   'EndTime' : [] }
+      encoded[ typeName ] = typeData
+      keyIndexes[ typeName ] = [ {} for _i in range( numKeys ) ]
+    numKeys = typeData[ 'NumKeys' ]
+    typeIndexes = keyIndexes[ typeName ]
+    for keyPos in range( numKeys ):
+      keyValue = valuesList[ keyPos ]
+      index = typeIndexes[ keyPos ].get( keyValue )
+      if index is None:
+        index = len( typeData[ 'KeyValues' ][ keyPos ] )
+        typeIndexes[ keyPos ][ keyValue ] = index
+        typeData[ 'KeyValues' ][ keyPos ].append( keyValue )
+      typeData[ 'Keys' ][ keyPos ].append( index )
+    for valPos in range( len( typeData[ 'Values' ] ) ):
+      typeData[ 'Values' ][ valPos ].append( valuesList[ numKeys + valPos ] )
+    typeData[ 'StartTime' ].append( int( Time.toEpoch( startTime ) ) )
+    typeData[ 'EndTime' ].append( int( Time.toEpoch( endTime ) ) )
+  return encoded
+
+def decodeRegistersByColumns( encoded ):
+  """ Decode registers encoded by _encodeRegistersByColumns
+
+      :return: list of ( typeName, startTime epoch, endTime epoch, valuesList )
+  """
+  registersList = []
+  for typeName, typeData in encoded.items():
+    keyValues = typeData[ 'KeyValues' ]
+    keysColumns = typeData[ 'Keys' ]
+    valuesColumns = typeData[ 'Values' ]
+    numKeys = typeData[ 'NumKeys' ]
+    for i in range( len( typeData[ 'StartTime' ] ) ):
+      valuesList = [ keyValues[ keyPos ][ keysColumns[ keyPos ][i] ] for keyPos in range( numKeys ) ]
+      valuesList.extend( [ column[i] for column in valuesColumns ] )
+      registersList.append( ( typeName, typeData[ 'StartTime' ][i], typeData[ 'EndTime' ][i], valuesList ) )
+  return registersList
+
 def _sendToFailover( rpcStub ):
   """ Create a ForwardDISET operation for failover
   """
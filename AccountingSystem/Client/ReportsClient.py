@@ -49,7 +49,7 @@ class ReportsClient:
                     'condDict' : condDict,
                     'grouping' : grouping,
                     'extraArgs' : extraArgs }
-    result = rpcClient.getReport( plotRequest )
+    result = rpcClient.collectRPC( 'getReport', plotRequest )
     if 'rpcStub' in result:
       del( result[ 'rpcStub' ] )
     return result
@@ -0,0 +1,91 @@
+""" Contains unit tests of DataStoreClient module
+"""
+
+import datetime
+import unittest
+
+from mock import MagicMock
+
+import DIRAC.AccountingSystem.Client.DataStoreClient as module
+from DIRAC import S_OK, S_ERROR
+
+__RCSID__ = "$Id$"
+
+START = datetime.datetime( 2016, 1, 1, 0, 0, 0 )
+END = datetime.datetime( 2016, 1, 1, 0, 10, 0 )
+
+class DataStoreClientTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    self.registers = [ ( 'DataOperation', START, END, [ 'user', 'CERN', 1, 2.5 ] ),
+                       ( 'DataOperation', START, END, [ 'user', 'IN2P3', 3, 0.5 ] ),
+                       ( 'Pilot', START, END, [ 'user', 5 ] ) ]
+    self.numKeys = { 'DataOperation' : 2, 'Pilot' : 1 }
+
+  def test_columnarEncoding( self ):
+    encoded = module._encodeRegistersByColumns( self.registers, self.numKeys )
+    self.assertEqual( encoded[ 'DataOperation' ][ 'KeyValues' ], [ [ 'user' ], [ 'CERN', 'IN2P3' ] ] )
+    self.assertEqual( encoded[ 'DataOperation' ][ 'Keys' ], [ [ 0, 0 ], [ 0, 1 ] ] )
+    self.assertEqual( encoded[ 'DataOperation' ][ 'Values' ], [ [ 1, 3 ], [ 2.5, 0.5 ] ] )
+
+    decoded = sorted( module.decodeRegistersByColumns( encoded ) )
+    startEpoch = int( module.Time.toEpoch( START ) )
+    endEpoch = int( module.Time.toEpoch( END ) )
+    self.assertEqual( decoded, sorted( [ ( typeName, startEpoch, endEpoch, values )
+                                         for typeName, _start, _end, values in self.registers ] ) )
+
+  def test_chunkedCommit( self ):
+    rpcMock = MagicMock()
+    rpcMock.commitColumnarRegisters.return_value = S_OK()
+    dsc = module.DataStoreClient()
+    dsc._DataStoreClient__getRPCClient = MagicMock( return_value = rpcMock )
+    for i in range( 10 ):
+      dsc._DataStoreClient__registersList.append( ( 'Pilot', START, END, [ 'user%d' % i, i ] ) )
+      dsc._DataStoreClient__registersSize.append( 100 )
+    dsc._DataStoreClient__numKeysByType[ 'Pilot' ] = 1
+    dsc.setMaxBundleSize( 350 )
+
+    result = dsc.commit()
+    self.assert_( result[ 'OK' ] )
+    self.assertEqual( result[ 'Value' ], 10 )
+    self.assertEqual( [ len( call[0][0][ 'Pilot' ][ 'StartTime' ] ) for call in rpcMock.commitColumnarRegisters.call_args_list ],
+                      [ 3, 3, 3, 1 ] )
+
+  def test_columnarFallback( self ):
+    rpcMock = MagicMock()
+    rpcMock.commitColumnarRegisters.return_value = S_ERROR( 'Unknown method commitColumnarRegisters' )
+    rpcMock.commitRegisters.return_value = S_OK()
+    dsc = module.DataStoreClient()
+    dsc._DataStoreClient__getRPCClient = MagicMock( return_value = rpcMock )
+    for _i in range( 2 ):
+      dsc._DataStoreClient__registersList.append( self.registers[2] )
+      dsc._DataStoreClient__registersSize.append( 100 )
+      self.assertEqual( dsc.commit()[ 'Value' ], 1 )
+    # The columnar encoding is only tried once
+    self.assertEqual( rpcMock.commitColumnarRegisters.call_count, 1 )
+    self.assertEqual( rpcMock.commitRegisters.call_count, 2 )
+
+  def test_failoverStub( self ):
+    rpcMock = MagicMock()
+    result = S_ERROR( 'Connection refused' )
+    result[ 'rpcStub' ] = ( ( 'Accounting/DataStore', {} ), 'commitColumnarRegisters', ( {}, ) )
+    rpcMock.commitColumnarRegisters.return_value = result
+    dsc = module.DataStoreClient()
+    dsc._DataStoreClient__getRPCClient = MagicMock( return_value = rpcMock )
+    dsc._DataStoreClient__failoverEnabled = True
+    dsc._DataStoreClient__registersList.append( self.registers[2] )
+    dsc._DataStoreClient__registersSize.append( 100 )
+    sendToFailover = module._sendToFailover
+    module._sendToFailover = MagicMock( return_value = S_OK() )
+    try:
+      self.assertTrue( dsc.commit()[ 'OK' ] )
+      # The failover request uses the plain encoding
+      rpcStub = module._sendToFailover.call_args[0][0]
+    finally:
+      module._sendToFailover = sendToFailover
+    self.assertEqual( rpcStub[1], 'commitRegisters' )
+    self.assertEqual( rpcStub[2], ( [ self.registers[2] ], ) )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( DataStoreClientTestCase )
+  unittest.TextTestRunner( verbosity = 2 ).run( suite )
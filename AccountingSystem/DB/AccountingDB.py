@@ -621,6 +621,8 @@ class AccountingDB( DB ):
     Do the real insert and delete from the in buffer table
     """
     self.log.verbose( "Received bundle to process", "of %s elements" % len( recordTuples ) )
+    if self.getCSOption( "BulkInsertion", True ):
+      recordTuples = self.__bulkInsertFromINTable( recordTuples )
     for record in recordTuples:
       iD, typeName, startTime, endTime, valuesList, insertionEpoch = record
       result = self.insertRecordDirectly( typeName, startTime, endTime, valuesList )
@@ -634,6 +636,176 @@ class AccountingDB( DB ):
       gMonitor.addMark( "insertiontime", Time.toEpoch() - insertionEpoch )
 
 
+  def __bulkInsertFromINTable( self, recordTuples ):
+    """
+    Insert the records type by type with insertRecordBundleDirectly and delete them from the in buffer table.
+    Returns the records that could not be inserted that way, to be retried one by one
+    """
+    recordsByType = {}
+    for record in recordTuples:
+      recordsByType.setdefault( record[1], [] ).append( record )
+    failedRecords = []
+    for typeName, typeRecords in recordsByType.items():
+      result = self.insertRecordBundleDirectly( typeName, [ ( record[2], record[3], record[4] ) for record in typeRecords ] )
+      if not result[ 'OK' ]:
+        self.log.warn( "Can't insert bundle, inserting records one by one", result[ 'Message' ] )
+        failedRecords.extend( typeRecords )
+        continue
+      idList = [ str( record[0] ) for record in typeRecords ]
+      result = self._update( "DELETE FROM `%s` WHERE id in (%s)" % ( _getTableName( "in", typeName ), ", ".join( idList ) ) )
+      if not result[ 'OK' ]:
+        self.log.error( "Can't delete rows from the IN table", result[ 'Message' ] )
+      now = Time.toEpoch()
+      for record in typeRecords:
+        gMonitor.addMark( "insertiontime", now - record[5] )
+    return failedRecords
+
+  def insertRecordBundleDirectly( self, typeName, recordsList ):
+    """
+    Add a bundle of entries of the same type. Keys are resolved once per distinct value, the raw
+    records are inserted with multi-row statements and the contributions to the buckets are summed
+    in memory so each bucket is updated only once. All is done in a single transaction.
+
+    :param str typeName: type of the records
+    :param list recordsList: list of ( startTime, endTime, valuesList ) tuples
+    """
+    if self.__readOnly:
+      return S_ERROR( "ReadOnly mode enabled. No modification allowed" )
+    if not typeName in self.dbCatalog:
+      return S_ERROR( "Type %s has not been defined in the db" % typeName )
+    if not recordsList:
+      return S_OK( 0 )
+    self.log.info( "Adding bundle of records", "for type %s: %s records" % ( typeName, len( recordsList ) ) )
+    keyNames = self.dbCatalog[ typeName ][ 'keys' ]
+    numKeys = len( keyNames )
+    numValues = len( self.dbCatalog[ typeName ][ 'values' ] )
+    #Resolve the key ids for all the distinct values in the bundle
+    keyIds = [ {} for _keyName in keyNames ]
+    for _startTime, _endTime, valuesList in recordsList:
+      if len( valuesList ) != numKeys + numValues:
+        return S_ERROR( "Fields mismatch for record %s. %s fields and %s expected" % ( typeName,
+                                                                                       len( valuesList ),
+                                                                                       numKeys + numValues ) )
+      for keyPos in range( numKeys ):
+        keyValue = valuesList[ keyPos ]
+        if keyValue not in keyIds[ keyPos ]:
+          retVal = self.__addKeyValue( typeName, keyNames[ keyPos ], keyValue )
+          if not retVal[ 'OK' ]:
+            return retVal
+          keyIds[ keyPos ][ keyValue ] = retVal[ 'Value' ]
+    #Build the raw rows and sum the contributions to each bucket
+    typeRows = []
+    bucketsData = {}
+    nowEpoch = int( Time.toEpoch( Time.dateTime() ) )
+    for startTime, endTime, valuesList in recordsList:
+      keyValues = tuple( [ keyIds[ keyPos ][ valuesList[ keyPos ] ] for keyPos in range( numKeys ) ] )
+      values = valuesList[ numKeys: ]
+      typeRows.append( list( keyValues ) + list( values ) + [ startTime, endTime ] )
+      for bStartTime, bProportion, bLength in self.calculateBuckets( typeName, startTime, endTime, nowEpoch ):
+        bucketKey = ( bStartTime, bLength, keyValues )
+        bucketValues = bucketsData.get( bucketKey )
+        if bucketValues is None:
+          bucketValues = [ 0.0 ] * ( numValues + 1 )
+          bucketsData[ bucketKey ] = bucketValues
+        for valPos in range( numValues ):
+          bucketValues[ valPos ] += float( values[ valPos ] ) * bProportion
+        #HACK: One more value in the buckets to be able to count total entries
+        bucketValues[ numValues ] += bProportion
+    retVal = self._getConnection()
+    if not retVal[ 'OK' ]:
+      return retVal
+    connObj = retVal[ 'Value' ]
+    try:
+      for _i in range( max( 1, self.__deadLockRetries ) ):
+        retVal = self.__insertBundleInTransaction( typeName, typeRows, bucketsData, connObj )
+        #A dead lock rolls back the whole transaction, it has to be restarted from the beginning
+        if retVal[ 'OK' ] or retVal[ 'Message' ].find( "try restarting transaction" ) == -1:
+          break
+        self.log.warn( "Dead lock while inserting bundle, restarting the transaction", "for type %s" % typeName )
+      if not retVal[ 'OK' ]:
+        return retVal
+    finally:
+      connObj.close()
+    gMonitor.addMark( "registeradded", len( recordsList ) )
+    gMonitor.addMark( "registeradded:%s" % typeName, len( recordsList ) )
+    return S_OK( len( recordsList ) )
+
+  def __insertBundleInTransaction( self, typeName, typeRows, bucketsData, connObj ):
+    """
+    Insert the raw records and the buckets of a bundle in a transaction, rolled back in case of error
+    """
+    retVal = self.__startTransaction( connObj )
+    if not retVal[ 'OK' ]:
+      return retVal
+    retVal = self.__insertTypeRows( typeName, typeRows, connObj = connObj )
+    if retVal[ 'OK' ]:
+      retVal = self.__writeAggregatedBuckets( typeName, bucketsData, connObj = connObj )
+    if not retVal[ 'OK' ]:
+      self.__rollbackTransaction( connObj )
+      return retVal
+    return self.__commitTransaction( connObj )
+
+  def __insertTypeRows( self, typeName, typeRows, connObj = False ):
+    """
+    Insert raw records with multi-row statements
+    """
+    sqlFields = ", ".join( [ "`%s`" % field for field in self.dbCatalog[ typeName ][ 'typeFields' ] ] )
+    rowsPerInsert = self.getCSOption( "RowsPerInsert", 1000 )
+    for iPos in range( 0, len( typeRows ), rowsPerInsert ):
+      valuesGroups = []
+      for row in typeRows[ iPos : iPos + rowsPerInsert ]:
+        retVal = self._escapeValues( row )
+        if not retVal[ 'OK' ]:
+          return retVal
+        valuesGroups.append( "( %s )" % ", ".join( retVal[ 'Value' ] ) )
+      cmd = "INSERT INTO `%s` ( %s ) VALUES %s" % ( _getTableName( "type", typeName ), sqlFields, ", ".join( valuesGroups ) )
+      retVal = self._update( cmd, conn = connObj )
+      if not retVal[ 'OK' ]:
+        return retVal
+    return S_OK()
+
+  def __writeAggregatedBuckets( self, typeName, bucketsData, connObj = False ):
+    """
+    Insert or update buckets with already summed contributions
+      bucketsData : { ( startTime, bucketLength, keyValues ) : [ value1, ..., valueN, entries ] }
+    """
+    bucketRows = []
+    for ( bStartTime, bLength, keyValues ), bucketValues in bucketsData.items():
+      bucketRows.append( ( bStartTime, bLength, keyValues, bucketValues ) )
+    rowsPerInsert = self.getCSOption( "RowsPerInsert", 1000 )
+    for iPos in range( 0, len( bucketRows ), rowsPerInsert ):
+      retVal = self.__writeBucketRows( typeName, bucketRows[ iPos : iPos + rowsPerInsert ], connObj = connObj )
+      if not retVal[ 'OK' ]:
+        return retVal
+    return S_OK()
+
+  def __writeBucketRows( self, typeName, bucketRows, connObj = False ):
+    """ Insert or update a list of ( startTime, bucketLength, keyValues, values + [ entries ] ) buckets
+    """
+    sqlFields = [ '`startTime`', '`bucketLength`', '`entriesInBucket`' ]
+    for keyName in self.dbCatalog[ typeName ][ 'keys' ]:
+      sqlFields.append( "`%s`" % keyName )
+    sqlUpData = [ "`entriesInBucket`=`entriesInBucket`+VALUES(`entriesInBucket`)" ]
+    for valueName in self.dbCatalog[ typeName ][ 'values' ]:
+      valueField = "`%s`" % valueName
+      sqlFields.append( valueField )
+      sqlUpData.append( "%s=%s+VALUES(%s)" % ( valueField, valueField, valueField ) )
+    valuesGroups = []
+    for bStartTime, bLength, keyValues, bucketValues in bucketRows:
+      sqlValues = [ bStartTime, bLength, repr( bucketValues[-1] ) ]
+      sqlValues.extend( keyValues )
+      sqlValues.extend( [ repr( value ) for value in bucketValues[:-1] ] )
+      valuesGroups.append( "( %s )" % ",".join( str( val ) for val in sqlValues ) )
+    cmd = "INSERT INTO `%s` ( %s ) " % ( _getTableName( "bucket", typeName ), ", ".join( sqlFields ) )
+    cmd += "VALUES %s " % ", ".join( valuesGroups )
+    cmd += "ON DUPLICATE KEY UPDATE %s" % ", ".join( sqlUpData )
+
+    #Not retried here: in case of dead lock the whole transaction has to be restarted
+    result = self._update( cmd, conn = connObj )
+    if not result[ 'OK' ]:
+      return S_ERROR( "Cannot update buckets: %s" % result[ 'Message' ] )
+    return result
+
   def insertRecordDirectly( self, typeName, startTime, endTime, valuesList ):
     """
     Add an entry to the type contents
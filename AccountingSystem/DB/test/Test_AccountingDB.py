@@ -0,0 +1,76 @@
+""" Unit tests of the bulk insertion of the AccountingDB, with mocked DB calls
+"""
+
+# pylint: disable=protected-access,missing-docstring,invalid-name
+
+import unittest
+
+from mock import MagicMock
+
+from DIRAC import S_OK, S_ERROR
+from DIRAC.AccountingSystem.DB.AccountingDB import AccountingDB
+
+__RCSID__ = "$Id$"
+
+DEADLOCK = S_ERROR( "Deadlock found when trying to get lock; try restarting transaction" )
+
+class AccountingDBBulkTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    # AccountingDB without connection
+    self.db = AccountingDB.__new__( AccountingDB )
+    self.db._AccountingDB__readOnly = False
+    self.db._AccountingDB__deadLockRetries = 2
+    self.db._AccountingDB__keysCache = { 'Pilot' : { 'User' : { 'user' : 1 } } }
+    self.db.dbCatalog = { 'Pilot' : { 'keys' : [ 'User' ], 'values' : [ 'Jobs' ],
+                                      'typeFields' : [ 'User', 'Jobs', 'startTime', 'endTime' ] } }
+    self.db.dbBucketsLength = { 'Pilot' : [ ( 86400 * 3650, 86400 ) ] }
+    self.db.maxBucketTime = 604800
+    self.db.log = MagicMock()
+    self.db.getCSOption = lambda _optionName, defaultValue: defaultValue
+    self.db._getConnection = MagicMock( return_value = S_OK( MagicMock() ) )
+    self.db._escapeValues = lambda values: S_OK( [ str( value ) for value in values ] )
+    self.db._query = MagicMock( return_value = S_OK() )
+    self.db._update = MagicMock( return_value = S_OK() )
+    self.records = [ ( 1000, 1000, [ 'user', 2 ] ), ( 1000, 1000, [ 'user', 3 ] ) ]
+
+  def __queries( self ):
+    return [ call[0][0] for call in self.db._query.call_args_list ]
+
+  def test_bundle( self ):
+    result = self.db.insertRecordBundleDirectly( 'Pilot', self.records )
+    self.assertTrue( result[ 'OK' ] )
+    self.assertEqual( self.__queries(), [ 'START TRANSACTION', 'COMMIT' ] )
+    # One statement for the raw records and one for the only bucket
+    statements = [ call[0][0] for call in self.db._update.call_args_list ]
+    self.assertEqual( len( statements ), 2 )
+    self.assertTrue( statements[1].startswith( 'INSERT INTO `ac_bucket_Pilot`' ) )
+    self.assertTrue( '5.0' in statements[1] )
+
+  def test_deadLock( self ):
+    # The bucket update hits a dead lock: the whole transaction is restarted
+    self.db._update.side_effect = [ S_OK(), DEADLOCK, S_OK(), S_OK() ]
+    result = self.db.insertRecordBundleDirectly( 'Pilot', self.records )
+    self.assertTrue( result[ 'OK' ] )
+    self.assertEqual( self.__queries(), [ 'START TRANSACTION', 'ROLLBACK', 'START TRANSACTION', 'COMMIT' ] )
+    statements = [ call[0][0] for call in self.db._update.call_args_list ]
+    self.assertEqual( [ statement.split( '`' )[1] for statement in statements ],
+                      [ 'ac_type_Pilot', 'ac_bucket_Pilot', 'ac_type_Pilot', 'ac_bucket_Pilot' ] )
+
+  def test_fallback( self ):
+    # Persistent dead locks: the bundle fails and its records are inserted one by one
+    self.db._update.side_effect = lambda cmd, conn = False: DEADLOCK if 'ac_bucket' in cmd else S_OK()
+    self.db.insertRecordDirectly = MagicMock( return_value = S_OK() )
+    recordTuples = [ ( i + 1, 'Pilot', startTime, endTime, values, 0 )
+                     for i, ( startTime, endTime, values ) in enumerate( self.records ) ]
+    self.db._AccountingDB__insertFromINTable( recordTuples )
+    self.assertEqual( self.__queries(), [ 'START TRANSACTION', 'ROLLBACK' ] * 2 )
+    self.assertFalse( 'COMMIT' in self.__queries() )
+    self.assertEqual( self.db.insertRecordDirectly.call_count, 2 )
+    # The records are deleted from the IN table one by one, after their insertion
+    deletions = [ call[0][0] for call in self.db._update.call_args_list if call[0][0].startswith( 'DELETE' ) ]
+    self.assertEqual( deletions, [ 'DELETE FROM `ac_in_Pilot` WHERE id=1', 'DELETE FROM `ac_in_Pilot` WHERE id=2' ] )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( AccountingDBBulkTestCase )
+  unittest.TextTestRunner( verbosity = 2 ).run( suite )
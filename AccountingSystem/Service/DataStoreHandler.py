@@ -6,6 +6,7 @@ import datetime
 
 from DIRAC import S_OK, S_ERROR, gConfig, gLogger
 from DIRAC.AccountingSystem.DB.MultiAccountingDB import MultiAccountingDB
+from DIRAC.AccountingSystem.Client.DataStoreClient import decodeRegistersByColumns
 from DIRAC.ConfigurationSystem.Client import PathFinder
 from DIRAC.Core.DISET.RequestHandler import RequestHandler,getServiceOption
 from DIRAC.Core.Utilities import Time
@@ -144,6 +145,24 @@ class DataStoreHandler( RequestHandler ):
       records.append( ( setup, entry[0], startTime, endTime, entry[3] ) )
     return self.__acDB.insertRecordBundleThroughQueue( records )
 
+  types_commitColumnarRegisters = [ dict ]
+  def export_commitColumnarRegisters( self, encodedRegisters ):
+    """
+      Add records encoded by columns (see DataStoreClient)
+    """
+    setup = self.serviceInfoDict[ 'clientSetup' ]
+    try:
+      entriesList = decodeRegistersByColumns( encodedRegisters )
+    except ( KeyError, IndexError, TypeError ) as e:
+      gLogger.error( "Invalid columnar records", repr( e ) )
+      return S_ERROR( "Invalid records" )
+    records = []
+    for typeName, startTime, endTime, valuesList in entriesList:
+      if not isinstance( typeName, basestring ) or not isinstance( startTime, ( int, long ) ) \
+         or not isinstance( endTime, ( int, long ) ):
+        return S_ERROR( "Unexpected type in report" )
+      records.append( ( setup, typeName, startTime, endTime, valuesList ) )
+    return self.__acDB.insertRecordBundleThroughQueue( records )
 
   types_compactDB = []
   def export_compactDB( self ):
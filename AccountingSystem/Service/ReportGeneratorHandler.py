@@ -18,6 +18,7 @@ from DIRAC.Core.Utilities.Plotting.Plots            import generateErrorMessageP
 from DIRAC.Core.Utilities.Plotting.FileCoding       import extractRequestFromFileId
 from DIRAC.ConfigurationSystem.Client import PathFinder
 from DIRAC.Core.DISET.RequestHandler import RequestHandler
+from DIRAC.Core.Utilities.ChunkedResult import streamResult
 
 
 __RCSID__ = "$Id$"
@@ -137,7 +138,7 @@ class ReportGeneratorHandler( RequestHandler ):
     reporter = MainReporter( self.__acDB, self.serviceInfoDict[ 'clientSetup' ] )
     gMonitor.addMark( "reportsRequested" )
     reportRequest[ 'generatePlot' ] = False
-    return reporter.generate( reportRequest, self.getRemoteCredentials() )
+    return streamResult( reporter.generate( reportRequest, self.getRemoteCredentials() ) )
 
   types_listReports = [ types.StringTypes ]
   def export_listReports( self, typeName ):
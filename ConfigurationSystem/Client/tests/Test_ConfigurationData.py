@@ -0,0 +1,115 @@
+""" Unit tests for the delta based distribution of the configuration and the lookup cache
+"""
+
+import unittest
+
+from DIRAC.ConfigurationSystem.private.ConfigurationData import ConfigurationData
+
+cfgV1 = """
+DIRAC
+{
+  Configuration
+  {
+    Name = Test
+    Version = 2016-01-01 00:00:00.000001
+  }
+}
+Systems
+{
+  WorkloadManagement
+  {
+    Option1 = 1
+    Option2 = 2
+  }
+}
+"""
+
+cfgV2 = """
+DIRAC
+{
+  Configuration
+  {
+    Name = Test
+    Version = 2016-01-02 00:00:00.000001
+  }
+}
+Systems
+{
+  WorkloadManagement
+  {
+    Option1 = 10
+    Option3 = 3
+  }
+  DataManagement
+  {
+    Option = 1
+  }
+}
+"""
+
+class TestConfigurationDataDelta( unittest.TestCase ):
+
+  def setUp( self ):
+    self.server = ConfigurationData( False )
+    self.server.setAsService()
+    self.server.loadRemoteCFGFromMem( cfgV1 )
+    self.client = ConfigurationData( False )
+    self.client.loadRemoteCFGFromMem( cfgV1 )
+
+  def test_modifications( self ):
+    v1 = self.server.getVersion()
+    self.assertFalse( self.server.getModificationsSince( v1 )[ 'OK' ] )
+    self.server.loadRemoteCFGFromMem( cfgV2 )
+    v2 = self.server.getVersion()
+
+    result = self.server.getModificationsSince( v1 )
+    self.assert_( result[ 'OK' ] )
+    # Cached delta
+    self.assert_( self.server.getModificationsSince( v1 )[ 'Value' ] is result[ 'Value' ] )
+
+    result = self.client.applyRemoteModifications( result[ 'Value' ], v2 )
+    self.assert_( result[ 'OK' ] )
+    self.assertEqual( self.client.getVersion(), v2 )
+    self.assertEqual( str( self.client.getRemoteCFG() ), str( self.server.getRemoteCFG() ) )
+
+  def test_wrongVersion( self ):
+    v1 = self.server.getVersion()
+    self.server.loadRemoteCFGFromMem( cfgV2 )
+    modList = self.server.getModificationsSince( v1 )[ 'Value' ]
+    self.assertFalse( self.client.applyRemoteModifications( modList, "bad version" )[ 'OK' ] )
+    self.assertEqual( self.client.getVersion(), v1 )
+    self.assertFalse( self.server.getModificationsSince( "unknown" )[ 'OK' ] )
+
+class TestConfigurationDataLookupCache( unittest.TestCase ):
+
+  def setUp( self ):
+    self.cfgData = ConfigurationData( False )
+    self.cfgData.loadRemoteCFGFromMem( cfgV1 )
+
+  def test_invalidation( self ):
+    self.assertEqual( self.cfgData.extractCachedOption( "/Systems/WorkloadManagement/Option1" ), "1" )
+    self.assertEqual( self.cfgData.extractCachedOption( "/Systems/WorkloadManagement/Option3" ), None )
+    self.assert_( "/Systems/WorkloadManagement/Option1" in self.cfgData.getLookupCache() )
+
+    # New remote version
+    self.cfgData.loadRemoteCFGFromMem( cfgV2 )
+    self.assertEqual( self.cfgData.extractCachedOption( "/Systems/WorkloadManagement/Option1" ), "10" )
+    self.assertEqual( self.cfgData.extractCachedOption( "/Systems/WorkloadManagement/Option3" ), "3" )
+
+    # Local modification
+    self.cfgData.setOptionInCFG( "/Systems/WorkloadManagement/Option3", "4" )
+    self.assertEqual( self.cfgData.extractCachedOption( "/Systems/WorkloadManagement/Option3" ), "4" )
+
+  def test_givenCache( self ):
+    """ Lookups done with a cache taken before a configuration change do not go to the new one
+    """
+    lookupCache = self.cfgData.getLookupCache()
+    self.cfgData.loadRemoteCFGFromMem( cfgV2 )
+    self.assertEqual( self.cfgData.extractCachedOption( "/Systems/WorkloadManagement/Option1", lookupCache ), "10" )
+    self.assert_( "/Systems/WorkloadManagement/Option1" in lookupCache )
+    self.assert_( "/Systems/WorkloadManagement/Option1" not in self.cfgData.getLookupCache() )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( TestConfigurationDataDelta )
+  suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( TestConfigurationDataLookupCache ) )
+  unittest.TextTestRunner( verbosity = 2 ).run( suite )
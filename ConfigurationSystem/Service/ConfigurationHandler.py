@@ -35,6 +35,21 @@ class ConfigurationHandler( RequestHandler ):
       retDict[ 'data' ] = gServiceInterface.getCompressedConfigurationData()
     return S_OK( retDict )
 
+  types_getModificationsIfNewer = [ basestring ]
+  def export_getModificationsIfNewer( self, sClientVersion ):
+    """ Get the modifications to apply to the client version of the configuration to get the newest one.
+        If they are not available for the client version, the whole compressed configuration is sent instead
+    """
+    sVersion = gServiceInterface.getVersion()
+    retDict = { 'newestVersion' : sVersion }
+    if sClientVersion < sVersion:
+      result = gServiceInterface.getModificationsSince( sClientVersion )
+      if result[ 'OK' ]:
+        retDict[ 'modifications' ] = result[ 'Value' ]
+      else:
+        retDict[ 'data' ] = gServiceInterface.getCompressedConfigurationData()
+    return S_OK( retDict )
+
   types_publishSlaveServer = [ basestring ]
   def export_publishSlaveServer( self, sURL ):
     gServiceInterface.publishSlaveServer( sURL )
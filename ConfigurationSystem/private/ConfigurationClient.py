@@ -73,7 +73,10 @@ class ConfigurationClient( object ):
 
   def getOption( self, optionPath, typeValue = None ):
     gRefresher.refreshConfigurationIfNeeded()
-    optionValue = gConfigurationData.extractOptionFromCFG( optionPath )
+    # The same cache has to be used for the raw and the casted values, otherwise a cast of
+    # a value of the previous configuration could end up in the cache of the new one
+    lookupCache = gConfigurationData.getLookupCache()
+    optionValue = gConfigurationData.extractCachedOption( optionPath, lookupCache )
 
     if optionValue is None:
       return S_ERROR( "Path %s does not exist or it's not an option" % optionPath )
@@ -87,21 +90,41 @@ class ConfigurationClient( object ):
     if not isinstance( typeValue, type ):
       requestedType = type( typeValue )
 
+    # The casted values are memoized with the raw ones until the configuration changes
+    cacheKey = ( optionPath, requestedType )
+    try:
+      castOK, castValue = lookupCache[ cacheKey ]
+    except KeyError:
+      castOK, castValue = self.__castValue( optionValue, typeValue, requestedType )
+      lookupCache[ cacheKey ] = ( castOK, castValue )
+    if not castOK:
+      return S_ERROR( castValue )
+    if requestedType == list:
+      # Do not share the cached list with the caller
+      return S_OK( list( castValue ) )
+    return S_OK( castValue )
+
+  @staticmethod
+  def __castValue( optionValue, typeValue, requestedType ):
+    """ Cast a raw option value to the requested type
+
+    :return: ( True, castedValue ) or ( False, errorMessage )
+    """
     if requestedType == list:
       try:
-        return S_OK( List.fromChar( optionValue, ',' ) )
+        return True, List.fromChar( optionValue, ',' )
       except Exception:
-        return S_ERROR( "Can't convert value (%s) to comma separated list" % str( optionValue ) )
+        return False, "Can't convert value (%s) to comma separated list" % str( optionValue )
     elif requestedType == bool:
       try:
-        return S_OK( optionValue.lower() in ( "y", "yes", "true", "1" ) )
+        return True, optionValue.lower() in ( "y", "yes", "true", "1" )
       except Exception:
-        return S_ERROR( "Can't convert value (%s) to Boolean" % str( optionValue ) )
+        return False, "Can't convert value (%s) to Boolean" % str( optionValue )
     else:
       try:
-        return S_OK( requestedType( optionValue ) )
+        return True, requestedType( optionValue )
       except:
-        return S_ERROR( "Type mismatch between default (%s) and configured value (%s) " % ( str( typeValue ), optionValue ) )
+        return False, "Type mismatch between default (%s) and configured value (%s) " % ( str( typeValue ), optionValue )
 
 
   def getSections( self, sectionPath, listOrdered = True ):
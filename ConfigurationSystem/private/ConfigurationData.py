@@ -26,6 +26,12 @@ class ConfigurationData( object ):
     self.threadingLock = lr.getLock()
     self.runningThreadsNumber = 0
     self.__compressedConfigurationData = None
+    # Snapshots of the remote CFG of the last versions served and deltas from them to the current one
+    self.__versionHistory = []
+    self.__modificationsCache = {}
+    self.__historyLock = lr.getLock()
+    # Memoized lookups on the merged CFG, replaced by an empty one each time the CFG changes
+    self.__lookupCache = {}
     self.configurationPath = "/DIRAC/Configuration"
     self.backupsDir = os.path.join( DIRAC.rootPath, "etc", "csbackup" )
     self._isService = False
@@ -60,6 +66,10 @@ class ConfigurationData( object ):
       self.remoteServerList.extend( List.fromChar( remoteServers, "," ) )
     self.remoteServerList = List.uniqueElements( self.remoteServerList )
     self.__compressedConfigurationData = None
+    # Has to be replaced after the mergedCFG so that no stale value gets in the new cache
+    self.__lookupCache = {}
+    if self._isService:
+      self.__recordVersion()
 
   def loadFile( self, fileName ):
     try:
@@ -92,6 +102,73 @@ class ConfigurationData( object ):
     self.unlock()
     self.sync()
 
+  def applyRemoteModifications( self, modList, newVersion ):
+    """ Update the remote CFG applying a list of modifications generated by CFG.getModifications
+
+    :param list modList: modifications to apply
+    :param str newVersion: version the remote CFG has to have once the modifications are applied
+    """
+    newCFG = self.remoteCFG.clone()
+    result = newCFG.applyModifications( modList )
+    if not result[ 'OK' ]:
+      return result
+    resultVersion = self.getVersion( newCFG )
+    if resultVersion != newVersion:
+      return S_ERROR( "Version after applying modifications is %s instead of %s" % ( resultVersion, newVersion ) )
+    self.lock()
+    self.remoteCFG = newCFG
+    self.unlock()
+    self.sync()
+    return S_OK()
+
+  def __recordVersion( self ):
+    """ Keep a snapshot of the remote CFG for each new version, to be able to compute deltas later on
+    """
+    version = self.getVersion()
+    self.dangerZoneStart()
+    try:
+      snapshot = self.remoteCFG.clone()
+    finally:
+      self.dangerZoneEnd()
+    self.__historyLock.acquire()
+    try:
+      if self.__versionHistory and self.__versionHistory[-1][0] == version:
+        # Same version but the contents may have changed (ie the servers list)
+        self.__versionHistory[-1] = ( version, snapshot )
+      else:
+        self.__versionHistory.append( ( version, snapshot ) )
+        del self.__versionHistory[ :-self.getDeltaHistorySize() - 1 ]
+      self.__modificationsCache = {}
+    finally:
+      self.__historyLock.release()
+
+  def getModificationsSince( self, oldVersion ):
+    """ Get the modifications to apply to the remote CFG of a previous version to get the current one
+
+    :param str oldVersion: version the client has
+    :return: S_OK( modList ) or S_ERROR if the version is too old or unknown
+    """
+    self.__historyLock.acquire()
+    try:
+      if oldVersion in self.__modificationsCache:
+        return S_OK( self.__modificationsCache[ oldVersion ] )
+      oldCFG = None
+      for version, cfg in self.__versionHistory[:-1]:
+        if version == oldVersion:
+          oldCFG = cfg
+          break
+      if oldCFG is None:
+        return S_ERROR( "No modifications available from version %s" % oldVersion )
+      self.dangerZoneStart()
+      try:
+        modList = oldCFG.getModifications( self.remoteCFG )
+      finally:
+        self.dangerZoneEnd()
+      self.__modificationsCache[ oldVersion ] = modList
+      return S_OK( modList )
+    finally:
+      self.__historyLock.release()
+
   def loadConfigurationData( self, fileName = False ):
     name = self.getName()
     self.lock()
@@ -161,6 +238,29 @@ class ConfigurationData( object ):
     if not disableDangerZones:
       self.dangerZoneEnd()
 
+  def getLookupCache( self ):
+    """ Get the dictionary to memoize lookups on the merged CFG.
+
+    A new dictionary is created each time the configuration changes, so values stored
+    while the configuration is being updated end up in the discarded one.
+    """
+    return self.__lookupCache
+
+  def extractCachedOption( self, path, cache = None ):
+    """ Same as extractOptionFromCFG on the merged CFG, but memoized until the configuration changes
+
+    :param dict cache: lookup cache as returned by getLookupCache, to use the same one for
+                       several lookups of the same operation
+    """
+    if cache is None:
+      cache = self.__lookupCache
+    try:
+      return cache[ path ]
+    except KeyError:
+      value = self.extractOptionFromCFG( path )
+      cache[ path ] = value
+      return value
+
   def setOptionInCFG( self, path, value, cfg = False, disableDangerZones = False ):
     if not cfg:
       cfg = self.localCFG
@@ -229,6 +329,12 @@ class ConfigurationData( object ):
     except:
       return 300
 
+  def getDeltaHistorySize( self ):
+    try:
+      return int( self.extractOptionFromCFG( "%s/DeltaHistorySize" % self.configurationPath, self.mergedCFG ) )
+    except:
+      return 10
+
   def getSlavesGraceTime( self ):
     try:
       return int( self.extractOptionFromCFG( "%s/SlavesGraceTime" % self.configurationPath, self.mergedCFG ) )
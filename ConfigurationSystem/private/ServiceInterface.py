@@ -161,6 +161,9 @@ class ServiceInterface( threading.Thread ):
   def getCompressedConfigurationData( self ):
     return gConfigurationData.getCompressedData()
 
+  def getModificationsSince( self, sVersion ):
+    return gConfigurationData.getModificationsSince( sVersion )
+
   def getVersion( self ):
     return gConfigurationData.getVersion()
 
@@ -4,6 +4,7 @@
 __RCSID__ = "$Id$"
 
 from DIRAC.Core.DISET.private.InnerRPCClient import InnerRPCClient
+from DIRAC.Core.Utilities.ChunkedResult import collectStream
 
 class _MagicMethod( object ):
 
@@ -34,6 +35,22 @@ class RPCClient( object ):
     """
     return self.__innerRPCClient.executeRPC( sFunctionName, args )
 
+  def streamRPC( self, sFunctionName, *args ):
+    """
+    Execute the RPC action receiving the result in chunks
+
+    :return: iterator over S_OK( chunk )/S_ERROR structures
+    """
+    return self.__innerRPCClient.executeStreamedRPC( sFunctionName, args )
+
+  def collectRPC( self, sFunctionName, *args ):
+    """
+    Execute the RPC action receiving the result in chunks and merge them
+
+    :return: S_OK/S_ERROR as for a regular RPC call
+    """
+    return collectStream( self.streamRPC( sFunctionName, *args ) )
+
   def __getattr__( self, attrName ):
     """ Function for emulating the existance of functions.
 
@@ -9,6 +9,7 @@ import DIRAC
 
 from DIRAC.Core.DISET.private.FileHelper import FileHelper
 from DIRAC.Core.Utilities.ReturnValues import S_OK, S_ERROR, isReturnStructure
+from DIRAC.Core.Utilities.ChunkedResult import STREAM_KEY, collectStream
 from DIRAC.FrameworkSystem.Client.Logger import gLogger
 from DIRAC.ConfigurationSystem.Client.Config import gConfig
 from DIRAC.Core.Utilities import Time
@@ -235,9 +236,9 @@ class RequestHandler( object ):
                                                                                         retVal[ 'Message' ] ) )
     args = retVal[ 'Value' ]
     self.__logRemoteQuery( "RPC/%s" % method, args )
-    return self.__RPCCallFunction( method, args )
+    return self.__RPCCallFunction( method, args, streamAccepted = retVal.get( STREAM_KEY, False ) )
 
-  def __RPCCallFunction( self, method, args ):
+  def __RPCCallFunction( self, method, args, streamAccepted = False ):
     realMethod = "export_%s" % method
     gLogger.debug( "RPC to %s" % realMethod )
     try:
@@ -254,14 +255,49 @@ class RequestHandler( object ):
     try:
       try:
         uReturnValue = oMethod( *args )
+        if isinstance( uReturnValue, types.GeneratorType ):
+          if streamAccepted:
+            return self.__sendStream( method, uReturnValue )
+          # The client does not know about streams, send the whole result at once
+          return collectStream( uReturnValue )
         return uReturnValue
       finally:
         self.__lockManager.unlock( "RPC/%s" % method )
         self.__msgBroker.removeTransport( self.__trid, closeTransport = False )
+    except RequestHandler.ConnectionError:
+      # The connection is lost, nothing can be sent back
+      raise
     except Exception as e:
       gLogger.exception( "Uncaught exception when serving RPC", "Function %s" % method, lException = e )
       return S_ERROR( "Server error while serving %s: %s" % ( method, str( e ) ) )
 
+  def __sendStream( self, method, stream ):
+    """
+    Send to the client the chunks yielded by a streaming export method
+
+    :type method: string
+    :param method: Method that generated the stream
+    :param stream: generator of S_OK/S_ERROR structures
+    :return: S_OK( number of chunks sent ) as end of stream marker/S_ERROR
+    """
+    sentChunks = 0
+    try:
+      for chunk in stream:
+        if not isReturnStructure( chunk ):
+          return S_ERROR( "Method %s yields something different from S_OK/S_ERROR" % method )
+        if not chunk[ 'OK' ]:
+          return chunk
+        chunk[ STREAM_KEY ] = True
+        result = self.__trPool.send( self.__trid, chunk )
+        if not result[ 'OK' ]:
+          raise RequestHandler.ConnectionError( "Error while streaming %s: %s" % ( method, result[ 'Message' ] ) )
+        sentChunks += 1
+    finally:
+      stream.close()
+    retVal = S_OK( sentChunks )
+    retVal[ STREAM_KEY ] = False
+    return retVal
+
   def __checkExpectedArgumentTypes( self, method, args ):
     """
     Check that the arguments received match the ones expected
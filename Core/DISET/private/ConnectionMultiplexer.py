@@ -0,0 +1,206 @@
+""" Event driven front end for the DISET services
+
+    Instead of handing every accepted connection to a worker thread that
+    blocks on the handshake and on the reception of the action proposal, the
+    ConnectionMultiplexer drives the handshakes and the reads of all the new
+    connections from a single thread, using epoll when available and select
+    otherwise. A connection is given to its service only when a complete
+    proposal has been received, so slow clients do not keep workers busy.
+"""
+
+__RCSID__ = "$Id$"
+
+import os
+import time
+import select
+import threading
+
+from DIRAC import gLogger, S_OK, S_ERROR
+
+# Size limit of the proposal, as enforced by Service._receiveAndCheckProposal
+MAX_PROPOSAL_SIZE = 1024
+
+class ConnectionMultiplexer( object ):
+
+  def __init__( self, pollTimeout = 1 ):
+    self.log = gLogger.getSubLogger( "ConnectionMultiplexer" )
+    self.__pollTimeout = pollTimeout
+    self.__lock = threading.Lock()
+    # fd -> connection dict
+    self.__connections = {}
+    self.__newConnections = []
+    self.__wakeUpRead, self.__wakeUpWrite = os.pipe()
+    if hasattr( select, 'epoll' ):
+      self.__epoll = select.epoll()
+      self.__epoll.register( self.__wakeUpRead, select.EPOLLIN )
+    else:
+      self.__epoll = None
+    self.__thread = threading.Thread( target = self.__loop, name = "ConnectionMultiplexer" )
+    self.__thread.setDaemon( 1 )
+    self.__thread.start()
+
+  def addConnection( self, clientTransport, readyCallback, timeout = 30 ):
+    """ Start handling a new connection
+
+        :param clientTransport: transport of the accepted connection
+        :param readyCallback: function called with the transport, the accept time and the handshake
+                              time once the proposal can be received without blocking
+        :param int timeout: seconds allowed to the client to complete the handshake and send the proposal
+    """
+    now = time.time()
+    connection = { 'transport' : clientTransport,
+                   'callback' : readyCallback,
+                   'acceptTime' : now,
+                   'deadline' : now + timeout,
+                   'handshakeTime' : 0,
+                   'handshaken' : False,
+                   'wantsWrite' : False }
+    try:
+      clientTransport.setBlocking( False )
+    except Exception as e:
+      self.log.warn( "Cannot make the connection non blocking, handling it in a worker", str( e ) )
+      readyCallback( clientTransport, now, 0, False )
+      return
+    with self.__lock:
+      self.__newConnections.append( connection )
+    os.write( self.__wakeUpWrite, "x" )
+
+  def getNumConnections( self ):
+    """ Number of connections waiting for the handshake or the proposal
+    """
+    with self.__lock:
+      return len( self.__connections ) + len( self.__newConnections )
+
+  def __registerNewConnections( self ):
+    with self.__lock:
+      newConnections = self.__newConnections
+      self.__newConnections = []
+    for connection in newConnections:
+      fd = connection[ 'transport' ].getSocket().fileno()
+      self.__connections[ fd ] = connection
+      if self.__epoll:
+        self.__epoll.register( fd, select.EPOLLIN | select.EPOLLERR | select.EPOLLHUP )
+      # Some data might already be there
+      self.__progress( fd )
+
+  def __setWantsWrite( self, fd, wantsWrite ):
+    """ Wait for the socket to be writable instead of readable, or the other way around
+    """
+    connection = self.__connections[ fd ]
+    if connection[ 'wantsWrite' ] == wantsWrite:
+      return
+    connection[ 'wantsWrite' ] = wantsWrite
+    if self.__epoll:
+      event = select.EPOLLOUT if wantsWrite else select.EPOLLIN
+      self.__epoll.modify( fd, event | select.EPOLLERR | select.EPOLLHUP )
+
+  def __unregister( self, fd ):
+    connection = self.__connections.pop( fd )
+    if self.__epoll:
+      try:
+        self.__epoll.unregister( fd )
+      except Exception:
+        pass
+    return connection
+
+  def __poll( self ):
+    if self.__epoll:
+      try:
+        return [ fd for fd, _event in self.__epoll.poll( self.__pollTimeout ) ]
+      except IOError:
+        # Interrupted system call
+        return []
+    readList = [ self.__wakeUpRead ]
+    writeList = []
+    for fd, connection in self.__connections.items():
+      if connection[ 'wantsWrite' ]:
+        writeList.append( fd )
+      else:
+        readList.append( fd )
+    try:
+      readyList, writableList = select.select( readList, writeList, [], self.__pollTimeout )[:2]
+      readyList += writableList
+    except ( select.error, ValueError ):
+      # One of the sockets has been closed, find it the hard way
+      readyList = []
+      for fd in list( self.__connections ):
+        try:
+          select.select( [ fd ], [], [], 0 )
+        except ( select.error, ValueError ):
+          self.__drop( fd, "Invalid socket" )
+    return readyList
+
+  def __loop( self ):
+    while True:
+      try:
+        for fd in self.__poll():
+          if fd == self.__wakeUpRead:
+            os.read( self.__wakeUpRead, 4096 )
+          elif fd in self.__connections:
+            self.__progress( fd )
+        self.__registerNewConnections()
+        self.__expireConnections()
+      except Exception:
+        self.log.exception( "Unexpected error in the connection multiplexer loop" )
+
+  def __progress( self, fd ):
+    """ Advance the handshake or the reception of the proposal of a connection
+    """
+    connection = self.__connections[ fd ]
+    transport = connection[ 'transport' ]
+    if not connection[ 'handshaken' ]:
+      try:
+        result = transport.handshakeStep()
+      except Exception as e:
+        self.__drop( fd, "Exception while handshaking: %s" % str( e ) )
+        return
+      if not result[ 'OK' ]:
+        self.__drop( fd, result[ 'Message' ] )
+        return
+      if not result[ 'Value' ]:
+        self.__setWantsWrite( fd, transport.handshakeWantsWrite() )
+        return
+      self.__setWantsWrite( fd, False )
+      connection[ 'handshaken' ] = True
+      connection[ 'handshakeTime' ] = time.time() - connection[ 'acceptTime' ]
+    try:
+      result = transport.readAvailableData( MAX_PROPOSAL_SIZE )
+    except Exception as e:
+      self.__drop( fd, "Exception while reading the proposal: %s" % str( e ) )
+      return
+    if not result[ 'OK' ]:
+      self.__drop( fd, result[ 'Message' ] )
+      return
+    if not result[ 'Value' ]:
+      return
+    # The proposal is there, give it to the service
+    self.__unregister( fd )
+    try:
+      transport.setBlocking( True )
+      connection[ 'callback' ]( transport, connection[ 'acceptTime' ], connection[ 'handshakeTime' ], True )
+    except Exception:
+      self.log.exception( "Error while dispatching connection" )
+      transport.close()
+
+  def __drop( self, fd, reason ):
+    connection = self.__unregister( fd )
+    self.log.verbose( "Dropping connection", "%s: %s" % ( connection[ 'transport' ].getRemoteAddress(), reason ) )
+    try:
+      connection[ 'transport' ].close()
+    except Exception:
+      pass
+
+  def __expireConnections( self ):
+    now = time.time()
+    for fd in [ fd for fd in self.__connections if self.__connections[ fd ][ 'deadline' ] < now ]:
+      self.__drop( fd, "Timeout while waiting for the handshake and the proposal" )
+
+gConnectionMultiplexer = None
+gMultiplexerLock = threading.Lock()
+
+def getGlobalConnectionMultiplexer():
+  global gConnectionMultiplexer
+  with gMultiplexerLock:
+    if not gConnectionMultiplexer:
+      gConnectionMultiplexer = ConnectionMultiplexer()
+  return gConnectionMultiplexer
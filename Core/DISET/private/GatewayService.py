@@ -202,7 +202,7 @@ class GatewayService( Service ):
 
   def __forwardRPCCall( self, targetService, clientInitArgs, method, params ):
     if targetService == "Configuration/Server":
-      if method == "getCompressedDataIfNewer":
+      if method in ( "getCompressedDataIfNewer", "getModificationsIfNewer" ):
         #Relay CS data directly
         serviceVersion = gConfigurationData.getVersion()
         retDict = { 'newestVersion' : serviceVersion }
@@ -4,7 +4,8 @@
 __RCSID__ = "$Id$"
 
 from DIRAC.Core.DISET.private.BaseClient import BaseClient
-from DIRAC.Core.Utilities.ReturnValues import S_OK
+from DIRAC.Core.Utilities.ReturnValues import S_OK, S_ERROR, isReturnStructure
+from DIRAC.Core.Utilities.ChunkedResult import STREAM_KEY
 
 
 class InnerRPCClient( BaseClient ):
@@ -41,3 +42,46 @@ class InnerRPCClient( BaseClient ):
       return receivedData
     finally:
       self._disconnect( trid )
+
+  def executeStreamedRPC( self, functionName, args ):
+    """ Generator executing an RPC call whose result is received in chunks.
+        Services that do not stream the method send the whole result in one go,
+        in which case it is the only yielded value.
+    """
+    stub = ( self._getBaseStub(), functionName, args )
+    retVal = self._connect()
+    if not retVal[ 'OK' ]:
+      retVal[ 'rpcStub' ] = stub
+      yield retVal
+      return
+    trid, transport = retVal[ 'Value' ]
+    try:
+      retVal = self._proposeAction( transport, ( "RPC", functionName ) )
+      if not retVal[ 'OK' ]:
+        retVal[ 'rpcStub' ] = stub
+        yield retVal
+        return
+      request = S_OK( args )
+      request[ STREAM_KEY ] = True
+      retVal = transport.sendData( request )
+      if not retVal[ 'OK' ]:
+        yield retVal
+        return
+      while True:
+        receivedData = transport.receiveData()
+        if not isReturnStructure( receivedData ):
+          yield S_ERROR( "Invalid data received while streaming %s" % functionName )
+          return
+        streamFlag = receivedData.pop( STREAM_KEY, None )
+        if streamFlag:
+          yield receivedData
+          continue
+        if not receivedData[ 'OK' ]:
+          receivedData[ 'rpcStub' ] = stub
+          yield receivedData
+        elif streamFlag is None:
+          # The service sent the whole result at once
+          yield receivedData
+        return
+    finally:
+      self._disconnect( trid )
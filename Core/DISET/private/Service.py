@@ -11,6 +11,7 @@ from DIRAC.FrameworkSystem.Client.MonitoringClient import MonitoringClient
 from DIRAC.Core.DISET.private.ServiceConfiguration import ServiceConfiguration
 from DIRAC.Core.DISET.private.TransportPool import getGlobalTransportPool
 from DIRAC.Core.DISET.private.MessageBroker import MessageBroker, MessageSender
+from DIRAC.Core.DISET.private.ConnectionMultiplexer import getGlobalConnectionMultiplexer
 from DIRAC.Core.Utilities.ThreadScheduler import gThreadScheduler
 from DIRAC.Core.Utilities.ThreadPool import ThreadPool
 from DIRAC.Core.Utilities.ReturnValues import isReturnStructure
@@ -44,6 +45,7 @@ class Service( object ):
     self._transportPool = getGlobalTransportPool()
     self.__cloneId = 0
     self.__maxFD = 0
+    self._connectionMultiplexer = None
 
   def setCloneProcessId( self, cloneId ):
     self.__cloneId = cloneId
@@ -66,6 +68,9 @@ class Service( object ):
     if not result[ 'OK' ]:
       return result
     self._handler = result[ 'Value' ]
+    if self._cfg.useEventDrivenIO():
+      gLogger.info( "Handshakes and proposals of %s will be handled by the connection multiplexer" % self._name )
+      self._connectionMultiplexer = getGlobalConnectionMultiplexer()
     #Initialize lock manager
     self._lockManager = LockManager( self._cfg.getMaxWaitingPetitions() )
     self._initMonitoring()
@@ -222,6 +227,16 @@ class Service( object ):
     self._monitor.registerActivity( 'ActiveQueries', "Active queries", 'Framework', 'threads', MonitoringClient.OP_MEAN )
     self._monitor.registerActivity( 'RunningThreads', "Running threads", 'Framework', 'threads', MonitoringClient.OP_MEAN )
     self._monitor.registerActivity( 'MaxFD', "Max File Descriptors", 'Framework', 'fd', MonitoringClient.OP_MEAN )
+    self._monitor.registerActivity( 'ServeTime', "Time serving a query", 'Framework', 'seconds', MonitoringClient.OP_MEAN )
+    if self._connectionMultiplexer:
+      self._monitor.registerActivity( 'WaitingConnections', "Connections waiting for handshake or proposal",
+                                      'Framework', 'connections', MonitoringClient.OP_MEAN )
+      self._monitor.registerActivity( 'HandshakeTime', "Time to receive handshake and proposal",
+                                      'Framework', 'seconds', MonitoringClient.OP_MEAN )
+      self._monitor.registerActivity( 'QueueTime', "Time waiting for a free thread",
+                                      'Framework', 'seconds', MonitoringClient.OP_MEAN )
+      self._monitor.registerActivity( 'RejectedConnections', "Connections rejected with a full queue",
+                                      'Framework', 'connections', MonitoringClient.OP_SUM )
 
     self._monitor.setComponentExtraParam( 'DIRACVersion', DIRAC.version )
     self._monitor.setComponentExtraParam( 'platform', DIRAC.getPlatform() )
@@ -245,6 +260,8 @@ class Service( object ):
     self._monitor.addMark( 'RunningThreads', threading.activeCount() )
     self._monitor.addMark( 'MaxFD', self.__maxFD )
     self.__maxFD = 0
+    if self._connectionMultiplexer:
+      self._monitor.addMark( 'WaitingConnections', self._connectionMultiplexer.getNumConnections() )
 
 
   def getConfig( self ):
@@ -255,11 +272,32 @@ class Service( object ):
   def handleConnection( self, clientTransport ):
     self._stats[ 'connections' ] += 1
     self._monitor.setComponentExtraParam( 'queries', self._stats[ 'connections' ] )
+    if self._connectionMultiplexer:
+      self._connectionMultiplexer.addConnection( clientTransport, self._handleReadyConnection,
+                                                 self._cfg.getHandshakeTimeout() )
+      return
     self._threadPool.generateJobAndQueueIt( self._processInThread,
                                              args = ( clientTransport, ) )
 
+  def _handleReadyConnection( self, clientTransport, acceptTime, handshakeTime, handshaken ):
+    """
+    Called by the connection multiplexer when the proposal of a connection can be read
+    without blocking. The I/O thread can't wait, so the connection is rejected if the queue is full
+    """
+    if handshaken:
+      self._monitor.addMark( 'HandshakeTime', handshakeTime )
+    result = self._threadPool.generateJobAndQueueIt( self._processInThread,
+                                                     args = ( clientTransport, handshaken, time.time() ),
+                                                     blocking = False )
+    if not result[ 'OK' ]:
+      self._monitor.addMark( 'RejectedConnections' )
+      gLogger.warn( "Rejecting connection", "%s: %s" % ( clientTransport.getRemoteAddress(), result[ 'Message' ] ) )
+      clientTransport.close()
+
   #Threaded process function
-  def _processInThread( self, clientTransport ):
+  def _processInThread( self, clientTransport, handshaken = False, queuedTime = None ):
+    if queuedTime:
+      self._monitor.addMark( 'QueueTime', time.time() - queuedTime )
     self.__maxFD = max( self.__maxFD, clientTransport.oSocket.fileno() )
     self._lockManager.lockGlobal()
     try:
@@ -268,13 +306,14 @@ class Service( object ):
       monReport = False
     try:
       #Handshake
-      try:
-        result = clientTransport.handshake()
-        if not result[ 'OK' ]:
-          clientTransport.close()
+      if not handshaken:
+        try:
+          result = clientTransport.handshake()
+          if not result[ 'OK' ]:
+            clientTransport.close()
+            return
+        except:
           return
-      except:
-        return
       #Add to the transport pool
       trid = self._transportPool.add( clientTransport )
       if not trid:
@@ -516,6 +555,7 @@ class Service( object ):
 
   def __endReportToMonitoring( self, initialWallTime, initialCPUTime ):
     wallTime = time.time() - initialWallTime
+    self._monitor.addMark( 'ServeTime', wallTime )
     stats = os.times()
     cpuTime = stats[0] + stats[2] - initialCPUTime
     percentage = cpuTime / wallTime * 100.
@@ -80,6 +80,16 @@ class ServiceConfiguration:
     except:
       return 15
 
+  def useEventDrivenIO( self ):
+    optionValue = self.getOption( "EventDrivenIO" )
+    return str( optionValue ).lower() in ( "true", "yes", "y", "1" )
+
+  def getHandshakeTimeout( self ):
+    try:
+      return int( self.getOption( "HandshakeTimeout" ) )
+    except:
+      return 30
+
   def getCloneProcesses( self ):
     try:
       return int( self.getOption( "CloneProcesses" ) )
@@ -4,7 +4,9 @@
 __RCSID__ = "$Id$"
 
 import time
+import errno
 import select
+import socket
 import cStringIO
 from hashlib import md5
 
@@ -57,6 +59,26 @@ class BaseTransport( object ):
   def handshake( self ):
     return S_OK()
 
+  def handshakeStep( self ):
+    """ Advance the server handshake without blocking
+
+        :return: S_OK( True ) once the handshake is done, S_OK( False ) if it has to wait for the peer
+    """
+    return S_OK( True )
+
+  def handshakeWantsWrite( self ):
+    """ Tell if the last handshakeStep has to wait for the socket to be writable instead of readable
+    """
+    return False
+
+  def setBlocking( self, blocking ):
+    """ Switch the socket between blocking and non blocking mode
+    """
+    if blocking:
+      self.oSocket.settimeout( self.extraArgsDict.get( 'timeout' ) )
+    else:
+      self.oSocket.setblocking( 0 )
+
   def close( self ):
     self.oSocket.close()
 
@@ -112,9 +134,59 @@ class BaseTransport( object ):
     except Exception as e:
       return S_ERROR( "Exception while reading from peer: %s" % str( e ) )
 
+  def _readNonBlocking( self, bufSize = 16384 ):
+    """ Read from a non blocking socket
+
+        :return: S_OK( data ), S_OK( None ) if there is nothing to read, S_ERROR if the connection is gone
+    """
+    try:
+      data = self.oSocket.recv( bufSize )
+    except socket.error as e:
+      if e.args and e.args[0] in ( errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR ):
+        return S_OK( None )
+      return S_ERROR( "Exception while reading from peer: %s" % str( e ) )
+    if not data:
+      return S_ERROR( "Connection closed by peer" )
+    return S_OK( data )
+
   def _write( self, buffer ):
     return S_OK( self.oSocket.send( buffer ) )
 
+  def hasCompleteMessage( self ):
+    """ Check if a whole message is already buffered, so receiveData will not block
+    """
+    if self.receivedMessages:
+      return True
+    byteStream = self.byteStream
+    if byteStream.find( BaseTransport.keepAliveMagic, 0, len( BaseTransport.keepAliveMagic ) ) == 0:
+      byteStream = byteStream[ len( BaseTransport.keepAliveMagic ): ]
+    iSeparatorPosition = byteStream.find( ":", 0, 10 )
+    if iSeparatorPosition == -1:
+      return False
+    try:
+      pkgSize = int( byteStream[ :iSeparatorPosition ] )
+    except ValueError:
+      # Garbage, receiveData will complain about it
+      return True
+    return len( byteStream ) - iSeparatorPosition - 1 >= pkgSize
+
+  def readAvailableData( self, maxBufferSize = 0 ):
+    """ Buffer the data available in a non blocking socket
+
+        :return: S_OK( True ) if receiveData can be called without blocking, S_OK( False ) otherwise
+    """
+    while not self.hasCompleteMessage():
+      if maxBufferSize and len( self.byteStream ) > maxBufferSize:
+        # Let receiveData report the error
+        return S_OK( True )
+      retVal = self._readNonBlocking()
+      if not retVal[ 'OK' ]:
+        return retVal
+      if retVal[ 'Value' ] is None:
+        return S_OK( False )
+      self.byteStream += retVal[ 'Value' ]
+    return S_OK( True )
+
   def sendData( self, uData, prefix = False ):
     self.__updateLastActionTimestamp()
     sCodedData = DEncode.encode( uData )
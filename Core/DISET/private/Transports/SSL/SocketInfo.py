@@ -23,6 +23,8 @@ class SocketInfo:
 
   def __init__( self, infoDict, sslContext = None ):
     self.__retry = 0
+    self.__acceptStateSet = False
+    self.handshakeWantsWrite = False
     self.infoDict = infoDict
     if sslContext:
       self.sslContext = sslContext
@@ -301,6 +303,30 @@ class SocketInfo:
     self.sslSocket.set_accept_state()
     return self.__sslHandshake()
 
+  def doServerHandshakeStep( self ):
+    """ Advance the server handshake on a non blocking socket
+
+        :return: S_OK( credentials ) once done, S_OK( None ) if it has to wait for the socket,
+                 handshakeWantsWrite telling if it waits to write or to read
+    """
+    if not self.__acceptStateSet:
+      self.sslSocket.set_accept_state()
+      self.__acceptStateSet = True
+    self.handshakeWantsWrite = False
+    try:
+      self.sslSocket.do_handshake()
+    except GSI.SSL.WantReadError:
+      return S_OK( None )
+    except GSI.SSL.WantWriteError:
+      self.handshakeWantsWrite = True
+      return S_OK( None )
+    except Exception, v:
+      gLogger.warn( "Error while handshaking", v )
+      return S_ERROR( "Error while handshaking" )
+    credentialsDict = self.gatherPeerCredentials()
+    gLogger.debug( "", "Authenticated peer (%s)" % credentialsDict[ 'DN' ] )
+    return S_OK( credentialsDict )
+
   #@gSynchro
   def __sslHandshake( self ):
     start = time.time()
@@ -94,12 +94,32 @@ class SSLTransport( BaseTransport ):
     retVal = self.oSocketInfo.doServerHandshake()
     if not retVal[ 'OK' ]:
       return retVal
-    creds = retVal[ 'Value' ]
+    self.__setPeerCredentials( retVal[ 'Value' ] )
+    return S_OK()
+
+  def handshakeStep( self ):
+    retVal = self.oSocketInfo.doServerHandshakeStep()
+    if not retVal[ 'OK' ]:
+      return retVal
+    if retVal[ 'Value' ] is None:
+      return S_OK( False )
+    self.__setPeerCredentials( retVal[ 'Value' ] )
+    return S_OK( True )
+
+  def handshakeWantsWrite( self ):
+    return self.oSocketInfo.handshakeWantsWrite
+
+  def __setPeerCredentials( self, creds ):
     if not self.oSocket.session_reused():
       gLogger.debug( "New session connecting from client at %s" % str( self.getRemoteAddress() ) )
     for key in creds.keys():
       self.peerCredentials[ key ] = creds[ key ]
-    return S_OK()
+
+  def setBlocking( self, blocking ):
+    if blocking:
+      self.oSocket.settimeout( self.oSocketInfo.infoDict[ 'timeout' ] )
+    else:
+      self.oSocket.setblocking( 0 )
 
   def setClientSocket( self, oSocket ):
     if self.serverMode():
@@ -143,6 +163,23 @@ class SSLTransport( BaseTransport ):
     finally:
       self.__unlock()
 
+  def _readNonBlocking( self, bufSize = 16384 ):
+    self.__lock()
+    try:
+      try:
+        data = self.oSocket.recv( bufSize )
+      except ( GSI.SSL.WantReadError, GSI.SSL.WantWriteError ):
+        return S_OK( None )
+      except GSI.SSL.ZeroReturnError:
+        return S_ERROR( "Connection closed by peer" )
+      except Exception as e:
+        return S_ERROR( "Exception while reading from peer: %s" % str( e ) )
+      if not data:
+        return S_ERROR( "Connection closed by peer" )
+      return S_OK( data )
+    finally:
+      self.__unlock()
+
   def isLocked( self ):
     return self.__locked
 
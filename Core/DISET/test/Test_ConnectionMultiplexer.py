@@ -0,0 +1,207 @@
+""" unit tests for the non blocking reads of the transports, the ConnectionMultiplexer
+    and the dispatching of its connections by the Service, over socket pairs
+"""
+
+# pylint: disable=missing-docstring,invalid-name,protected-access
+
+import time
+import socket
+import unittest
+import threading
+
+from mock import MagicMock
+
+from DIRAC import S_OK, S_ERROR
+from DIRAC.Core.Utilities import DEncode
+from DIRAC.Core.DISET.private.Transports.PlainTransport import PlainTransport
+from DIRAC.Core.DISET.private.ConnectionMultiplexer import ConnectionMultiplexer
+from DIRAC.Core.DISET.private.Service import Service
+
+PROPOSAL = ( ( 'Framework/Test', 'aSetup', 'aVO' ), 'RPC/ping', '' )
+
+def encodeMessage( uData ):
+  data = DEncode.encode( uData )
+  return "%s:%s" % ( len( data ), data )
+
+def getTransportPair():
+  """ Server side PlainTransport and the client socket connected to it
+  """
+  serverSocket, clientSocket = socket.socketpair()
+  transport = PlainTransport( 'test' )
+  transport.setClientSocket( serverSocket )
+  return transport, clientSocket
+
+def waitFor( condition, timeout = 5 ):
+  end = time.time() + timeout
+  while not condition() and time.time() < end:
+    time.sleep( 0.01 )
+  return condition()
+
+class NonBlockingReadTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    self.transport, self.client = getTransportPair()
+    self.transport.setBlocking( False )
+
+  def tearDown( self ):
+    self.transport.close()
+    self.client.close()
+
+  def test_readAvailableData( self ):
+    message = encodeMessage( PROPOSAL )
+    result = self.transport.readAvailableData()
+    self.assertEqual( result, S_OK( False ) )
+    self.client.sendall( message[:2] )
+    self.assertEqual( self.transport.readAvailableData(), S_OK( False ) )
+    self.client.sendall( message[2:-1] )
+    self.assertEqual( self.transport.readAvailableData(), S_OK( False ) )
+    self.assertFalse( self.transport.hasCompleteMessage() )
+    self.client.sendall( message[-1:] )
+    self.assertEqual( self.transport.readAvailableData(), S_OK( True ) )
+    self.assertTrue( self.transport.hasCompleteMessage() )
+    self.transport.setBlocking( True )
+    self.assertEqual( self.transport.receiveData(), PROPOSAL )
+
+  def test_hasCompleteMessage( self ):
+    self.assertFalse( self.transport.hasCompleteMessage() )
+    self.transport.byteStream = "%s%s" % ( PlainTransport.keepAliveMagic, encodeMessage( 'ping' ) )
+    self.assertTrue( self.transport.hasCompleteMessage() )
+    self.transport.byteStream = "12"
+    self.assertFalse( self.transport.hasCompleteMessage() )
+    # Garbage is left to receiveData
+    self.transport.byteStream = "abc:def"
+    self.assertTrue( self.transport.hasCompleteMessage() )
+
+  def test_limits( self ):
+    self.client.sendall( "5000:" + "x" * 2000 )
+    self.assertEqual( self.transport.readAvailableData( 1024 ), S_OK( True ) )
+    self.client.close()
+    transport, client = getTransportPair()
+    transport.setBlocking( False )
+    client.close()
+    self.assertFalse( transport.readAvailableData()[ 'OK' ] )
+    transport.close()
+
+class ConnectionMultiplexerTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    self.multiplexer = ConnectionMultiplexer( pollTimeout = 0.05 )
+    self.ready = []
+    self.readyEvent = threading.Event()
+    self.sockets = []
+
+  def tearDown( self ):
+    for sock in self.sockets:
+      sock.close()
+
+  def readyCallback( self, transport, acceptTime, handshakeTime, handshaken ):
+    self.ready.append( ( transport, acceptTime, handshakeTime, handshaken ) )
+    self.readyEvent.set()
+
+  def getMockTransport( self, handshakeSteps ):
+    serverSocket, clientSocket = socket.socketpair()
+    self.sockets.extend( [ serverSocket, clientSocket ] )
+    transport = MagicMock()
+    transport.getSocket.return_value = serverSocket
+    transport.handshakeStep.side_effect = handshakeSteps
+    transport.readAvailableData.return_value = S_OK( True )
+    # Create the child mock before the multiplexer thread can race to create it
+    transport.close.return_value = None
+    return transport, clientSocket
+
+  def test_dispatch( self ):
+    transport, client = getTransportPair()
+    self.sockets.append( client )
+    self.multiplexer.addConnection( transport, self.readyCallback )
+    client.sendall( encodeMessage( PROPOSAL )[:10] )
+    time.sleep( 0.2 )
+    self.assertFalse( self.ready )
+    self.assertEqual( self.multiplexer.getNumConnections(), 1 )
+    client.sendall( encodeMessage( PROPOSAL )[10:] )
+    self.assertTrue( self.readyEvent.wait( 5 ) )
+    readyTransport, _acceptTime, _handshakeTime, handshaken = self.ready[0]
+    self.assertTrue( readyTransport is transport )
+    self.assertTrue( handshaken )
+    self.assertEqual( self.multiplexer.getNumConnections(), 0 )
+    # The transport is given back in blocking mode
+    self.assertEqual( transport.receiveData(), PROPOSAL )
+    transport.close()
+
+  def test_handshakeWantsWrite( self ):
+    transport, _client = self.getMockTransport( [ S_OK( False ), S_OK( False ), S_OK( True ) ] )
+    transport.handshakeWantsWrite.return_value = True
+    # Nothing is sent by the client, only the writability of the socket can make progress
+    self.multiplexer.addConnection( transport, self.readyCallback )
+    self.assertTrue( self.readyEvent.wait( 5 ) )
+    self.assertEqual( transport.handshakeStep.call_count, 3 )
+    self.assertTrue( self.ready[0][3] )
+
+  def test_handshakeErrors( self ):
+    for handshakeSteps in ( Exception( "Boom" ), [ S_ERROR( "Bad certificate" ) ] ):
+      transport, _client = self.getMockTransport( handshakeSteps )
+      self.multiplexer.addConnection( transport, self.readyCallback, timeout = 60 )
+      self.assertTrue( waitFor( lambda: transport.close.called ) )
+      self.assertEqual( transport.handshakeStep.call_count, 1 )
+      self.assertTrue( waitFor( lambda: self.multiplexer.getNumConnections() == 0 ) )
+    self.assertFalse( self.ready )
+
+  def test_timeout( self ):
+    transport, _client = self.getMockTransport( lambda: S_OK( False ) )
+    transport.handshakeWantsWrite.return_value = False
+    self.multiplexer.addConnection( transport, self.readyCallback, timeout = 0.1 )
+    self.assertTrue( waitFor( lambda: transport.close.called ) )
+    self.assertEqual( self.multiplexer.getNumConnections(), 0 )
+
+class ServiceDispatchTestCase( unittest.TestCase ):
+  """ Accept, handshake and dispatch cycle of a service using the connection multiplexer
+  """
+
+  def setUp( self ):
+    self.service = Service.__new__( Service )
+    self.service._stats = { 'connections' : 0 }
+    self.service._monitor = MagicMock()
+    self.service._cfg = MagicMock()
+    self.service._cfg.getHandshakeTimeout.return_value = 5
+    self.service._connectionMultiplexer = ConnectionMultiplexer( pollTimeout = 0.05 )
+    self.processed = threading.Event()
+    self.service._processInThread = MagicMock( side_effect = lambda *args: self.processed.set() )
+    self.service._threadPool = MagicMock()
+
+    def generateJobAndQueueIt( func, args = (), blocking = True ):
+      func( *args )
+      return S_OK()
+    self.service._threadPool.generateJobAndQueueIt.side_effect = generateJobAndQueueIt
+
+  def test_dispatch( self ):
+    transport, client = getTransportPair()
+    self.service.handleConnection( transport )
+    self.assertEqual( self.service._stats[ 'connections' ], 1 )
+    self.assertFalse( self.service._processInThread.called )
+    client.sendall( encodeMessage( PROPOSAL ) )
+    self.assertTrue( self.processed.wait( 5 ) )
+    args = self.service._processInThread.call_args[0]
+    self.assertTrue( args[0] is transport )
+    self.assertTrue( args[1] )
+    self.assertFalse( self.service._threadPool.generateJobAndQueueIt.call_args[1][ 'blocking' ] )
+    self.assertEqual( transport.receiveData(), PROPOSAL )
+    transport.close()
+    client.close()
+
+  def test_reject( self ):
+    self.service._threadPool.generateJobAndQueueIt.side_effect = None
+    self.service._threadPool.generateJobAndQueueIt.return_value = S_ERROR( "Queue is full" )
+    transport, client = getTransportPair()
+    self.service.handleConnection( transport )
+    client.sendall( encodeMessage( PROPOSAL ) )
+    # The connection is closed by the service
+    client.settimeout( 5 )
+    self.assertEqual( client.recv( 10 ), "" )
+    self.service._monitor.addMark.assert_any_call( 'RejectedConnections' )
+    self.assertFalse( self.service._processInThread.called )
+    client.close()
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( NonBlockingReadTestCase )
+  suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( ConnectionMultiplexerTestCase ) )
+  suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( ServiceDispatchTestCase ) )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
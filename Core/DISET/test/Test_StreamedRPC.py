@@ -0,0 +1,191 @@
+""" unit tests for the streaming of RPC results between the RPCClient and the RequestHandler,
+    over an in memory transport
+"""
+
+# pylint: disable=missing-docstring,invalid-name,protected-access
+
+import Queue
+import unittest
+import threading
+
+from mock import MagicMock
+
+from DIRAC import S_OK, S_ERROR
+from DIRAC.Core.Utilities import DEncode
+from DIRAC.Core.Utilities.ChunkedResult import streamResult
+from DIRAC.Core.DISET.RequestHandler import RequestHandler
+from DIRAC.Core.DISET.RPCClient import RPCClient
+from DIRAC.Core.DISET.private.InnerRPCClient import InnerRPCClient
+
+TRID = 1
+
+def wireCopy( data ):
+  """ What the other end receives
+  """
+  return DEncode.decode( DEncode.encode( data ) )[0]
+
+class Pipe( object ):
+  """ Both ends of a connection: the client transport and the server transport pool
+  """
+
+  def __init__( self, failAfter = None ):
+    self.toServer = Queue.Queue()
+    self.toClient = Queue.Queue()
+    self.failAfter = failAfter
+    self.sentToClient = 0
+    self.sendAttempts = 0
+
+  # Client transport
+  def sendData( self, data ):
+    self.toServer.put( wireCopy( data ) )
+    return S_OK()
+
+  def receiveData( self ):
+    return self.toClient.get( timeout = 5 )
+
+  # Server transport pool
+  def receive( self, trid ):
+    return self.toServer.get( timeout = 5 )
+
+  def send( self, trid, data ):
+    self.sendAttempts += 1
+    if self.failAfter is not None and self.sentToClient >= self.failAfter:
+      return S_ERROR( "Connection reset by peer" )
+    self.sentToClient += 1
+    self.toClient.put( wireCopy( data ) )
+    return S_OK()
+
+  def get( self, trid ):
+    return None
+
+class StreamHandler( RequestHandler ):
+
+  closedStreams = []
+
+  types_getStream = [ int ]
+  def export_getStream( self, numChunks ):
+    try:
+      for i in range( numChunks ):
+        yield S_OK( { 'Successful' : { 'lfn%d' % i : i }, 'Failed' : {} } )
+    finally:
+      self.closedStreams.append( numChunks )
+
+  types_getBrokenStream = []
+  def export_getBrokenStream( self ):
+    yield S_OK( { 'Successful' : { 'lfn0' : 0 } } )
+    yield S_ERROR( "Database went away" )
+
+  types_getPlain = []
+  def export_getPlain( self ):
+    return S_OK( [ 1, 2, 3 ] )
+
+  types_getBigResult = []
+  def export_getBigResult( self ):
+    return streamResult( S_OK( range( 10 ) ), chunkSize = 3 )
+
+class StreamedRPCTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    self.pipe = Pipe()
+    StreamHandler.closedStreams = []
+    self.handler = self.getHandler( self.pipe )
+    self.client = self.getClient( self.pipe )
+    self.serverResults = []
+
+  @staticmethod
+  def getHandler( pipe ):
+    for name, value in ( ( '_RequestHandler__trPool', pipe ),
+                         ( '_RequestHandler__lockManager', MagicMock() ),
+                         ( '_RequestHandler__msgBroker', MagicMock() ),
+                         ( '_RequestHandler__srvInfoDict', { 'csPaths' : [] } ) ):
+      setattr( StreamHandler, name, value )
+    handler = StreamHandler.__new__( StreamHandler )
+    handler._RequestHandler__trid = TRID
+    handler.serviceInfoDict = { 'serviceName' : 'Framework/Stream' }
+    return handler
+
+  @staticmethod
+  def getClient( pipe ):
+    innerClient = InnerRPCClient.__new__( InnerRPCClient )
+    innerClient._connect = lambda: S_OK( ( TRID, pipe ) )
+    innerClient._disconnect = lambda trid: None
+    innerClient._proposeAction = lambda transport, action: S_OK()
+    innerClient._getBaseStub = lambda: ( 'Framework/Stream', {} )
+    client = RPCClient.__new__( RPCClient )
+    client._RPCClient__innerRPCClient = innerClient
+    return client
+
+  def serve( self, method ):
+    """ Serve one RPC call in a thread, as the Service does
+    """
+    def execute():
+      self.serverResults.append( self.handler._rh_executeAction( ( ( 'Framework/Stream', 'aSetup', 'aVO' ),
+                                                                   ( 'RPC', method ), '' ) ) )
+    thread = threading.Thread( target = execute )
+    thread.setDaemon( 1 )
+    thread.start()
+    return thread
+
+  def test_stream( self ):
+    thread = self.serve( 'getStream' )
+    chunks = list( self.client.streamRPC( 'getStream', 3 ) )
+    thread.join( 5 )
+    self.assertEqual( [ chunk[ 'Value' ][ 'Successful' ] for chunk in chunks ],
+                      [ { 'lfn0' : 0 }, { 'lfn1' : 1 }, { 'lfn2' : 2 } ] )
+    # The end of stream marker is not given to the caller
+    self.assertEqual( self.pipe.sentToClient, 4 )
+    self.assertTrue( self.serverResults[0][ 'OK' ] )
+    self.assertEqual( StreamHandler.closedStreams, [ 3 ] )
+
+    thread = self.serve( 'getBigResult' )
+    result = self.client.collectRPC( 'getBigResult' )
+    thread.join( 5 )
+    self.assertEqual( result, S_OK( range( 10 ) ) )
+
+  def test_nonStreamingClient( self ):
+    thread = self.serve( 'getStream' )
+    result = self.client.getStream( 3 )
+    thread.join( 5 )
+    self.assertTrue( result[ 'OK' ] )
+    self.assertEqual( result[ 'Value' ][ 'Successful' ], { 'lfn0' : 0, 'lfn1' : 1, 'lfn2' : 2 } )
+    self.assertFalse( 'Stream' in result )
+    # The whole result is sent at once
+    self.assertEqual( self.pipe.sentToClient, 1 )
+
+  def test_nonStreamingMethod( self ):
+    thread = self.serve( 'getPlain' )
+    result = self.client.collectRPC( 'getPlain' )
+    thread.join( 5 )
+    self.assertEqual( result, S_OK( [ 1, 2, 3 ] ) )
+
+  def test_errorInStream( self ):
+    thread = self.serve( 'getBrokenStream' )
+    chunks = list( self.client.streamRPC( 'getBrokenStream' ) )
+    thread.join( 5 )
+    self.assertEqual( len( chunks ), 2 )
+    self.assertTrue( chunks[0][ 'OK' ] )
+    self.assertFalse( chunks[1][ 'OK' ] )
+    self.assertEqual( chunks[1][ 'Message' ], "Database went away" )
+    self.assertEqual( chunks[1][ 'rpcStub' ][1], 'getBrokenStream' )
+
+    thread = self.serve( 'getBrokenStream' )
+    result = self.client.collectRPC( 'getBrokenStream' )
+    thread.join( 5 )
+    self.assertFalse( result[ 'OK' ] )
+
+  def test_connectionLostInStream( self ):
+    self.pipe.failAfter = 1
+    self.pipe.toServer.put( wireCopy( dict( S_OK( ( 5, ) ), Stream = True ) ) )
+    result = self.handler._rh_executeAction( ( ( 'Framework/Stream', 'aSetup', 'aVO' ),
+                                               ( 'RPC', 'getStream' ), '' ) )
+    # The connection error is not turned into a response for the lost client
+    self.assertFalse( result[ 'OK' ] )
+    self.assertTrue( 'Connection reset by peer' in str( result[ 'Message' ] ) )
+    self.assertEqual( self.pipe.sentToClient, 1 )
+    self.assertEqual( self.pipe.sendAttempts, 2 )
+    self.assertEqual( StreamHandler.closedStreams, [ 5 ] )
+    self.handler._RequestHandler__lockManager.unlock.assert_called_once_with( "RPC/getStream" )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( StreamedRPCTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
@@ -0,0 +1,99 @@
+""" Utilities to split large RPC results in chunks and to put them back together
+
+    A result is split following its structure: nested dictionaries are kept
+    with the same shape in every chunk and long lists are sliced, so merging
+    the chunks in order with mergeChunk rebuilds the original value.
+"""
+
+__RCSID__ = "$Id$"
+
+from DIRAC.Core.Utilities.ReturnValues import S_OK
+
+# Key added to the messages of a streamed RPC response
+STREAM_KEY = 'Stream'
+DEFAULT_CHUNK_SIZE = 10000
+
+def _iterLeaves( value, path, chunkSize ):
+  """ Yield ( path, leaf ) tuples for all the leaves of the value. Lists longer
+      than chunkSize are yielded as several slices with the same path
+  """
+  if isinstance( value, dict ) and value:
+    for key, item in value.iteritems():
+      for leaf in _iterLeaves( item, path + ( key, ), chunkSize ):
+        yield leaf
+  elif isinstance( value, list ) and len( value ) > chunkSize:
+    for i in xrange( 0, len( value ), chunkSize ):
+      yield path, value[ i:i + chunkSize ]
+  else:
+    yield path, value
+
+def splitInChunks( value, chunkSize = DEFAULT_CHUNK_SIZE ):
+  """ Generator splitting a value in pieces of about chunkSize elements
+
+      :param value: value to split, usually the Value of a S_OK structure
+      :param int chunkSize: maximum number of leaves or list items per chunk
+  """
+  chunkSize = max( 1, chunkSize )
+  chunk = {}
+  chunkLength = 0
+  for path, leaf in _iterLeaves( value, (), chunkSize ):
+    if not path:
+      # The value is not a dictionary, every leaf is a chunk by itself
+      yield leaf
+      continue
+    branch = chunk
+    for key in path[:-1]:
+      branch = branch.setdefault( key, {} )
+    if isinstance( leaf, list ) and isinstance( branch.get( path[-1] ), list ):
+      branch[ path[-1] ].extend( leaf )
+    else:
+      branch[ path[-1] ] = leaf
+    chunkLength += max( 1, len( leaf ) ) if isinstance( leaf, list ) else 1
+    if chunkLength >= chunkSize:
+      yield chunk
+      chunk = {}
+      chunkLength = 0
+  if chunkLength:
+    yield chunk
+
+def mergeChunk( target, chunk ):
+  """ Merge a chunk into the value built so far
+
+      :return: the merged value
+  """
+  if isinstance( target, dict ) and isinstance( chunk, dict ):
+    for key, item in chunk.iteritems():
+      if key in target:
+        target[ key ] = mergeChunk( target[ key ], item )
+      else:
+        target[ key ] = item
+    return target
+  if isinstance( target, list ) and isinstance( chunk, list ):
+    target.extend( chunk )
+    return target
+  return chunk
+
+def streamResult( result, chunkSize = DEFAULT_CHUNK_SIZE ):
+  """ Generator to be returned by an export method to stream its result
+
+      :param dict result: S_OK/S_ERROR structure to send
+      :param int chunkSize: maximum number of leaves or list items per chunk
+  """
+  if not result[ 'OK' ]:
+    yield result
+    return
+  for chunk in splitInChunks( result[ 'Value' ], chunkSize ):
+    yield S_OK( chunk )
+
+def collectStream( stream ):
+  """ Merge all the chunks of a streamed result
+
+      :param stream: iterable of S_OK/S_ERROR structures
+      :return: S_OK( merged value )/the first S_ERROR found
+  """
+  value = None
+  for result in stream:
+    if not result[ 'OK' ]:
+      return result
+    value = result[ 'Value' ] if value is None else mergeChunk( value, result[ 'Value' ] )
+  return S_OK( value )
@@ -11,6 +11,12 @@ Encoding and decoding for dirac, Ids:
  l -> list
  t -> tuple
  d -> dictionary
+
+All the decoding functions work on offsets over the encoded string and dispatch on the
+type identifier through g_dDecodeFunctions. The containers handle strings and ints
+(the vast majority of the items) inline to avoid a function call per item.
+If the compiled DEncodeAccel module is available, its encode and decode functions
+are used instead. They produce and accept exactly the same data.
 """
 __RCSID__ = "$Id$"
 
@@ -169,20 +175,49 @@ def decodeNone( data, i ):
 g_dEncodeFunctions[ types.NoneType ] = encodeNone
 g_dDecodeFunctions[ 'n' ] = decodeNone
 
+#Encode and decode the items of lists and tuples
+def _encodeItems( lValue, eList ):
+  extend = eList.extend
+  for uObject in lValue:
+    oType = type( uObject )
+    if oType is str:
+      extend( ( 's', str( len( uObject ) ), ':', uObject ) )
+    elif oType is int:
+      extend( ( 'i', str( uObject ), 'e' ) )
+    else:
+      g_dEncodeFunctions[ oType ]( uObject, eList )
+
+def _decodeItems( data, i ):
+  """ Decode items starting at position i up to the closing 'e'
+  """
+  oL = []
+  append = oL.append
+  index = data.index
+  while True:
+    typeId = data[ i ]
+    if typeId == 's':
+      colon = index( ':', i + 1 )
+      end = colon + 1 + int( data[ i + 1 : colon ] )
+      append( data[ colon + 1 : end ] )
+      i = end
+    elif typeId == 'i':
+      end = index( 'e', i + 1 )
+      append( int( data[ i + 1 : end ] ) )
+      i = end + 1
+    elif typeId == 'e':
+      return ( oL, i + 1 )
+    else:
+      ob, i = g_dDecodeFunctions[ typeId ]( data, i )
+      append( ob )
+
 #Encode and decode a list
 def encodeList( lValue, eList ):
   eList.append( "l" )
-  for uObject in lValue:
-    g_dEncodeFunctions[ type( uObject ) ]( uObject, eList )
+  _encodeItems( lValue, eList )
   eList.append( "e" )
 
 def decodeList( data, i ):
-  oL = []
-  i += 1
-  while data[ i ] != "e":
-    ob, i = g_dDecodeFunctions[ data[ i ] ]( data, i )
-    oL.append( ob )
-  return( oL, i + 1 )
+  return _decodeItems( data, i + 1 )
 
 g_dEncodeFunctions[ types.ListType ] = encodeList
 g_dDecodeFunctions[ "l" ] = decodeList
@@ -190,12 +225,11 @@ g_dDecodeFunctions[ "l" ] = decodeList
 #Encode and decode a tuple
 def encodeTuple( lValue, eList ):
   eList.append( "t" )
-  for uObject in lValue:
-    g_dEncodeFunctions[ type( uObject ) ]( uObject, eList )
+  _encodeItems( lValue, eList )
   eList.append( "e" )
 
 def decodeTuple( data, i ):
-  oL, i = decodeList( data, i )
+  oL, i = _decodeItems( data, i + 1 )
   return ( tuple( oL ), i )
 
 g_dEncodeFunctions[ types.TupleType ] = encodeTuple
@@ -204,18 +238,51 @@ g_dDecodeFunctions[ "t" ] = decodeTuple
 #Encode and decode a dictionary
 def encodeDict( dValue, eList ):
   eList.append( "d" )
+  extend = eList.extend
   for key in sorted( dValue ):
-    g_dEncodeFunctions[ type( key ) ]( key, eList )
-    g_dEncodeFunctions[ type( dValue[key] ) ]( dValue[key], eList )
+    if type( key ) is str:
+      extend( ( 's', str( len( key ) ), ':', key ) )
+    else:
+      g_dEncodeFunctions[ type( key ) ]( key, eList )
+    value = dValue[ key ]
+    vType = type( value )
+    if vType is str:
+      extend( ( 's', str( len( value ) ), ':', value ) )
+    elif vType is int:
+      extend( ( 'i', str( value ), 'e' ) )
+    else:
+      g_dEncodeFunctions[ vType ]( value, eList )
   eList.append( "e" )
 
 def decodeDict( data, i ):
   oD = {}
+  index = data.index
   i += 1
-  while data[ i ] != "e":
-    k, i = g_dDecodeFunctions[ data[ i ] ]( data, i )
-    oD[ k ], i = g_dDecodeFunctions[ data[ i ] ]( data, i )
-  return ( oD, i + 1 )
+  while True:
+    #Key
+    typeId = data[ i ]
+    if typeId == 's':
+      colon = index( ':', i + 1 )
+      end = colon + 1 + int( data[ i + 1 : colon ] )
+      key = data[ colon + 1 : end ]
+      i = end
+    elif typeId == 'e':
+      return ( oD, i + 1 )
+    else:
+      key, i = g_dDecodeFunctions[ typeId ]( data, i )
+    #Value
+    typeId = data[ i ]
+    if typeId == 's':
+      colon = index( ':', i + 1 )
+      end = colon + 1 + int( data[ i + 1 : colon ] )
+      oD[ key ] = data[ colon + 1 : end ]
+      i = end
+    elif typeId == 'i':
+      end = index( 'e', i + 1 )
+      oD[ key ] = int( data[ i + 1 : end ] )
+      i = end + 1
+    else:
+      oD[ key ], i = g_dDecodeFunctions[ typeId ]( data, i )
 
 g_dEncodeFunctions[ types.DictType ] = encodeDict
 g_dDecodeFunctions[ "d" ] = decodeDict
@@ -241,6 +308,13 @@ def decode( data ):
     raise
 
 
+
+try:
+  # Compiled implementation of encode and decode, if installed
+  from DEncodeAccel import encode, decode #pylint: disable=import-error,unused-import
+except ImportError:
+  pass
+
 if __name__ == "__main__":
   gObject = {2:"3", True : ( 3, None ), 2.0 * 10 ** 20 : 2.0 * 10 ** -10 }
   print "Initial: %s" % gObject
@@ -0,0 +1,56 @@
+""" Unit tests for the splitting and merging of chunked RPC results
+"""
+
+import unittest
+import copy
+
+from DIRAC import S_OK, S_ERROR
+from DIRAC.Core.Utilities.ChunkedResult import splitInChunks, mergeChunk, streamResult, collectStream
+
+__RCSID__ = "$Id$"
+
+class ChunkedResultTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    self.value = { 'Successful' : dict( ( '/vo/dir/file%d' % i, { 'SE%d' % ( i % 3 ) : 'pfn%d' % i } )
+                                        for i in xrange( 250 ) ),
+                   'Failed' : {},
+                   'JobIDs' : range( 1000 ),
+                   'Total' : 1250 }
+
+  def test_splitAndMerge( self ):
+    original = copy.deepcopy( self.value )
+    chunks = list( splitInChunks( self.value, 100 ) )
+    self.assert_( len( chunks ) > 10 )
+    merged = None
+    for chunk in chunks:
+      merged = chunk if merged is None else mergeChunk( merged, chunk )
+    self.assertEqual( merged, original )
+
+  def test_report( self ):
+    """ Accounting reports: data per group and time bin, with extra plot information
+    """
+    report = { 'data' : dict( ( 'Site%d' % i, dict( ( 1000 + j * 600, float( j ) ) for j in xrange( 50 ) ) )
+                              for i in xrange( 20 ) ),
+               'granularity' : 600,
+               'unit' : 'jobs',
+               'graphDataDict' : {} }
+    original = copy.deepcopy( report )
+    chunks = list( streamResult( S_OK( report ), 100 ) )
+    self.assertEqual( len( chunks ), 11 )
+    self.assertEqual( collectStream( chunks )['Value'], original )
+
+  def test_notDictionaries( self ):
+    self.assertEqual( list( splitInChunks( range( 25 ), 10 ) ), [ range( 10 ), range( 10, 20 ), range( 20, 25 ) ] )
+    self.assertEqual( list( splitInChunks( 'value', 10 ) ), [ 'value' ] )
+    self.assertEqual( list( splitInChunks( {}, 10 ) ), [ {} ] )
+    self.assertEqual( collectStream( streamResult( S_OK( range( 25 ) ), 10 ) )['Value'], range( 25 ) )
+    self.assertEqual( collectStream( streamResult( S_OK( None ) ) )['Value'], None )
+
+  def test_errors( self ):
+    self.assertFalse( collectStream( streamResult( S_ERROR( 'Boom' ) ) )['OK'] )
+    self.assertFalse( collectStream( iter( [ S_OK( [ 1 ] ), S_ERROR( 'Boom' ), S_OK( [ 2 ] ) ] ) )['OK'] )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( ChunkedResultTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
@@ -0,0 +1,55 @@
+""".. module:: DEncodeTestCase
+
+Test cases for DIRAC.Core.Utilities.DEncode module.
+
+"""
+
+import datetime
+import unittest
+
+# sut
+from DIRAC.Core.Utilities import DEncode
+
+__RCSID__ = "$Id$"
+
+
+########################################################################
+class DEncodeTestCase( unittest.TestCase ):
+  """ py:class DEncodeTestCase
+      Test case for DIRAC.Core.Utilities.DEncode module.
+  """
+
+  def testWireFormat( self ):
+    """ encoded data has to be the same in all the versions """
+    self.assertEqual( DEncode.encode( 12 ), "i12e" )
+    self.assertEqual( DEncode.encode( 12L ), "I12e" )
+    self.assertEqual( DEncode.encode( 2.5 ), "f2.5e" )
+    self.assertEqual( DEncode.encode( 2e20 ), "f2e+20e" )
+    self.assertEqual( DEncode.encode( True ), "b1" )
+    self.assertEqual( DEncode.encode( None ), "n" )
+    self.assertEqual( DEncode.encode( "abc" ), "s3:abc" )
+    self.assertEqual( DEncode.encode( u"\xe9" ), "u2:\xc3\xa9" )
+    self.assertEqual( DEncode.encode( [ 1, "a", ( None, False ) ] ), "li1es1:atnb0ee" )
+    self.assertEqual( DEncode.encode( { "b" : 1, "a" : { 2 : "x" } } ), "ds1:adi2es1:xes1:bi1ee" )
+    self.assertEqual( DEncode.encode( datetime.date( 2016, 1, 2 ) ), "zdti2016ei1ei2ee" )
+
+  def testRoundTrip( self ):
+    """ decode( encode( x ) ) == x """
+    data = { 'Successful' : { '/lfn/file_%d' % i : { 'SE1' : 'srm://se1/file_%d' % i, 'SE2' : i } for i in range( 100 ) },
+             'Failed' : {},
+             'Records' : [ [ i, 'Running', 1.5 * i, 2e-10, None, True, u'\xe9', 10L ** 20 ] for i in range( 10 ) ],
+             1 : ( datetime.datetime( 2016, 1, 2, 3, 4, 5, 6 ), datetime.time( 1, 2, 3 ) ),
+             ( 1, 'a' ) : [] }
+    encoded = DEncode.encode( data )
+    self.assertEqual( DEncode.decode( encoded ), ( data, len( encoded ) ) )
+    # Decoding from an offset in a longer string
+    self.assertEqual( DEncode.decode( encoded + "s3:abc" )[1], len( encoded ) )
+
+  def testMalformed( self ):
+    """ malformed data raises an exception """
+    self.assertRaises( Exception, DEncode.decode, "ds1:ai1e" )
+    self.assertRaises( Exception, DEncode.decode, "x" )
+
+if __name__ == "__main__":
+  SUITE = unittest.defaultTestLoader.loadTestsFromTestCase( DEncodeTestCase )
+  unittest.TextTestRunner( verbosity = 3 ).run( SUITE )
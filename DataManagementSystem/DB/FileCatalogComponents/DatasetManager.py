@@ -9,9 +9,22 @@ __RCSID__ = "$Id$"
 
 import hashlib as md5
 import os
+import datetime
 
 from DIRAC import S_OK, S_ERROR, gLogger
-from DIRAC.Core.Utilities.List import stringListToString
+from DIRAC.Core.Utilities.List import stringListToString, intListToString, breakListIntoChunks
+from DIRAC.Core.Utilities import Time
+from DIRAC.DataManagementSystem.Client.MetaQuery import FILE_STANDARD_METAKEYS
+
+# Standard file metadata which can not change once the file is registered. The file lists
+# of the datasets selecting on other standard metadata ( SE, Status, owner... ) are not
+# materialized, they are obtained by running the dataset query
+MATERIALIZED_STANDARD_METAKEYS = [ 'Path', 'Name', 'FileName', 'Size' ]
+# Number of files inserted together in a materialized dataset file list
+FILE_BATCH_SIZE = 1000
+# Seconds after which a file list still being built is considered abandoned, e.g. by a
+# service killed while building it, and is built again
+BUILD_TIMEOUT = 3600
 
 class DatasetManager( object ):
 
@@ -46,6 +59,29 @@ class DatasetManager( object ):
                                                  },
                                        "PrimaryKey": "DatasetID",
                                      }
+  # Materialized file lists of the dynamic datasets, maintained incrementally when files
+  # are added, removed or get their metadata changed. Version is incremented with each
+  # change of the file list, CheckedVersion is the version for which the parameters
+  # stored in FC_MetaDatasets are known to be up to date. Building is set while the
+  # dataset query runs and the file list is stored, since BuildStartTime
+  _tables["FC_DynamicDatasets"] = { "Fields": {
+                                               "DatasetID": "INT NOT NULL",
+                                               "NumberOfFiles": "INT NOT NULL DEFAULT 0",
+                                               "TotalSize": "BIGINT UNSIGNED NOT NULL DEFAULT 0",
+                                               "Version": "INT NOT NULL DEFAULT 0",
+                                               "CheckedVersion": "INT NOT NULL DEFAULT -1",
+                                               "Building": "TINYINT NOT NULL DEFAULT 0",
+                                               "BuildStartTime": "DATETIME"
+                                              },
+                                    "PrimaryKey": "DatasetID"
+                                  }
+  _tables["FC_DynamicDatasetFiles"] = { "Fields": {
+                                                   "DatasetID": "INT NOT NULL",
+                                                   "FileID": "INT NOT NULL"
+                                                  },
+                                        "UniqueIndexes": { "DatasetID_FileID": ["DatasetID","FileID"] },
+                                        "Indexes": { "FileID": ["FileID"] }
+                                      }
 
   def __init__( self, database = None ):
     self.db = None
@@ -107,12 +143,19 @@ class DatasetManager( object ):
 
   def __addDataset( self, datasetName, metaQuery, credDict, uid, gid ):
 
-    result = self.__getMetaQueryParameters( metaQuery, credDict )
-    if not result['OK']:
-      return result
-    totalSize = result['Value']['TotalSize']
-    datasetHash = result['Value']['DatasetHash']
-    numberOfFiles = result['Value']['NumberOfFiles']
+    materialized = self.__isMaterialized( metaQuery )
+    if materialized:
+      # The query is run once the dataset is registered, when its file list can be
+      # maintained: the files changed while it runs are then taken into account
+      parameters = { 'TotalSize': 0, 'DatasetHash': self.__getDatasetHash( [] ), 'NumberOfFiles': 0 }
+    else:
+      result = self.__getMetaQueryParameters( metaQuery, credDict )
+      if not result['OK']:
+        return result
+      parameters = result['Value']
+    totalSize = parameters['TotalSize']
+    datasetHash = parameters['DatasetHash']
+    numberOfFiles = parameters['NumberOfFiles']
 
     result = self.db.fileManager._getStatusInt( 'Dynamic' )
     if not result['OK']:
@@ -155,6 +198,23 @@ class DatasetManager( object ):
       else:
         return result
     datasetID = result['lastRowId']
+
+    if materialized:
+      result = self.__materializeDataset( datasetID, metaQuery, credDict )
+      if not result['OK']:
+        self.__removeDatasetByID( datasetID )
+        return result
+      parameters = result['Value']
+      req = "UPDATE FC_MetaDatasets SET TotalSize=%d, NumberOfFiles=%d, DatasetHash='%s' WHERE DatasetID=%d" % \
+            ( parameters['TotalSize'], parameters['NumberOfFiles'], parameters['DatasetHash'], datasetID )
+      result = self.db._update( req )
+      if not result['OK']:
+        self.__removeDatasetByID( datasetID )
+        return result
+      # The parameters correspond to the first version of the file list
+      result = self.__setCheckedVersion( datasetID, 0 )
+      if not result['OK']:
+        gLogger.warn( 'Failed to set the dataset checked version', '%s: %s' % ( datasetName, result['Message'] ) )
     return S_OK( datasetID )
   
   def _getDatasetDirectories( self, datasets ):
@@ -339,9 +399,7 @@ class DatasetManager( object ):
     if not lfnIDList:
       lfnIDList = lfnIDDict.keys()
     lfnList.sort()
-    myMd5 = md5.md5()
-    myMd5.update( str( lfnList ) )
-    datasetHash = myMd5.hexdigest().upper()
+    datasetHash = self.__getDatasetHash( lfnList )
     numberOfFiles = len( lfnList )
     result = self.db.fileManager.getFileSize( lfnList )
     totalSize = 0
@@ -355,6 +413,14 @@ class DatasetManager( object ):
                      'LFNIDList': lfnIDList } )
     return result
 
+  @staticmethod
+  def __getDatasetHash( lfnList ):
+    """ Get the hash of the sorted list of the dataset lfns
+    """
+    myMd5 = md5.md5()
+    myMd5.update( str( sorted( lfnList ) ) )
+    return myMd5.hexdigest().upper()
+
   def removeDataset( self, datasets, credDict ):
     """ Remove the requested datasets
 
@@ -386,8 +452,13 @@ class DatasetManager( object ):
       # No requested dataset
       return S_OK( 'Dataset %s does not exist' % datasetName  )
     datasetID = result['Value'][0][0]
+    return self.__removeDatasetByID( datasetID )
 
-    for table in ["FC_MetaDatasetFiles","FC_MetaDatasets","FC_DatasetAnnotations"]:
+  def __removeDatasetByID( self, datasetID ):
+    """ Remove the dataset with the given ID from all the tables
+    """
+    for table in ["FC_MetaDatasetFiles","FC_DynamicDatasets","FC_DynamicDatasetFiles",
+                  "FC_MetaDatasets","FC_DatasetAnnotations"]:
       req = "DELETE FROM %s WHERE DatasetID=%s" % (table, datasetID)
       result = self.db._update( req )
 
@@ -414,7 +485,7 @@ class DatasetManager( object ):
   def __checkDataset( self, datasetName, credDict ):
     """ Check that the dataset parameters correspond to the actual state
     """
-    req = "SELECT MetaQuery,DatasetHash,TotalSize,NumberOfFiles FROM FC_MetaDatasets"
+    req = "SELECT DatasetID,MetaQuery,DatasetHash,TotalSize,NumberOfFiles FROM FC_MetaDatasets"
     req += " WHERE DatasetName='%s'" % datasetName
     result = self.db._query( req )
     if not result['OK']:
@@ -423,12 +494,38 @@ class DatasetManager( object ):
       return S_ERROR( 'Unknown MetaDataset %s' % datasetName )
 
     row = result['Value'][0]
-    metaQuery = eval( row[0] )
-    datasetHashOld = row[1]
-    totalSizeOld = int( row[2] )
-    numberOfFilesOld = int( row[3] )
-
-    result = self.__getMetaQueryParameters( metaQuery, credDict )
+    datasetID = int( row[0] )
+    metaQuery = eval( row[1] )
+    datasetHashOld = row[2]
+    totalSizeOld = int( row[3] )
+    numberOfFilesOld = int( row[4] )
+
+    version = None
+    if self.__isMaterialized( metaQuery ):
+      result = self.__getDatasetFilesState( datasetID )
+      if not result['OK']:
+        return result
+      if result['Value'] is None:
+        version = 0
+        result = self.__materializeDataset( datasetID, metaQuery, credDict )
+      elif result['Value'][4]:
+        # Being materialized
+        result = self.__getMetaQueryParameters( metaQuery, credDict )
+      else:
+        _numberOfFiles, totalSize, version, checkedVersion, _building = result['Value']
+        if version == checkedVersion:
+          # The file list did not change since the parameters were last checked
+          result = S_OK( {} )
+          result['DatasetID'] = datasetID
+          result['Version'] = version
+          return result
+        result = self.__getStoredDatasetFiles( 'FC_DynamicDatasetFiles', datasetID )
+        if result['OK']:
+          result = S_OK( { 'DatasetHash': self.__getDatasetHash( result['Value'] ),
+                           'NumberOfFiles': len( result['Value'] ),
+                           'TotalSize': totalSize } )
+    else:
+      result = self.__getMetaQueryParameters( metaQuery, credDict )
     if not result['OK']:
       return result
     totalSize = result['Value']['TotalSize']
@@ -443,7 +540,14 @@ class DatasetManager( object ):
     if numberOfFiles != numberOfFilesOld:
       changeDict['NumberOfFiles'] = ( numberOfFilesOld, numberOfFiles )
 
+    if not changeDict and version is not None:
+      result = self.__setCheckedVersion( datasetID, version )
+      if not result['OK']:
+        return result
+
     result = S_OK( changeDict )
+    result['DatasetID'] = datasetID
+    result['Version'] = version
     return result
 
   def updateDataset( self, datasets, credDict ):
@@ -478,6 +582,8 @@ class DatasetManager( object ):
       return S_OK()
     else:
       changeDict = result['Value']
+    datasetID = result['DatasetID']
+    version = result['Version']
 
     req = "UPDATE FC_MetaDatasets SET "
     for field in changeDict:
@@ -485,6 +591,10 @@ class DatasetManager( object ):
     req += "ModificationDate=UTC_TIMESTAMP() "
     req += "WHERE DatasetName='%s'" % datasetName
     result = self.db._update( req )
+    if not result['OK']:
+      return result
+    if version is not None:
+      result = self.__setCheckedVersion( datasetID, version )
     return result
 
   def getDatasets( self, datasets, credDict ):
@@ -697,7 +807,19 @@ class DatasetManager( object ):
       return S_ERROR( 'Unknown MetaDataset ID %d' % datasetID )
 
     metaQuery = eval( result['Value'][0][0] )
-    result = self.__getMetaQueryParameters( metaQuery, credDict )
+    if self.__isMaterialized( metaQuery ):
+      result = self.__getDatasetFilesState( datasetID )
+      if not result['OK']:
+        return result
+      if result['Value'] is None:
+        result = self.__materializeDataset( datasetID, metaQuery, credDict )
+      elif result['Value'][4]:
+        # Being materialized
+        result = self.__getMetaQueryParameters( metaQuery, credDict )
+      else:
+        return self.__getStoredDatasetFiles( 'FC_DynamicDatasetFiles', datasetID )
+    else:
+      result = self.__getMetaQueryParameters( metaQuery, credDict )
     if not result['OK']:
       return result
 
@@ -709,21 +831,29 @@ class DatasetManager( object ):
   def __getFrozenDatasetFiles( self, datasetID, credDict ):
     """ Get dataset lfns from a frozen snapshot
     """
+    return self.__getStoredDatasetFiles( 'FC_MetaDatasetFiles', datasetID )
+
+  def __getStoredDatasetFiles( self, table, datasetID ):
+    """ Get dataset lfns from the file IDs stored in the given table, sorted by lfn
+    """
 
-    req = "SELECT FileID FROM FC_MetaDatasetFiles WHERE DatasetID=%d" % datasetID
+    req = "SELECT FileID FROM %s WHERE DatasetID=%d" % ( table, datasetID )
     result = self.db._query( req )
     if not result['OK']:
       return result
 
     fileIDList = [ row[0] for row in result['Value'] ]
+    if not fileIDList:
+      result = S_OK( [] )
+      result['FileIDList'] = []
+      return result
     result = self.db.fileManager._getFileLFNs( fileIDList )
     if not result['OK']:
       return result
 
-    lfnDict = result['Value']['Successful']
-    lfnList = [ lfnDict[i] for i in lfnDict.keys() ]
-    result = S_OK( lfnList )
-    result['FileIDList'] = lfnDict.keys()
+    lfnItems = sorted( result['Value']['Successful'].items(), key = lambda item: item[1] )
+    result = S_OK( [ lfn for _fileID, lfn in lfnItems ] )
+    result['FileIDList'] = [ fileID for fileID, _lfn in lfnItems ]
     return result
 
   def getDatasetFiles( self, datasets, credDict ):
@@ -842,3 +972,291 @@ class DatasetManager( object ):
     result = self.setDatasetStatus( datasetName, 'Dynamic' )
     return result
 
+  #####################################################################
+  #
+  #  Materialized file lists of the dynamic datasets
+  #
+
+  @staticmethod
+  def __isMaterialized( metaQuery ):
+    """ Check if the file list of a dataset with the given query can be maintained
+        incrementally
+    """
+    for meta in metaQuery:
+      if meta in FILE_STANDARD_METAKEYS and meta not in MATERIALIZED_STANDARD_METAKEYS:
+        return False
+    return True
+
+  def __getDatasetFilesState( self, datasetID ):
+    """ Get the state of the materialized file list of a dataset
+
+    :return: S_OK( ( NumberOfFiles, TotalSize, Version, CheckedVersion, Building ) ) or S_OK( None )
+             if the file list is not materialized or its build was abandoned
+    """
+    req = "SELECT NumberOfFiles,TotalSize,Version,CheckedVersion,Building FROM FC_DynamicDatasets"
+    req += " WHERE DatasetID=%d AND ( Building=0 OR BuildStartTime>='%s' )" % ( datasetID, self.__getBuildTimeLimit() )
+    result = self.db._query( req )
+    if not result['OK']:
+      return result
+    if not result['Value']:
+      return S_OK( None )
+    return S_OK( tuple( int( x ) for x in result['Value'][0] ) )
+
+  @staticmethod
+  def __getBuildTimeLimit():
+    """ Start time of the oldest file list build not yet considered abandoned
+    """
+    return str( Time.dateTime().replace( microsecond = 0 ) - datetime.timedelta( seconds = BUILD_TIMEOUT ) )
+
+  def __materializeDataset( self, datasetID, metaQuery, credDict ):
+    """ Run the dataset query and store its file list. The state of the file list is created
+        first, marked as being built, so that the files changed while the query runs increment
+        its version: the file list is then dropped instead of being used out of date
+
+    :return: result of __getMetaQueryParameters
+    """
+    # Abandoned build of the file list
+    req = "DELETE FROM FC_DynamicDatasets WHERE DatasetID=%d AND Building=1 AND BuildStartTime<'%s'" % \
+          ( datasetID, self.__getBuildTimeLimit() )
+    result = self.db._update( req )
+    if not result['OK']:
+      return result
+    buildStartTime = str( Time.dateTime().replace( microsecond = 0 ) )
+    req = "INSERT INTO FC_DynamicDatasets (DatasetID,Building,BuildStartTime) VALUES (%d,1,'%s')" % \
+          ( datasetID, buildStartTime )
+    result = self.db._update( req )
+    # If the file list is being built concurrently the query result is only returned
+    building = result['OK']
+    if building:
+      # Leftovers of a file list dropped while being built
+      result = self.db._update( "DELETE FROM FC_DynamicDatasetFiles WHERE DatasetID=%d" % datasetID )
+      building = result['OK']
+
+    result = self.__getMetaQueryParameters( metaQuery, credDict )
+    if building:
+      if result['OK']:
+        storeResult = self.__storeDatasetFiles( datasetID, result['Value'], buildStartTime )
+      else:
+        storeResult = result
+      if not storeResult['OK']:
+        # Not fatal, the file list is materialized again when needed
+        gLogger.warn( 'Failed to materialize the dataset files', '%d: %s' % ( datasetID, storeResult['Message'] ) )
+        self.__dropDatasetFiles( [ datasetID ] )
+    return result
+
+  def __storeDatasetFiles( self, datasetID, parameters, buildStartTime ):
+    """ Store the materialized file list of a dataset being built. The state is written last,
+        only if no file was changed since the query was run and the build was not taken over
+
+    :param dict parameters: dataset parameters as returned by __getMetaQueryParameters
+    :param str buildStartTime: start time of this build
+    """
+    for fileIDs in breakListIntoChunks( parameters['LFNIDList'], FILE_BATCH_SIZE ):
+      valueString = ','.join( [ '(%d,%d)' % ( datasetID, fileID ) for fileID in fileIDs ] )
+      req = "INSERT INTO FC_DynamicDatasetFiles (DatasetID,FileID) VALUES %s" % valueString
+      result = self.db._update( req )
+      if not result['OK']:
+        return result
+
+    req = "UPDATE FC_DynamicDatasets SET NumberOfFiles=%d, TotalSize=%d, Building=0" % \
+          ( parameters['NumberOfFiles'], parameters['TotalSize'] )
+    req += " WHERE DatasetID=%d AND Building=1 AND Version=0 AND BuildStartTime='%s'" % ( datasetID, buildStartTime )
+    result = self.db._update( req )
+    if not result['OK']:
+      return result
+    if not result['Value']:
+      return S_ERROR( 'Dataset files changed while being materialized' )
+    return S_OK()
+
+  def __dropDatasetFiles( self, datasetIDs ):
+    """ Drop the materialized file lists of the given datasets, they are materialized
+        again when needed
+    """
+    idString = intListToString( datasetIDs )
+    for table in [ "FC_DynamicDatasets", "FC_DynamicDatasetFiles" ]:
+      req = "DELETE FROM %s WHERE DatasetID IN (%s)" % ( table, idString )
+      result = self.db._update( req )
+      if not result['OK']:
+        return result
+    return S_OK()
+
+  def __setCheckedVersion( self, datasetID, version ):
+    """ Record that the parameters stored in FC_MetaDatasets are up to date with the
+        given version of the dataset file list
+    """
+    req = "UPDATE FC_DynamicDatasets SET CheckedVersion=%d WHERE DatasetID=%d" % ( version, datasetID )
+    return self.db._update( req )
+
+  def __getMaterializedDatasets( self, metaNames = None ):
+    """ Get the datasets with a materialized file list
+
+    :param list metaNames: only the datasets selecting on one of these metadata, all if None
+    :return: S_OK( { datasetID : metaQuery } ) for the materialized file lists, the IDs of
+             those being built are in the 'Building' key
+    """
+    req = "SELECT M.DatasetID,M.MetaQuery,D.Building FROM FC_MetaDatasets M, FC_DynamicDatasets D"
+    req += " WHERE M.DatasetID=D.DatasetID"
+    result = self.db._query( req )
+    if not result['OK']:
+      return result
+    datasets = {}
+    buildingIDs = []
+    for datasetID, metaQuery, building in result['Value']:
+      metaQuery = eval( metaQuery )
+      if metaNames is None or set( metaQuery ) & set( metaNames ):
+        if building:
+          buildingIDs.append( datasetID )
+        else:
+          datasets[datasetID] = metaQuery
+    result = S_OK( datasets )
+    result['Building'] = buildingIDs
+    return result
+
+  def __setBuildingDatasetsChanged( self, datasetIDs = None ):
+    """ Increment the version of the file lists being built, so that they are dropped
+        instead of being used once built
+
+    :param list datasetIDs: IDs of the concerned datasets, all those being built if None
+    """
+    req = "UPDATE FC_DynamicDatasets SET Version=Version+1 WHERE Building=1"
+    if datasetIDs is not None:
+      if not datasetIDs:
+        return S_OK()
+      req += " AND DatasetID IN (%s)" % intListToString( datasetIDs )
+    return self.db._update( req )
+
+  def __changeDatasetFiles( self, datasetID, addedIDs, removedIDs, fileSizes ):
+    """ Add and remove files from the materialized file list of a dataset
+
+    :param dict fileSizes: { fileID : size } of the added and removed files
+    """
+    if not addedIDs and not removedIDs:
+      return S_OK()
+    if addedIDs:
+      valueString = ','.join( [ '(%d,%d)' % ( datasetID, fileID ) for fileID in addedIDs ] )
+      req = "INSERT INTO FC_DynamicDatasetFiles (DatasetID,FileID) VALUES %s" % valueString
+      result = self.db._update( req )
+      if not result['OK']:
+        return result
+    if removedIDs:
+      req = "DELETE FROM FC_DynamicDatasetFiles WHERE DatasetID=%d AND FileID IN (%s)" % \
+            ( datasetID, intListToString( removedIDs ) )
+      result = self.db._update( req )
+      if not result['OK']:
+        return result
+
+    addedSize = sum( fileSizes.get( fileID, 0 ) for fileID in addedIDs )
+    removedSize = sum( fileSizes.get( fileID, 0 ) for fileID in removedIDs )
+    req = "UPDATE FC_DynamicDatasets SET NumberOfFiles=NumberOfFiles+%d-%d, " % ( len( addedIDs ), len( removedIDs ) )
+    req += "TotalSize=TotalSize+%d-%d, Version=Version+1 WHERE DatasetID=%d" % ( addedSize, removedSize, datasetID )
+    return self.db._update( req )
+
+  def __updateDatasetFiles( self, datasetID, metaQuery, fileIDs, fileSizes, credDict ):
+    """ Evaluate the dataset query for the given files and update its file list accordingly
+    """
+    findMetaQuery = dict( metaQuery )
+    path = findMetaQuery.pop( 'Path', '/' )
+    result = self.db.fmeta.filterFilesByMetadata( findMetaQuery, path, credDict, fileIDs )
+    if not result['OK']:
+      return result
+    selectedIDs = set( result['Value'] )
+
+    req = "SELECT FileID FROM FC_DynamicDatasetFiles WHERE DatasetID=%d AND FileID IN (%s)" % \
+          ( datasetID, intListToString( fileIDs ) )
+    result = self.db._query( req )
+    if not result['OK']:
+      return result
+    presentIDs = set( row[0] for row in result['Value'] )
+
+    return self.__changeDatasetFiles( datasetID, list( selectedIDs - presentIDs ),
+                                      list( presentIDs - selectedIDs ), fileSizes )
+
+  def __dropFailedDatasetFiles( self, failedIDs ):
+    """ Drop the file lists which could not be updated, so that they are not used
+        while being out of date
+    """
+    if not failedIDs:
+      return S_OK()
+    result = self.__dropDatasetFiles( failedIDs )
+    if not result['OK']:
+      gLogger.error( 'Failed to drop the dataset files', result['Message'] )
+    return result
+
+  def updateDatasetFiles( self, fileIDs, credDict, metaNames = None ):
+    """ Update the materialized dataset file lists for new files or files with changed metadata
+
+    :param list fileIDs: IDs of the files to evaluate against the dataset queries
+    :param credDict:  dictionary of the caller credentials
+    :param list metaNames: names of the changed metadata, only the datasets selecting on
+                           them are concerned. All the datasets if None
+    :return: S_OK/S_ERROR
+    """
+    if not fileIDs:
+      return S_OK()
+    result = self.__getMaterializedDatasets( metaNames )
+    if not result['OK']:
+      return result
+    datasets = result['Value']
+    result = self.__setBuildingDatasetsChanged( result['Building'] )
+    if not result['OK']:
+      return result
+    if not datasets:
+      return S_OK()
+
+    req = "SELECT FileID,Size FROM FC_Files WHERE FileID IN (%s)" % intListToString( fileIDs )
+    result = self.db._query( req )
+    if not result['OK']:
+      return result
+    fileSizes = dict( ( fileID, int( size ) ) for fileID, size in result['Value'] )
+
+    failedIDs = []
+    for datasetID, metaQuery in datasets.items():
+      result = self.__updateDatasetFiles( datasetID, metaQuery, fileIDs, fileSizes, credDict )
+      if not result['OK']:
+        gLogger.warn( 'Failed to update the dataset files', '%d: %s' % ( datasetID, result['Message'] ) )
+        failedIDs.append( datasetID )
+    return self.__dropFailedDatasetFiles( failedIDs )
+
+  def removeDatasetFiles( self, fileSizes ):
+    """ Remove files from the materialized dataset file lists. To be called once the files
+        are removed from the catalog, with the IDs and sizes they had
+
+    :param dict fileSizes: { fileID : size } of the removed files
+    :return: S_OK/S_ERROR
+    """
+    if not fileSizes:
+      return S_OK()
+    result = self.__setBuildingDatasetsChanged()
+    if not result['OK']:
+      return result
+    req = "SELECT DatasetID,FileID FROM FC_DynamicDatasetFiles WHERE FileID IN (%s)" % \
+          intListToString( fileSizes.keys() )
+    result = self.db._query( req )
+    if not result['OK']:
+      return result
+    datasetFiles = {}
+    for datasetID, fileID in result['Value']:
+      datasetFiles.setdefault( datasetID, [] ).append( fileID )
+
+    failedIDs = []
+    for datasetID, fileIDs in datasetFiles.items():
+      result = self.__changeDatasetFiles( datasetID, [], fileIDs, fileSizes )
+      if not result['OK']:
+        gLogger.warn( 'Failed to update the dataset files', '%d: %s' % ( datasetID, result['Message'] ) )
+        failedIDs.append( datasetID )
+    return self.__dropFailedDatasetFiles( failedIDs )
+
+  def invalidateDatasetFiles( self, metaNames ):
+    """ Drop the materialized file lists of the datasets selecting on the given metadata,
+        when the change can not be applied incrementally ( directory metadata )
+
+    :param list metaNames: names of the changed metadata
+    :return: S_OK/S_ERROR
+    """
+    result = self.__getMaterializedDatasets( metaNames )
+    if not result['OK']:
+      return result
+    datasetIDs = result['Value'].keys() + result['Building']
+    if not datasetIDs:
+      return S_OK()
+    return self.__dropDatasetFiles( datasetIDs )
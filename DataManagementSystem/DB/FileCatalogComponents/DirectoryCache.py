@@ -0,0 +1,151 @@
+""" DirectoryCache keeps in memory the directory IDs and the permission parameters
+    (owner, group and mode) of the most recently used directories of the catalog.
+
+    The entries are evicted in LRU order when the cache is full, and expire after
+    maxAge seconds to bound the staleness with respect to the changes done by other
+    instances of the catalog service. The changes done through this instance are
+    invalidated explicitly by the directory tree managers.
+"""
+
+__RCSID__ = "$Id$"
+
+import time
+import threading
+from collections import OrderedDict
+
+class DirectoryCache( object ):
+
+  def __init__( self, maxSize = 10000, maxAge = 60 ):
+    """ c'tor
+
+    :param int maxSize: maximum number of directories in the cache, 0 disables the cache
+    :param int maxAge: number of seconds after which an entry is considered stale
+    """
+    self.maxSize = max( 0, maxSize )
+    self.maxAge = maxAge
+    self.__lock = threading.Lock()
+    # path : ( dirID, ( uid, gid, mode ) or None, expiration time )
+    self.__entries = OrderedDict()
+    self.__hits = 0
+    self.__misses = 0
+
+  def __getEntry( self, path, now ):
+    """ Get a valid entry, marking it as the most recently used one. To be called with the lock
+    """
+    entry = self.__entries.pop( path, None )
+    if entry is None:
+      return None
+    if entry[2] < now:
+      return None
+    self.__entries[path] = entry
+    return entry
+
+  def __setEntry( self, path, entry ):
+    """ Add an entry, evicting the least recently used ones. To be called with the lock
+    """
+    self.__entries.pop( path, None )
+    self.__entries[path] = entry
+    while len( self.__entries ) > self.maxSize:
+      self.__entries.popitem( last = False )
+
+  def getDirIDs( self, paths ):
+    """ Get the cached directory IDs
+
+    :param list paths: normalized directory paths
+    :return: ( { path : dirID }, [ paths not in the cache ] )
+    """
+    if not self.maxSize:
+      return {}, list( paths )
+    found = {}
+    missing = []
+    now = time.time()
+    with self.__lock:
+      for path in paths:
+        entry = self.__getEntry( path, now )
+        if entry is None:
+          missing.append( path )
+        else:
+          found[path] = entry[0]
+      self.__hits += len( found )
+      self.__misses += len( missing )
+    return found, missing
+
+  def getParameters( self, paths ):
+    """ Get the cached permission parameters
+
+    :param list paths: normalized directory paths
+    :return: ( { path : ( uid, gid, mode ) }, [ paths without cached parameters ] )
+    """
+    if not self.maxSize:
+      return {}, list( paths )
+    found = {}
+    missing = []
+    now = time.time()
+    with self.__lock:
+      for path in paths:
+        entry = self.__getEntry( path, now )
+        if entry is None or entry[1] is None:
+          missing.append( path )
+        else:
+          found[path] = entry[1]
+      self.__hits += len( found )
+      self.__misses += len( missing )
+    return found, missing
+
+  def addDirIDs( self, dirIDs ):
+    """ Add directory IDs to the cache
+
+    :param dict dirIDs: { normalized path : dirID }
+    """
+    if not self.maxSize:
+      return
+    now = time.time()
+    with self.__lock:
+      for path, dirID in dirIDs.iteritems():
+        entry = self.__getEntry( path, now )
+        if entry is not None and entry[0] == dirID:
+          continue
+        self.__setEntry( path, ( dirID, None, now + self.maxAge ) )
+
+  def addParameters( self, parameters ):
+    """ Add the permission parameters of directories to the cache
+
+    :param dict parameters: { normalized path : ( dirID, uid, gid, mode ) }
+    """
+    if not self.maxSize:
+      return
+    expiration = time.time() + self.maxAge
+    with self.__lock:
+      for path, ( dirID, uid, gid, mode ) in parameters.iteritems():
+        self.__setEntry( path, ( dirID, ( uid, gid, mode ), expiration ) )
+
+  def invalidate( self, paths, recursive = False ):
+    """ Remove directories from the cache
+
+    :param list paths: normalized directory paths
+    :param bool recursive: remove also all their subdirectories
+    """
+    if not self.maxSize:
+      return
+    with self.__lock:
+      for path in paths:
+        self.__entries.pop( path, None )
+      if recursive and self.__entries:
+        prefixes = tuple( path.rstrip( '/' ) + '/' for path in paths )
+        for path in [ path for path in self.__entries if path.startswith( prefixes ) ]:
+          del self.__entries[path]
+
+  def clear( self ):
+    """ Remove all the directories from the cache
+    """
+    with self.__lock:
+      self.__entries.clear()
+
+  def getStatus( self ):
+    """ Get the size and the usage counters of the cache
+    """
+    with self.__lock:
+      return { 'Size' : len( self.__entries ),
+               'MaxSize' : self.maxSize,
+               'Hits' : self.__hits,
+               'Misses' : self.__misses }
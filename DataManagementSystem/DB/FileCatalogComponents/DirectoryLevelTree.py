@@ -29,7 +29,7 @@ class DirectoryLevelTree(DirectoryTreeBase):
     
     return 'Directory'
 
-  def findDir(self,path,connection=False):
+  def _findDir(self,path,connection=False):
     """  Find directory ID for the given path
     """
     
@@ -46,7 +46,7 @@ class DirectoryLevelTree(DirectoryTreeBase):
     res['Level'] = result['Value'][0][1]
     return res
   
-  def findDirs( self, paths, connection=False ):
+  def _findDirs( self, paths, connection=False ):
     """ Find DirIDs for the given path list
     """
     dpaths = ','.join( [ "'"+os.path.normpath( path )+"'" for path in paths ] )
@@ -59,6 +59,11 @@ class DirectoryLevelTree(DirectoryTreeBase):
       dirDict[dirName] = dirID
 
     return S_OK( dirDict )
+
+  def _getDirectoryModes( self, paths ):
+    """ Get the owner, group and mode of the given directories with a few bulk queries
+    """
+    return self._getDirectoryModesBulk( paths )
   
   def removeDir(self,path):
     """ Remove directory
@@ -603,8 +603,7 @@ class DirectoryMetadata:
         if not result['OK']:
           return result
         pathSelection = result['Value']
-      dirList = []
-      first = True
+      dirSet = None
       for meta, value in finalMetaDict.items():
         if value == "Missing":
           result = self.__findSubdirMissingMeta( meta, pathSelection )
@@ -612,16 +611,14 @@ class DirectoryMetadata:
           result = self.__findSubdirByMeta( meta, value, pathSelection )
         if not result['OK']:
           return result
-        mList = result['Value']
-        if first:
-          dirList = mList
-          first = False
+        if dirSet is None:
+          dirSet = set( result['Value'] )
         else:
-          newList = []
-          for d in dirList:
-            if d in mList:
-              newList.append( d )
-          dirList = newList
+          dirSet.intersection_update( result['Value'] )
+        if not dirSet:
+          # The intersection is empty whatever the other metadata
+          break
+      dirList = list( dirSet )
     else:
       if pathDirID:
         result = self.db.dtree.getSubdirectoriesByID( pathDirID, includeParent = True )
@@ -651,6 +648,65 @@ class DirectoryMetadata:
 
     return result
 
+  def filterDirIDsByMetadata( self, queryDict, path, credDict, dirIDs ):
+    """ Select among the given directories the ones satisfying the given metadata and being
+        subdirectories of the given path. Only the metadata of these directories and of their
+        parents are looked at, so that the cost does not depend on the size of the namespace
+
+        :param list dirIDs: IDs of the directories to check
+        :return: S_OK( [ IDs of the selected directories ] ), 'Selection' being 'All' if the
+                 query does not put any condition on the directories
+    """
+    result = self.__expandMetaDictionary( queryDict, credDict )
+    if not result['OK']:
+      return result
+    metaDict = result['Value']
+    if not path:
+      path = '/'
+    if not metaDict and path == '/':
+      result = S_OK( list( dirIDs ) )
+      result['Selection'] = 'All'
+      return result
+
+    pathDirID = 0
+    if path != '/':
+      result = self.db.dtree.getPathIDs( path )
+      if not result['OK']:
+        return result
+      pathDirID = result['Value'][-1]
+
+    # The directories with their parents
+    parentIDs = {}
+    for dirID in set( dirIDs ):
+      result = self.db.dtree.getPathIDsByID( dirID )
+      if not result['OK']:
+        return result
+      parentIDs[dirID] = set( result['Value'] )
+    selectedIDs = set( dirID for dirID in parentIDs if not pathDirID or pathDirID in parentIDs[dirID] )
+    pathString = ','.join( [ str( x ) for x in set().union( *parentIDs.values() ) ] )
+
+    for meta, value in metaDict.items():
+      if not selectedIDs:
+        break
+      missing = value == "Missing"
+      result = self.__createMetaSelection( meta, 'Any' if missing else value )
+      if not result['OK']:
+        return result
+      selectString = result['Value']
+      req = "SELECT DirID FROM FC_Meta_%s WHERE DirID IN (%s)" % ( meta, pathString )
+      if selectString:
+        req += " AND %s" % selectString
+      result = self.db._query( req )
+      if not result['OK']:
+        return result
+      # Directories having the meta datum themselves or inheriting it
+      metaIDs = set( row[0] for row in result['Value'] )
+      selectedIDs = set( dirID for dirID in selectedIDs if bool( parentIDs[dirID] & metaIDs ) != missing )
+
+    result = S_OK( list( selectedIDs ) )
+    result['Selection'] = 'Done'
+    return result
+
   @queryTime
   def findDirectoriesByMetadata( self, queryDict, path, credDict ):
     """ Find Directory names satisfying the given metadata and being subdirectories of 
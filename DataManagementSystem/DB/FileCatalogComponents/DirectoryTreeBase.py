@@ -6,6 +6,7 @@
 __RCSID__ = "$Id$"
 
 from DIRAC.DataManagementSystem.DB.FileCatalogComponents.Utilities  import getIDSelectString
+from DIRAC.Core.Utilities.List                                     import intListToString
 from DIRAC                                                          import S_OK, S_ERROR, gLogger
 import time, threading, os
 from types import StringTypes, ListType
@@ -27,13 +28,13 @@ class DirectoryTreeBase:
 #
 ############################################################################
 
-  def findDir( self, path, connection = False ):
-    """  Find directory ID for the given path
+  def _findDir( self, path, connection = False ):
+    """  Find directory ID for the given normalized path
     """
     return S_ERROR( "To be implemented on derived class" )
 
-  def findDirs( self, paths, connection = False ):
-    """ Find DirIDs for the given path list
+  def _findDirs( self, paths, connection = False ):
+    """ Find DirIDs for the given normalized path list
     """
     return S_ERROR( "To be implemented on derived class" )
 
@@ -81,6 +82,30 @@ class DirectoryTreeBase:
   def setDatabase(self,database):
     self.db = database  
 
+  def findDir( self, path, connection = False ):
+    """  Find directory ID for the given path, looking first in the directory cache
+    """
+    dpath = os.path.normpath( path )
+    dirIDs, _missing = self.db.dirCache.getDirIDs( [dpath] )
+    if dpath in dirIDs:
+      return S_OK( dirIDs[dpath] )
+    result = self._findDir( dpath, connection )
+    if result['OK'] and result['Value']:
+      self.db.dirCache.addDirIDs( { dpath : result['Value'] } )
+    return result
+
+  def findDirs( self, paths, connection = False ):
+    """ Find DirIDs for the given path list, looking first in the directory cache
+    """
+    dirDict, missing = self.db.dirCache.getDirIDs( set( os.path.normpath( path ) for path in paths ) )
+    if missing:
+      result = self._findDirs( missing, connection )
+      if not result['OK']:
+        return result
+      self.db.dirCache.addDirIDs( result['Value'] )
+      dirDict.update( result['Value'] )
+    return S_OK( dirDict )
+
   def makeDirectory(self,path,credDict,status=0):
     """Create a new directory. The return value is the dictionary
        containing all the parameters of the newly created directory
@@ -119,6 +144,7 @@ class DirectoryTreeBase:
 
     if not dirDict:
       self.removeDir( path )
+      self.db.dirCache.invalidate( [path] )
       return S_ERROR( 'Failed to create directory %s' % path )
     return S_OK( dirID )
 
@@ -271,6 +297,7 @@ class DirectoryTreeBase:
         failed[dir] = 'Failed to remove non-empty directory'
         continue
       result = self.removeDir( dir )
+      self.db.dirCache.invalidate( [dir] )
       if not result['OK']:
         failed[dir] = result['Message']
       else:
@@ -493,50 +520,50 @@ class DirectoryTreeBase:
     return self._setDirectoryParameter( path, 'Status', status )
 
   def getPathPermissions( self, lfns, credDict ):
-    """ Get permissions for the given user/group to manipulate the given lfns 
-    """
-    successful = {}
-    failed = {}
-    for path in lfns:
-      result = self.getDirectoryPermissions( path, credDict )
-      if not result['OK']:
-        failed[path] = result['Message']
-      else:
-        successful[path] = result['Value']
-
-    return S_OK( {'Successful':successful, 'Failed':failed} )
-
-  #####################################################################
-  def getDirectoryPermissions( self, path, credDict ):
-    """ Get permissions for the given user/group to manipulate the given directory 
+    """ Get permissions for the given user/group to manipulate the given lfns.
+        The permissions of a path which is not an existing directory are the ones
+        of its nearest existing parent directory
     """
     result = self.db.ugManager.getUserAndGroupID( credDict )
     if not result['OK']:
       return result
     uid, gid = result['Value']
 
-    result = self.getDirectoryParameters( path )
-    if not result['OK']:
-      if "not found" in result['Message'] or "not exist" in result['Message']:
-        # If the directory does not exist, check the nearest parent for the permissions
-        if path == '/':
-          # Nothing yet exists, starting from the scratch
-          resultDict = {}  
-          resultDict['Write'] = True
-          resultDict['Read'] = True 
-          resultDict['Execute'] = True
-          return S_OK( resultDict )
-        else:
-          pDir = os.path.dirname( path )
-          result = self.getDirectoryPermissions( pDir, credDict )
-          return result
+    successful = {}
+    failed = {}
+    # { directory to check : [ lfns resolved by it ] }
+    toResolve = {}
+    for path in lfns:
+      if not path or path[0] != '/':
+        failed[path] = 'Not an absolute path'
       else:
+        toResolve.setdefault( os.path.normpath( path ), [] ).append( path )
+
+    while toResolve:
+      result = self._getDirectoryModes( toResolve.keys() )
+      if not result['OK']:
         return result
+      modeDict = result['Value']
+      parents = {}
+      for dirPath, paths in toResolve.items():
+        if dirPath in modeDict:
+          permissions = self.__getPermissions( modeDict[dirPath], uid, gid )
+        elif dirPath == '/':
+          # Nothing yet exists, starting from the scratch
+          permissions = { 'Read' : True, 'Write' : True, 'Execute' : True }
+        else:
+          parents.setdefault( os.path.dirname( dirPath ), [] ).extend( paths )
+          continue
+        for path in paths:
+          successful[path] = dict( permissions )
+      toResolve = parents
 
-    dUid = result['Value']['UID']
-    dGid = result['Value']['GID']
-    mode = result['Value']['Mode']
+    return S_OK( {'Successful':successful, 'Failed':failed} )
 
+  def __getPermissions( self, parameters, uid, gid ):
+    """ Evaluate the permissions of the user/group for a directory with the given parameters
+    """
+    dUid, dGid, mode = parameters
     owner = uid == dUid
     group = gid == dGid
 
@@ -556,7 +583,76 @@ class DirectoryTreeBase:
                             or ( group and mode & stat.S_IXGRP > 0 )\
                             or mode & stat.S_IXOTH > 0
 
-    return S_OK( resultDict )
+    return resultDict
+
+  def _getDirectoryModes( self, paths ):
+    """ Get the owner, group and mode of the given directories, one directory at a time.
+        The trees able to find several directories at once use _getDirectoryModesBulk instead
+
+        :param list paths: normalized directory paths
+        :return: S_OK( { path : ( uid, gid, mode ) } ) for the existing directories
+    """
+    modeDict = {}
+    for path in paths:
+      result = self.getDirectoryParameters( path )
+      if not result['OK']:
+        if "not found" in result['Message'] or "not exist" in result['Message']:
+          continue
+        return result
+      modeDict[path] = ( result['Value']['UID'], result['Value']['GID'], result['Value']['Mode'] )
+    return S_OK( modeDict )
+
+  def _getDirectoryModesBulk( self, paths ):
+    """ Get the owner, group and mode of the given directories, looking first in the directory cache.
+        It needs _findDirs and _getDirectoryModesForIDs to be implemented by the tree
+
+        :param list paths: normalized directory paths
+        :return: S_OK( { path : ( uid, gid, mode ) } ) for the existing directories
+    """
+    modeDict, missing = self.db.dirCache.getParameters( paths )
+    if not missing:
+      return S_OK( modeDict )
+
+    result = self.findDirs( missing )
+    if not result['OK']:
+      return result
+    dirIDs = result['Value']
+    if not dirIDs:
+      return S_OK( modeDict )
+
+    result = self._getDirectoryModesForIDs( dirIDs.values() )
+    if not result['OK']:
+      return result
+    idModes = result['Value']
+    cacheDict = {}
+    for path, dirID in dirIDs.items():
+      if dirID in idModes:
+        modeDict[path] = idModes[dirID]
+        cacheDict[path] = ( dirID, ) + idModes[dirID]
+    self.db.dirCache.addParameters( cacheDict )
+    return S_OK( modeDict )
+
+  def _getDirectoryModesForIDs( self, dirIDs ):
+    """ Get the owner, group and mode of the directories with the given IDs
+
+        :return: S_OK( { dirID : ( uid, gid, mode ) } )
+    """
+    req = "SELECT DirID,UID,GID,Mode FROM FC_DirectoryInfo WHERE DirID IN ( %s )" % intListToString( dirIDs )
+    result = self.db._query( req )
+    if not result['OK']:
+      return result
+    return S_OK( dict( ( dirID, ( int( uid ), int( gid ), int( mode ) ) ) for dirID, uid, gid, mode in result['Value'] ) )
+
+  #####################################################################
+  def getDirectoryPermissions( self, path, credDict ):
+    """ Get permissions for the given user/group to manipulate the given directory 
+    """
+    result = self.getPathPermissions( [path], credDict )
+    if not result['OK']:
+      return result
+    if path in result['Value']['Failed']:
+      return S_ERROR( result['Value']['Failed'][path] )
+    return S_OK( result['Value']['Successful'][path] )
 
   def getFileIDsInDirectoryWithLimits( self, dirID, credDict, startItem = 1, maxItems = 25 ):
     """ Get file IDs for the given directory
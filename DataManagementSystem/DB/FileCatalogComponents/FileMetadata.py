@@ -8,19 +8,33 @@
 
 __RCSID__ = "$Id$"
 
+from bisect import bisect_left
 from types import IntType, ListType, LongType, DictType, StringTypes, FloatType
 from DIRAC import S_OK, S_ERROR
+from DIRAC.Core.Utilities import DEncode
 from DIRAC.Core.Utilities.Time import queryTime
-from DIRAC.Core.Utilities.List import intListToString
+from DIRAC.Core.Utilities.DictCache import DictCache
+from DIRAC.Core.Utilities.List import intListToString, breakListIntoChunks
 from DIRAC.DataManagementSystem.Client.MetaQuery import FILE_STANDARD_METAKEYS, \
                                                         FILES_TABLE_METAKEYS, \
                                                         FILEINFO_TABLE_METAKEYS
 
+# Default maximum number of files in a page of a metadata query
+QUERY_PAGE_SIZE = 10000
+# Number of candidate directories looked up together in a metadata query
+DIRECTORY_BATCH_SIZE = 1000
+# Number of given files checked together against a metadata query
+FILE_BATCH_SIZE = 1000
+# Seconds during which the directories selected by a paged query are reused for its next pages
+QUERY_CACHE_TIME = 600
+
 class FileMetadata:
 
   def __init__( self, database = None ):
 
     self.db = database
+    # Directories selected by the paged queries, for the next pages of the same query
+    self.__queryDirCache = DictCache()
 
   def setDatabase( self, database ):
     self.db = database
@@ -496,9 +510,11 @@ class FileMetadata:
     return S_OK( resultList )
 
 
-  def __findFilesByMetadata( self, metaDict, dirList, credDict ):
-    """ Find a list of file IDs meeting the metaDict requirements and belonging
-        to directories in dirList
+  def __buildFilesQuery( self, metaDict ):
+    """ Build the joins and the conditions selecting the files of FC_Files F meeting
+        the metaDict requirements
+
+        :return: S_OK( ( joins string, [ conditions ] ) )
     """
     # 1.- classify Metadata keys
     storageElements = None
@@ -538,18 +554,14 @@ class FileMetadata:
         return result
       tablesAndConditions.extend( result['Value'] )
 
-    query = 'SELECT F.FileID FROM FC_Files F '
+    joins = []
     conditions = []
     tables = []
 
-    if dirList:
-      dirString = intListToString( dirList )
-      conditions.append( "F.DirID in (%s)" % dirString )
-
     counter = 0
     for table, condition in tablesAndConditions:
       if table == 'FC_FileInfo':
-        query += 'INNER JOIN FC_FileInfo FI USING( FileID ) '
+        joins.append( 'INNER JOIN FC_FileInfo FI USING( FileID )' )
         condition = condition.replace( '%%', '%' )
       elif table == 'FC_Files':
         condition = condition.replace( '%%', '%' )
@@ -563,7 +575,22 @@ class FileMetadata:
         condition = condition % table
       conditions.append( condition )
 
-    query += ' '.join( tables )
+    return S_OK( ( ' '.join( joins + tables ), conditions ) )
+
+  def __findFilesByMetadata( self, metaDict, dirList, credDict ):
+    """ Find a list of file IDs meeting the metaDict requirements and belonging
+        to directories in dirList
+    """
+    result = self.__buildFilesQuery( metaDict )
+    if not result['OK']:
+      return result
+    joins, conditions = result['Value']
+
+    if dirList:
+      dirString = intListToString( dirList )
+      conditions.insert( 0, "F.DirID in (%s)" % dirString )
+
+    query = 'SELECT F.FileID FROM FC_Files F %s' % joins
     if conditions:
       query += ' WHERE %s' % ' AND '.join( conditions )
 
@@ -640,3 +667,167 @@ class FileMetadata:
       result['LFNIDDict'] = lfnIdDict
 
     return result
+
+  @queryTime
+  def findFilesByMetadataPaged( self, metaDict, path, credDict, token = '', maxItems = QUERY_PAGE_SIZE ):
+    """ Find a page of the files satisfying the given metadata. The files are ordered by
+        directory ID and file ID, the query is resumed after the last file of the previous
+        page given by the token. The candidate directories are queried in batches, only as
+        long as the page is not full
+
+        :param str token: continuation token returned with the previous page, empty for the first one
+        :param int maxItems: maximum number of files in the page
+        :return: S_OK( { 'LFNs' : [ lfns ], 'Token' : continuation token, empty when the query is complete } )
+    """
+    if not path:
+      path = '/'
+    result = self.__parseQueryToken( token )
+    if not result['OK']:
+      return result
+    lastDirID, lastFileID = result['Value']
+    maxItems = max( 1, maxItems )
+    page = { 'LFNs' : [], 'Token' : '' }
+
+    # 1.- Get Directories matching the metadata query, only once for all the pages of the query
+    result = self.__getQueryDirectories( metaDict, path, credDict, reuse = bool( token ) )
+    if not result['OK']:
+      return result
+    dirFlag, dirList = result['Value']
+    if dirFlag == 'None':
+      return S_OK( page )
+
+    # 2.- Build the file metadata query
+    result = self.getFileMetadataFields( credDict )
+    if not result['OK']:
+      return result
+    fileMetaKeys = result['Value'].keys() + FILE_STANDARD_METAKEYS.keys()
+    fileMetaDict = dict( item for item in metaDict.items() if item[0] in fileMetaKeys )
+    if dirFlag == 'All' and not fileMetaDict:
+      # No Directory and no File metadata: empty search as for findFilesByMetadata
+      return S_OK( page )
+    result = self.__buildFilesQuery( fileMetaDict )
+    if not result['OK']:
+      return result
+    joins, conditions = result['Value']
+    conditions.append( '( F.DirID > %d OR ( F.DirID = %d AND F.FileID > %d ) )' % ( lastDirID, lastDirID, lastFileID ) )
+
+    # 3.- Get the file IDs, directory batch by directory batch
+    if dirFlag == 'All':
+      dirBatches = [ None ]
+    else:
+      dirList = dirList[ bisect_left( dirList, lastDirID ): ]
+      dirBatches = breakListIntoChunks( dirList, DIRECTORY_BATCH_SIZE )
+    rows = []
+    for dirBatch in dirBatches:
+      batchConditions = list( conditions )
+      if dirBatch:
+        batchConditions.insert( 0, 'F.DirID IN ( %s )' % intListToString( dirBatch ) )
+      query = 'SELECT F.DirID, F.FileID FROM FC_Files F %s WHERE %s ORDER BY F.DirID, F.FileID LIMIT %d' % \
+              ( joins, ' AND '.join( batchConditions ), maxItems - len( rows ) )
+      result = self.db._query( query )
+      if not result['OK']:
+        return result
+      rows.extend( result['Value'] )
+      if len( rows ) >= maxItems:
+        page['Token'] = '%d:%d' % ( rows[-1][0], rows[-1][1] )
+        break
+
+    # 4.- Get the LFNs in the same order
+    if rows:
+      fileIDs = [ row[1] for row in rows ]
+      result = self.db.fileManager._getFileLFNs( fileIDs )
+      if not result['OK']:
+        return result
+      lfnDict = result['Value']['Successful']
+      page['LFNs'] = [ lfnDict[fileID] for fileID in fileIDs if fileID in lfnDict ]
+
+    return S_OK( page )
+
+  def __getQueryDirectories( self, metaDict, path, credDict, reuse = False ):
+    """ Get the directories matching the directory metadata of a paged query. The selection of
+        the first page is kept for the next ones, so that each page does not select them again
+
+        :param bool reuse: use the selection of a previous page of the same query if there is one
+        :return: S_OK( ( selection flag, sorted directory IDs ) )
+    """
+    queryKey = DEncode.encode( ( metaDict, path, credDict.get( 'username' ), credDict.get( 'group' ) ) )
+    if reuse:
+      dirSelection = self.__queryDirCache.get( queryKey )
+      if dirSelection:
+        return S_OK( dirSelection )
+    result = self.db.dmeta.findDirIDsByMetadata( metaDict, path, credDict )
+    if not result['OK']:
+      return result
+    dirSelection = ( result['Selection'], sorted( result['Value'] ) )
+    self.__queryDirCache.add( queryKey, QUERY_CACHE_TIME, dirSelection )
+    return S_OK( dirSelection )
+
+  def filterFilesByMetadata( self, metaDict, path, credDict, fileIDs ):
+    """ Select among the given files the ones satisfying the given metadata. Only these files
+        and their directories are checked, so that the cost does not depend on the number of
+        files and directories in the catalog
+
+        :param list fileIDs: IDs of the files to check
+        :return: S_OK( [ IDs of the files satisfying the metadata ] )
+    """
+    if not fileIDs:
+      return S_OK( [] )
+
+    # 1.- Get the directories of the files
+    fileDirs = {}
+    for fileIDChunk in breakListIntoChunks( list( fileIDs ), FILE_BATCH_SIZE ):
+      query = 'SELECT FileID, DirID FROM FC_Files WHERE FileID IN ( %s )' % intListToString( fileIDChunk )
+      result = self.db._query( query )
+      if not result['OK']:
+        return result
+      fileDirs.update( result['Value'] )
+
+    # 2.- Select the directories matching the metadata query
+    result = self.db.dmeta.filterDirIDsByMetadata( metaDict, path, credDict, set( fileDirs.values() ) )
+    if not result['OK']:
+      return result
+    dirFlag = result['Selection']
+    dirSet = set( result['Value'] )
+    candidateIDs = [ fileID for fileID, dirID in fileDirs.items() if dirID in dirSet ]
+    if not candidateIDs:
+      return S_OK( [] )
+
+    # 3.- Build the file metadata query
+    result = self.getFileMetadataFields( credDict )
+    if not result['OK']:
+      return result
+    fileMetaKeys = result['Value'].keys() + FILE_STANDARD_METAKEYS.keys()
+    fileMetaDict = dict( item for item in metaDict.items() if item[0] in fileMetaKeys )
+    if not fileMetaDict:
+      if dirFlag == 'All':
+        # No Directory and no File metadata: empty search as for findFilesByMetadata
+        return S_OK( [] )
+      return S_OK( candidateIDs )
+    result = self.__buildFilesQuery( fileMetaDict )
+    if not result['OK']:
+      return result
+    joins, conditions = result['Value']
+
+    # 4.- Check the files in the selected directories
+    selectedIDs = []
+    for fileIDChunk in breakListIntoChunks( candidateIDs, FILE_BATCH_SIZE ):
+      chunkConditions = [ 'F.FileID IN ( %s )' % intListToString( fileIDChunk ) ] + conditions
+      query = 'SELECT F.FileID FROM FC_Files F %s WHERE %s' % ( joins, ' AND '.join( chunkConditions ) )
+      result = self.db._query( query )
+      if not result['OK']:
+        return result
+      selectedIDs.extend( row[0] for row in result['Value'] )
+
+    return S_OK( selectedIDs )
+
+  @staticmethod
+  def __parseQueryToken( token ):
+    """ Get the ( DirID, FileID ) of the last file returned from a query token
+    """
+    if not token:
+      return S_OK( ( 0, 0 ) )
+    try:
+      dirID, fileID = [ int( x ) for x in token.split( ':' ) ]
+    except ValueError:
+      return S_ERROR( 'Invalid query token %s' % token )
+    return S_OK( ( dirID, fileID ) )
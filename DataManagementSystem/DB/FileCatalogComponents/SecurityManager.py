@@ -81,6 +81,43 @@ class SecurityManagerBase( object ):
       return S_OK( True )
     return S_OK( False )
 
+  def _resolveDirectoryPermissions( self, toGet, credDict, permissions, failed ):
+    """ Resolve the permissions of the paths from the directories containing them.
+        All the directories of a batch are checked together, and the paths whose
+        directory does not exist are resolved from the parent directory, level by level.
+
+        :param dict toGet: { directory : [ paths resolved by this directory ] }
+        :param dict permissions: { path : permission dict }, filled in
+        :param dict failed: { path : error message }, filled in
+    """
+    while toGet:
+      res = self.db.dtree.getPathPermissions( toGet.keys(), credDict )
+      if not res['OK']:
+        return res
+      for path, mode in res['Value']['Successful'].items():
+        for resolvedPath in toGet[path]:
+          permissions[resolvedPath] = dict( mode )
+        toGet.pop( path )
+      for path, error in res['Value']['Failed'].items():
+        if error != 'No such file or directory':
+          for resolvedPath in toGet[path]:
+            failed[resolvedPath] = error
+          toGet.pop( path )
+      parents = {}
+      for path, resolvedPaths in toGet.items():
+        if path == '/':
+          for resolvedPath in resolvedPaths:
+            permissions[resolvedPath] = {'Read':True, 'Write':True, 'Execute':True}
+          continue
+        parents.setdefault( os.path.dirname( path ), [] ).extend( resolvedPaths )
+      toGet = parents
+
+    if self.db.globalReadAccess:
+      for path in permissions:
+        permissions[path]['Read'] = True
+
+    return S_OK()
+
 class NoSecurityManager( SecurityManagerBase ):
 
   def getPathPermissions( self, paths, credDict ):
@@ -112,31 +149,9 @@ class DirectorySecurityManager( SecurityManagerBase ):
     toGet = dict( zip( paths, [ [path] for path in paths ] ) )
     permissions = {}
     failed = {}
-    while toGet:
-      res = self.db.dtree.getPathPermissions( toGet.keys(), credDict )
-      if not res['OK']:
-        return res
-      for path, mode in res['Value']['Successful'].items():
-        for resolvedPath in toGet[path]:
-          permissions[resolvedPath] = mode
-        toGet.pop( path )
-      for path, error in res['Value']['Failed'].items():
-        if error != 'No such file or directory':
-          for resolvedPath in toGet[path]:
-            failed[resolvedPath] = error
-          toGet.pop( path )
-      for path, resolvedPaths in toGet.items():
-        if path == '/':
-          for resolvedPath in resolvedPaths:
-            permissions[path] = {'Read':True, 'Write':True, 'Execute':True}
-        if not toGet.has_key( os.path.dirname( path ) ):
-          toGet[os.path.dirname( path )] = []
-        toGet[os.path.dirname( path )] += resolvedPaths
-        toGet.pop( path )
-
-    if self.db.globalReadAccess:
-      for path in permissions:
-        permissions[path]['Read'] = True
+    result = self._resolveDirectoryPermissions( toGet, credDict, permissions, failed )
+    if not result['OK']:
+      return result
 
     return S_OK( {'Successful':permissions, 'Failed':failed} )
 
@@ -146,50 +161,25 @@ class FullSecurityManager( SecurityManagerBase ):
     """ Get path permissions according to the policy
     """
 
-    toGet = dict( zip( paths, [ [path] for path in paths ] ) )
     permissions = {}
     failed = {}
     res = self.db.fileManager.getPathPermissions( paths, credDict )
     if not res['OK']:
       return res
-    for path, mode in res['Value']['Successful'].items():
-      for resolvedPath in toGet[path]:
-        permissions[resolvedPath] = mode
-      toGet.pop( path )
-    for path, resolvedPaths in toGet.items():
-      if path == '/':
-        for resolvedPath in resolvedPaths:
-          permissions[path] = {'Read':True, 'Write':True, 'Execute':True}
-      if not toGet.has_key( os.path.dirname( path ) ):
-        toGet[os.path.dirname( path )] = []
-      toGet[os.path.dirname( path )] += resolvedPaths
-      toGet.pop( path )
-    while toGet:
-      paths = toGet.keys()
-      res = self.db.dtree.getPathPermissions( paths, credDict )
-      if not res['OK']:
-        return res
-      for path, mode in res['Value']['Successful'].items():
-        for resolvedPath in toGet[path]:
-          permissions[resolvedPath] = mode
-        toGet.pop( path )
-      for path, error in res['Value']['Failed'].items():
-        if error != 'No such file or directory':
-          for resolvedPath in toGet[path]:
-            failed[resolvedPath] = error
-          toGet.pop( path )
-      for path, resolvedPaths in toGet.items():
-        if path == '/':
-          for resolvedPath in resolvedPaths:
-            permissions[path] = {'Read':True, 'Write':True, 'Execute':True}
-        if not toGet.has_key( os.path.dirname( path ) ):
-          toGet[os.path.dirname( path )] = []
-        toGet[os.path.dirname( path )] += resolvedPaths
-        toGet.pop( path )
+    permissions.update( res['Value']['Successful'] )
 
-    if self.db.globalReadAccess:
-      for path in permissions:
-        permissions[path]['Read'] = True
+    # The paths which are not files get the permissions of their directory
+    toGet = {}
+    for path in paths:
+      if path in permissions:
+        continue
+      if path == '/':
+        permissions[path] = {'Read':True, 'Write':True, 'Execute':True}
+      else:
+        toGet.setdefault( os.path.dirname( path ), [] ).append( path )
+    result = self._resolveDirectoryPermissions( toGet, credDict, permissions, failed )
+    if not result['OK']:
+      return result
 
     return S_OK( {'Successful':permissions, 'Failed':failed} )
 
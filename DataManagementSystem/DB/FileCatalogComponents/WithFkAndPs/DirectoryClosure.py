@@ -31,7 +31,7 @@ class DirectoryClosure( DirectoryTreeBase ):
     self.closureTable = 'FC_DirectoryClosure'
 
 
-  def findDir( self, path, connection = False ):
+  def _findDir( self, path, connection = False ):
     """  Find directory ID for the given path
 
       :param path : path of the directory
@@ -52,7 +52,7 @@ class DirectoryClosure( DirectoryTreeBase ):
     return res
 
 
-  def findDirs( self, paths, connection = False ):
+  def _findDirs( self, paths, connection = False ):
     """ Find DirIDs for the given path list
 
         :param paths: list of path
@@ -481,6 +481,27 @@ class DirectoryClosure( DirectoryTreeBase ):
     return S_OK( rowDict )
 
 
+  def _getDirectoryModes( self, paths ):
+    """ Get the owner, group and mode of the given directories with a few bulk queries
+    """
+    return self._getDirectoryModesBulk( paths )
+
+  def _getDirectoryModesForIDs( self, dirIDs ):
+    """ Get the owner, group and mode of the directories with the given IDs
+
+      :param dirIDs : list of directory ids
+
+      :returns S_OK( { dirID : ( uid, gid, mode ) } )
+    """
+
+    req = "SELECT DirID, UID, GID, Mode FROM FC_DirectoryList WHERE DirID IN ( %s )" % intListToString( dirIDs )
+    result = self.db._query( req )
+    if not result['OK']:
+      return result
+
+    return S_OK( dict( ( dirID, ( int( uid ), int( gid ), int( mode ) ) ) for dirID, uid, gid, mode in result['Value'] ) )
+
+
   def _setDirectoryParameter( self, path, pname, pvalue, recursive = False ):
     """ Set a numerical directory parameter
 
@@ -0,0 +1,214 @@
+""" unit tests for the materialized file lists of the dynamic datasets of the DatasetManager,
+    run against an in-memory sqlite database
+"""
+
+# pylint: disable=missing-docstring,invalid-name,protected-access
+
+import unittest
+import sqlite3
+from mock import MagicMock
+
+from DIRAC import S_OK
+from DIRAC.Core.Utilities import Time
+from DIRAC.DataManagementSystem.DB.FileCatalogComponents.DatasetManager import DatasetManager
+
+# FileID : ( LFN, Size, Run )
+FILES = { 1 : ( '/vo/f1', 10, 5 ), 2 : ( '/vo/f2', 20, 5 ), 3 : ( '/vo/f3', 40, 6 ) }
+
+class mock_db( object ):
+
+  def __init__( self ):
+    self.connection = sqlite3.connect( ':memory:' )
+    self.connection.executescript( """
+      CREATE TABLE FC_Files( FileID INTEGER PRIMARY KEY, Size INTEGER );
+      CREATE TABLE FC_MetaDatasets( DatasetID INTEGER PRIMARY KEY, DatasetName TEXT, MetaQuery TEXT,
+                                    DatasetHash TEXT, TotalSize INTEGER, NumberOfFiles INTEGER,
+                                    ModificationDate TEXT );
+      CREATE TABLE FC_DynamicDatasets( DatasetID INTEGER PRIMARY KEY, NumberOfFiles INTEGER DEFAULT 0, TotalSize INTEGER DEFAULT 0,
+                                       Version INTEGER DEFAULT 0, CheckedVersion INTEGER DEFAULT -1,
+                                       Building INTEGER DEFAULT 0, BuildStartTime TEXT );
+      CREATE TABLE FC_DynamicDatasetFiles( DatasetID INTEGER, FileID INTEGER, UNIQUE( DatasetID, FileID ) );
+      CREATE TABLE FC_MetaDatasetFiles( DatasetID INTEGER, FileID INTEGER );
+      CREATE TABLE FC_DatasetAnnotations( DatasetID INTEGER, Annotation TEXT );
+    """ )
+    self.files = dict( FILES )
+    for fileID, ( _lfn, size, _run ) in self.files.items():
+      self.connection.execute( "INSERT INTO FC_Files VALUES ( ?, ? )", ( fileID, size ) )
+    self.fmeta = MagicMock()
+    self.fmeta.findFilesByMetadata.side_effect = self.findFilesByMetadata
+    self.fmeta.filterFilesByMetadata.side_effect = self.filterFilesByMetadata
+    self.fileManager = MagicMock()
+    self.fileManager._getFileLFNs.side_effect = self.getFileLFNs
+    self.fileManager.getFileSize.side_effect = self.getFileSize
+
+  def __selectFiles( self, metaDict, fileIDs ):
+    return [ fileID for fileID in fileIDs if self.files[fileID][2] == metaDict['Run'] ]
+
+  def findFilesByMetadata( self, metaDict, _path, _credDict, extra = False ):
+    fileIDs = self.__selectFiles( metaDict, self.files )
+    result = S_OK( [ self.files[fileID][0] for fileID in fileIDs ] )
+    result['LFNIDDict'] = dict( ( fileID, self.files[fileID][0] ) for fileID in fileIDs )
+    return result
+
+  def filterFilesByMetadata( self, metaDict, _path, _credDict, fileIDs ):
+    return S_OK( self.__selectFiles( metaDict, fileIDs ) )
+
+  def getFileLFNs( self, fileIDs ):
+    return S_OK( { 'Successful' : dict( ( fileID, self.files[fileID][0] ) for fileID in fileIDs ), 'Failed' : {} } )
+
+  def getFileSize( self, lfns ):
+    result = S_OK()
+    result['TotalSize'] = sum( size for lfn, size, _run in self.files.values() if lfn in lfns )
+    return result
+
+  def setFile( self, fileID, lfn, size, run ):
+    self.files[fileID] = ( lfn, size, run )
+    self.connection.execute( "INSERT OR REPLACE INTO FC_Files VALUES ( ?, ? )", ( fileID, size ) )
+
+  def _query( self, req, connection = False ):
+    return S_OK( tuple( self.connection.execute( req ).fetchall() ) )
+
+  def _update( self, req, connection = False ):
+    req = req.replace( 'UTC_TIMESTAMP()', "'now'" )
+    return S_OK( self.connection.execute( req ).rowcount )
+
+class DatasetManagerTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    self.db = mock_db()
+    self.dm = DatasetManager()
+    self.dm.db = self.db
+    self.db.connection.execute( "INSERT INTO FC_MetaDatasets VALUES ( 1, 'ds', ?, ?, 30, 2, '' )",
+                                ( str( { 'Run' : 5 } ), self.__hash( [ '/vo/f1', '/vo/f2' ] ) ) )
+
+  def __hash( self, lfns ):
+    return self.dm._DatasetManager__getDatasetHash( lfns )
+
+  def __getFiles( self ):
+    result = self.dm._DatasetManager__getDynamicDatasetFiles( 1, {} )
+    self.assertTrue( result['OK'] )
+    return result['Value']
+
+  def __getState( self ):
+    return self.db.connection.execute( "SELECT NumberOfFiles,TotalSize,Version,CheckedVersion FROM FC_DynamicDatasets" ).fetchall()
+
+  def test_materialization( self ):
+    # The file list is materialized by the first read, the next ones do not run the query
+    self.assertEqual( self.__getFiles(), [ '/vo/f1', '/vo/f2' ] )
+    self.assertEqual( self.__getFiles(), [ '/vo/f1', '/vo/f2' ] )
+    self.assertEqual( self.db.fmeta.findFilesByMetadata.call_count, 1 )
+    self.assertEqual( self.__getState(), [ ( 2, 30, 0, -1 ) ] )
+
+    # The datasets selecting on the storage elements are not materialized
+    self.db.connection.execute( "INSERT INTO FC_MetaDatasets VALUES ( 2, 'se', ?, '', 0, 0, '' )",
+                                ( str( { 'Run' : 5, 'SE' : 'SE1' } ), ) )
+    self.dm._DatasetManager__getDynamicDatasetFiles( 2, {} )
+    self.dm._DatasetManager__getDynamicDatasetFiles( 2, {} )
+    self.assertEqual( self.db.fmeta.findFilesByMetadata.call_count, 3 )
+    self.assertEqual( len( self.__getState() ), 1 )
+
+  def test_checkDataset( self ):
+    result = self.dm.checkDataset( { 'ds' : True }, {} )
+    self.assertEqual( result['Value']['Successful'], { 'ds' : {} } )
+    self.assertEqual( self.__getState(), [ ( 2, 30, 0, 0 ) ] )
+    # Unchanged file list: the parameters are not computed again
+    self.db.fileManager._getFileLFNs.reset_mock()
+    result = self.dm.checkDataset( { 'ds' : True }, {} )
+    self.assertEqual( result['Value']['Successful'], { 'ds' : {} } )
+    self.assertFalse( self.db.fileManager._getFileLFNs.called )
+
+    # A new matching file and a non matching one
+    self.db.setFile( 4, '/vo/f4', 100, 5 )
+    self.db.setFile( 5, '/vo/f5', 200, 6 )
+    self.assertTrue( self.dm.updateDatasetFiles( [ 4, 5 ], {} )['OK'] )
+    self.assertEqual( self.__getState(), [ ( 3, 130, 1, 0 ) ] )
+    self.assertEqual( self.__getFiles(), [ '/vo/f1', '/vo/f2', '/vo/f4' ] )
+    result = self.dm.checkDataset( { 'ds' : True }, {} )
+    changes = result['Value']['Successful']['ds']
+    self.assertEqual( changes['NumberOfFiles'], ( 2, 3 ) )
+    self.assertEqual( changes['TotalSize'], ( 30, 130 ) )
+    self.assertEqual( changes['DatasetHash'][1], self.__hash( [ '/vo/f1', '/vo/f2', '/vo/f4' ] ) )
+
+    # The update stores the parameters and the checked version
+    self.assertTrue( self.dm.updateDataset( { 'ds' : True }, {} )['OK'] )
+    self.assertEqual( self.__getState(), [ ( 3, 130, 1, 1 ) ] )
+    self.assertEqual( self.dm.checkDataset( { 'ds' : True }, {} )['Value']['Successful'], { 'ds' : {} } )
+
+  def test_incrementalChanges( self ):
+    self.__getFiles()
+    # Metadata change of a file: it leaves the dataset
+    self.db.setFile( 2, '/vo/f2', 20, 7 )
+    self.assertTrue( self.dm.updateDatasetFiles( [ 2 ], {}, [ 'Run' ] )['OK'] )
+    self.assertEqual( self.__getFiles(), [ '/vo/f1' ] )
+    self.assertEqual( self.__getState(), [ ( 1, 10, 1, -1 ) ] )
+    # The datasets not selecting on the changed metadata are not concerned
+    self.db.fmeta.filterFilesByMetadata.reset_mock()
+    self.db.setFile( 3, '/vo/f3', 40, 5 )
+    self.assertTrue( self.dm.updateDatasetFiles( [ 3 ], {}, [ 'Other' ] )['OK'] )
+    self.assertFalse( self.db.fmeta.filterFilesByMetadata.called )
+    self.assertEqual( self.__getFiles(), [ '/vo/f1' ] )
+
+    # File removal
+    self.assertTrue( self.dm.removeDatasetFiles( { 1 : 10, 3 : 40 } )['OK'] )
+    self.assertEqual( self.__getFiles(), [] )
+    self.assertEqual( self.__getState(), [ ( 0, 0, 2, -1 ) ] )
+
+  def test_changeWhileMaterializing( self ):
+    # A file is added while the dataset query runs: the file list being built is not kept
+    findFilesByMetadata = self.db.findFilesByMetadata
+    def findFilesAndAddFile( *args, **kwargs ):
+      result = findFilesByMetadata( *args, **kwargs )
+      self.db.setFile( 4, '/vo/f4', 100, 5 )
+      self.assertTrue( self.dm.updateDatasetFiles( [ 4 ], {} )['OK'] )
+      return result
+    self.db.fmeta.findFilesByMetadata.side_effect = findFilesAndAddFile
+    self.assertEqual( self.__getFiles(), [ '/vo/f1', '/vo/f2' ] )
+    # The hook did not evaluate the file for the list being built
+    self.assertFalse( self.db.fmeta.filterFilesByMetadata.called )
+    self.assertEqual( self.__getState(), [] )
+    self.assertEqual( self.db.connection.execute( "SELECT COUNT(*) FROM FC_DynamicDatasetFiles" ).fetchall(), [ ( 0, ) ] )
+    # Materialized by the next read
+    self.db.fmeta.findFilesByMetadata.side_effect = self.db.findFilesByMetadata
+    self.assertEqual( self.__getFiles(), [ '/vo/f1', '/vo/f2', '/vo/f4' ] )
+    self.assertEqual( self.__getState(), [ ( 3, 130, 0, -1 ) ] )
+
+  def test_invalidation( self ):
+    self.__getFiles()
+    self.assertTrue( self.dm.invalidateDatasetFiles( [ 'Other' ] )['OK'] )
+    self.assertEqual( len( self.__getState() ), 1 )
+    self.assertTrue( self.dm.invalidateDatasetFiles( [ 'Run' ] )['OK'] )
+    self.assertEqual( self.__getState(), [] )
+    # Materialized again by the next read
+    self.db.setFile( 3, '/vo/f3', 40, 5 )
+    self.assertEqual( self.__getFiles(), [ '/vo/f1', '/vo/f2', '/vo/f3' ] )
+    self.assertEqual( self.__getState(), [ ( 3, 70, 0, -1 ) ] )
+    # Removing the dataset removes its file list
+    self.assertTrue( self.dm.removeDataset( [ 'ds' ], {} )['OK'] )
+    self.assertEqual( self.db.connection.execute( "SELECT COUNT(*) FROM FC_DynamicDatasetFiles" ).fetchall(), [ ( 0, ) ] )
+
+  def test_abandonedBuild( self ):
+    # Left by a service which died while building the file list
+    self.db.connection.execute( "INSERT INTO FC_DynamicDatasets (DatasetID,Building,BuildStartTime) "
+                                "VALUES ( 1, 1, '2016-01-01 00:00:00' )" )
+    self.db.connection.execute( "INSERT INTO FC_DynamicDatasetFiles VALUES ( 1, 3 )" )
+    self.assertEqual( self.__getFiles(), [ '/vo/f1', '/vo/f2' ] )
+    self.assertEqual( self.__getState(), [ ( 2, 30, 0, -1 ) ] )
+    self.assertEqual( self.__getFiles(), [ '/vo/f1', '/vo/f2' ] )
+    self.assertEqual( self.db.fmeta.findFilesByMetadata.call_count, 1 )
+
+  def test_buildInProgress( self ):
+    # Another service is building the file list: the query is run without storing its result
+    buildStartTime = str( Time.dateTime().replace( microsecond = 0 ) )
+    self.db.connection.execute( "INSERT INTO FC_DynamicDatasets (DatasetID,Building,BuildStartTime) "
+                                "VALUES ( 1, 1, ? )", ( buildStartTime, ) )
+    self.assertEqual( self.__getFiles(), [ '/vo/f1', '/vo/f2' ] )
+    self.assertEqual( self.db.connection.execute( "SELECT Building,BuildStartTime FROM FC_DynamicDatasets" ).fetchall(),
+                      [ ( 1, buildStartTime ) ] )
+    # The build taken over by another service is not stored
+    result = self.dm._DatasetManager__storeDatasetFiles( 1, { 'LFNIDList' : [ 1 ], 'NumberOfFiles' : 1, 'TotalSize' : 10 },
+                                                         '2016-01-01 00:00:00' )
+    self.assertFalse( result['OK'] )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( DatasetManagerTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
@@ -0,0 +1,162 @@
+""" unit tests for the directory cache of the FileCatalogDB and the bulk resolution
+    of the directory permissions
+"""
+
+# pylint: disable=missing-docstring,invalid-name,protected-access
+
+import unittest
+
+from DIRAC import S_OK, S_ERROR
+from DIRAC.DataManagementSystem.DB.FileCatalogComponents.DirectoryCache import DirectoryCache
+from DIRAC.DataManagementSystem.DB.FileCatalogComponents.DirectoryTreeBase import DirectoryTreeBase
+
+# path : ( dirID, uid, gid, mode )
+DIRECTORIES = { '/' : ( 1, 0, 0, 0775 ),
+                '/vo' : ( 2, 1, 1, 0755 ),
+                '/vo/user' : ( 3, 2, 2, 0700 ),
+                '/vo/data' : ( 4, 1, 1, 0775 ) }
+
+class mock_ugManager( object ):
+
+  def getUserAndGroupID( self, credDict ):
+    return S_OK( ( credDict['uid'], credDict['gid'] ) )
+
+class mock_db( object ):
+
+  def __init__( self, cacheSize = 100 ):
+    self.dirCache = DirectoryCache( cacheSize, 60 )
+    self.ugManager = mock_ugManager()
+    self.globalReadAccess = False
+
+class mock_DirectoryTree( DirectoryTreeBase ):
+
+  def __init__( self, database ):
+    DirectoryTreeBase.__init__( self, database )
+    self.findDirsCalls = []
+    self.modesCalls = []
+
+  def _findDir( self, path, connection = False ):
+    return S_OK( DIRECTORIES.get( path, ( 0, ) )[0] )
+
+  def _findDirs( self, paths, connection = False ):
+    self.findDirsCalls.append( sorted( paths ) )
+    return S_OK( dict( ( path, DIRECTORIES[path][0] ) for path in paths if path in DIRECTORIES ) )
+
+  def _getDirectoryModes( self, paths ):
+    return self._getDirectoryModesBulk( paths )
+
+  def _getDirectoryModesForIDs( self, dirIDs ):
+    self.modesCalls.append( sorted( dirIDs ) )
+    return S_OK( dict( ( entry[0], entry[1:] ) for entry in DIRECTORIES.values() if entry[0] in dirIDs ) )
+
+class mock_SimpleTree( DirectoryTreeBase ):
+  """ Tree without bulk lookup, the directories are resolved one at a time
+  """
+
+  def __init__( self, database ):
+    DirectoryTreeBase.__init__( self, database )
+    self.parameterCalls = []
+
+  def getDirectoryParameters( self, path ):
+    self.parameterCalls.append( path )
+    if path not in DIRECTORIES:
+      return S_ERROR( 'Directory %s not found' % path )
+    _dirID, uid, gid, mode = DIRECTORIES[path]
+    return S_OK( { 'UID' : uid, 'GID' : gid, 'Mode' : mode } )
+
+class DirectoryCacheTestCase( unittest.TestCase ):
+
+  def test_lru( self ):
+    cache = DirectoryCache( 3, 60 )
+    for path, dirID in [ ( '/a', 1 ), ( '/b', 2 ), ( '/c', 3 ) ]:
+      cache.addDirIDs( { path : dirID } )
+    # Use /a, so that /b is the least recently used
+    self.assertEqual( cache.getDirIDs( [ '/a' ] ), ( { '/a' : 1 }, [] ) )
+    cache.addDirIDs( { '/d' : 4 } )
+    self.assertEqual( cache.getDirIDs( [ '/a', '/b', '/c', '/d' ] ), ( { '/a' : 1, '/c' : 3, '/d' : 4 }, [ '/b' ] ) )
+    status = cache.getStatus()
+    self.assertEqual( ( status['Size'], status['Hits'], status['Misses'] ), ( 3, 4, 1 ) )
+
+  def test_parameters( self ):
+    cache = DirectoryCache( 10, 60 )
+    cache.addDirIDs( { '/a' : 1 } )
+    self.assertEqual( cache.getParameters( [ '/a' ] ), ( {}, [ '/a' ] ) )
+    cache.addParameters( { '/a' : ( 1, 10, 20, 0755 ) } )
+    self.assertEqual( cache.getParameters( [ '/a' ] ), ( { '/a' : ( 10, 20, 0755 ) }, [] ) )
+    # Same directory ID: the parameters are kept
+    cache.addDirIDs( { '/a' : 1 } )
+    self.assertEqual( cache.getParameters( [ '/a' ] )[0], { '/a' : ( 10, 20, 0755 ) } )
+    # Recreated directory: the parameters are dropped
+    cache.addDirIDs( { '/a' : 5 } )
+    self.assertEqual( cache.getParameters( [ '/a' ] )[1], [ '/a' ] )
+
+  def test_invalidate( self ):
+    cache = DirectoryCache( 10, 60 )
+    cache.addDirIDs( { '/a' : 1, '/a/b' : 2, '/a/b/c' : 3, '/ab' : 4 } )
+    cache.invalidate( [ '/a/b' ] )
+    self.assertEqual( cache.getDirIDs( [ '/a', '/a/b', '/a/b/c' ] )[1], [ '/a/b' ] )
+    cache.invalidate( [ '/a' ], recursive = True )
+    self.assertEqual( cache.getDirIDs( [ '/a', '/a/b/c', '/ab' ] ), ( { '/ab' : 4 }, [ '/a', '/a/b/c' ] ) )
+    cache.invalidate( [ '/' ], recursive = True )
+    self.assertEqual( cache.getStatus()['Size'], 0 )
+
+  def test_expiration( self ):
+    cache = DirectoryCache( 10, -1 )
+    cache.addDirIDs( { '/a' : 1 } )
+    self.assertEqual( cache.getDirIDs( [ '/a' ] ), ( {}, [ '/a' ] ) )
+    disabled = DirectoryCache( 0, 60 )
+    disabled.addDirIDs( { '/a' : 1 } )
+    self.assertEqual( disabled.getDirIDs( [ '/a' ] ), ( {}, [ '/a' ] ) )
+
+class PathPermissionsTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    self.dtree = mock_DirectoryTree( mock_db() )
+
+  def test_getPathPermissions( self ):
+    lfns = [ '/vo/user/f1', '/vo/user/f2', '/vo/user/sub/f3', '/vo/data/f4', '/vo/user/', '/other/f5', 'relative' ]
+    result = self.dtree.getPathPermissions( lfns, { 'uid' : 2, 'gid' : 1 } )
+    self.assertTrue( result['OK'] )
+    permissions = result['Value']['Successful']
+    self.assertEqual( result['Value']['Failed'].keys(), [ 'relative' ] )
+    # Owner of /vo/user
+    for lfn in [ '/vo/user/f1', '/vo/user/f2', '/vo/user/sub/f3', '/vo/user/' ]:
+      self.assertEqual( permissions[lfn], { 'Read' : True, 'Write' : True, 'Execute' : True } )
+    # Group of /vo/data
+    self.assertEqual( permissions['/vo/data/f4'], { 'Read' : True, 'Write' : True, 'Execute' : True } )
+    # Others of /
+    self.assertEqual( permissions['/other/f5'], { 'Read' : True, 'Write' : False, 'Execute' : True } )
+    # The directories of a level are looked up together
+    self.assertEqual( len( self.dtree.findDirsCalls ), 3 )
+
+    # The directories are now in the cache, only the file path itself is looked up
+    result = self.dtree.getDirectoryPermissions( '/vo/user/f1', { 'uid' : 3, 'gid' : 3 } )
+    self.assertEqual( result['Value'], { 'Read' : False, 'Write' : False, 'Execute' : False } )
+    self.assertEqual( self.dtree.findDirsCalls[3:], [ [ '/vo/user/f1' ] ] )
+    self.assertEqual( len( self.dtree.modesCalls ), 3 )
+
+    # After the invalidation the directory is looked up again
+    self.dtree.db.dirCache.invalidate( [ '/vo/user' ] )
+    self.assertEqual( self.dtree.findDir( '/vo/user/' )['Value'], 3 )
+    self.dtree.getDirectoryPermissions( '/vo/user/f1', { 'uid' : 3, 'gid' : 3 } )
+    self.assertEqual( self.dtree.modesCalls[-1], [ 3 ] )
+
+  def test_perPathFallback( self ):
+    dtree = mock_SimpleTree( mock_db() )
+    result = dtree.getPathPermissions( [ '/vo/user/f1', '/vo/data/f4', '/other/f5' ], { 'uid' : 2, 'gid' : 1 } )
+    self.assertTrue( result['OK'] )
+    permissions = result['Value']['Successful']
+    self.assertEqual( permissions['/vo/user/f1'], { 'Read' : True, 'Write' : True, 'Execute' : True } )
+    self.assertEqual( permissions['/vo/data/f4'], { 'Read' : True, 'Write' : True, 'Execute' : True } )
+    self.assertEqual( permissions['/other/f5'], { 'Read' : True, 'Write' : False, 'Execute' : True } )
+    self.assertEqual( sorted( set( dtree.parameterCalls ) ),
+                      [ '/', '/other', '/other/f5', '/vo/data', '/vo/data/f4', '/vo/user', '/vo/user/f1' ] )
+
+    dtree.getDirectoryParameters = lambda path: S_ERROR( 'Connection lost' )
+    result = dtree.getPathPermissions( [ '/vo/user/f1' ], { 'uid' : 2, 'gid' : 1 } )
+    self.assertFalse( result['OK'] )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( DirectoryCacheTestCase )
+  suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( PathPermissionsTestCase ) )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
@@ -0,0 +1,76 @@
+""" unit tests for the selection of given directories by metadata of the DirectoryMetadata,
+    run against an in-memory sqlite database
+"""
+
+# pylint: disable=missing-docstring,invalid-name,protected-access
+
+import unittest
+import sqlite3
+from mock import MagicMock
+
+from DIRAC import S_OK
+from DIRAC.DataManagementSystem.DB.FileCatalogComponents.DirectoryMetadata import DirectoryMetadata
+
+# DirID : parent DirID
+# 1 /, 2 /vo, 3 /vo/data, 4 /vo/data/run5, 5 /vo/user
+TREE = { 1 : None, 2 : 1, 3 : 2, 4 : 3, 5 : 2 }
+
+class mock_db( object ):
+
+  def __init__( self ):
+    self.connection = sqlite3.connect( ':memory:' )
+    self.connection.executescript( """
+      CREATE TABLE FC_MetaFields( MetaName TEXT, MetaType TEXT );
+      CREATE TABLE FC_Meta_Type( DirID INTEGER PRIMARY KEY, Value TEXT );
+      CREATE TABLE FC_Meta_Run( DirID INTEGER PRIMARY KEY, Value INTEGER );
+      INSERT INTO FC_MetaFields VALUES ( 'Type', 'VARCHAR(128)' );
+      INSERT INTO FC_MetaFields VALUES ( 'Run', 'INT' );
+      INSERT INTO FC_Meta_Type VALUES ( 3, 'data' );
+      INSERT INTO FC_Meta_Type VALUES ( 5, 'user' );
+      INSERT INTO FC_Meta_Run VALUES ( 4, 5 );
+    """ )
+    self.queries = []
+    self.dtree = MagicMock()
+    self.dtree.getPathIDsByID.side_effect = self.getPathIDsByID
+    self.dtree.getPathIDs.return_value = S_OK( [ 1, 2, 3 ] )
+
+  @staticmethod
+  def getPathIDsByID( dirID ):
+    pathIDs = []
+    while dirID:
+      pathIDs.insert( 0, dirID )
+      dirID = TREE[dirID]
+    return S_OK( pathIDs )
+
+  def _query( self, req ):
+    self.queries.append( req )
+    return S_OK( tuple( self.connection.execute( req ).fetchall() ) )
+
+class DirectoryMetadataFilterTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    self.db = mock_db()
+    self.dmeta = DirectoryMetadata( self.db )
+
+  def __filter( self, metaDict, path = '/' ):
+    result = self.dmeta.filterDirIDsByMetadata( metaDict, path, {}, [ 2, 3, 4, 5 ] )
+    self.assertTrue( result['OK'] )
+    return sorted( result['Value'] ), result['Selection']
+
+  def test_inherited( self ):
+    # The metadata of the parent directories is inherited
+    self.assertEqual( self.__filter( { 'Type' : 'data' } ), ( [ 3, 4 ], 'Done' ) )
+    self.assertEqual( self.__filter( { 'Type' : 'data', 'Run' : 5 } ), ( [ 4 ], 'Done' ) )
+    self.assertEqual( self.__filter( { 'Type' : [ 'data', 'user' ] } ), ( [ 3, 4, 5 ], 'Done' ) )
+    self.assertEqual( self.__filter( { 'Run' : 'Missing' } ), ( [ 2, 3, 5 ], 'Done' ) )
+    # Only the given directories and their parents are looked at
+    self.assertFalse( [ query for query in self.db.queries if 'FC_Meta_' in query and 'DirID IN' not in query ] )
+
+  def test_path( self ):
+    self.assertEqual( self.__filter( {} ), ( [ 2, 3, 4, 5 ], 'All' ) )
+    self.assertEqual( self.__filter( {}, '/vo/data' ), ( [ 3, 4 ], 'Done' ) )
+    self.assertEqual( self.__filter( { 'Run' : 5 }, '/vo/data' ), ( [ 4 ], 'Done' ) )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( DirectoryMetadataFilterTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
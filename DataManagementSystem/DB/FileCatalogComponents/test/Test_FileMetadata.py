@@ -0,0 +1,140 @@
+""" unit tests for the paged metadata queries of the FileMetadata, run against an
+    in-memory sqlite database
+"""
+
+# pylint: disable=missing-docstring,invalid-name,protected-access
+
+import unittest
+import sqlite3
+from mock import MagicMock
+
+from DIRAC import S_OK
+import DIRAC.DataManagementSystem.DB.FileCatalogComponents.FileMetadata as moduleTested
+
+# FileID : ( DirID, Run )
+FILES = { 1 : ( 2, 5 ), 2 : ( 1, 5 ), 3 : ( 2, 6 ), 4 : ( 3, 5 ), 5 : ( 1, 5 ),
+          6 : ( 2, 5 ), 7 : ( 3, None ), 8 : ( 1, 6 ), 9 : ( 3, 5 ), 10 : ( 2, 5 ) }
+
+class mock_db( object ):
+
+  def __init__( self ):
+    self.connection = sqlite3.connect( ':memory:' )
+    self.connection.executescript( """
+      CREATE TABLE FC_Files( FileID INTEGER PRIMARY KEY, DirID INTEGER, FileName TEXT );
+      CREATE TABLE FC_FileMetaFields( MetaName TEXT, MetaType TEXT );
+      CREATE TABLE FC_FileMeta_Run( FileID INTEGER PRIMARY KEY, Value INTEGER );
+      INSERT INTO FC_FileMetaFields VALUES ( 'Run', 'INT' );
+    """ )
+    for fileID, ( dirID, run ) in FILES.items():
+      self.connection.execute( "INSERT INTO FC_Files VALUES ( ?, ?, ? )", ( fileID, dirID, 'f%d' % fileID ) )
+      if run is not None:
+        self.connection.execute( "INSERT INTO FC_FileMeta_Run VALUES ( ?, ? )", ( fileID, run ) )
+    self.queries = []
+    self.dmeta = MagicMock()
+    self.fileManager = MagicMock()
+    self.fileManager._getFileLFNs.side_effect = lambda fileIDs: S_OK( { 'Successful' : dict( ( fileID, self.getLFN( fileID ) )
+                                                                                             for fileID in fileIDs ),
+                                                                        'Failed' : {} } )
+
+  @staticmethod
+  def getLFN( fileID ):
+    return '/dir%d/f%d' % ( FILES[fileID][0], fileID )
+
+  def _query( self, req ):
+    self.queries.append( req )
+    return S_OK( tuple( self.connection.execute( req ).fetchall() ) )
+
+  def _escapeString( self, value ):
+    return S_OK( "'%s'" % value )
+
+class FileMetadataPagedTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    self.db = mock_db()
+    self.fmeta = moduleTested.FileMetadata( self.db )
+
+  def tearDown( self ):
+    moduleTested.DIRECTORY_BATCH_SIZE = 1000
+
+  def __getAllPages( self, metaDict, pageSize ):
+    lfns = []
+    token = ''
+    pages = 0
+    while True:
+      result = self.fmeta.findFilesByMetadataPaged( metaDict, '/', {}, token, pageSize )
+      self.assertTrue( result['OK'] )
+      self.assertTrue( len( result['Value']['LFNs'] ) <= pageSize )
+      lfns += result['Value']['LFNs']
+      pages += 1
+      token = result['Value']['Token']
+      if not token:
+        return lfns, pages
+
+  def test_fileMetadata( self ):
+    result = S_OK( [] )
+    result['Selection'] = 'All'
+    self.db.dmeta.findDirIDsByMetadata.return_value = result
+    expected = [ self.db.getLFN( fileID ) for fileID in sorted( FILES, key = lambda x: ( FILES[x][0], x ) )
+                 if FILES[fileID][1] == 5 ]
+    lfns, pages = self.__getAllPages( { 'Run' : 5 }, 3 )
+    self.assertEqual( lfns, expected )
+    self.assertEqual( pages, 3 )
+    # The directories are selected for the first page only
+    self.assertEqual( self.db.dmeta.findDirIDsByMetadata.call_count, 1 )
+    # A new query selects them again
+    self.__getAllPages( { 'Run' : 5 }, 3 )
+    self.assertEqual( self.db.dmeta.findDirIDsByMetadata.call_count, 2 )
+    # The selection is not shared between queries
+    self.__getAllPages( { 'Run' : 6 }, 1 )
+    self.assertEqual( self.db.dmeta.findDirIDsByMetadata.call_args[0][0], { 'Run' : 6 } )
+
+  def test_directorySelection( self ):
+    moduleTested.DIRECTORY_BATCH_SIZE = 1
+    result = S_OK( [ 3, 1 ] )
+    result['Selection'] = 'Done'
+    self.db.dmeta.findDirIDsByMetadata.return_value = result
+    # Only the directory metadata
+    lfns, _pages = self.__getAllPages( {}, 2 )
+    self.assertEqual( lfns, [ '/dir1/f2', '/dir1/f5', '/dir1/f8', '/dir3/f4', '/dir3/f7', '/dir3/f9' ] )
+    # Directory and file metadata
+    del self.db.queries[:]
+    result = self.fmeta.findFilesByMetadataPaged( { 'Run' : 5 }, '/', {}, '', 2 )
+    self.assertEqual( result['Value'], { 'LFNs' : [ '/dir1/f2', '/dir1/f5' ], 'Token' : '1:5' } )
+    # The page is full with the first directory: the second one is not queried
+    self.assertEqual( len( [ query for query in self.db.queries if 'FC_Files' in query ] ), 1 )
+    result = self.fmeta.findFilesByMetadataPaged( { 'Run' : 5 }, '/', {}, result['Value']['Token'], 2 )
+    self.assertEqual( result['Value'], { 'LFNs' : [ '/dir3/f4', '/dir3/f9' ], 'Token' : '3:9' } )
+    result = self.fmeta.findFilesByMetadataPaged( { 'Run' : 5 }, '/', {}, result['Value']['Token'], 2 )
+    self.assertEqual( result['Value'], { 'LFNs' : [], 'Token' : '' } )
+
+  def test_emptySelection( self ):
+    result = S_OK( [] )
+    result['Selection'] = 'None'
+    self.db.dmeta.findDirIDsByMetadata.return_value = result
+    result = self.fmeta.findFilesByMetadataPaged( { 'Run' : 5 }, '/', {} )
+    self.assertEqual( result['Value'], { 'LFNs' : [], 'Token' : '' } )
+    self.assertFalse( self.fmeta.findFilesByMetadataPaged( { 'Run' : 5 }, '/', {}, 'bad' )['OK'] )
+
+  def test_filterFiles( self ):
+    def filterDirIDs( _metaDict, _path, _credDict, dirIDs ):
+      result = S_OK( [ dirID for dirID in dirIDs if dirID in ( 1, 3 ) ] )
+      result['Selection'] = 'Done'
+      return result
+    self.db.dmeta.filterDirIDsByMetadata.side_effect = filterDirIDs
+    result = self.fmeta.filterFilesByMetadata( { 'Run' : 5 }, '/', {}, [ 1, 2, 4, 7, 9 ] )
+    self.assertEqual( sorted( result['Value'] ), [ 2, 4, 9 ] )
+    # Only the directories of the given files are checked
+    self.assertEqual( sorted( self.db.dmeta.filterDirIDsByMetadata.call_args[0][3] ), [ 1, 2, 3 ] )
+    self.assertFalse( self.db.dmeta.findDirIDsByMetadata.called )
+    # Only the given files in the selected directories are queried
+    queriedIDs = self.db.queries[-1].split( 'F.FileID IN (' )[1].split( ')' )[0]
+    self.assertEqual( sorted( int( fileID ) for fileID in queriedIDs.split( ',' ) ), [ 2, 4, 7, 9 ] )
+    # Only directory metadata: the file metadata is not queried
+    del self.db.queries[:]
+    result = self.fmeta.filterFilesByMetadata( {}, '/', {}, [ 1, 2, 7 ] )
+    self.assertEqual( sorted( result['Value'] ), [ 2, 7 ] )
+    self.assertFalse( [ query for query in self.db.queries if 'FC_FileMeta_' in query ] )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( FileMetadataPagedTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
@@ -2,6 +2,8 @@
 
 __RCSID__ = "$Id$"
 
+import os
+
 from DIRAC                                                                     import gLogger, S_OK, S_ERROR
 from DIRAC.Core.Base.DB                                                        import DB
 from DIRAC.DataManagementSystem.DB.FileCatalogComponents.DirectoryMetadata     import DirectoryMetadata
@@ -18,6 +20,7 @@ from DIRAC.DataManagementSystem.DB.FileCatalogComponents.SEManager             i
 from DIRAC.DataManagementSystem.DB.FileCatalogComponents.SecurityManager       import NoSecurityManager, DirectorySecurityManager, FullSecurityManager, DirectorySecurityManagerWithDelete, PolicyBasedSecurityManager
 from DIRAC.DataManagementSystem.DB.FileCatalogComponents.UserAndGroupManager   import UserAndGroupManagerCS,UserAndGroupManagerDB
 from DIRAC.DataManagementSystem.DB.FileCatalogComponents.DatasetManager        import DatasetManager
+from DIRAC.DataManagementSystem.DB.FileCatalogComponents.DirectoryCache        import DirectoryCache
 from DIRAC.Resources.Catalog.Utilities                                         import checkArgumentFormat
 
 #############################################################################
@@ -59,6 +62,9 @@ class FileCatalogDB( DB ):
     self.validReplicaStatus = databaseConfig['ValidReplicaStatus']
     self.visibleFileStatus = databaseConfig['VisibleFileStatus']
     self.visibleReplicaStatus = databaseConfig['VisibleReplicaStatus']
+    # In memory cache of the directory IDs and permissions
+    self.dirCache = DirectoryCache( databaseConfig.get( 'DirectoryCacheSize', 10000 ),
+                                    databaseConfig.get( 'DirectoryCacheMaxAge', 60 ) )
 
     try:
       # Obtain the plugins to be used for DB interaction
@@ -375,6 +381,7 @@ class FileCatalogDB( DB ):
         fileArgs[path] = paths[path]
     if dirArgs:
       result = change_function_directory( dirArgs, recursive = recursive )
+      self.dirCache.invalidate( [ os.path.normpath( path ) for path in dirArgs ], recursive = recursive )
       if not result['OK']:
         return result
       successful.update( result['Value']['Successful'] )
@@ -416,6 +423,8 @@ class FileCatalogDB( DB ):
       return res
     failed.update( res['Value']['Failed'] )
     successful = res['Value']['Successful']
+    if successful:
+      self.__updateDatasetFiles( successful.keys(), credDict )
     return S_OK( {'Successful':successful, 'Failed':failed} )
 
   def setFileStatus( self, lfns, credDict ):
@@ -463,11 +472,22 @@ class FileCatalogDB( DB ):
     if not res['Value']['Successful']:
       return S_OK( {'Successful':{}, 'Failed':failed} )
 
-    res = self.fileManager.removeFile(res['Value']['Successful'])
+    lfns = res['Value']['Successful']
+    # The file IDs and sizes are needed to update the dataset file lists after the removal
+    res = self.fileManager._findFiles( lfns, ['FileID', 'Size'] )
+    fileDicts = res['Value']['Successful'] if res['OK'] else {}
+
+    res = self.fileManager.removeFile( lfns )
     if not res['OK']:
       return res
     failed.update( res['Value']['Failed'] )
     successful = res['Value']['Successful']
+
+    fileSizes = dict( ( fileDicts[lfn]['FileID'], fileDicts[lfn]['Size'] ) for lfn in successful if lfn in fileDicts )
+    if fileSizes:
+      res = self.datasetManager.removeDatasetFiles( fileSizes )
+      if not res['OK']:
+        gLogger.error( "Failed to update the dataset files", res['Message'] )
     return S_OK( {'Successful':successful, 'Failed':failed} )
 
   def addReplica( self, lfns, credDict ):
@@ -1028,6 +1048,8 @@ class FileCatalogDB( DB ):
     result = S_OK()
     if directoryFlag:
       result = self.dtree.recoverOrphanDirectories( credDict )
+      # The directory IDs and parameters may have been changed
+      self.dirCache.clear()
 
     return result
 
@@ -1039,6 +1061,15 @@ class FileCatalogDB( DB ):
   def setMetadata( self, path, metadataDict, credDict ):
     """ Add metadata to the given path
     """
+    datasetChanges = {}
+    result = self.__setMetadata( path, metadataDict, credDict, datasetChanges )
+    self.__applyDatasetChanges( datasetChanges, credDict )
+    return result
+
+  def __setMetadata( self, path, metadataDict, credDict, datasetChanges ):
+    """ Add metadata to the given path, the changes affecting the datasets are added
+        to datasetChanges
+    """
     res = self._checkPathPermissions( 'setMetadata', path, credDict )
     if not res['OK']:
       return res
@@ -1054,22 +1085,29 @@ class FileCatalogDB( DB ):
       return S_ERROR( 'Failed to determine the path type' )
     if result['Value']['Successful'][path]:
       # This is a directory
-      return self.dmeta.setMetadata( path, metadataDict, credDict )
+      result = self.dmeta.setMetadata( path, metadataDict, credDict )
+      if result['OK']:
+        self.__addDatasetChanges( datasetChanges, None, metadataDict )
     else:
       # This is a file
-      return self.fmeta.setMetadata( path, metadataDict, credDict )
+      result = self.fmeta.setMetadata( path, metadataDict, credDict )
+      if result['OK']:
+        self.__addDatasetChanges( datasetChanges, path, metadataDict )
+    return result
 
   def setMetadataBulk( self, pathMetadataDict, credDict ):
     """  Add metadata for the given paths
     """
     successful = {}
     failed = {}
+    datasetChanges = {}
     for path, metadataDict in pathMetadataDict.items():
-      result = self.setMetadata( path, metadataDict, credDict )
+      result = self.__setMetadata( path, metadataDict, credDict, datasetChanges )
       if result['OK']:
         successful[path] = True
       else:
         failed[path] = result['Message']
+    self.__applyDatasetChanges( datasetChanges, credDict )
 
     return S_OK( { 'Successful': successful, 'Failed': failed } )
 
@@ -1078,17 +1116,20 @@ class FileCatalogDB( DB ):
     """
     successful = {}
     failed = {}
+    datasetChanges = {}
     for path, metadataDict in pathMetadataDict.items():
-      result = self.__removeMetadata( path, metadataDict, credDict )
+      result = self.__removeMetadata( path, metadataDict, credDict, datasetChanges )
       if result['OK']:
         successful[path] = True
       else:
         failed[path] = result['Message']
+    self.__applyDatasetChanges( datasetChanges, credDict )
 
     return S_OK( { 'Successful': successful, 'Failed': failed } )
 
-  def __removeMetadata( self, path, metadata, credDict ):
-    """ Remove metadata from the given path
+  def __removeMetadata( self, path, metadata, credDict, datasetChanges ):
+    """ Remove metadata from the given path, the changes affecting the datasets are added
+        to datasetChanges
     """
     res = self._checkPathPermissions( '__removeMetadata', path, credDict )
     if not res['OK']:
@@ -1105,10 +1146,68 @@ class FileCatalogDB( DB ):
       return S_ERROR( 'Failed to determine the path type' )
     if result['Value']['Successful'][path]:
       # This is a directory
-      return self.dmeta.removeMetadata( path, metadata, credDict )
+      result = self.dmeta.removeMetadata( path, metadata, credDict )
+      if result['OK']:
+        self.__addDatasetChanges( datasetChanges, None, metadata )
     else:
       # This is a file
-      return self.fmeta.removeMetadata( path, metadata, credDict )
+      result = self.fmeta.removeMetadata( path, metadata, credDict )
+      if result['OK']:
+        self.__addDatasetChanges( datasetChanges, path, metadata )
+    return result
+
+  def deleteMetadataField( self, fieldName, credDict ):
+    """ Delete the directory and file metadata field
+    """
+    result = self.dmeta.deleteMetadataField( fieldName, credDict )
+    error = ''
+    if not result['OK']:
+      error = result['Message']
+    result = self.fmeta.deleteMetadataField( fieldName, credDict )
+    if not result['OK']:
+      if error:
+        result["Message"] = error + "; " + result["Message"]
+    else:
+      # The datasets selecting on the field are evaluated again by their query
+      self.__invalidateDatasetFiles( [ fieldName ] )
+    return result
+
+  @staticmethod
+  def __addDatasetChanges( datasetChanges, lfn, metaNames ):
+    """ Record a metadata change of a file, or of a directory if lfn is None
+    """
+    if lfn is None:
+      datasetChanges.setdefault( 'DirectoryMeta', set() ).update( metaNames )
+    else:
+      datasetChanges.setdefault( 'Files', set() ).add( lfn )
+      datasetChanges.setdefault( 'FileMeta', set() ).update( metaNames )
+
+  def __applyDatasetChanges( self, datasetChanges, credDict ):
+    """ Update the materialized dataset file lists once for all the metadata changes
+        of a bulk operation
+    """
+    if datasetChanges.get( 'DirectoryMeta' ):
+      self.__invalidateDatasetFiles( list( datasetChanges['DirectoryMeta'] ) )
+    if datasetChanges.get( 'Files' ):
+      self.__updateDatasetFiles( list( datasetChanges['Files'] ), credDict, list( datasetChanges['FileMeta'] ) )
+
+  def __updateDatasetFiles( self, lfns, credDict, metaNames = None ):
+    """ Update the materialized dataset file lists for new files or files with changed
+        metadata. A failure does not affect the catalog operation
+    """
+    result = self.fileManager._findFiles( lfns )
+    if result['OK']:
+      fileIDs = [ lfnDict['FileID'] for lfnDict in result['Value']['Successful'].values() ]
+      result = self.datasetManager.updateDatasetFiles( fileIDs, credDict, metaNames )
+    if not result['OK']:
+      gLogger.error( "Failed to update the dataset files", result['Message'] )
+
+  def __invalidateDatasetFiles( self, metaNames ):
+    """ Drop the materialized file lists of the datasets affected by a directory metadata change
+    """
+    result = self.datasetManager.invalidateDatasetFiles( metaNames )
+    if not result['OK']:
+      gLogger.error( "Failed to invalidate the dataset files", result['Message'] )
 
   #######################################################################
   #
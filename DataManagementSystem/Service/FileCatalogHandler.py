@@ -19,17 +19,27 @@ from DIRAC.Core.DISET.RequestHandler import RequestHandler, getServiceOption
 from DIRAC import gLogger, S_OK, S_ERROR
 from DIRAC.FrameworkSystem.Client.MonitoringClient import gMonitor
 from DIRAC.DataManagementSystem.DB.FileCatalogDB import FileCatalogDB
+from DIRAC.Core.Utilities.ChunkedResult import streamResult, DEFAULT_CHUNK_SIZE
+from DIRAC.Resources.Catalog.CompactReplicas import compactReplicas
 
 # This is a global instance of the FileCatalogDB class
 gFileCatalogDB = None
+# Maximum number of entries per chunk of the streamed results
+gStreamChunkSize = DEFAULT_CHUNK_SIZE
+# Maximum number of files per page of the paged metadata queries
+gMaxQueryPageSize = 100000
 
 def initializeFileCatalogHandler( serviceInfo ):
   """ handler initialisation """
 
   global gFileCatalogDB
+  global gStreamChunkSize
+  global gMaxQueryPageSize
 
   dbLocation = getServiceOption( serviceInfo, 'Database', 'DataManagement/FileCatalogDB' )
   gFileCatalogDB = FileCatalogDB( dbLocation )
+  gStreamChunkSize = getServiceOption( serviceInfo, 'StreamChunkSize', DEFAULT_CHUNK_SIZE )
+  gMaxQueryPageSize = getServiceOption( serviceInfo, 'MaxQueryPageSize', gMaxQueryPageSize )
 
   databaseConfig = {}
   # Obtain the plugins to be used for DB interaction
@@ -58,7 +68,9 @@ def initializeFileCatalogHandler( serviceInfo ):
                     'ValidFileStatus'     : ['AprioriGood','Trash','Removing','Probing'],
                     'ValidReplicaStatus'  : ['AprioriGood','Trash','Removing','Probing'],
                     'VisibleFileStatus'   : ['AprioriGood'],
-                    'VisibleReplicaStatus': ['AprioriGood']}
+                    'VisibleReplicaStatus': ['AprioriGood'],
+                    'DirectoryCacheSize'  : 10000,
+                    'DirectoryCacheMaxAge': 60 }
   for configKey in sorted( defaultConfig.keys() ):
     defaultValue = defaultConfig[configKey]
     configValue = getServiceOption( serviceInfo, configKey, defaultValue )
@@ -318,6 +330,17 @@ class FileCatalogHandler( RequestHandler ):
     """ Get replicas for supplied lfns """
     return gFileCatalogDB.getReplicas( lfns, allStatus, self.getRemoteCredentials() )
 
+  types_getReplicasCompact = [ [ ListType, DictType ] + list( StringTypes ), BooleanType ]
+  def export_getReplicasCompact( self, lfns, allStatus = False ):
+    """ Get replicas for supplied lfns, the successful replicas being returned in the compact
+        format of the CompactReplicas module
+    """
+    result = gFileCatalogDB.getReplicas( lfns, allStatus, self.getRemoteCredentials() )
+    if not result['OK']:
+      return result
+    result['Value']['Successful'] = compactReplicas( result['Value']['Successful'] )
+    return result
+
   types_getReplicaStatus = [ [ ListType, DictType ] + list( StringTypes ) ]
   def export_getReplicaStatus( self, lfns ):
     """ Get the status for the supplied replicas """
@@ -370,7 +393,8 @@ class FileCatalogHandler( RequestHandler ):
   def export_listDirectory( self, lfns, verbose ):
     """ List the contents of supplied directories """
     gMonitor.addMark( 'ListDirectory', 1 )
-    return gFileCatalogDB.listDirectory( lfns, self.getRemoteCredentials(), verbose = verbose )
+    return streamResult( gFileCatalogDB.listDirectory( lfns, self.getRemoteCredentials(), verbose = verbose ),
+                         gStreamChunkSize )
 
   types_isDirectory = [ [ ListType, DictType ] + list( StringTypes ) ]
   def export_isDirectory( self, lfns ):
@@ -390,7 +414,8 @@ class FileCatalogHandler( RequestHandler ):
   types_getDirectoryReplicas = [ [ ListType, DictType ] + list( StringTypes ), BooleanType ]
   def export_getDirectoryReplicas( self, lfns, allStatus = False ):
     """ Get replicas for files in the supplied directory """
-    return gFileCatalogDB.getDirectoryReplicas( lfns, allStatus, self.getRemoteCredentials() )
+    return streamResult( gFileCatalogDB.getDirectoryReplicas( lfns, allStatus, self.getRemoteCredentials() ),
+                         gStreamChunkSize )
 
   ########################################################################
   #
@@ -432,16 +457,7 @@ class FileCatalogHandler( RequestHandler ):
   def export_deleteMetadataField( self, fieldName ):
     """ Delete the metadata field 
     """
-    result = gFileCatalogDB.dmeta.deleteMetadataField( fieldName, self.getRemoteCredentials() )
-    error = ''
-    if not result['OK']:
-      error = result['Message']
-    result = gFileCatalogDB.fmeta.deleteMetadataField( fieldName, self.getRemoteCredentials() )
-    if not result['OK']:
-      if error:
-        result["Message"] = error + "; " + result["Message"]
-
-    return result
+    return gFileCatalogDB.deleteMetadataField( fieldName, self.getRemoteCredentials() )
 
   types_getMetadataFields = [ ]
   def export_getMetadataFields( self ):
@@ -497,7 +513,16 @@ class FileCatalogHandler( RequestHandler ):
   def export_findFilesByMetadata( self, metaDict, path = '/' ):
     """ Find all the files satisfying the given metadata set
     """
-    return gFileCatalogDB.fmeta.findFilesByMetadata( metaDict, path, self.getRemoteCredentials() )
+    return streamResult( gFileCatalogDB.fmeta.findFilesByMetadata( metaDict, path, self.getRemoteCredentials() ),
+                         gStreamChunkSize )
+
+  types_findFilesByMetadataPaged = [ DictType, StringTypes, StringTypes, [IntType, LongType] ]
+  def export_findFilesByMetadataPaged( self, metaDict, path, token, maxItems ):
+    """ Find a page of at most maxItems files satisfying the given metadata set,
+        starting after the file given by the continuation token
+    """
+    return gFileCatalogDB.fmeta.findFilesByMetadataPaged( metaDict, path, self.getRemoteCredentials(),
+                                                          token, min( maxItems, gMaxQueryPageSize ) )
 
   types_getReplicasByMetadata = [ DictType, StringTypes, BooleanType ]
   def export_getReplicasByMetadata( self, metaDict, path = '/', allStatus = False ):
@@ -2081,7 +2081,7 @@ class Dirac( API ):
     self.log.verbose( 'Will select jobs with last update %s and following conditions' % date )
     self.log.verbose( self.pPrint.pformat( conditions ) )
     monitoring = RPCClient( 'WorkloadManagement/JobMonitoring' )
-    result = monitoring.getJobs( conditions, date )
+    result = monitoring.collectRPC( 'getJobs', conditions, date )
     if not result['OK']:
       self.log.warn( result['Message'] )
       return result
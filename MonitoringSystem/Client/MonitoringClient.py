@@ -94,7 +94,7 @@ class MonitoringClient( object ):
                     'condDict' : condDict,
                     'grouping' : grouping,
                     'extraArgs' : extraArgs }
-    result = rpcClient.getReport( plotRequest )
+    result = rpcClient.collectRPC( 'getReport', plotRequest )
     if 'rpcStub' in result:
       del result[ 'rpcStub' ]
     return result
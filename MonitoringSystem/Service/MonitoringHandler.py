@@ -9,6 +9,7 @@ import os
 from DIRAC import gLogger, S_OK, S_ERROR, gConfig
 from DIRAC.Core.DISET.RequestHandler import RequestHandler
 from DIRAC.Core.Utilities import Time
+from DIRAC.Core.Utilities.ChunkedResult import streamResult
 from DIRAC.Core.Utilities.Plotting import gDataCache
 from DIRAC.Core.Utilities.Plotting.FileCoding import extractRequestFromFileId
 from DIRAC.Core.Utilities.Plotting.Plots import generateErrorMessagePlot
@@ -234,7 +235,7 @@ class MonitoringHandler( RequestHandler ):
       return retVal
     reporter = MainReporter( self.__db, self.serviceInfoDict[ 'clientSetup' ] )
     reportRequest[ 'generatePlot' ] = False
-    return reporter.generate( reportRequest, self.getRemoteCredentials() )
+    return streamResult( reporter.generate( reportRequest, self.getRemoteCredentials() ) )
 
 
   types_addMonitoringRecords = [basestring, basestring, list]
@@ -0,0 +1,78 @@
+""" Compact, columnar encoding of the replicas returned by the FileCatalog getReplicas call.
+
+    The SE names are given once, the LFNs are grouped by directory and the replicas of
+    each file are given by a bit mask over the list of SE names::
+
+      { 'SEs' : [ se0, se1, ... ],
+        'Directories' : { directory : [ [ fileName, ... ], [ mask, ... ], [ [ pfn, ... ], ... ] ] } }
+
+    The PFN column of a directory is empty if none of its files has a PFN, otherwise it
+    gives for each file the PFNs in the order of the bits of its mask.
+"""
+
+__RCSID__ = "$Id$"
+
+import os
+
+def compactReplicas( replicas ):
+  """ Encode the replicas in the compact format
+
+  :param dict replicas: { lfn : { se : pfn } }
+  :return: compact dictionary
+  """
+  seIndex = {}
+  directories = {}
+  for lfn, seDict in replicas.iteritems():
+    dirName, fileName = os.path.split( lfn )
+    names, masks, pfns = directories.setdefault( dirName, [ [], [], [] ] )
+    for se in seDict:
+      if se not in seIndex:
+        seIndex[se] = len( seIndex )
+    seNames = sorted( seDict, key = seIndex.get )
+    mask = 0
+    for se in seNames:
+      mask |= 1 << seIndex[se]
+    names.append( fileName )
+    masks.append( mask )
+    pfns.append( [ seDict[se] for se in seNames ] )
+
+  # Drop the PFN columns without any PFN
+  for columns in directories.itervalues():
+    if not any( pfn for pfnList in columns[2] for pfn in pfnList ):
+      columns[2] = []
+
+  seNames = [ None ] * len( seIndex )
+  for se, bit in seIndex.iteritems():
+    seNames[bit] = se
+  return { 'SEs' : seNames, 'Directories' : directories }
+
+def expandReplicas( compact, sePrefixes = None ):
+  """ Decode the replicas from the compact format
+
+  :param dict compact: replicas in the compact format
+  :param dict sePrefixes: { se : prefix } used to build the missing PFNs from the LFN
+  :return: { lfn : { se : pfn } }
+  """
+  seNames = compact['SEs']
+  sePrefixes = sePrefixes if sePrefixes else {}
+  replicas = {}
+  for dirName, ( names, masks, pfnColumn ) in compact['Directories'].iteritems():
+    for position, fileName in enumerate( names ):
+      lfn = os.path.join( dirName, fileName )
+      pfns = pfnColumn[position] if pfnColumn else None
+      seDict = {}
+      mask = masks[position]
+      bit = 0
+      index = 0
+      while mask:
+        if mask & 1:
+          se = seNames[bit]
+          pfn = pfns[index] if pfns else ''
+          if not pfn and se in sePrefixes:
+            pfn = sePrefixes[se] + lfn
+          seDict[se] = pfn
+          index += 1
+        mask >>= 1
+        bit += 1
+      replicas[lfn] = seDict
+  return replicas
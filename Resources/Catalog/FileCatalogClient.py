@@ -7,9 +7,13 @@ from DIRAC import S_OK, S_ERROR
 from DIRAC.ConfigurationSystem.Client.Helpers.Registry import getVOMSAttributeForGroup, getDNForUsername
 from DIRAC.Resources.Catalog.Utilities                 import checkCatalogArguments
 from DIRAC.Resources.Catalog.FileCatalogClientBase     import FileCatalogClientBase
+from DIRAC.Resources.Catalog.CompactReplicas          import expandReplicas
 
 __RCSID__ = "$Id$"
 
+# Default number of files per page of the metadata queries
+QUERY_PAGE_SIZE = 10000
+
 
 class FileCatalogClient( FileCatalogClientBase ):
   """ Client code to the DIRAC File Catalogue
@@ -20,7 +24,8 @@ class FileCatalogClient( FileCatalogClientBase ):
                  [ 'isFile', 'getFileMetadata',
                    'getReplicas', 'getReplicaStatus', 'getFileSize', 'isDirectory', 'getDirectoryReplicas',
                    'listDirectory', 'getDirectoryMetadata', 'getDirectorySize', 'getDirectoryContents',
-                   'getLFNForPFN', 'getLFNForGUID', 'findFilesByMetadata','getMetadataFields',
+                   'getLFNForPFN', 'getLFNForGUID', 'findFilesByMetadata', 'findFilesByMetadataPaged',
+                   'getMetadataFields',
                    'findDirectoriesByMetadata','getReplicasByMetadata','findFilesByMetadataDetailed',
                    'findFilesByMetadataWeb','getCompatibleMetadata','getMetadataSet', 'getDatasets',
                    'getFileDescendents', 'getFileAncestors', 'getDirectoryUserMetadata', 'getFileUserMetadata',
@@ -34,7 +39,7 @@ class FileCatalogClient( FileCatalogClientBase ):
                    'freezeDataset', 'releaseDataset', 'addUser', 'deleteUser', 'addGroup', 'deleteGroup',
                    'repairCatalog', 'rebuildDirectoryUsage' ]
 
-  NO_LFN_METHODS = ['findFilesByMetadata','addMetadataField','deleteMetadataField','getMetadataFields','setMetadata',
+  NO_LFN_METHODS = ['findFilesByMetadata', 'findFilesByMetadataPaged', 'addMetadataField','deleteMetadataField','getMetadataFields','setMetadata',
                     'setMetadataBulk','removeMetadata','getDirectoryUserMetadata','findDirectoriesByMetadata',
                     'getReplicasByMetadata','findFilesByMetadataDetailed','findFilesByMetadataWeb',
                     'getCompatibleMetadata', 'addMetadataSet', 'getMetadataSet', 'getFileUserMetadata', 'getLFNForGUID',
@@ -48,6 +53,8 @@ class FileCatalogClient( FileCatalogClientBase ):
     """
     self.serverURL = 'DataManagement/FileCatalog' if not url else url
     super( FileCatalogClient, self ).__init__( self.serverURL, **kwargs )
+    # Cleared when the service turns out not to support the compact replicas format
+    self.__compactReplicas = True
 
 ##################################################################################
 #
@@ -55,9 +62,28 @@ class FileCatalogClient( FileCatalogClientBase ):
 
   @checkCatalogArguments
   def getReplicas( self, lfns, allStatus = False, timeout = 120 ):
-    """ Get the replicas of the given files
+    """ Get the replicas of the given files. They are transferred in the compact format
+        when the service supports it
     """
     rpcClient = self._getRPC( timeout = timeout )
+    if not self.__compactReplicas:
+      return self.__getReplicas( rpcClient, lfns, allStatus )
+    result = rpcClient.getReplicasCompact( lfns, allStatus )
+    if not result['OK']:
+      if 'Unknown method' in result['Message']:
+        # Service not supporting the compact format, not asked again by this client
+        self.__compactReplicas = False
+        return self.__getReplicas( rpcClient, lfns, allStatus )
+      return result
+
+    lfnDict = result['Value']
+    lfnDict['Successful'] = expandReplicas( lfnDict['Successful'], lfnDict.get( 'SEPrefixes', {} ) )
+    return S_OK( lfnDict )
+
+  @staticmethod
+  def __getReplicas( rpcClient, lfns, allStatus ):
+    """ Get the replicas of the given files as a dictionary
+    """
     result = rpcClient.getReplicas( lfns, allStatus )
     if not result['OK']:
       return result
@@ -149,7 +175,7 @@ class FileCatalogClient( FileCatalogClientBase ):
     """ List the given directory's contents
     """
     rpcClient = self._getRPC( timeout = timeout )
-    result = rpcClient.listDirectory( lfn, verbose )
+    result = rpcClient.collectRPC( 'listDirectory', lfn, verbose )
     if not result['OK']:
       return result
     # Force returned directory entries to be LFNs
@@ -194,7 +220,7 @@ class FileCatalogClient( FileCatalogClientBase ):
     """ Find all the given directories' replicas
     """
     rpcClient = self._getRPC( timeout = timeout )
-    result = rpcClient.getDirectoryReplicas( lfns, allStatus )
+    result = rpcClient.collectRPC( 'getDirectoryReplicas', lfns, allStatus )
     if not result['OK']:
       return result
 
@@ -211,10 +237,20 @@ class FileCatalogClient( FileCatalogClientBase ):
     return result
 
   def findFilesByMetadata( self, metaDict, path = '/', timeout = 120 ):
-    """ Find files given the meta data query and the path
+    """ Find files given the meta data query and the path. The files are retrieved page by page
+    """
+    lfnList = []
+    for result in self.iterFilesByMetadata( metaDict, path, timeout = timeout ):
+      if not result['OK']:
+        return result
+      lfnList.extend( result['Value'] )
+    return S_OK( lfnList )
+
+  def __collectFilesByMetadata( self, metaDict, path, timeout ):
+    """ Find files given the meta data query and the path in a single call
     """
     rpcClient = self._getRPC( timeout = timeout )
-    result = rpcClient.findFilesByMetadata( metaDict, path )
+    result = rpcClient.collectRPC( 'findFilesByMetadata', metaDict, path )
     if not result['OK']:
       return result
     if isinstance( result['Value'], list ):
@@ -230,6 +266,35 @@ class FileCatalogClient( FileCatalogClientBase ):
     else:
       return S_ERROR( 'Illegal return value type %s' % type( result['Value'] ) )
 
+  def findFilesByMetadataPaged( self, metaDict, path = '/', token = '', maxItems = QUERY_PAGE_SIZE, timeout = 120 ):
+    """ Find a page of the files given the meta data query and the path
+
+        :param str token: continuation token of the previous page, empty for the first page
+        :return: S_OK( { 'LFNs' : [ lfns ], 'Token' : continuation token, empty for the last page } )
+    """
+    return self._getRPC( timeout = timeout ).findFilesByMetadataPaged( metaDict, path, token, maxItems )
+
+  def iterFilesByMetadata( self, metaDict, path = '/', pageSize = QUERY_PAGE_SIZE, timeout = 120 ):
+    """ Generator of the files given the meta data query and the path, page by page. All the files
+        come in a single page from the services not supporting the paged queries
+
+        :return: S_OK( [ lfns ] ) for each page, or a final S_ERROR
+    """
+    token = ''
+    while True:
+      result = self.findFilesByMetadataPaged( metaDict, path, token, pageSize, timeout = timeout )
+      if not result['OK']:
+        if not token and 'Unknown method' in result['Message']:
+          # Service not supporting the paged queries
+          yield self.__collectFilesByMetadata( metaDict, path, timeout )
+          return
+        yield result
+        return
+      yield S_OK( result['Value']['LFNs'] )
+      token = result['Value']['Token']
+      if not token:
+        return
+
   def getFileUserMetadata( self, path, timeout = 120 ):
     """Get the meta data attached to a file, but also to
     the its corresponding directory
@@ -16,9 +16,9 @@ class TSCatalogClient( FileCatalogClientBase ):
   """
 
   # List of common File Catalog methods implemented by this client
-  WRITE_METHODS = FileCatalogClientBase.WRITE_METHODS + [ "addFile", "removeFile", "setMetadata" ]
+  WRITE_METHODS = FileCatalogClientBase.WRITE_METHODS + [ "addFile", "removeFile", "setMetadata", "setMetadataBulk" ]
 
-  NO_LFN_METHODS = [ "setMetadata" ]
+  NO_LFN_METHODS = [ "setMetadata", "setMetadataBulk" ]
 
   def __init__( self, url = None, **kwargs ):
 
@@ -50,4 +50,20 @@ class TSCatalogClient( FileCatalogClientBase ):
         :return Successful/Failed dict.
     """
     rpcClient = self._getRPC()
-    return rpcClient.setMetadata( path, metadatadict )
\ No newline at end of file
+    return rpcClient.setMetadata( path, metadatadict )
+
+  def setMetadataBulk( self, pathMetadataDict ):
+    """ Set metadata parameters for many paths
+        :return Successful/Failed dict.
+    """
+    rpcClient = self._getRPC()
+    successful = {}
+    failed = {}
+    for pathChunk in breakListIntoChunks( pathMetadataDict.keys(), 1000 ):
+      res = rpcClient.setMetadataBulk( dict( ( path, pathMetadataDict[path] ) for path in pathChunk ) )
+      if not res['OK']:
+        failed.update( dict.fromkeys( pathChunk, res['Message'] ) )
+        continue
+      successful.update( res['Value']['Successful'] )
+      failed.update( res['Value']['Failed'] )
+    return S_OK( { 'Successful' : successful, 'Failed' : failed } )
\ No newline at end of file
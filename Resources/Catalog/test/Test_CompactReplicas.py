@@ -0,0 +1,40 @@
+""" Testing the compact encoding of the replicas
+"""
+
+# pylint: disable=missing-docstring,invalid-name
+
+import unittest
+
+from DIRAC.Core.Utilities import DEncode
+from DIRAC.Resources.Catalog.CompactReplicas import compactReplicas, expandReplicas
+
+__RCSID__ = "$Id $"
+
+REPLICAS = { '/vo/data/f1' : { 'SE1' : '', 'SE2' : '' },
+             '/vo/data/f2' : { 'SE2' : '' },
+             '/vo/user/f3' : { 'SE3' : 'srm://se3/vo/user/f3', 'SE1' : '' },
+             '/f4' : {} }
+
+class CompactReplicasTestCase( unittest.TestCase ):
+
+  def test_encoding( self ):
+    compact = compactReplicas( REPLICAS )
+    self.assertEqual( sorted( compact['SEs'] ), [ 'SE1', 'SE2', 'SE3' ] )
+    self.assertEqual( sorted( compact['Directories'] ), [ '/', '/vo/data', '/vo/user' ] )
+    # No PFN in the directory: no PFN column
+    self.assertEqual( compact['Directories']['/vo/data'][2], [] )
+    self.assertEqual( len( compact['Directories']['/vo/user'][2][0] ), 2 )
+    # Round trip through DEncode
+    self.assertEqual( expandReplicas( DEncode.decode( DEncode.encode( compact ) )[0] ), REPLICAS )
+
+  def test_sePrefixes( self ):
+    replicas = expandReplicas( compactReplicas( REPLICAS ), { 'SE1' : 'root://se1' } )
+    self.assertEqual( sorted( replicas ), sorted( REPLICAS ) )
+    # The missing PFNs are built from the SE prefixes
+    self.assertEqual( replicas['/vo/user/f3'], { 'SE3' : 'srm://se3/vo/user/f3', 'SE1' : 'root://se1/vo/user/f3' } )
+    self.assertEqual( replicas['/vo/data/f1'], { 'SE1' : 'root://se1/vo/data/f1', 'SE2' : '' } )
+    self.assertEqual( replicas['/f4'], {} )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( CompactReplicasTestCase )
+  unittest.TextTestRunner( verbosity = 2 ).run( suite )
@@ -0,0 +1,78 @@
+""" Testing the paged metadata queries and the compact replicas of the FileCatalogClient
+"""
+
+# pylint: disable=missing-docstring,invalid-name,protected-access
+
+import unittest
+from mock import MagicMock
+
+from DIRAC import S_OK, S_ERROR
+from DIRAC.Resources.Catalog.FileCatalogClient import FileCatalogClient
+from DIRAC.Resources.Catalog.CompactReplicas import compactReplicas
+
+__RCSID__ = "$Id $"
+
+class FileCatalogClientTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    self.rpcClient = MagicMock()
+    self.fc = FileCatalogClient()
+    self.fc._getRPC = MagicMock( return_value = self.rpcClient )
+
+  def test_iterFilesByMetadata( self ):
+    self.rpcClient.findFilesByMetadataPaged.side_effect = [ S_OK( { 'LFNs' : [ '/a/f1', '/a/f2' ], 'Token' : '1:2' } ),
+                                                            S_OK( { 'LFNs' : [ '/b/f3' ], 'Token' : '' } ) ]
+    pages = list( self.fc.iterFilesByMetadata( { 'Run' : 5 }, pageSize = 2 ) )
+    self.assertEqual( pages, [ S_OK( [ '/a/f1', '/a/f2' ] ), S_OK( [ '/b/f3' ] ) ] )
+    self.assertEqual( self.rpcClient.findFilesByMetadataPaged.call_args[0], ( { 'Run' : 5 }, '/', '1:2', 2 ) )
+    self.assertFalse( self.rpcClient.collectRPC.called )
+
+  def test_notPagedService( self ):
+    self.rpcClient.findFilesByMetadataPaged.return_value = S_ERROR( 'Unknown method findFilesByMetadataPaged' )
+    self.rpcClient.collectRPC.return_value = S_OK( { '/a' : [ 'f1', 'f2' ] } )
+    pages = list( self.fc.iterFilesByMetadata( { 'Run' : 5 } ) )
+    self.assertEqual( len( pages ), 1 )
+    self.assertEqual( sorted( pages[0]['Value'] ), [ '/a/f1', '/a/f2' ] )
+    self.rpcClient.collectRPC.assert_called_once_with( 'findFilesByMetadata', { 'Run' : 5 }, '/' )
+    self.assertEqual( sorted( self.fc.findFilesByMetadata( { 'Run' : 5 } )['Value'] ), [ '/a/f1', '/a/f2' ] )
+
+  def test_error( self ):
+    self.rpcClient.findFilesByMetadataPaged.side_effect = [ S_OK( { 'LFNs' : [ '/a/f1' ], 'Token' : '1:1' } ),
+                                                            S_ERROR( 'Unknown method findFilesByMetadataPaged' ) ]
+    # Errors after the first page are not hidden by the fallback
+    result = self.fc.findFilesByMetadata( { 'Run' : 5 } )
+    self.assertFalse( result['OK'] )
+    self.assertFalse( self.rpcClient.collectRPC.called )
+
+  def test_getReplicas( self ):
+    replicas = { '/a/f1' : { 'SE1' : '' }, '/a/f2' : { 'SE1' : '', 'SE2' : 'url' } }
+    self.rpcClient.getReplicasCompact.return_value = S_OK( { 'Successful' : compactReplicas( replicas ),
+                                                             'Failed' : { '/a/f3' : 'No such file' },
+                                                             'SEPrefixes' : { 'SE1' : 'root://se1' } } )
+    result = self.fc.getReplicas( [ '/a/f1', '/a/f2', '/a/f3' ] )
+    self.assertTrue( result['OK'] )
+    # A plain dictionary is given back
+    self.assertEqual( type( result['Value']['Successful'] ), dict )
+    self.assertEqual( result['Value']['Successful'], { '/a/f1' : { 'SE1' : 'root://se1/a/f1' },
+                                                       '/a/f2' : { 'SE1' : 'root://se1/a/f2', 'SE2' : 'url' } } )
+    self.assertEqual( result['Value']['Failed'], { '/a/f3' : 'No such file' } )
+    self.assertFalse( self.rpcClient.getReplicas.called )
+
+  def test_getReplicasNotCompact( self ):
+    self.rpcClient.getReplicasCompact.return_value = S_ERROR( 'Unknown method getReplicasCompact' )
+    self.rpcClient.getReplicas.return_value = S_OK( { 'Successful' : { '/a/f1' : { 'SE1' : '' } }, 'Failed' : {},
+                                                      'SEPrefixes' : { 'SE1' : 'root://se1' } } )
+    for _i in range( 2 ):
+      result = self.fc.getReplicas( '/a/f1' )
+      self.assertEqual( result['Value']['Successful'], { '/a/f1' : { 'SE1' : 'root://se1/a/f1' } } )
+    # The compact format is only asked once
+    self.assertEqual( self.rpcClient.getReplicasCompact.call_count, 1 )
+    self.assertEqual( self.rpcClient.getReplicas.call_count, 2 )
+
+    # Other errors are given back
+    self.rpcClient.getReplicas.return_value = S_ERROR( 'Connection refused' )
+    self.assertFalse( self.fc.getReplicas( '/a/f1' )['OK'] )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( FileCatalogClientTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
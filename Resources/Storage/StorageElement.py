@@ -9,6 +9,7 @@ import copy
 import errno
 import threading
 import sys
+import Queue
 
 # # from DIRAC
 from DIRAC import gLogger, gConfig, siteName
@@ -20,6 +21,9 @@ from DIRAC.Core.Utilities.SiteSEMapping import getSEsForSite
 from DIRAC.Core.Security.ProxyInfo import getVOfromProxyGroup
 from DIRAC.ConfigurationSystem.Client.Helpers.Operations import Operations
 from DIRAC.Core.Utilities.DictCache import DictCache
+from DIRAC.Core.Utilities.ThreadPool import ThreadPool
+from DIRAC.Core.Utilities.List import breakListIntoChunks
+from DIRAC.ConfigurationSystem.Client.ConfigurationData import gConfigurationData
 from DIRAC.Resources.Storage.Utilities import checkArgumentFormat
 from DIRAC.Resources.Catalog.FileCatalog import FileCatalog
 from DIRAC.Core.Security.ProxyInfo import getProxyInfo
@@ -29,15 +33,51 @@ from DIRAC.DataManagementSystem.Utilities.DMSHelpers import DMSHelpers
 
 __RCSID__ = "$Id$"
 
+# Default number of files per plugin call and number of concurrent calls for the
+# parallel methods. They can be overwritten by the ParallelChunkSize and
+# MaxParallelCalls options of the SE or of its protocol sections
+DEFAULT_PARALLEL_CHUNK_SIZE = 100
+DEFAULT_MAX_PARALLEL_CALLS = 1
+# Number of threads executing the parallel calls, shared by all the SEs
+PARALLEL_CALLS_THREADS = 20
+
+gParallelCallsPool = None
+gParallelCallsPoolLock = threading.Lock()
+
+def getParallelCallsPool():
+  """ Get the thread pool executing the chunks of the parallel storage calls. Its threads
+      are never stopped so that they keep their storage plugins from one call to the next.
+  """
+  global gParallelCallsPool
+  with gParallelCallsPoolLock:
+    if not gParallelCallsPool:
+      gParallelCallsPool = ThreadPool( PARALLEL_CALLS_THREADS, PARALLEL_CALLS_THREADS )
+  return gParallelCallsPool
+
 
 class StorageElementCache( object ):
+  """ Process wide pool of StorageElementItem objects
+
+      The objects are shared by all the threads: the SE configuration is read from the CS
+      once, only the storage plugins are instantiated per thread (see StorageElementItem.storages).
+      All the objects are dropped when a new version of the configuration is loaded.
+  """
+
+  # Lifetime of the objects in the pool
+  seLifetime = 1800
+  # Period of the checks of the configuration version and of the purge of expired objects
+  checkPeriod = 60
 
   def __init__( self ):
     self.seCache = DictCache()
+    self.__creationLock = threading.Lock()
+    self.__statsLock = threading.Lock()
+    self.__csVersion = None
+    self.__lastCheck = 0
+    self.__stats = { 'Hits' : 0, 'Misses' : 0, 'Invalidations' : 0 }
 
   def __call__( self, name, plugins = None, vo = None, hideExceptions = False ):
-    self.seCache.purgeExpired( expiredInSeconds = 60 )
-    tId = threading.current_thread().ident
+    self.__checkConfiguration()
 
     if not vo:
       result = getVOfromProxyGroup()
@@ -45,16 +85,62 @@ class StorageElementCache( object ):
         return
       vo = result['Value']
 
-    argTuple = ( tId, name, plugins, vo )
+    argTuple = ( name, tuple( plugins ) if isinstance( plugins, list ) else plugins, vo )
     seObj = self.seCache.get( argTuple )
 
     if not seObj:
-      seObj = StorageElementItem( name, plugins, vo, hideExceptions = hideExceptions )
-      # Add the StorageElement to the cache for 1/2 hour
-      self.seCache.add( argTuple, 1800, seObj )
-
+      with self.__creationLock:
+        # Another thread may have created it meanwhile
+        seObj = self.seCache.get( argTuple )
+        if not seObj:
+          self.__count( 'Misses' )
+          seObj = StorageElementItem( name, plugins, vo, hideExceptions = hideExceptions )
+          self.seCache.add( argTuple, self.seLifetime, seObj )
+          return seObj
+
+    self.__count( 'Hits' )
     return seObj
 
+  def __count( self, counter ):
+    with self.__statsLock:
+      self.__stats[counter] += 1
+
+  def __checkConfiguration( self ):
+    """ Purge the expired objects and invalidate the pool if the configuration changed.
+        This is done at most once per checkPeriod
+    """
+    now = time.time()
+    if now - self.__lastCheck < self.checkPeriod:
+      return
+    self.__lastCheck = now
+    self.seCache.purgeExpired()
+    csVersion = gConfigurationData.getVersion()
+    if self.__csVersion is not None and csVersion != self.__csVersion:
+      gLogger.verbose( "Configuration changed, invalidating the StorageElement pool" )
+      self.invalidate()
+    self.__csVersion = csVersion
+
+  def invalidate( self, name = None ):
+    """ Drop the objects of a given SE, or all of them, from the pool.
+        Objects already handed out remain usable.
+
+    :param str name: SE name, all SEs if None
+    """
+    for argTuple in self.seCache.getKeys():
+      if name is None or argTuple[0] == name:
+        self.seCache.delete( argTuple )
+    self.__count( 'Invalidations' )
+
+  def getStats( self ):
+    """ Get the pool counters
+
+    :return: dictionary with the Hits, Misses and Invalidations counters and the pool Size
+    """
+    with self.__statsLock:
+      stats = dict( self.__stats )
+    stats['Size'] = len( self.seCache.getKeys() )
+    return stats
+
 class StorageElementItem( object ):
   """
   .. class:: StorageElement
@@ -142,6 +228,10 @@ class StorageElementItem( object ):
     :param: vo
     """
 
+    # The object is shared between threads: the method being called and the
+    # storage plugins are kept per thread
+    self.__threadData = threading.local()
+    self.__pluginDefinitions = []
     self.methodName = None
 
     if vo:
@@ -183,6 +273,8 @@ class StorageElementItem( object ):
       self.storages = factoryDict['StorageObjects']
       self.protocolOptions = factoryDict['ProtocolOptions']
       self.turlProtocols = factoryDict['TurlProtocols']
+      self.__pluginDefinitions = [ ( storage.name, protocolDict )
+                                   for storage, protocolDict in zip( self.storages, self.protocolOptions ) ]
 
       for storage in self.storages:
 
@@ -236,6 +328,13 @@ class StorageElementItem( object ):
                           'isFile',
                         ]
 
+    # Methods whose calls on many files can be split in chunks executed in parallel
+    self.parallelMethods = [ 'exists',
+                             'isFile',
+                             'getFileMetadata',
+                             'getFileSize',
+                             'removeFile' ]
+
     self.okMethods = [ 'getLocalProtocols',
                        'getProtocols',
                        'getRemoteProtocols',
@@ -246,6 +345,50 @@ class StorageElementItem( object ):
 
     self.__fileCatalog = None
 
+  @property
+  def methodName( self ):
+    """ Name of the method being called by the current thread """
+    return getattr( self.__threadData, 'methodName', None )
+
+  @methodName.setter
+  def methodName( self, methodName ):
+    self.__threadData.methodName = methodName
+
+  @property
+  def storages( self ):
+    """ Storage plugin objects of the current thread
+
+        The plugins may keep a state, like a connection context, so they are not shared
+        between threads. The thread creating the SE uses the ones built by the StorageFactory,
+        the others get their own plugins, built from the same protocol parameters without
+        reading the CS again.
+    """
+    storages = getattr( self.__threadData, 'storages', None )
+    if storages is None:
+      storages = self.__createThreadStorages()
+      self.__threadData.storages = storages
+    return storages
+
+  @storages.setter
+  def storages( self, storages ):
+    self.__threadData.storages = storages
+
+  def __createThreadStorages( self ):
+    """ Instantiate the storage plugins for the current thread
+    """
+    storageFactory = StorageFactory( useProxy = self.useProxy, vo = self.vo )
+    storages = []
+    for storageName, protocolDict in self.__pluginDefinitions:
+      result = storageFactory.getStorage( dict( protocolDict, StorageName = storageName ) )
+      if not result['OK']:
+        self.log.error( "Failed to instantiate storage plugin", "%s: %s" % ( protocolDict.get( 'PluginName' ),
+                                                                           result['Message'] ) )
+        continue
+      storage = result['Value']
+      storage.setStorageElement( self )
+      storages.append( storage )
+    return storages
+
   def dump( self ):
     """ Dump to the logger a summary of the StorageElement items. """
     log = self.log.getSubLogger( 'dump', True )
@@ -910,13 +1053,18 @@ class StorageElementItem( object ):
         for url in urlDict:
           urlsToUse[url] = lfnDict[urlDict[url]]
 
-        startDate = datetime.datetime.utcnow()
-        startTime = time.time()
-        res = fcn( urlsToUse, *args, **kwargs )
-        elapsedTime = time.time() - startTime
+        chunkSize, maxParallelCalls = self.__getParallelism( storageParameters )
+        if self.methodName in self.parallelMethods and maxParallelCalls > 1 and len( urlsToUse ) > chunkSize:
+          res = self.__executeInParallel( storage, urlsToUse, chunkSize, maxParallelCalls,
+                                          storageParameters, args, kwargs )
+        else:
+          startDate = datetime.datetime.utcnow()
+          startTime = time.time()
+          res = fcn( urlsToUse, *args, **kwargs )
+          elapsedTime = time.time() - startTime
 
 
-        self.addAccountingOperation( urlsToUse, startDate, elapsedTime, storageParameters, res )
+          self.addAccountingOperation( urlsToUse, startDate, elapsedTime, storageParameters, res )
 
         if not res['OK']:
           errStr = "Completely failed to perform %s." % self.methodName
@@ -952,6 +1100,82 @@ class StorageElementItem( object ):
     return S_OK( { 'Failed': failed, 'Successful': successful } )
 
 
+  def __getParallelism( self, storageParameters ):
+    """ Get the chunk size and the maximum number of parallel calls for a plugin,
+        the protocol section options taking precedence over the SE ones
+
+        :return: ( chunkSize, maxParallelCalls )
+    """
+    options = dict( self.options )
+    for protocolDict in self.protocolOptions:
+      if protocolDict.get( 'PluginName' ) == storageParameters.get( 'PluginName' ) and \
+         protocolDict.get( 'Protocol' ) == storageParameters.get( 'Protocol' ):
+        options.update( protocolDict )
+        break
+    try:
+      chunkSize = max( 1, int( options.get( 'ParallelChunkSize', DEFAULT_PARALLEL_CHUNK_SIZE ) ) )
+      maxParallelCalls = int( options.get( 'MaxParallelCalls', DEFAULT_MAX_PARALLEL_CALLS ) )
+    except ValueError:
+      self.log.warn( "Invalid parallelism options, calls will not be parallel",
+                     "%s %s" % ( options.get( 'ParallelChunkSize' ), options.get( 'MaxParallelCalls' ) ) )
+      return DEFAULT_PARALLEL_CHUNK_SIZE, 1
+    return chunkSize, min( maxParallelCalls, PARALLEL_CALLS_THREADS )
+
+  def __executeInParallel( self, storage, urlsToUse, chunkSize, maxParallelCalls, storageParameters, args, kwargs ):
+    """ Split the urls in chunks and call the plugin method for each of them, at most
+        maxParallelCalls at a time. The chunks are executed by the threads of the parallel
+        calls pool, each with its own instance of the plugin.
+
+        :return: S_OK( { 'Successful' : { url : value }, 'Failed' : { url : reason } } ), the urls
+                 of a chunk whose call failed completely being Failed with the error message
+    """
+    log = self.log.getSubLogger( '__executeInParallel' )
+    pluginIndex = self.storages.index( storage )
+    chunks = [ dict( ( url, urlsToUse[url] ) for url in urls )
+               for urls in breakListIntoChunks( urlsToUse.keys(), chunkSize ) ]
+    log.verbose( "Executing %s on %d urls in %d chunks, %d at a time" % ( self.methodName, len( urlsToUse ),
+                                                                        len( chunks ), maxParallelCalls ) )
+    pool = getParallelCallsPool()
+    resultQueue = Queue.Queue()
+    successful = {}
+    failed = {}
+    running = 0
+    startTime = time.time()
+    while chunks or running:
+      while chunks and running < maxParallelCalls:
+        pool.generateJobAndQueueIt( self.__executeChunk,
+                                    args = ( pluginIndex, storage.pluginName, self.methodName,
+                                             chunks.pop(), args, dict( kwargs ), resultQueue ) )
+        running += 1
+      chunkUrls, chunkStartDate, chunkElapsedTime, res = resultQueue.get()
+      running -= 1
+      self.addAccountingOperation( chunkUrls, chunkStartDate, chunkElapsedTime, storageParameters, res )
+      if not res['OK']:
+        log.debug( "Chunk failed", res['Message'] )
+        failed.update( dict.fromkeys( chunkUrls, res['Message'] ) )
+      else:
+        successful.update( res['Value']['Successful'] )
+        failed.update( res['Value']['Failed'] )
+    log.verbose( "%s on %d urls done in %.1f seconds" % ( self.methodName, len( urlsToUse ), time.time() - startTime ) )
+
+    return S_OK( { 'Successful' : successful, 'Failed' : failed } )
+
+  def __executeChunk( self, pluginIndex, pluginName, methodName, urls, args, kwargs, resultQueue ):
+    """ Execute a chunk of a parallel call, in a thread of the parallel calls pool
+    """
+    startDate = datetime.datetime.utcnow()
+    startTime = time.time()
+    try:
+      storages = self.storages
+      if pluginIndex < len( storages ) and storages[pluginIndex].pluginName == pluginName:
+        res = getattr( storages[pluginIndex], methodName )( urls, *args, **kwargs )
+      else:
+        res = S_ERROR( "Storage plugin %s not available in the thread" % pluginName )
+    except Exception as x: #pylint: disable=broad-except
+      self.log.exception( "Exception while calling %s" % methodName, lException = x )
+      res = S_ERROR( "Exception while calling %s: %s" % ( methodName, x ) )
+    resultQueue.put( ( urls, startDate, time.time() - startTime, res ) )
+
   def __getattr__( self, name ):
     """ Forwards the equivalent Storage calls to __executeMethod"""
     # We take either the equivalent name, or the name itself
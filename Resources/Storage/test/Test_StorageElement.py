@@ -4,9 +4,10 @@
 import mock
 import unittest
 import itertools
+import threading
 
-from DIRAC import S_OK
-from DIRAC.Resources.Storage.StorageElement import StorageElementItem
+from DIRAC import S_OK, S_ERROR
+from DIRAC.Resources.Storage.StorageElement import StorageElementItem, StorageElementCache
 from DIRAC.Resources.Storage.StorageBase import StorageBase
 
 
@@ -22,6 +23,12 @@ class fake_SRM2Plugin( StorageBase ):
   def getTransportURL( self, path, protocols = False ):
     return S_OK( {'Successful' : dict.fromkeys( path, "srm:getTransportURL" ), 'Failed' : {}} )
 
+  def exists( self, path ):
+    if len( path ) > 2:
+      return S_ERROR( "Too many files in a single call" )
+    return S_OK( { 'Successful' : dict( ( url, threading.current_thread().ident ) for url in path if 'bad' not in url ),
+                   'Failed' : dict( ( url, "srm:exists failed" ) for url in path if 'bad' in url ) } )
+
 class fake_XROOTPlugin( StorageBase ):
   """ Fake XROOT plugin.
       Only implements the two methods needed
@@ -35,6 +42,9 @@ class fake_XROOTPlugin( StorageBase ):
   def getTransportURL( self, path, protocols = False ):
     return S_OK( {'Successful' : dict.fromkeys( path, "root:getTransportURL" ), 'Failed' : {}} )
 
+  def exists( self, path ):
+    return S_OK( {'Successful' : dict.fromkeys( path, "root:exists" ), 'Failed' : {}} )
+
 
 def mock_StorageFactory_generateStorageObject( storageName, pluginName, parameters, hideExceptions = False ):
   """ Generate fake storage object"""
@@ -71,6 +81,11 @@ def mock_StorageFactory_getConfigStorageOptions( storageName, derivedStorageName
   if storageName in ( 'StorageE', ):
     options['WriteProtocols'] = ['root', 'srm']
 
+  if storageName in ( 'StorageF', ):
+    options['AccessProtocols'] = ['srm', 'root']
+    options['MaxParallelCalls'] = '3'
+    options['ParallelChunkSize'] = '2'
+
 
 
 
@@ -114,6 +129,17 @@ def mock_StorageFactory_getConfigStorageProtocols( storageName, derivedStorageNa
                                      'Path' : '',
                                    },
                                    ],
+                     'StorageF' : [
+                                   {'PluginName': 'SRM2',
+                                     'Protocol': 'srm',
+                                     'Path' : '',
+                                   },
+                                   {'PluginName': 'XROOT',
+                                     'Protocol': 'root',
+                                     'Path' : '',
+                                     'MaxParallelCalls' : '1',
+                                   },
+                                   ],
                     }
 
   return S_OK( protocolDetails[storageName] )
@@ -165,6 +191,8 @@ class TestBase( unittest.TestCase ):
     self.seD.vo = 'lhcb'
     self.seE = StorageElementItem( 'StorageE' )
     self.seE.vo = 'lhcb'
+    self.seF = StorageElementItem( 'StorageF' )
+    self.seF.vo = 'lhcb'
 
 
 
@@ -451,6 +479,76 @@ class TestBase( unittest.TestCase ):
     self.assertEqual( res['Value']['Successful'][lfn], "srm:putFile" )
 
 
+  @mock.patch( 'DIRAC.Resources.Storage.StorageFactory.StorageFactory._StorageFactory__generateStorageObject',
+                side_effect = mock_StorageFactory_generateStorageObject )
+  @mock.patch( 'DIRAC.Resources.Storage.StorageElement.StorageElementItem._StorageElementItem__isLocalSE',
+                return_value = S_OK( True ) )  # Pretend it's local
+  @mock.patch( 'DIRAC.Resources.Storage.StorageElement.StorageElementItem.addAccountingOperation',
+                return_value = None )  # Don't send accounting
+  def test_08_threadPlugins( self, _mk_generateStorage, _mk_isLocalSE, _mk_addAccounting ):
+    """ The SE is shared between threads, but not its plugins """
+
+    threadStorages = []
+    threadResults = []
+    def useSE():
+      threadStorages.extend( self.seD.storages )
+      threadResults.append( self.seD.putFile( { '/lhcb/fake/lfn' : 'localFile' } ) )
+
+    thread = threading.Thread( target = useSE )
+    thread.start()
+    thread.join()
+
+    self.assertEqual( [ storage.pluginName for storage in threadStorages ],
+                      [ storage.pluginName for storage in self.seD.storages ] )
+    self.assertFalse( set( threadStorages ) & set( self.seD.storages ) )
+    self.assertEqual( [ storage.getParameters() for storage in threadStorages ],
+                      [ storage.getParameters() for storage in self.seD.storages ] )
+    self.assertTrue( threadResults[0]['OK'], threadResults[0] )
+    self.assertEqual( threadResults[0]['Value']['Successful']['/lhcb/fake/lfn'], "srm:putFile" )
+
+  @mock.patch( 'DIRAC.Resources.Storage.StorageFactory.StorageFactory._StorageFactory__generateStorageObject',
+                side_effect = mock_StorageFactory_generateStorageObject )
+  @mock.patch( 'DIRAC.Resources.Storage.StorageElement.StorageElementItem._StorageElementItem__isLocalSE',
+                return_value = S_OK( True ) )  # Pretend it's local
+  @mock.patch( 'DIRAC.Resources.Storage.StorageElement.StorageElementItem.addAccountingOperation',
+                return_value = None )  # Don't send accounting
+  def test_10_parallelCalls( self, mk_addAccounting, _mk_isLocalSE, _mk_generateStorage ):
+    """ Calls on many files are split in chunks executed in parallel, only the failed
+        files being tried with the next plugin
+    """
+
+    lfns = [ '/lhcb/fake/lfn%d' % i for i in range( 10 ) ] + [ '/lhcb/fake/bad%d' % i for i in range( 3 ) ]
+    res = self.seF.exists( lfns )
+    self.assertTrue( res['OK'], res )
+    self.assertEqual( res['Value']['Failed'], {} )
+    self.assertEqual( sorted( res['Value']['Successful'] ), sorted( lfns ) )
+    srmThreads = set( res['Value']['Successful'][lfn] for lfn in lfns[:10] )
+    self.assertTrue( threading.current_thread().ident not in srmThreads )
+    for lfn in lfns[10:]:
+      self.assertEqual( res['Value']['Successful'][lfn], "root:exists" )
+    # One call per chunk of 2 files with SRM2, then a single call for the failed ones with XROOT
+    self.assertEqual( mk_addAccounting.call_count, 8 )
+    self.assertEqual( len( mk_addAccounting.call_args_list[-1][0][0] ), 3 )
+
+  @mock.patch( 'DIRAC.Resources.Storage.StorageElement.StorageElementItem', side_effect = lambda *args, **kwargs: object() )
+  def test_09_sharedPool( self, _mk_seItem ):
+    """ The pool returns the same object to all the threads """
+
+    seCache = StorageElementCache()
+    seObj = seCache( 'StorageA', vo = 'lhcb' )
+    threadObjects = []
+    thread = threading.Thread( target = lambda: threadObjects.append( seCache( 'StorageA', vo = 'lhcb' ) ) )
+    thread.start()
+    thread.join()
+    self.assertTrue( threadObjects[0] is seObj )
+    self.assertFalse( seCache( 'StorageA', plugins = ['File'], vo = 'lhcb' ) is seObj )
+    self.assertEqual( seCache.getStats(), { 'Hits' : 1, 'Misses' : 2, 'Invalidations' : 0, 'Size' : 2 } )
+
+    seCache.invalidate( 'StorageA' )
+    self.assertFalse( seCache( 'StorageA', vo = 'lhcb' ) is seObj )
+    self.assertEqual( seCache.getStats()['Misses'], 3 )
+
+
 if __name__ == '__main__':
   from DIRAC import gLogger
   gLogger.setLevel( 'DEBUG' )
@@ -1,6 +1,8 @@
 '''
 Update the transformation files of active transformations given an InputDataQuery fetched from the Transformation Service.
 
+The files are fetched from the catalog and added to the transformation page by page.
+
 Possibility to speedup the query time by only fetching files that were added since the last iteration.
 Use the CS option RefreshOnly (False by default) and set the DateKey (empty by default) to the meta data
 key set in the DIRAC FileCatalog.
@@ -35,6 +37,7 @@ class InputDataAgent( AgentModule ):
     self.fullUpdatePeriod = self.am_getOption( 'FullUpdatePeriod', 86400 )
     self.refreshonly = self.am_getOption( 'RefreshOnly', False )
     self.dateKey = self.am_getOption( 'DateKey', None )
+    self.queryPageSize = self.am_getOption( 'QueryPageSize', 10000 )
 
     self.transClient = TransformationClient()
     self.metadataClient = FileCatalogClient()
@@ -103,43 +106,52 @@ class InputDataAgent( AgentModule ):
         if not self.fullTimeLog.has_key( transID ):
           self.fullTimeLog[transID] = datetime.datetime.utcnow()
 
-      # Perform the query to the metadata catalog
+      # Perform the query to the metadata catalog, adding the files page by page
       gLogger.verbose( "Using input data query for transformation %d: %s" % ( transID, str( inputDataQuery ) ) )
       start = time.time()
-      result = self.metadataClient.findFilesByMetadata( inputDataQuery )
-      rtime = time.time() - start
-      gLogger.verbose( "Metadata catalog query time: %.2f seconds." % ( rtime ) )
-      if not result['OK']:
-        gLogger.error( "InputDataAgent.execute: Failed to get response from the metadata catalog", result['Message'] )
-        continue
-      lfnList = result['Value']
-
-      # Check if the number of files has changed since the last cycle
-      nlfns = len( lfnList )
-      gLogger.info( "%d files returned for transformation %d from the metadata catalog" % ( nlfns, int( transID ) ) )
-      if self.fileLog.has_key( transID ):
-        if nlfns == self.fileLog[transID]:
-          gLogger.verbose( 'No new files in metadata catalog since last check' )
-      self.fileLog[transID] = nlfns
-
-      # Add any new files to the transformation
+      nlfns = 0
       addedLfns = []
-      if lfnList:
-        gLogger.verbose( 'Processing %d lfns for transformation %d' % ( len( lfnList ), transID ) )
-        # Add the files to the transformation
-        gLogger.verbose( 'Adding %d lfns for transformation %d' % ( len( lfnList ), transID ) )
-        result = self.transClient.addFilesToTransformation( transID, sorted( lfnList ) )
+      addFailed = False
+      for result in self.metadataClient.iterFilesByMetadata( inputDataQuery, pageSize = self.queryPageSize ):
         if not result['OK']:
-          gLogger.warn( "InputDataAgent.execute: failed to add lfns to transformation", result['Message'] )
-          self.fileLog[transID] = 0
-        else:
-          if result['Value']['Failed']:
-            for lfn, error in res['Value']['Failed'].items():
-              gLogger.warn( "InputDataAgent.execute: Failed to add %s to transformation" % lfn, error )
-          if result['Value']['Successful']:
-            for lfn, status in result['Value']['Successful'].items():
-              if status == 'Added':
-                addedLfns.append( lfn )
-            gLogger.info( "InputDataAgent.execute: Added %d files to transformation" % len( addedLfns ) )
+          gLogger.error( "InputDataAgent.execute: Failed to get response from the metadata catalog", result['Message'] )
+          break
+        lfnList = result['Value']
+        nlfns += len( lfnList )
+        if lfnList:
+          # Add the files to the transformation
+          result = self.__addFilesToTransformation( transID, lfnList )
+          if not result['OK']:
+            addFailed = True
+          else:
+            addedLfns += result['Value']
+      else:
+        rtime = time.time() - start
+        gLogger.verbose( "Metadata catalog query time: %.2f seconds." % ( rtime ) )
+
+        # Check if the number of files has changed since the last cycle
+        gLogger.info( "%d files returned for transformation %d from the metadata catalog" % ( nlfns, int( transID ) ) )
+        if self.fileLog.has_key( transID ):
+          if nlfns == self.fileLog[transID]:
+            gLogger.verbose( 'No new files in metadata catalog since last check' )
+        self.fileLog[transID] = nlfns
+      if addFailed:
+        self.fileLog[transID] = 0
+      if addedLfns:
+        gLogger.info( "InputDataAgent.execute: Added %d files to transformation" % len( addedLfns ) )
 
     return S_OK()
+
+  def __addFilesToTransformation( self, transID, lfnList ):
+    """ Add a page of files to the transformation
+
+        :return: S_OK( [ added lfns ] )
+    """
+    gLogger.verbose( 'Adding %d lfns for transformation %d' % ( len( lfnList ), transID ) )
+    result = self.transClient.addFilesToTransformation( transID, sorted( lfnList ) )
+    if not result['OK']:
+      gLogger.warn( "InputDataAgent.execute: failed to add lfns to transformation", result['Message'] )
+      return result
+    for lfn, error in result['Value']['Failed'].items():
+      gLogger.warn( "InputDataAgent.execute: Failed to add %s to transformation" % lfn, error )
+    return S_OK( [ lfn for lfn, status in result['Value']['Successful'].items() if status == 'Added' ] )
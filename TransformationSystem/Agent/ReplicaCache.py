@@ -0,0 +1,187 @@
+""" ReplicaCache keeps the replicas of the input files of the transformations in
+    an indexed sqlite file in the agent work directory.
+
+    There is one entry per LFN, so that only the LFNs that are looked up are read
+    and only the LFNs that changed are written. The SE names are stored as integer
+    IDs and the entries are put in time buckets (one per hour by default): the
+    expired replicas are removed bucket by bucket using an index. A single
+    connection is shared by all the threads of the agent, protected by a lock.
+"""
+
+__RCSID__ = "$Id$"
+
+import time
+import calendar
+import sqlite3
+import threading
+
+from DIRAC import gLogger, S_OK, S_ERROR
+from DIRAC.Core.Utilities.List import breakListIntoChunks
+
+# Maximum number of LFNs in a single statement (sqlite limits the number of variables to 999)
+MAX_LFNS_PER_STATEMENT = 500
+
+class ReplicaCache( object ):
+
+  def __init__( self, dbFile, validity = 2 * 86400, bucketSize = 3600 ):
+    """ c'tor
+
+    :param str dbFile: path of the sqlite file holding the cache
+    :param int validity: number of seconds the replicas stay in the cache
+    :param int bucketSize: granularity in seconds of the expiration of the replicas
+    """
+    self.log = gLogger.getSubLogger( "ReplicaCache" )
+    self.dbFile = dbFile
+    self.validity = validity
+    self.bucketSize = max( 1, bucketSize )
+    self.__lock = threading.RLock()
+    self.__seIDs = {}
+    self.__seNames = {}
+    self.__conn = sqlite3.connect( dbFile, check_same_thread = False )
+    self.__createTables()
+
+  def __createTables( self ):
+    with self.__lock:
+      with self.__conn:
+        self.__conn.execute( "CREATE TABLE IF NOT EXISTS StorageElements "
+                             "( SEID INTEGER PRIMARY KEY, SEName TEXT UNIQUE NOT NULL )" )
+        self.__conn.execute( "CREATE TABLE IF NOT EXISTS Replicas "
+                             "( TransID INTEGER NOT NULL, LFN TEXT NOT NULL, Bucket INTEGER NOT NULL, "
+                             "SEIDs TEXT NOT NULL, PRIMARY KEY ( TransID, LFN ) )" )
+        self.__conn.execute( "CREATE INDEX IF NOT EXISTS ReplicasBucket ON Replicas ( TransID, Bucket )" )
+      self.__loadSEs()
+
+  def __loadSEs( self ):
+    self.__seIDs = {}
+    self.__seNames = {}
+    for seID, seName in self.__conn.execute( "SELECT SEID, SEName FROM StorageElements" ):
+      self.__seIDs[seName] = seID
+      self.__seNames[seID] = seName
+
+  def __getBucket( self, updateTime = None ):
+    """ Time bucket of a datetime, the current one by default
+    """
+    if updateTime is None:
+      epoch = time.time()
+    else:
+      epoch = calendar.timegm( updateTime.utctimetuple() )
+    return int( epoch // self.bucketSize )
+
+  def __getOldestValidBucket( self ):
+    return self.__getBucket() - int( self.validity // self.bucketSize )
+
+  def __encodeSEs( self, seList ):
+    """ Encode a list of SE names as a string of SE IDs, registering the new SEs
+    """
+    seIDs = []
+    for seName in seList:
+      seID = self.__seIDs.get( seName )
+      if seID is None:
+        seID = self.__conn.execute( "INSERT INTO StorageElements ( SEName ) VALUES ( ? )", ( seName, ) ).lastrowid
+        self.__seIDs[seName] = seID
+        self.__seNames[seID] = seName
+      seIDs.append( str( seID ) )
+    return ','.join( seIDs )
+
+  def __decodeSEs( self, seIDs ):
+    return [ self.__seNames[int( seID )] for seID in seIDs.split( ',' ) ]
+
+  def getReplicas( self, transID, lfns ):
+    """ Get the cached replicas of some LFNs of a transformation
+
+    :return: S_OK( { lfn : [ seName ] } ) for the LFNs found in the cache
+    """
+    replicas = {}
+    try:
+      with self.__lock:
+        oldestBucket = self.__getOldestValidBucket()
+        for lfnChunk in breakListIntoChunks( list( lfns ), MAX_LFNS_PER_STATEMENT ):
+          query = "SELECT LFN, SEIDs FROM Replicas WHERE TransID = ? AND Bucket >= ? AND LFN IN ( %s )" % \
+                  ','.join( '?' * len( lfnChunk ) )
+          for lfn, seIDs in self.__conn.execute( query, [ transID, oldestBucket ] + lfnChunk ):
+            replicas[lfn] = self.__decodeSEs( seIDs )
+    except sqlite3.Error as e:
+      self.log.error( "Failed to get cached replicas", "%s: %s" % ( self.dbFile, e ) )
+      return S_ERROR( "Failed to get cached replicas: %s" % e )
+    return S_OK( replicas )
+
+  def addReplicas( self, transID, replicas, updateTime = None ):
+    """ Add or replace the replicas of some LFNs of a transformation
+
+    :param dict replicas: { lfn : [ seName ] }, the LFNs without replicas are not cached
+    :param updateTime: datetime the replicas were obtained, now by default
+    :return: S_OK( number of cached LFNs )
+    """
+    bucket = self.__getBucket( updateTime )
+    try:
+      with self.__lock:
+        with self.__conn:
+          rows = [ ( transID, lfn, bucket, self.__encodeSEs( ses ) ) for lfn, ses in replicas.iteritems() if ses ]
+          self.__conn.executemany( "INSERT OR REPLACE INTO Replicas ( TransID, LFN, Bucket, SEIDs ) "
+                                   "VALUES ( ?, ?, ?, ? )", rows )
+    except sqlite3.Error as e:
+      self.log.error( "Failed to cache replicas", "%s: %s" % ( self.dbFile, e ) )
+      # New SEs may have been rolled back
+      with self.__lock:
+        self.__loadSEs()
+      return S_ERROR( "Failed to cache replicas: %s" % e )
+    return S_OK( len( rows ) )
+
+  def removeReplicas( self, transID, lfns ):
+    """ Remove the replicas of some LFNs of a transformation
+
+    :return: S_OK( number of removed LFNs )
+    """
+    removed = 0
+    try:
+      with self.__lock:
+        with self.__conn:
+          for lfnChunk in breakListIntoChunks( list( lfns ), MAX_LFNS_PER_STATEMENT ):
+            query = "DELETE FROM Replicas WHERE TransID = ? AND LFN IN ( %s )" % ','.join( '?' * len( lfnChunk ) )
+            removed += self.__conn.execute( query, [ transID ] + lfnChunk ).rowcount
+    except sqlite3.Error as e:
+      self.log.error( "Failed to remove cached replicas", "%s: %s" % ( self.dbFile, e ) )
+      return S_ERROR( "Failed to remove cached replicas: %s" % e )
+    return S_OK( removed )
+
+  def clearTransformation( self, transID ):
+    """ Remove all the replicas of a transformation
+
+    :return: S_OK( number of removed LFNs )
+    """
+    return self.__delete( "DELETE FROM Replicas WHERE TransID = ?", ( transID, ) )
+
+  def purgeExpired( self, transID = None ):
+    """ Remove the replicas older than the validity, for one or all transformations
+
+    :return: S_OK( number of removed LFNs )
+    """
+    oldestBucket = self.__getOldestValidBucket()
+    if transID is None:
+      return self.__delete( "DELETE FROM Replicas WHERE Bucket < ?", ( oldestBucket, ) )
+    return self.__delete( "DELETE FROM Replicas WHERE TransID = ? AND Bucket < ?", ( transID, oldestBucket ) )
+
+  def __delete( self, query, args ):
+    try:
+      with self.__lock:
+        with self.__conn:
+          return S_OK( self.__conn.execute( query, args ).rowcount )
+    except sqlite3.Error as e:
+      self.log.error( "Failed to remove cached replicas", "%s: %s" % ( self.dbFile, e ) )
+      return S_ERROR( "Failed to remove cached replicas: %s" % e )
+
+  def getNumberOfReplicas( self, transID ):
+    """ Number of LFNs of a transformation with valid cached replicas
+    """
+    try:
+      with self.__lock:
+        return S_OK( self.__conn.execute( "SELECT COUNT(*) FROM Replicas WHERE TransID = ? AND Bucket >= ?",
+                                          ( transID, self.__getOldestValidBucket() ) ).fetchone()[0] )
+    except sqlite3.Error as e:
+      return S_ERROR( "Failed to count cached replicas: %s" % e )
+
+  def close( self ):
+    """ Close the connection to the cache file
+    """
+    with self.__lock:
+      self.__conn.close()
@@ -15,6 +15,7 @@ from DIRAC.Core.Utilities.List                                      import break
 from DIRAC.ConfigurationSystem.Client.Helpers.Operations            import Operations
 from DIRAC.TransformationSystem.Client.TransformationClient         import TransformationClient
 from DIRAC.TransformationSystem.Agent.TransformationAgentsUtilities import TransformationAgentsUtilities
+from DIRAC.TransformationSystem.Agent.ReplicaCache                  import ReplicaCache
 from DIRAC.DataManagementSystem.Client.DataManager                  import DataManager
 
 __RCSID__ = "$Id$"
@@ -54,8 +55,6 @@ class TransformationAgent( AgentModule, TransformationAgentsUtilities ):
     # Validity of the cache
     self.replicaCache = None
     self.replicaCacheValidity = None
-    self.writingCache = False
-    self.removedFromCache = 0
 
     self.noUnusedDelay = 0
     self.unusedFiles = {}
@@ -86,7 +85,7 @@ class TransformationAgent( AgentModule, TransformationAgentsUtilities ):
     # clients
     self.transfClient = TransformationClient()
 
-    # for caching using a pickle file
+    # for caching using an indexed file (the pickle files are only read to import them)
     self.workDirectory = self.am_getWorkDirectory()
     self.cacheFile = os.path.join( self.workDirectory, 'ReplicaCache.pkl' )
     self.controlDirectory = self.am_getControlDirectory()
@@ -95,8 +94,10 @@ class TransformationAgent( AgentModule, TransformationAgentsUtilities ):
     self.lastFileOffset = {}
 
     # Validity of the cache
-    self.replicaCache = {}
     self.replicaCacheValidity = self.am_getOption( 'ReplicaCacheValidity', 2 )
+    self.replicaCache = ReplicaCache( os.path.join( self.workDirectory, 'ReplicaCache.db' ),
+                                      validity = int( self.replicaCacheValidity * 86400 ) )
+    self.replicaCache.purgeExpired()
 
     self.noUnusedDelay = self.am_getOption( 'NoUnusedDelay', 6 )
 
@@ -123,7 +124,7 @@ class TransformationAgent( AgentModule, TransformationAgentsUtilities ):
       while self.transInThread:
         time.sleep( 2 )
       self._logInfo( "Threads are empty, terminating the agent..." , method = method )
-    self.__writeCache()
+    self.replicaCache.close()
     return S_OK()
 
   def execute( self ):
@@ -238,8 +239,7 @@ class TransformationAgent( AgentModule, TransformationAgentsUtilities ):
     if not transFiles['Value']:
       return S_OK()
 
-    if transID not in self.replicaCache:
-      self.__readCache( transID )
+    self.__importCacheFile( transID )
     transFiles = transFiles['Value']
     unusedLfns = [ f['LFN'] for f in transFiles ]
     unusedFiles = len( unusedLfns )
@@ -443,21 +443,18 @@ class TransformationAgent( AgentModule, TransformationAgentsUtilities ):
       # If the cache needs to be cleaned
       self.__cleanCache( transID )
     startTime = time.time()
-    dataReplicas = {}
     nLfns = len( lfns )
     self._logVerbose( "Getting replicas for %d files" % nLfns, method = method, transID = transID )
-    cachedReplicaSets = self.replicaCache.get( transID, {} )
-    cachedReplicas = {}
-    # Merge all sets of replicas
-    for replicas in cachedReplicaSets.itervalues():
-      cachedReplicas.update( replicas )
-    self._logInfo( "Number of cached replicas: %d" % len( cachedReplicas ), method = method, transID = transID )
-    setCached = set( cachedReplicas )
     setLfns = set( lfns )
-    for lfn in setLfns & setCached:
-      dataReplicas[lfn] = cachedReplicas[lfn]
-    newLFNs = setLfns - setCached
-    self._logInfo( "ReplicaCache hit for %d out of %d LFNs" % ( len( dataReplicas ), nLfns ),
+    res = self.replicaCache.getReplicas( transID, setLfns )
+    if not res['OK']:
+      self._logWarn( "Failed to get cached replicas", res['Message'], method = method, transID = transID )
+      dataReplicas = {}
+    else:
+      dataReplicas = res['Value']
+    newLFNs = setLfns - set( dataReplicas )
+    self._logInfo( "ReplicaCache hit for %d out of %d LFNs in %.1f seconds" % ( len( dataReplicas ), nLfns,
+                                                                                time.time() - startTime ),
                    method = method, transID = transID )
     if newLFNs:
       startTime = time.time()
@@ -479,7 +476,6 @@ class TransformationAgent( AgentModule, TransformationAgentsUtilities ):
                      method = method, transID = transID )
       dataReplicas.update( newReplicas )
       noReplicas = newLFNs - set( dataReplicas )
-      self.__writeCache( transID )
       if noReplicas:
         self._logWarn( "Found %d files without replicas (or only in Failover)" % len( noReplicas ),
                        method = method, transID = transID )
@@ -547,119 +543,71 @@ class TransformationAgent( AgentModule, TransformationAgentsUtilities ):
   def __updateCache( self, transID, newReplicas ):
     """ Add replicas to the cache
     """
-    self.replicaCache.setdefault( transID, {} )[datetime.datetime.utcnow()] = newReplicas
-#    if len( newReplicas ) > 5000:
-#      self.__writeCache( transID )
+    res = self.replicaCache.addReplicas( transID, newReplicas )
+    if not res['OK']:
+      self._logWarn( "Failed to cache replicas", res['Message'], method = '__updateCache', transID = transID )
 
   def __clearCacheForTrans( self, transID ):
     """ Remove all replicas for a transformation
     """
-    self.replicaCache.pop( transID , None )
-
-  def __cleanReplicas( self, transID, lfns ):
-    """ Remove cached replicas that are not in a list
-    """
-    cachedReplicas = set()
-    for replicas in self.replicaCache.get( transID, {} ).itervalues():
-      cachedReplicas.update( replicas )
-    toRemove = cachedReplicas - set( lfns )
-    if toRemove:
-      self._logInfo( "Remove %d files from cache" % len( toRemove ), method = '__cleanReplicas', transID = transID )
-      self.__removeFromCache( transID, toRemove )
+    res = self.replicaCache.clearTransformation( transID )
+    if not res['OK']:
+      self._logWarn( "Failed to clear cached replicas", res['Message'], method = '__clearCacheForTrans',
+                     transID = transID )
 
   def __cleanCache( self, transID ):
     """ Cleans the cache
     """
-    try:
-      if transID in self.replicaCache:
-        timeLimit = datetime.datetime.utcnow() - datetime.timedelta( days = self.replicaCacheValidity )
-        for updateTime in set( self.replicaCache[transID] ):
-          nCache = len( self.replicaCache[transID][updateTime] )
-          if updateTime < timeLimit or not nCache:
-            self._logInfo( "Clear %s replicas for transformation %s, time %s" %
-                           ( '%d cached' % nCache if nCache else 'empty cache' , str( transID ), str( updateTime ) ),
-                           transID = transID, method = '__cleanCache' )
-            del self.replicaCache[transID][updateTime]
-        # Remove empty transformations
-        if not self.replicaCache[transID]:
-          del self.replicaCache[transID]
-    except Exception as x:
-      self._logException( "Exception when cleaning replica cache:", lException = x )
+    res = self.replicaCache.purgeExpired( transID )
+    if not res['OK']:
+      self._logWarn( "Failed to clean replica cache", res['Message'], method = '__cleanCache', transID = transID )
+    elif res['Value']:
+      self._logInfo( "Cleared %d expired replicas from cache" % res['Value'], method = '__cleanCache',
+                     transID = transID )
 
   def __removeFilesFromCache( self, transID, lfns ):
-    removed = self.__removeFromCache( transID, lfns )
-    if removed:
-      self._logInfo( "Removed %d replicas from cache" % removed, method = '__removeFilesFromCache', transID = transID )
-      self.__writeCache( transID )
-
-  def __removeFromCache( self, transID, lfns ):
-    if transID not in self.replicaCache:
+    if not lfns:
       return
-    removed = 0
-    if self.replicaCache[transID] and lfns:
-      for lfn in lfns:
-        for timeKey in self.replicaCache[transID]:
-          if self.replicaCache[transID][timeKey].pop( lfn, None ):
-            removed += 1
-    return removed
+    res = self.replicaCache.removeReplicas( transID, lfns )
+    if not res['OK']:
+      self._logWarn( "Failed to remove replicas from cache", res['Message'], method = '__removeFilesFromCache',
+                     transID = transID )
+    elif res['Value']:
+      self._logInfo( "Removed %d replicas from cache" % res['Value'], method = '__removeFilesFromCache',
+                     transID = transID )
 
   def __cacheFile( self, transID ):
     return self.cacheFile.replace( '.pkl', '_%s.pkl' % str( transID ) )
 
   @gSynchro
-  def __readCache( self, transID ):
-    """ Reads from the cache
+  def __importCacheFile( self, transID ):
+    """ Imports in the replica cache the pickle file written by previous versions of the agent, if any
     """
-    if transID in self.replicaCache:
+    method = '__importCacheFile'
+    fileName = self.__cacheFile( transID )
+    if not os.path.exists( fileName ):
       return
     try:
-      method = '__readCache'
-      fileName = self.__cacheFile( transID )
-      if not os.path.exists( fileName ):
-        self.replicaCache[transID] = {}
-      else:
-        with open( fileName, 'r' ) as cacheFile:
-          self.replicaCache[transID] = pickle.load( cacheFile )
-        self._logInfo( "Successfully loaded replica cache from file %s (%d files)" %
-                       ( fileName, self.__filesInCache( transID ) ),
-                       method = method, transID = transID )
+      with open( fileName, 'r' ) as cacheFile:
+        replicaSets = pickle.load( cacheFile )
+      nFiles = 0
+      for updateTime, replicas in replicaSets.iteritems():
+        res = self.replicaCache.addReplicas( transID, replicas, updateTime = updateTime )
+        if not res['OK']:
+          self._logError( "Failed to import replica cache file %s" % fileName, res['Message'],
+                          method = method, transID = transID )
+          return
+        nFiles += res['Value']
+      self.__cleanCache( transID )
+      self._logInfo( "Successfully imported replica cache file %s (%d files)" % ( fileName, nFiles ),
+                     method = method, transID = transID )
     except Exception as x:
       self._logException( "Failed to load replica cache from file %s" % fileName, lException = x,
                           method = method, transID = transID )
-      self.replicaCache[transID] = {}
-
-  def __filesInCache( self, transID ):
-    cache = self.replicaCache.get( transID, {} )
-    return sum( len( lfns ) for lfns in cache.itervalues() )
-
-  @gSynchro
-  def __writeCache( self, transID = None ):
-    """ Writes the cache
-    """
-    method = '__writeCache'
     try:
-      startTime = time.time()
-      transList = [transID] if transID else set( self.replicaCache )
-      filesInCache = 0
-      nCache = 0
-      for t_id in transList:
-        # Protect the copy of the cache
-        filesInCache += self.__filesInCache( t_id )
-        # write to a temporary file in order to avoid corrupted files
-        cacheFile = self.__cacheFile( t_id )
-        tmpFile = cacheFile + '.tmp'
-        f = open( tmpFile, 'w' )
-        pickle.dump( self.replicaCache.get( t_id, {} ), f )
-        f.close()
-        # Now rename the file as it shold
-        os.rename( tmpFile, cacheFile )
-        nCache += 1
-      self._logInfo( "Successfully wrote %d replica cache file(s) (%d files) in %.1f seconds" \
-                     % ( nCache, filesInCache, time.time() - startTime ),
-                     method = method, transID = transID if transID else None )
-    except Exception as x:
-      self._logException( "Could not write replica cache file %s" % cacheFile, lException = x,
-                          method = method, transID = t_id )
+      os.remove( fileName )
+    except OSError as x:
+      self._logWarn( "Failed to remove replica cache file %s" % fileName, str( x ), method = method, transID = transID )
 
   def __generatePluginObject( self, plugin, clients ):
     """ This simply instantiates the TransformationPlugin class with the relevant plugin name
@@ -685,10 +633,5 @@ class TransformationAgent( AgentModule, TransformationAgentsUtilities ):
     """ Standard plugin callback
     """
     if invalidateCache:
-      try:
-        if transID in self.replicaCache:
-          self._logInfo( "Removed cached replicas for transformation" , method = 'pluginCallBack', transID = transID )
-          self.replicaCache.pop( transID )
-          self.__writeCache( transID )
-      except:
-        pass
+      self._logInfo( "Removed cached replicas for transformation" , method = 'pluginCallBack', transID = transID )
+      self.__clearCacheForTrans( transID )
@@ -0,0 +1,67 @@
+""" Test of the replica cache of the TransformationAgent
+"""
+
+import unittest
+import datetime
+import tempfile
+import shutil
+import os
+
+from DIRAC.TransformationSystem.Agent.ReplicaCache import ReplicaCache
+
+class ReplicaCacheTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    self.tmpDir = tempfile.mkdtemp()
+    self.dbFile = os.path.join( self.tmpDir, 'ReplicaCache.db' )
+    self.cache = ReplicaCache( self.dbFile, validity = 86400 )
+
+  def tearDown( self ):
+    self.cache.close()
+    shutil.rmtree( self.tmpDir )
+
+  def test_addAndGet( self ):
+    replicas = dict( ( '/lhcb/data/file%d' % i, [ 'CERN-DST', 'PIC-DST' ] if i % 2 else [ 'RAL-DST' ] )
+                     for i in xrange( 1200 ) )
+    replicas['/lhcb/data/noReplica'] = []
+    res = self.cache.addReplicas( 1, replicas )
+    self.assertTrue( res['OK'] )
+    self.assertEqual( res['Value'], 1200 )
+
+    lfns = [ '/lhcb/data/file%d' % i for i in xrange( 0, 2000, 3 ) ] + [ '/lhcb/data/noReplica' ]
+    res = self.cache.getReplicas( 1, lfns )
+    self.assertTrue( res['OK'] )
+    self.assertEqual( res['Value'], dict( ( lfn, replicas[lfn] ) for lfn in lfns if replicas.get( lfn ) ) )
+    # Other transformations are not affected
+    self.assertEqual( self.cache.getReplicas( 2, lfns )['Value'], {} )
+
+    # The cache is persistent and replicas are replaced
+    self.cache.close()
+    self.cache = ReplicaCache( self.dbFile, validity = 86400 )
+    self.cache.addReplicas( 1, { '/lhcb/data/file0' : [ 'CNAF-DST' ] } )
+    self.assertEqual( self.cache.getReplicas( 1, [ '/lhcb/data/file0', '/lhcb/data/file1' ] )['Value'],
+                      { '/lhcb/data/file0' : [ 'CNAF-DST' ], '/lhcb/data/file1' : [ 'CERN-DST', 'PIC-DST' ] } )
+    self.assertEqual( self.cache.getNumberOfReplicas( 1 )['Value'], 1200 )
+
+  def test_remove( self ):
+    self.cache.addReplicas( 1, dict( ( '/lhcb/data/file%d' % i, [ 'CERN-DST' ] ) for i in xrange( 10 ) ) )
+    self.cache.addReplicas( 2, { '/lhcb/data/file0' : [ 'CERN-DST' ] } )
+    res = self.cache.removeReplicas( 1, [ '/lhcb/data/file0', '/lhcb/data/file1', '/lhcb/data/unknown' ] )
+    self.assertEqual( res['Value'], 2 )
+    self.assertEqual( self.cache.getNumberOfReplicas( 1 )['Value'], 8 )
+    self.assertEqual( self.cache.clearTransformation( 1 )['Value'], 8 )
+    self.assertEqual( self.cache.getNumberOfReplicas( 2 )['Value'], 1 )
+
+  def test_expiration( self ):
+    now = datetime.datetime.utcnow()
+    self.cache.addReplicas( 1, { '/lhcb/data/old' : [ 'CERN-DST' ] }, updateTime = now - datetime.timedelta( days = 2 ) )
+    self.cache.addReplicas( 1, { '/lhcb/data/new' : [ 'CERN-DST' ] }, updateTime = now - datetime.timedelta( hours = 2 ) )
+    self.assertEqual( self.cache.getReplicas( 1, [ '/lhcb/data/old', '/lhcb/data/new' ] )['Value'].keys(),
+                      [ '/lhcb/data/new' ] )
+    self.assertEqual( self.cache.purgeExpired( 2 )['Value'], 0 )
+    self.assertEqual( self.cache.purgeExpired( 1 )['Value'], 1 )
+    self.assertEqual( self.cache.getNumberOfReplicas( 1 )['Value'], 1 )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( ReplicaCacheTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
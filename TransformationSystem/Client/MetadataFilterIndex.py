@@ -0,0 +1,218 @@
+""" MetadataFilterIndex routes the files to the transformations whose metadata query
+    (the FileMask of the transformation) they match.
+
+    The queries are compiled once, with their operands converted to the type of
+    the metadata field, following the MetaQuery.applyQuery semantics. Each query
+    with an equality condition ('=' or 'in') is indexed by the metadata name and
+    the value(s) of its most selective equality condition, so that only the queries
+    whose indexed condition is satisfied, plus those that cannot be indexed, are
+    fully evaluated for a given file.
+"""
+
+__RCSID__ = "$Id$"
+
+import threading
+
+from DIRAC import gLogger
+import DIRAC.Core.Utilities.Time as Time
+
+def _getTypedValue( value, mtype ):
+  """ Same conversion as in MetaQuery.applyQuery
+  """
+  if mtype[0:3].lower() == 'int':
+    return int( value )
+  elif mtype[0:5].lower() == 'float':
+    return float( value )
+  elif mtype[0:4].lower() == 'date':
+    return Time.fromString( value )
+  return value
+
+def _getOperands( value ):
+  if isinstance( value, list ):
+    return [ ( 'in', value ) ]
+  elif isinstance( value, dict ):
+    return value.items()
+  return [ ( '=', value ) ]
+
+class MetadataFilterIndex( object ):
+
+  def __init__( self ):
+    self.log = gLogger.getSubLogger( "MetadataFilterIndex" )
+    self.__lock = threading.Lock()
+    # The state is replaced as a whole, so that the readers do not need the lock:
+    # ( { transID : compiled query }, { meta : ( type, { value : set( transIDs ) } ) }, set( not indexed transIDs ) )
+    self.__state = ( {}, {}, set() )
+
+  def setFilters( self, filters, typeDict ):
+    """ Compile all the filters, replacing the current ones
+
+    :param list filters: [ ( transID, queryDict ) ]
+    :param dict typeDict: { metadata name : metadata type }
+    """
+    compiledFilters = {}
+    index = {}
+    notIndexed = set()
+    for transID, queryDict in filters:
+      self.__addFilter( transID, queryDict, typeDict, compiledFilters, index, notIndexed )
+    with self.__lock:
+      self.__state = ( compiledFilters, index, notIndexed )
+
+  def addFilter( self, transID, queryDict, typeDict ):
+    """ Compile and add the filter of a transformation
+    """
+    with self.__lock:
+      compiledFilters, index, notIndexed = self.__copyState()
+      self.__removeFilter( transID, compiledFilters, index, notIndexed )
+      self.__addFilter( transID, queryDict, typeDict, compiledFilters, index, notIndexed )
+      self.__state = ( compiledFilters, index, notIndexed )
+
+  def removeFilter( self, transID ):
+    """ Remove the filter of a transformation
+    """
+    with self.__lock:
+      compiledFilters, index, notIndexed = self.__copyState()
+      self.__removeFilter( transID, compiledFilters, index, notIndexed )
+      self.__state = ( compiledFilters, index, notIndexed )
+
+  def getNumberOfFilters( self ):
+    return len( self.__state[0] )
+
+  def __copyState( self ):
+    compiledFilters, index, notIndexed = self.__state
+    return ( dict( compiledFilters ),
+             dict( ( meta, ( mtype, dict( ( value, set( transIDs ) ) for value, transIDs in valueDict.iteritems() ) ) )
+                   for meta, ( mtype, valueDict ) in index.iteritems() ),
+             set( notIndexed ) )
+
+  def __addFilter( self, transID, queryDict, typeDict, compiledFilters, index, notIndexed ):
+    try:
+      conditions, indexKey = self.__compile( queryDict, typeDict )
+    except ( KeyError, ValueError, TypeError ) as e:
+      self.log.error( "Invalid metadata filter, ignored", "transformation %s: %s %s" % ( transID, queryDict, repr( e ) ) )
+      return
+    compiledFilters[transID] = conditions
+    if indexKey is None:
+      notIndexed.add( transID )
+    else:
+      meta, values = indexKey
+      valueDict = index.setdefault( meta, ( typeDict[meta], {} ) )[1]
+      for value in values:
+        valueDict.setdefault( value, set() ).add( transID )
+
+  @staticmethod
+  def __removeFilter( transID, compiledFilters, index, notIndexed ):
+    if compiledFilters.pop( transID, None ) is None:
+      return
+    notIndexed.discard( transID )
+    for meta in list( index ):
+      valueDict = index[meta][1]
+      for value in list( valueDict ):
+        valueDict[value].discard( transID )
+        if not valueDict[value]:
+          del valueDict[value]
+      if not valueDict:
+        del index[meta]
+
+  @staticmethod
+  def __compile( queryDict, typeDict ):
+    """ Compile a metadata query
+
+    :return: ( [ ( meta, mtype, presence, [ ( operation, typedOperand ) ] ) ], indexKey ), where presence
+             is 'missing', 'any' or None, and indexKey is ( meta, values ) for the most selective
+             equality condition or None
+    """
+    conditions = []
+    indexKey = None
+    for meta, value in queryDict.iteritems():
+      presence = str( value ).lower()
+      if presence in ( 'missing', 'any' ):
+        conditions.append( ( meta, None, presence, [] ) )
+        continue
+      mtype = typeDict[meta]
+      operations = []
+      for operation, operand in _getOperands( value ):
+        if isinstance( operand, list ):
+          typedOperand = set( _getTypedValue( x, mtype ) for x in operand )
+        else:
+          typedOperand = _getTypedValue( operand, mtype )
+        if operation in ( '>', '<', '>=', '<=' ):
+          if isinstance( typedOperand, set ):
+            raise ValueError( "list of values for comparison operation" )
+        elif operation in ( 'in', '=' ):
+          values = typedOperand if isinstance( typedOperand, set ) else set( [ typedOperand ] )
+          if indexKey is None or len( values ) < len( indexKey[1] ):
+            indexKey = ( meta, values )
+        elif operation not in ( 'nin', '!=' ):
+          # Ignored by MetaQuery.applyQuery
+          continue
+        operations.append( ( operation, typedOperand ) )
+      conditions.append( ( meta, mtype, None, operations ) )
+    return conditions, indexKey
+
+  @staticmethod
+  def __apply( conditions, metadataDict, typedValues ):
+    """ Evaluate a compiled query, the typed user values being cached in typedValues
+    """
+    for meta, mtype, presence, operations in conditions:
+      userValue = metadataDict.get( meta )
+      if userValue is None:
+        if presence == 'missing':
+          continue
+        return False
+      elif presence == 'missing':
+        return False
+      elif presence == 'any':
+        continue
+      key = ( meta, mtype )
+      if key not in typedValues:
+        try:
+          typedValues[key] = _getTypedValue( userValue, mtype )
+        except ValueError:
+          typedValues[key] = None
+      userValue = typedValues[key]
+      if userValue is None:
+        return False
+      try:
+        for operation, operand in operations:
+          if operation == '>':
+            if operand >= userValue:
+              return False
+          elif operation == '<':
+            if operand <= userValue:
+              return False
+          elif operation == '>=':
+            if operand > userValue:
+              return False
+          elif operation == '<=':
+            if operand < userValue:
+              return False
+          elif operation in ( 'in', '=' ):
+            if ( userValue not in operand ) if isinstance( operand, set ) else ( userValue != operand ):
+              return False
+          elif ( userValue in operand ) if isinstance( operand, set ) else ( userValue == operand ):
+            return False
+      except TypeError:
+        # Not hashable user value
+        return False
+    return True
+
+  def getTransformations( self, metadataDict ):
+    """ Get the transformations whose filter is passed by the metadata of a file
+
+    :param dict metadataDict: { metadata name : value }
+    :return: sorted list of transformation IDs
+    """
+    compiledFilters, index, notIndexed = self.__state
+    candidates = set( notIndexed )
+    for meta, ( mtype, valueDict ) in index.iteritems():
+      userValue = metadataDict.get( meta )
+      if userValue is None:
+        continue
+      try:
+        candidates.update( valueDict.get( _getTypedValue( userValue, mtype ), () ) )
+      except ( ValueError, TypeError ):
+        # Not a valid value for the type, or not hashable: no equality can be satisfied
+        pass
+    typedValues = {}
+    return sorted( transID for transID in candidates
+                   if self.__apply( compiledFilters[transID], metadataDict, typedValues ) )
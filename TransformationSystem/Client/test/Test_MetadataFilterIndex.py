@@ -0,0 +1,73 @@
+""" unit tests for the compiled transformation metadata filters
+"""
+
+# pylint: disable=missing-docstring,invalid-name
+
+import unittest
+import random
+
+from DIRAC.DataManagementSystem.Client.MetaQuery import MetaQuery
+from DIRAC.TransformationSystem.Client.MetadataFilterIndex import MetadataFilterIndex
+
+TYPE_DICT = { 'DataType' : 'VARCHAR(128)',
+              'Run' : 'INT',
+              'Energy' : 'FLOAT',
+              'Polarity' : 'VARCHAR(16)' }
+
+class MetadataFilterIndexTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    self.filterIndex = MetadataFilterIndex()
+
+  def test_routing( self ):
+    filters = [ ( 1, { 'DataType' : 'RAW' } ),
+                ( 2, { 'DataType' : [ 'RAW', 'DST' ], 'Run' : { '>=' : 100, '<' : 200 } } ),
+                ( 3, { 'Run' : { '>' : 150 } } ),
+                ( 4, { 'DataType' : 'DST', 'Polarity' : 'Missing' } ),
+                ( 5, { 'Polarity' : 'Any', 'Run' : { '!=' : 120 } } ),
+                ( 6, { 'Energy' : '3.5', 'DataType' : { 'nin' : [ 'RAW' ] } } ) ]
+    self.filterIndex.setFilters( filters, TYPE_DICT )
+    self.assertEqual( self.filterIndex.getNumberOfFilters(), 6 )
+    self.assertEqual( self.filterIndex.getTransformations( { 'DataType' : 'RAW', 'Run' : 120 } ), [ 1, 2 ] )
+    self.assertEqual( self.filterIndex.getTransformations( { 'DataType' : 'DST', 'Run' : '160' } ), [ 2, 3, 4 ] )
+    self.assertEqual( self.filterIndex.getTransformations( { 'DataType' : 'DST', 'Polarity' : 'Up', 'Run' : 300 } ),
+                      [ 3, 5 ] )
+    self.assertEqual( self.filterIndex.getTransformations( { 'DataType' : 'MDST', 'Energy' : 3.5 } ), [ 6 ] )
+    self.assertEqual( self.filterIndex.getTransformations( { 'Run' : 'NotAnInt' } ), [] )
+
+    self.filterIndex.removeFilter( 1 )
+    self.filterIndex.addFilter( 7, { 'Run' : [ 120, 121 ] }, TYPE_DICT )
+    self.assertEqual( self.filterIndex.getTransformations( { 'DataType' : 'RAW', 'Run' : 120 } ), [ 2, 7 ] )
+    # Invalid filters are ignored
+    self.filterIndex.addFilter( 8, { 'Unknown' : 1 }, TYPE_DICT )
+    self.filterIndex.addFilter( 9, { 'Run' : { '>' : [ 1, 2 ] } }, TYPE_DICT )
+    self.assertEqual( self.filterIndex.getNumberOfFilters(), 6 )
+
+  def test_sameAsMetaQuery( self ):
+    random.seed( 12345 )
+    dataTypes = [ 'RAW', 'DST', 'MDST', 'SIM' ]
+    filters = []
+    for transID in xrange( 200 ):
+      query = {}
+      if random.random() < 0.8:
+        query['DataType'] = random.choice( [ random.choice( dataTypes ), random.sample( dataTypes, 2 ),
+                                             { 'nin' : random.sample( dataTypes, 2 ) } ] )
+      if random.random() < 0.5:
+        low = random.randint( 0, 50 )
+        query['Run'] = random.choice( [ low, { '>=' : low, '<=' : low + 20 }, { '>' : low }, [ low, low + 1 ] ] )
+      if random.random() < 0.3:
+        query['Polarity'] = random.choice( [ 'Up', 'Down', 'Any', 'Missing' ] )
+      filters.append( ( transID, query ) )
+    self.filterIndex.setFilters( filters, TYPE_DICT )
+
+    for _i in xrange( 500 ):
+      metadataDict = { 'DataType' : random.choice( dataTypes ), 'Run' : random.randint( 0, 80 ) }
+      if random.random() < 0.5:
+        metadataDict['Polarity'] = random.choice( [ 'Up', 'Down' ] )
+      expected = [ transID for transID, query in filters
+                   if MetaQuery( query, TYPE_DICT ).applyQuery( metadataDict )['Value'] ]
+      self.assertEqual( self.filterIndex.getTransformations( metadataDict ), expected )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( MetadataFilterIndexTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
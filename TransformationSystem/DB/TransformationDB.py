@@ -19,11 +19,15 @@ from DIRAC.Core.Utilities.List                            import stringListToStr
 from DIRAC.Core.Utilities.Shifter                         import setupShifterProxyInEnv
 from DIRAC.ConfigurationSystem.Client.Helpers.Operations  import Operations
 from DIRAC.Core.Utilities.Subprocess                      import pythonCall
-from DIRAC.DataManagementSystem.Client.MetaQuery import MetaQuery
+from DIRAC.TransformationSystem.Client.MetadataFilterIndex import MetadataFilterIndex
 
 __RCSID__ = "$Id$"
 
 MAX_ERROR_COUNT = 10
+# Time in seconds the types of the catalog metadata fields are cached for the filters
+METADATA_FIELDS_CACHE_TIME = 300
+# Maximum number of files added to the DataFiles and TransformationFiles tables in a single transaction
+MAX_FILES_PER_TRANSACTION = 1000
 
 #############################################################################
 
@@ -45,7 +49,13 @@ class TransformationDB( DB ):
       DB.__init__( self, dbname, dbconfig )
 
     self.lock = threading.Lock()
+    self.filterLock = threading.Lock()
     self.filters = []
+    # Compiled filters, built when needed with the types of the metadata fields
+    self.filterIndex = MetadataFilterIndex()
+    self.__filtersCompiled = False
+    self.__metaTypes = None
+    self.__metaTypesTime = 0
     res = self.__updateFilters()
     if not res['OK']:
       gLogger.fatal( "Failed to create filters" )
@@ -176,7 +186,16 @@ class TransformationDB( DB ):
     self.lock.release()
     # If the transformation has an input data specification
     if fileMask:
-      self.filters.append( ( transID, json.loads( fileMask ) ) )
+      queryDict = json.loads( fileMask )
+      with self.filterLock:
+        self.filters.append( ( transID, queryDict ) )
+        if self.__filtersCompiled:
+          if set( queryDict ) - set( self.__metaTypes ):
+            # The metadata field may be newer than the cached types: get them again and recompile
+            self.__metaTypesTime = 0
+            self.__filtersCompiled = False
+          else:
+            self.filterIndex.addFilter( transID, queryDict, self.__metaTypes )
 
     if inheritedFrom:
       res = self._getTransformationID( inheritedFrom, connection = connection )
@@ -383,9 +402,40 @@ class TransformationDB( DB ):
     for transID, mask in res['Value']:
       if mask:
         resultList.append( ( transID, json.loads( mask ) ) )
-    self.filters = resultList
+    with self.filterLock:
+      self.filters = resultList
+      self.__filtersCompiled = False
     return S_OK( resultList )
 
+  def __compileFilters( self ):
+    """ Compile the filters if they changed or if the types of the metadata fields changed.
+        The types are obtained from the catalog at most every METADATA_FIELDS_CACHE_TIME seconds.
+    """
+    with self.filterLock:
+      now = time.time()
+      if self.__metaTypes is None or now > self.__metaTypesTime + METADATA_FIELDS_CACHE_TIME:
+        self.__metaTypesTime = now
+        res = FileCatalog().getMetadataFields()
+        if not res['OK']:
+          gLogger.error( "Error in getMetadataFields: %s" % res['Message'] )
+        elif not res['Value']:
+          gLogger.error( "Error: no metadata fields defined" )
+        else:
+          typeDict = dict( res['Value']['FileMetaFields'] )
+          typeDict.update( res['Value']['DirectoryMetaFields'] )
+          if typeDict != self.__metaTypes:
+            self.__metaTypes = typeDict
+            self.__filtersCompiled = False
+      if self.__metaTypes is None:
+        return S_ERROR( "Metadata fields not available" )
+      if not self.__filtersCompiled:
+        startTime = time.time()
+        self.filterIndex.setFilters( self.filters, self.__metaTypes )
+        self.__filtersCompiled = True
+        gLogger.info( "Compiled %d transformation filters in %.3f seconds" % ( len( self.filters ),
+                                                                               time.time() - startTime ) )
+    return S_OK()
+
   def __filterFile( self, lfn, filters = None ):
     """Pass the input file through a supplied filter or those currently active """
     result = []
@@ -654,23 +704,23 @@ class TransformationDB( DB ):
     return S_OK( countDict )
 
   def __addFilesToTransformation( self, transID, fileIDs, connection = False ):
-    req = "SELECT FileID from TransformationFiles"
-    req = req + " WHERE TransformationID = %d AND FileID IN (%s);" % ( transID, intListToString( fileIDs ) )
-    res = self._query( req, connection )
-    if not res['OK']:
-      return res
-    for tupleIn in res['Value']:
-      fileIDs.remove( tupleIn[0] )
-    if not fileIDs:
-      return S_OK( [] )
-    req = "INSERT INTO TransformationFiles (TransformationID,FileID,LastUpdate,InsertedTime) VALUES"
-    for fileID in fileIDs:
-      req = "%s (%d,%d,UTC_TIMESTAMP(),UTC_TIMESTAMP())," % ( req, transID, fileID )
-    req = req.rstrip( ',' )
-    res = self._update( req, connection )
-    if not res['OK']:
-      return res
-    return S_OK( fileIDs )
+    addedFileIDs = []
+    for fileIDChunk in breakListIntoChunks( fileIDs, MAX_FILES_PER_TRANSACTION ):
+      req = "SELECT FileID from TransformationFiles"
+      req = req + " WHERE TransformationID = %d AND FileID IN (%s);" % ( transID, intListToString( fileIDChunk ) )
+      res = self._query( req, connection )
+      if not res['OK']:
+        return res
+      newFileIDs = set( fileIDChunk ) - set( tupleIn[0] for tupleIn in res['Value'] )
+      if not newFileIDs:
+        continue
+      req = "INSERT INTO TransformationFiles (TransformationID,FileID,LastUpdate,InsertedTime) VALUES %s" % \
+            ','.join( "(%d,%d,UTC_TIMESTAMP(),UTC_TIMESTAMP())" % ( transID, fileID ) for fileID in newFileIDs )
+      res = self._update( req, connection )
+      if not res['OK']:
+        return res
+      addedFileIDs.extend( newFileIDs )
+    return S_OK( addedFileIDs )
 
   def __insertExistingTransformationFiles( self, transID, fileTuplesList, connection = False ):
     """ Inserting already transformation files in TransformationFiles table (e.g. for deriving transformations)
@@ -1199,13 +1249,17 @@ class TransformationDB( DB ):
     if not res['OK']:
       return res
     _fileIDs, lfnFileIDs = res['Value']
-    for lfn in lfns:
-      if lfn not in lfnFileIDs:
-        req = "INSERT INTO DataFiles (LFN,Status) VALUES ('%s','New');" % lfn
-        res = self._update( req, connection )
-        if not res['OK']:
-          return res
-        lfnFileIDs[lfn] = res['lastRowId']
+    missing = [ lfn for lfn in set( lfns ) if lfn not in lfnFileIDs ]
+    for lfnChunk in breakListIntoChunks( missing, MAX_FILES_PER_TRANSACTION ):
+      req = "INSERT INTO DataFiles (LFN,Status) VALUES %s;" % ','.join( "('%s','New')" % lfn for lfn in lfnChunk )
+      res = self._update( req, connection )
+      if not res['OK']:
+        return res
+      # The IDs of a multi-row insert are not necessarily consecutive
+      res = self.__getFileIDsForLfns( lfnChunk, connection = connection )
+      if not res['OK']:
+        return res
+      lfnFileIDs.update( res['Value'][1] )
     return S_OK( lfnFileIDs )
 
   def __setDataFileStatus( self, fileIDs, status, connection = False ):
@@ -1420,49 +1474,84 @@ class TransformationDB( DB ):
     """ Add the supplied lfn to the Transformations and to the DataFiles table if it passes the filter
     """
     gLogger.info( "TransformationDB.addFile: Attempting to add %s files." % len( fileDicts ) )
-    successful = {}
     failed = {}
-    # Determine which files pass the filters and are to be added to transformations
-    transFiles = {}
-    filesToAdd = []
+    lfnMetadataDict = {}
     catalog = FileCatalog()
 
     for lfn in fileDicts:
-      gLogger.info( "addFile: Attempting to add file %s" % lfn )
+      gLogger.verbose( "addFile: Attempting to add file %s" % lfn )
       res = catalog.getFileUserMetadata( lfn )
       if not res['OK']:
         gLogger.error( "Failed to getFileUserMetadata for file", "%s: %s" % ( lfn, res['Message'] ) )
         failed[lfn] = res['Message']
-        continue
       else:
-        metadatadict = res['Value']
-      gLogger.info( 'Filter file with metadata', metadatadict )
-      transIDs = self._filterFileByMetadata( metadatadict )
-      gLogger.info('Transformations passing the filter: %s' % transIDs)
-      if not ( transIDs or force ):  # not clear how force should be used for
-        successful[lfn] = False  # True -> False bug fix: otherwise it is set to True even if transIDs is empty.
-      else:
-        filesToAdd.append( lfn )
-        for trans in transIDs:
-          if trans not in transFiles:
-            transFiles[trans] = []
-          transFiles[trans].append( lfn )
-
-      # Add the files to the transformations
-      gLogger.info( 'Files to add to transformations:', filesToAdd )
-      if filesToAdd:
-        for transID, lfns in transFiles.iteritems():
-          res = self.addFilesToTransformation( transID, lfns )
-          if not res['OK']:
-            gLogger.error( "Failed to add files to transformation", "%s %s" % ( transID, res['Message'] ) )
-            return res
-          else:
-            for lfn in lfns:
-              successful[lfn] = True
+        lfnMetadataDict[lfn] = res['Value']
 
-    res = S_OK( {'Successful':successful, 'Failed':failed } )
+    res = self.addFilesWithMetadata( lfnMetadataDict, force = force, connection = connection )
+    if not res['OK']:
+      return res
+    res['Value']['Failed'].update( failed )
     return res
 
+  def addFilesWithMetadata( self, lfnMetadataDict, force = False, connection = False ):
+    """ Add files to the transformations whose filters are passed by their metadata, and to
+        the DataFiles table. The inserts are done in transactions of MAX_FILES_PER_TRANSACTION files.
+
+        :param dict lfnMetadataDict: { lfn : complete metadata dictionary of the file }
+        :param bool force: add to the DataFiles table also the files passing no filter
+        :return: S_OK( { 'Successful' : { lfn : True/False (no filter passed) }, 'Failed' : { lfn : reason } } )
+    """
+    successful = {}
+    lfnTransIDs = {}
+    for lfn, metadataDict in lfnMetadataDict.iteritems():
+      transIDs = self._filterFileByMetadata( metadataDict )
+      if transIDs or force:
+        lfnTransIDs[lfn] = transIDs
+      else:
+        successful[lfn] = False
+    gLogger.info( "TransformationDB.addFilesWithMetadata: %d files out of %d passing the filters" %
+                  ( len( lfnTransIDs ), len( lfnMetadataDict ) ) )
+    res = self.__addFilesToTransformations( lfnTransIDs, connection = connection )
+    if not res['OK']:
+      return res
+    successful.update( res['Value']['Successful'] )
+    return S_OK( { 'Successful' : successful, 'Failed' : res['Value']['Failed'] } )
+
+  def __addFilesToTransformations( self, lfnTransIDs, connection = False ):
+    """ Add files to the DataFiles table and to a list of transformations, in transactions
+        of MAX_FILES_PER_TRANSACTION files
+
+        :param dict lfnTransIDs: { lfn : [ transIDs ] }
+        :return: S_OK( { 'Successful' : { lfn : True }, 'Failed' : { lfn : reason } } )
+    """
+    successful = {}
+    failed = {}
+    connection = self.__getConnection( connection )
+    for lfnChunk in breakListIntoChunks( lfnTransIDs.keys(), MAX_FILES_PER_TRANSACTION ):
+      res = self._update( "START TRANSACTION", connection )
+      if not res['OK']:
+        return res
+      res = self.__addDataFiles( lfnChunk, connection = connection )
+      if res['OK']:
+        lfnFileIDs = res['Value']
+        transFileIDs = {}
+        for lfn in lfnChunk:
+          for transID in lfnTransIDs[lfn]:
+            transFileIDs.setdefault( transID, [] ).append( lfnFileIDs[lfn] )
+        for transID, fileIDs in transFileIDs.iteritems():
+          res = self.__addFilesToTransformation( transID, fileIDs, connection = connection )
+          if not res['OK']:
+            break
+      if res['OK']:
+        res = self._update( "COMMIT", connection )
+      if not res['OK']:
+        gLogger.error( "Failed to add files to transformations", res['Message'] )
+        self._update( "ROLLBACK", connection )
+        failed.update( dict.fromkeys( lfnChunk, res['Message'] ) )
+      else:
+        successful.update( dict.fromkeys( lfnChunk, True ) )
+    return S_OK( { 'Successful' : successful, 'Failed' : failed } )
+
   def removeFile( self, lfns, connection = False ):
     """ Remove file specified by lfn from the ProcessingDB
     """
@@ -1530,8 +1619,6 @@ class TransformationDB( DB ):
         For a directory, add the files contained in the directory to the Transformations if the the updated metadata dictionary passes the filter.
     """
     gLogger.info( "setMetadata: Attempting to set metadata %s to: %s" % (usermetadatadict, path) )
-    transFiles = {}
-    filesToAdd = []
 
     catalog = FileCatalog()
     res = catalog.isFile( path )
@@ -1551,6 +1638,8 @@ class TransformationDB( DB ):
       res = catalog.getFileUserMetadata( path )
     elif isDirectory:
       res = catalog.getDirectoryUserMetadata( path )
+    else:
+      return S_ERROR( "No such file or directory: %s" % path )
 
     if not res['OK']:
       gLogger.error( "Failed to get User Metadata %s: %s" % ( path, res['Message'] ) )
@@ -1558,61 +1647,102 @@ class TransformationDB( DB ):
     else:
       metadatadict = res['Value']
     metadatadict.update( usermetadatadict )
-    gLogger.info( 'Filter file with metadata:', metadatadict )
-    transIDs = self._filterFileByMetadata( metadatadict )
-    gLogger.info('Transformations passing the filter: %s' % transIDs)
-    if not transIDs:
-      return S_OK()
-    elif isFile:
-      filesToAdd.append( path )
-    elif isDirectory:
-      res = catalog.findFilesByMetadata( metadatadict, path )
-      if not res['OK']:
-        gLogger.error( "Failed to findFilesByMetadata %s: %s" % ( path, res['Message'] ) )
-        return res
-      filesToAdd.extend( res['Value'] )
-    for trans in transIDs:
-      transFiles[trans].extend( filesToAdd )
-
-    # Add the files to the transformations
-    gLogger.info( 'Files to add to transformations:', filesToAdd )
-    if filesToAdd:
-      for transID, lfns in transFiles.iteritems():
-        res = self.addFilesToTransformation( transID, lfns )
-        if not res['OK']:
-          gLogger.error( "Failed to add files to transformation", "%s %s" % ( transID, res['Message'] ) )
-          return res
-
+    res = self.__routeMetadata( catalog, path, metadatadict, isFile )
+    if not res['OK']:
+      return res
+    res = self.__addFilesToTransformations( res['Value'] )
+    if not res['OK']:
+      return res
+    if res['Value']['Failed']:
+      return S_ERROR( "Failed to add files to transformations: %s" % res['Value']['Failed'].values()[0] )
     return S_OK()
 
-  def _filterFileByMetadata( self, metadatadict ):
-    """Pass the input metadatadict through those currently active"""
-    transIDs = []
-    queries = self.filters
-    catalog = FileCatalog()
-    gLogger.info( 'Filter file by queries', queries )
-    res = catalog.getMetadataFields()
+  def setMetadataBulk( self, pathMetadataDict ):
+    """ Bulk version of setMetadata: the given metadata are merged with the ones already attached to
+        each path, so that the files are sent to the same transformations as with setMetadata. Only the
+        insertion of the files into the transformations is grouped.
 
+        :param dict pathMetadataDict: { path : metadata dictionary }
+        :return: S_OK( { 'Successful' : { path : True }, 'Failed' : { path : reason } } )
+    """
+    gLogger.info( "setMetadataBulk: Attempting to set metadata to %d paths" % len( pathMetadataDict ) )
+    failed = {}
+    catalog = FileCatalog()
+    res = catalog.isFile( pathMetadataDict.keys() )
     if not res['OK']:
-      gLogger.error( "Error in getMetadataFields: %s" % res['Message'] )
+      gLogger.error( "Failed isFile", res['Message'] )
       return res
-    if not res['Value']:
-      gLogger.error( "Error: no metadata fields defined" )
-      return res
-    typeDict = res['Value']['FileMetaFields']
-    typeDict.update( res['Value']['DirectoryMetaFields'] )
-
-    for transID, query in queries:
-      mq = MetaQuery( query, typeDict )
-      gLogger.info( "Apply query %s to metadata %s" % ( mq.getMetaQuery(), metadatadict ) )
-      res = mq.applyQuery(metadatadict)
+    failed.update( res['Value']['Failed'] )
+    files = [ path for path, isFile in res['Value']['Successful'].iteritems() if isFile ]
+    directories = set()
+    others = [ path for path, isFile in res['Value']['Successful'].iteritems() if not isFile ]
+    if others:
+      res = catalog.isDirectory( others )
       if not res['OK']:
-        gLogger.error( "Error in applying query: %s" % res['Message'] )
+        gLogger.error( "Failed isDirectory", res['Message'] )
         return res
-      elif res['Value']:
-        gLogger.info( "Apply query result is True" )
-        transIDs.append( transID )
+      failed.update( res['Value']['Failed'] )
+      for path, isDirectory in res['Value']['Successful'].iteritems():
+        if isDirectory:
+          directories.add( path )
+        else:
+          failed[path] = "No such file or directory"
+
+    lfnTransIDs = {}
+    pathLfns = {}
+    for path in files + list( directories ):
+      if path in directories:
+        res = catalog.getDirectoryUserMetadata( path )
       else:
-        gLogger.info( "Apply query result is False" )
+        res = catalog.getFileUserMetadata( path )
+      if not res['OK']:
+        gLogger.error( "Failed to get User Metadata %s: %s" % ( path, res['Message'] ) )
+        failed[path] = res['Message']
+        continue
+      metadatadict = dict( res['Value'] )
+      metadatadict.update( pathMetadataDict[path] )
+      res = self.__routeMetadata( catalog, path, metadatadict, path not in directories )
+      if not res['OK']:
+        failed[path] = res['Message']
+        continue
+      pathLfns[path] = res['Value'].keys()
+      for lfn, transIDs in res['Value'].iteritems():
+        lfnTransIDs.setdefault( lfn, set() ).update( transIDs )
 
-    return transIDs
+    res = self.__addFilesToTransformations( lfnTransIDs )
+    if not res['OK']:
+      return res
+    successful = {}
+    for path, lfns in pathLfns.iteritems():
+      failedLfns = [ lfn for lfn in lfns if lfn in res['Value']['Failed'] ]
+      if failedLfns:
+        failed[path] = res['Value']['Failed'][failedLfns[0]]
+      else:
+        successful[path] = True
+    return S_OK( { 'Successful' : successful, 'Failed' : failed } )
+
+  def __routeMetadata( self, catalog, path, metadatadict, isFile ):
+    """ Find the transformations whose filter is passed by the metadata of a path and the files concerned
+
+        :return: S_OK( { lfn : [ transIDs ] } ), the files of a directory being looked up in the catalog
+    """
+    gLogger.verbose( 'Filter file with metadata:', metadatadict )
+    transIDs = self._filterFileByMetadata( metadatadict )
+    gLogger.verbose( 'Transformations passing the filter: %s' % transIDs )
+    if not transIDs:
+      return S_OK( {} )
+    if isFile:
+      return S_OK( { path : transIDs } )
+    res = catalog.findFilesByMetadata( metadatadict, path )
+    if not res['OK']:
+      gLogger.error( "Failed to findFilesByMetadata %s: %s" % ( path, res['Message'] ) )
+      return res
+    return S_OK( dict.fromkeys( res['Value'], transIDs ) )
+
+  def _filterFileByMetadata( self, metadatadict ):
+    """Pass the input metadatadict through those currently active"""
+    res = self.__compileFilters()
+    if not res['OK']:
+      gLogger.error( "Failed to compile the transformation filters", res['Message'] )
+      return []
+    return self.filterIndex.getTransformations( metadatadict )
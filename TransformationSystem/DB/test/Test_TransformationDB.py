@@ -0,0 +1,173 @@
+""" unit tests for the registration of files with metadata in the TransformationDB,
+    run against an in-memory sqlite database and a mocked catalog
+"""
+
+# pylint: disable=missing-docstring,invalid-name,protected-access
+
+import unittest
+import json
+import sqlite3
+from mock import MagicMock, patch
+
+from DIRAC import S_OK, S_ERROR
+from DIRAC.TransformationSystem.DB.TransformationDB import TransformationDB
+
+META_FIELDS = { 'FileMetaFields' : { 'Run' : 'INT' },
+                'DirectoryMetaFields' : { 'DataType' : 'VARCHAR(128)' } }
+
+FILTERS = { 1 : { 'DataType' : 'RAW' },
+            2 : { 'DataType' : [ 'RAW', 'DST' ], 'Run' : { '>=' : 100 } },
+            3 : { 'DataType' : 'DST' } }
+
+class MockTransformationDB( TransformationDB ):
+  """ TransformationDB on top of an sqlite database with only the tables used for the files registration
+  """
+
+  def __init__( self ):
+    self.connection = sqlite3.connect( ':memory:' )
+    self.connection.executescript( """
+      CREATE TABLE Transformations( TransformationID INTEGER PRIMARY KEY, FileMask TEXT );
+      CREATE TABLE DataFiles( FileID INTEGER PRIMARY KEY AUTOINCREMENT, LFN TEXT UNIQUE, Status TEXT );
+      CREATE TABLE TransformationFiles( TransformationID INTEGER, FileID INTEGER, Status TEXT DEFAULT 'Unused',
+                                        LastUpdate TEXT, InsertedTime TEXT,
+                                        PRIMARY KEY( TransformationID, FileID ) );
+    """ )
+    for transID, fileMask in FILTERS.items():
+      self.connection.execute( "INSERT INTO Transformations VALUES ( ?, ? )", ( transID, json.dumps( fileMask ) ) )
+    TransformationDB.__init__( self, dbIn = True )
+
+  def _getConnection( self ):
+    return S_OK( self.connection )
+
+  def _query( self, req, connection = False ):
+    if 'INFORMATION_SCHEMA' in req:
+      return S_OK( ( ( 'InnoDB', ), ) )
+    return S_OK( tuple( self.connection.execute( req ).fetchall() ) )
+
+  def _update( self, req, connection = False ):
+    if req in ( "START TRANSACTION", "COMMIT", "ROLLBACK" ):
+      return S_OK( 0 )
+    req = req.replace( 'UTC_TIMESTAMP()', "'now'" )
+    return S_OK( self.connection.execute( req ).rowcount )
+
+  def getDataFiles( self ):
+    return sorted( row[0] for row in self.connection.execute( "SELECT LFN FROM DataFiles" ) )
+
+  def getTransformationFiles( self ):
+    rows = self.connection.execute( "SELECT t.TransformationID, d.LFN FROM TransformationFiles t, DataFiles d "
+                                    "WHERE t.FileID = d.FileID" )
+    transFiles = {}
+    for transID, lfn in rows:
+      transFiles.setdefault( transID, [] ).append( lfn )
+    return dict( ( transID, sorted( lfns ) ) for transID, lfns in transFiles.items() )
+
+class TransformationDBTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    self.catalog = MagicMock()
+    self.catalog.getMetadataFields.return_value = S_OK( META_FIELDS )
+    self.catalogPatch = patch( 'DIRAC.TransformationSystem.DB.TransformationDB.FileCatalog',
+                               return_value = self.catalog )
+    self.catalogPatch.start()
+    self.db = MockTransformationDB()
+
+  def tearDown( self ):
+    self.catalogPatch.stop()
+
+  def test_filterMatching( self ):
+    res = self.db.addFilesWithMetadata( { '/vo/raw/f1' : { 'DataType' : 'RAW', 'Run' : 10 },
+                                          '/vo/raw/f2' : { 'DataType' : 'RAW', 'Run' : 200 },
+                                          '/vo/sim/f3' : { 'DataType' : 'SIM', 'Run' : 200 } } )
+    self.assert_( res['OK'] )
+    self.assertEqual( res['Value']['Successful'], { '/vo/raw/f1' : True, '/vo/raw/f2' : True, '/vo/sim/f3' : False } )
+    self.assertEqual( res['Value']['Failed'], {} )
+    # Files passing no filter are not added
+    self.assertEqual( self.db.getDataFiles(), [ '/vo/raw/f1', '/vo/raw/f2' ] )
+    self.assertEqual( self.db.getTransformationFiles(), { 1 : [ '/vo/raw/f1', '/vo/raw/f2' ], 2 : [ '/vo/raw/f2' ] } )
+
+  def test_force( self ):
+    res = self.db.addFilesWithMetadata( { '/vo/sim/f3' : { 'DataType' : 'SIM', 'Run' : 200 } }, force = True )
+    self.assert_( res['OK'] )
+    self.assertEqual( res['Value']['Successful'], { '/vo/sim/f3' : True } )
+    # With force the file goes to the DataFiles table even if no transformation takes it
+    self.assertEqual( self.db.getDataFiles(), [ '/vo/sim/f3' ] )
+    self.assertEqual( self.db.getTransformationFiles(), {} )
+
+  def test_fanOut( self ):
+    lfnMetadata = dict( ( '/vo/dst/f%d' % i, { 'DataType' : 'DST', 'Run' : 100 + i } ) for i in xrange( 5 ) )
+    res = self.db.addFilesWithMetadata( lfnMetadata )
+    self.assert_( res['OK'] )
+    self.assertEqual( sorted( res['Value']['Successful'] ), sorted( lfnMetadata ) )
+    transFiles = self.db.getTransformationFiles()
+    self.assertEqual( sorted( transFiles ), [ 2, 3 ] )
+    self.assertEqual( transFiles[2], sorted( lfnMetadata ) )
+    self.assertEqual( transFiles[3], sorted( lfnMetadata ) )
+    # Adding the files again does not duplicate them
+    res = self.db.addFilesWithMetadata( lfnMetadata )
+    self.assert_( res['OK'] )
+    self.assertEqual( self.db.getTransformationFiles(), transFiles )
+    self.assertEqual( len( self.db.getDataFiles() ), 5 )
+
+  def test_newMetadataField( self ):
+    self.assertEqual( self.db._filterFileByMetadata( { 'DataType' : 'RAW', 'Run' : 10 } ), [ 1 ] )
+    metaFields = { 'FileMetaFields' : { 'Run' : 'INT', 'Polarity' : 'VARCHAR(16)' },
+                   'DirectoryMetaFields' : { 'DataType' : 'VARCHAR(128)' } }
+    self.catalog.getMetadataFields.return_value = S_OK( metaFields )
+    self.db._getTransformationID = MagicMock( return_value = S_ERROR( "Transformation does not exist" ) )
+    self.db._escapeString = lambda body: S_OK( "'%s'" % body )
+    for transID, fileMask in ( ( 4, { 'Polarity' : 'Up' } ), ( 5, { 'Run' : 10 } ) ):
+      with patch.object( self.db, '_update', return_value = { 'OK' : True, 'Value' : 1, 'lastRowId' : transID } ):
+        res = self.db.addTransformation( 'Trans%d' % transID, '', '', 'aDN', 'aGroup', 'MCSimulation', 'Standard',
+                                         'Manual', json.dumps( fileMask ), addFiles = False )
+      self.assert_( res['OK'] )
+    # The types are obtained again for the field unknown when the transformation was added
+    self.assertEqual( self.db._filterFileByMetadata( { 'DataType' : 'SIM', 'Polarity' : 'Up', 'Run' : 10 } ),
+                      [ 4, 5 ] )
+    self.assertEqual( self.catalog.getMetadataFields.call_count, 2 )
+
+  def test_addFile( self ):
+    def getFileUserMetadata( lfn ):
+      if lfn == '/vo/raw/missing':
+        return S_ERROR( 'No such file' )
+      return S_OK( { 'DataType' : 'RAW', 'Run' : 150 } )
+    self.catalog.getFileUserMetadata.side_effect = getFileUserMetadata
+    res = self.db.addFile( { '/vo/raw/f1' : {}, '/vo/raw/missing' : {} } )
+    self.assert_( res['OK'] )
+    self.assertEqual( res['Value']['Successful'], { '/vo/raw/f1' : True } )
+    self.assertEqual( res['Value']['Failed'], { '/vo/raw/missing' : 'No such file' } )
+    self.assertEqual( self.db.getTransformationFiles(), { 1 : [ '/vo/raw/f1' ], 2 : [ '/vo/raw/f1' ] } )
+
+  def test_setMetadataBulk( self ):
+    files = [ '/vo/raw/f1', '/vo/raw/f2', '/vo/dst/f3' ]
+    self.catalog.isFile.return_value = S_OK( { 'Successful' : dict( [ ( lfn, True ) for lfn in files ] +
+                                                                    [ ( '/vo/dst/dir', False ),
+                                                                      ( '/vo/none', False ) ] ),
+                                               'Failed' : {} } )
+    self.catalog.isDirectory.return_value = S_OK( { 'Successful' : { '/vo/dst/dir' : True, '/vo/none' : False },
+                                                    'Failed' : {} } )
+    self.catalog.getDirectoryUserMetadata.return_value = S_OK( { 'DataType' : 'DST' } )
+    # Metadata already stored on the files, merged with the ones of their directory
+    fileMetadata = { '/vo/raw/f1' : { 'DataType' : 'RAW', 'Run' : 150 },
+                     '/vo/raw/f2' : { 'DataType' : 'RAW' },
+                     '/vo/dst/f3' : { 'DataType' : 'DST' } }
+    self.catalog.getFileUserMetadata.side_effect = lambda path: S_OK( dict( fileMetadata[path] ) )
+    self.catalog.findFilesByMetadata.return_value = S_OK( [ '/vo/dst/dir/f4' ] )
+
+    res = self.db.setMetadataBulk( { '/vo/raw/f1' : { 'Owner' : 'me' },
+                                     '/vo/raw/f2' : { 'Run' : 200 },
+                                     '/vo/dst/f3' : { 'Run' : 5 },
+                                     '/vo/dst/dir' : { 'Run' : 300 },
+                                     '/vo/none' : { 'Run' : 1 } } )
+    self.assert_( res['OK'] )
+    self.assertEqual( sorted( res['Value']['Successful'] ), [ '/vo/dst/dir', '/vo/dst/f3', '/vo/raw/f1', '/vo/raw/f2' ] )
+    self.assertEqual( res['Value']['Failed'].keys(), [ '/vo/none' ] )
+    self.assertEqual( sorted( call[0][0] for call in self.catalog.getFileUserMetadata.call_args_list ),
+                      [ '/vo/dst/f3', '/vo/raw/f1', '/vo/raw/f2' ] )
+    # The stored Run of /vo/raw/f1 sends it to the transformation 2, as setMetadata would
+    self.assertEqual( self.db.getTransformationFiles(), { 1 : [ '/vo/raw/f1', '/vo/raw/f2' ],
+                                                          2 : [ '/vo/dst/dir/f4', '/vo/raw/f1', '/vo/raw/f2' ],
+                                                          3 : [ '/vo/dst/dir/f4', '/vo/dst/f3' ] } )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( TransformationDBTestCase )
+  unittest.TextTestRunner( verbosity = 2 ).run( suite )
@@ -348,6 +348,13 @@ class TransformationManagerHandlerBase( RequestHandler ):
     res = database.setMetadata( path, querydict )
     return self._parseRes( res )
 
+  types_setMetadataBulk = [ dict ]
+  def export_setMetadataBulk( self, pathMetadataDict ):
+    """ Set metadata to many files or directories: { path : metadataDict }
+    """
+    res = database.setMetadataBulk( pathMetadataDict )
+    return self._parseRes( res )
+
 
   ####################################################################
   #
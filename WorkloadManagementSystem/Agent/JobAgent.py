@@ -56,6 +56,7 @@ class JobAgent( AgentModule ):
     self.minimumTimeLeft = 1000
     self.stopOnApplicationFailure = True
     self.stopAfterFailedMatches = 10
+    self.maxJobsPerRequest = 1
     self.jobCount = 0
     self.matchFailedCount = 0
     self.extraOptions = ''
@@ -110,6 +111,8 @@ class JobAgent( AgentModule ):
     self.minimumTimeLeft = self.am_getOption( 'MinimumTimeLeft', self.minimumTimeLeft )
     self.stopOnApplicationFailure = self.am_getOption( 'StopOnApplicationFailure', self.stopOnApplicationFailure )
     self.stopAfterFailedMatches = self.am_getOption( 'StopAfterFailedMatches', self.stopAfterFailedMatches )
+    # Number of jobs requested at once to fill the available slots of the CE (e.g. Pool CE)
+    self.maxJobsPerRequest = self.am_getOption( 'MaxJobsPerRequest', self.maxJobsPerRequest )
     self.extraOptions = gConfig.getValue( '/AgentJobRequirements/ExtraOptions', self.extraOptions )
     # Timeleft
     self.timeLeftUtil = TimeLeft()
@@ -194,8 +197,14 @@ class JobAgent( AgentModule ):
       self.log.info( 'Requirements:', requirementsDict )
 
     self.log.verbose( ceDict )
+    maxJobs = 1
+    if self.maxJobsPerRequest > 1:
+      maxJobs = min( self.maxJobsPerRequest, availableSlots )
     start = time.time()
-    jobRequest = self.__requestJob( ceDict )
+    if maxJobs > 1:
+      jobRequest = self.__requestJobs( ceDict, maxJobs )
+    else:
+      jobRequest = self.__requestJob( ceDict )
     matchTime = time.time() - start
     self.log.info( 'MatcherTime = %.2f (s)' % ( matchTime ) )
 
@@ -228,7 +237,34 @@ class JobAgent( AgentModule ):
     # Reset the Counter
     self.matchFailedCount = 0
 
-    matcherInfo = jobRequest['Value']
+    if maxJobs > 1:
+      matcherInfoList = jobRequest['Value']
+      self.log.info( 'Matched %d jobs' % len( matcherInfoList ) )
+    else:
+      matcherInfoList = [ jobRequest['Value'] ]
+    return self.__processMatchedJobs( matcherInfoList, ceDict, matchTime )
+
+  #############################################################################
+  def __processMatchedJobs( self, matcherInfoList, ceDict, matchTime ):
+    """ Process the jobs returned by the Matcher. Once a job has stopped the agent,
+        the jobs not processed yet are rescheduled
+    """
+    result = S_OK( 'Job Agent cycle complete' )
+    for index, matcherInfo in enumerate( matcherInfoList ):
+      jobResult = self.__processMatchedJob( matcherInfo, ceDict, matchTime )
+      # Keep going with the other jobs already matched, report the first problem
+      if not jobResult['OK'] and result['OK']:
+        result = jobResult
+      if not self.am_getModuleParam( 'alive' ):
+        self.__rescheduleMatchedJobs( [ info['JobID'] for info in matcherInfoList[index + 1:] ],
+                                      jobResult.get( 'Message', jobResult.get( 'Value' ) ) )
+        break
+    return result
+
+  #############################################################################
+  def __processMatchedJob( self, matcherInfo, ceDict, matchTime ):
+    """ Set up and submit to the CE a job returned by the Matcher
+    """
     if not self.pilotInfoReportedFlag:
       # Check the flag after the first access to the Matcher
       self.pilotInfoReportedFlag = matcherInfo.get( 'PilotInfoReportedFlag', False )
@@ -285,7 +321,7 @@ class JobAgent( AgentModule ):
       params['Arguments'] += ' ' + self.extraOptions
       params['ExtraOptions'] = self.extraOptions
 
-    self.log.verbose( 'Job request successful: \n', jobRequest['Value'] )
+    self.log.verbose( 'Job request successful: \n', matcherInfo )
     self.log.info( 'Received JobID=%s, JobType=%s' % ( jobID, jobType ) )
     self.log.info( 'OwnerDN: %s JobGroup: %s' % ( ownerDN, jobGroup ) )
     self.jobCount += 1
@@ -511,6 +547,13 @@ class JobAgent( AgentModule ):
     matcher = RPCClient( 'WorkloadManagement/Matcher', timeout = 600 )
     return matcher.requestJob( ceDict )
 
+  #############################################################################
+  def __requestJobs( self, ceDict, maxJobs ):
+    """Request several jobs fitting in the CE available processors and memory from the matcher service.
+    """
+    matcher = RPCClient( 'WorkloadManagement/Matcher', timeout = 600 )
+    return matcher.requestJobs( ceDict, maxJobs )
+
   #############################################################################
   def __getJDLParameters( self, jdl ):
     """Returns a dictionary of JDL parameters.
@@ -604,6 +647,21 @@ class JobAgent( AgentModule ):
     self.log.info( 'Job Rescheduled %s' % ( jobID ) )
     return self.__finish( 'Job Rescheduled', stop )
 
+  #############################################################################
+  def __rescheduleMatchedJobs( self, jobIDs, message ):
+    """
+    Give back the jobs matched for this agent that it will not run
+    """
+    if not jobIDs:
+      return S_OK()
+
+    self.log.info( 'Rescheduling %d matched jobs after "%s"' % ( len( jobIDs ), message ) )
+    jobManager = RPCClient( 'WorkloadManagement/JobManager' )
+    result = jobManager.rescheduleJob( jobIDs )
+    if not result['OK']:
+      self.log.error( 'Failed to reschedule jobs', '%s: %s' % ( jobIDs, result['Message'] ) )
+    return result
+
   #############################################################################
   def finalize( self ):
     """ Job Agent finalization method
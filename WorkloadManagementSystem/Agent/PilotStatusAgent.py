@@ -143,6 +143,7 @@ class PilotStatusAgent( AgentModule ):
             continue
 
           statusDict = result[ 'Value' ]
+          pilotStatusDict = {}
           for pRef in statusDict:
             pDict = statusDict[ pRef ]
             if pDict:
@@ -158,11 +159,13 @@ class PilotStatusAgent( AgentModule ):
                 pilotsToAccount[ pRef ] = pDict
               else:
                 self.log.verbose( 'Setting Status for %s to %s' % ( pRef, pDict['Status'] ) )
-                result = self.pilotDB.setPilotStatus( pRef,
-                                                      pDict['Status'],
-                                                      pDict['DestinationSite'],
-                                                      updateTime = pDict['StatusDate'],
-                                                      conn = connection )
+                pilotStatusDict[ pRef ] = { 'Status' : pDict['Status'],
+                                            'DestinationSite' : pDict['DestinationSite'],
+                                            'UpdateTime' : pDict['StatusDate'] }
+          if pilotStatusDict:
+            result = self.pilotDB.setPilotsStatus( pilotStatusDict, conn = connection )
+            if not result['OK']:
+              self.log.error( 'Failed to update the pilot statuses', result['Message'] )
 
           if len( pilotsToAccount ) > 100:
             self.accountPilots( pilotsToAccount, connection )
@@ -195,11 +198,9 @@ class PilotStatusAgent( AgentModule ):
       return S_OK()
     refList = result['Value']
 
-    for pilotRef in refList:
-      self.log.info( 'Setting Waiting pilot to Aborted: %s' % pilotRef )
-      result = self.pilotDB.setPilotStatus( pilotRef, 'Stalled', statusReason = 'Exceeded max waiting time' )
-
-    return S_OK()
+    self.log.info( 'Setting %d Waiting pilots to Stalled' % len( refList ) )
+    return self.pilotDB.setPilotsStatus( dict.fromkeys( refList, 'Stalled' ),
+                                         statusReason = 'Exceeded max waiting time' )
 
   def clearParentJob( self, pRef, pDict, connection ):
     """ Clear the parameteric parent job from the PilotAgentsDB
@@ -328,14 +329,17 @@ class PilotStatusAgent( AgentModule ):
         accountingSent = True
 
     if not accountingFlag or accountingSent:
+      pilotStatusDict = {}
       for pRef in pilotsToAccount:
         pDict = pilotsToAccount[pRef]
         self.log.verbose( 'Setting Status for %s to %s' % ( pRef, pDict['Status'] ) )
-        self.pilotDB.setPilotStatus( pRef,
-                                     pDict['Status'],
-                                     pDict['DestinationSite'],
-                                     pDict['StatusDate'],
-                                     conn = connection )
+        pilotStatusDict[ pRef ] = { 'Status' : pDict['Status'],
+                                    'DestinationSite' : pDict['DestinationSite'],
+                                    'UpdateTime' : pDict['StatusDate'] }
+      result = self.pilotDB.setPilotsStatus( pilotStatusDict, conn = connection )
+      if not result['OK']:
+        self.log.error( 'Failed to update the pilot statuses', result['Message'] )
+        return result
 
     return S_OK()
 
@@ -6,6 +6,9 @@
 """  The Site Director is a simple agent performing pilot job submission to particular sites.
 """
 import os
+import time
+import Queue
+import threading
 import base64
 import bz2
 import tempfile
@@ -46,6 +49,8 @@ WAITING_PILOT_STATUS = ['Submitted', 'Waiting', 'Scheduled', 'Ready']
 FINAL_PILOT_STATUS = ['Aborted', 'Failed', 'Done']
 MAX_PILOTS_TO_SUBMIT = 100
 MAX_JOBS_IN_FILLMODE = 5
+SUBMISSION_THREADS_PER_CETYPE = 5
+QUEUE_SUBMISSION_TIMEOUT = 600
 
 def getSubmitPools( group = None, vo = None ):
   if group:
@@ -77,6 +82,12 @@ class SiteDirector( AgentModule ):
     self.firstPass = True
     self.maxJobsInFillMode = MAX_JOBS_IN_FILLMODE
     self.maxPilotsToSubmit = MAX_PILOTS_TO_SUBMIT
+    self.submissionThreadsPerCEType = SUBMISSION_THREADS_PER_CETYPE
+    self.queueSubmissionTimeout = QUEUE_SUBMISSION_TIMEOUT
+    # Queues being submitted to by the submission threads and the duration of the last submission
+    self.submissionLock = threading.Lock()
+    self.busyQueues = set()
+    self.queueSubmitTimes = {}
 
     self.gridEnv = ''
     self.vo = ''
@@ -153,6 +164,9 @@ class SiteDirector( AgentModule ):
     self.failedQueueCycleFactor = self.am_getOption( 'FailedQueueCycleFactor', 10 )
     self.pilotStatusUpdateCycleFactor = self.am_getOption( 'PilotStatusUpdateCycleFactor', 10 )
     self.addPilotsToEmptySites = self.am_getOption( 'AddPilotsToEmptySites', False )
+    self.submissionThreadsPerCEType = max( 1, self.am_getOption( 'SubmissionThreadsPerCEType',
+                                                                 self.submissionThreadsPerCEType ) )
+    self.queueSubmissionTimeout = self.am_getOption( 'QueueSubmissionTimeout', self.queueSubmissionTimeout )
 
     # Flags
     self.updateStatus = self.am_getOption( 'UpdatePilotStatus', True )
@@ -207,6 +221,7 @@ class SiteDirector( AgentModule ):
     self.log.always( 'PilotGroup:', self.pilotGroup )
     self.log.always( 'MaxPilotsToSubmit:', self.maxPilotsToSubmit )
     self.log.always( 'MaxJobsInFillMode:', self.maxJobsInFillMode )
+    self.log.always( 'SubmissionThreadsPerCEType:', self.submissionThreadsPerCEType )
 
     self.localhost = socket.getfqdn()
     self.proxy = ''
@@ -365,6 +380,11 @@ class SiteDirector( AgentModule ):
 
   def submitJobs( self ):
     """ Go through defined computing elements and submit jobs if necessary
+
+        The site and CE statuses, the site mask and the matching task queues are evaluated
+        once per cycle in the agent thread. The queues with work to do are then handled
+        concurrently, with a bounded number of threads per CE type, so that the cycle lasts
+        as long as the slowest CE rather than the sum of all of them
     """
     # Check that there is some work at all
     setup = CSGlobals.getSetup()
@@ -439,233 +459,407 @@ class SiteDirector( AgentModule ):
         return S_ERROR( 'Can not get the site mask' )
       siteMaskList = result['Value']
 
+    cycleInfo = { 'Matcher' : rpcMatcher,
+                  'SiteMask' : set( siteMaskList ),
+                  'JobSites' : jobSites,
+                  'AnySite' : anySite,
+                  'TestSites' : testSites,
+                  'Proxies' : {},
+                  'CompatiblePlatforms' : {} }
+    if self.rssFlag:
+      result = self._getResourceStatuses()
+      if not result['OK']:
+        return result
+      cycleInfo['SiteStatus'], cycleInfo['CEStatus'] = result['Value']
+
     queues = self.queueDict.keys()
     random.shuffle( queues )
-    totalSubmittedPilots = 0
-    matchedQueues = 0
+    submissionDict = {}
     for queue in queues:
+      result = self._prepareQueueSubmission( queue, cycleInfo )
+      if not result['OK']:
+        return result
+      if result['Value']:
+        submissionDict[queue] = result['Value']
 
-      # Check if the queue failed previously
-      failedCount = self.failedQueues[ queue ] % self.failedQueueCycleFactor
-      if failedCount != 0:
-        self.log.warn( "%s queue failed recently, skipping %d cycles" % ( queue, 10-failedCount ) )
-        self.failedQueues[queue] += 1
+    totalSubmittedPilots = self._executeSubmissions( submissionDict )
+    self.log.info( "%d pilots submitted in total in this cycle, %d matched queues" % ( totalSubmittedPilots, len( submissionDict ) ) )
+    return S_OK()
+
+  def _getResourceStatuses( self ):
+    """ Get the statuses of all the sites and of the CEs served by the director in one go
+
+    :return: S_OK( ( { siteName: status }, { ceName: status } ) )
+    """
+    result = self.siteClient.getSiteStatuses()
+    if not result['OK']:
+      return S_ERROR( 'Can not get the site statuses: %s' % result['Message'] )
+    siteStatusDict = result['Value']
+
+    ceStatusDict = {}
+    for ceName in set( self.queueDict[queue]['CEName'] for queue in self.queueDict ):
+      result = self.rssClient.getElementStatus( ceName, "ComputingElement" )
+      if not result['OK']:
+        self.log.error( "Can not get the status of computing element %s: %s" % ( ceName, result['Message'] ) )
         continue
+      if result['Value']:
+        ceStatusDict[ceName] = result['Value'][ceName]['all']
+    return S_OK( ( siteStatusDict, ceStatusDict ) )
 
-      ce = self.queueDict[queue]['CE']
-      ceName = self.queueDict[queue]['CEName']
-      ceType = self.queueDict[queue]['CEType']
-      queueName = self.queueDict[queue]['QueueName']
-      siteName = self.queueDict[queue]['Site']
-      platform = self.queueDict[queue]['Platform']
-      siteMask = siteName in siteMaskList
-
-      if self.rssFlag:
-        # Check the status of the Site
-        result = self.siteClient.getSiteStatuses({siteName})
-        if not result['OK']:
-          self.log.error( "Can not get the status of site %s: %s" % (siteName, result['Message']) )
-          continue
-        if result['Value']:
-          result = result['Value'][siteName]   #get the value of the status
+  def _prepareQueueSubmission( self, queue, cycleInfo ):
+    """ Check whether pilots should be submitted to the queue and collect what the
+        submission needs. Only DIRAC services are contacted here, the CE is not.
 
-        if result not in ('Active', 'Degraded'):
-          self.log.verbose( "Skipping site %s: site not usable" % siteName )
-          continue
+    :param str queue: queue name
+    :param dict cycleInfo: information shared by all the queues in this cycle
+    :return: S_OK( submission dictionary )/S_OK( None ) if there is nothing to submit
+    """
+    # Check if the queue failed previously
+    failedCount = self.failedQueues[ queue ] % self.failedQueueCycleFactor
+    if failedCount != 0:
+      self.log.warn( "%s queue failed recently, skipping %d cycles" % ( queue, 10-failedCount ) )
+      self.failedQueues[queue] += 1
+      return S_OK()
 
-        # Check the status of the ComputingElement
-        result = self.rssClient.getElementStatus(ceName, "ComputingElement")
-        if not result['OK']:
-          self.log.error( "Can not get the status of computing element %s: %s" % (siteName, result['Message']) )
-          continue
-        if result['Value']:
-          result = result['Value'][ceName]['all']   #get the value of the status
+    with self.submissionLock:
+      if queue in self.busyQueues:
+        self.log.warn( "Skipping queue %s: submission from a previous cycle still ongoing" % queue )
+        return S_OK()
 
-        if result not in ('Active', 'Degraded'):
-          self.log.verbose( "Skipping computing element %s at %s: resource not usable" % (ceName, siteName) )
-          continue
+    ce = self.queueDict[queue]['CE']
+    ceName = self.queueDict[queue]['CEName']
+    queueName = self.queueDict[queue]['QueueName']
+    siteName = self.queueDict[queue]['Site']
+    platform = self.queueDict[queue]['Platform']
+    siteMask = siteName in cycleInfo['SiteMask']
 
-      if not anySite and siteName not in jobSites:
-        self.log.verbose( "Skipping queue %s at %s: no workload expected" % (queueName, siteName) )
-        continue
-      if not siteMask and siteName not in testSites:
-        self.log.verbose( "Skipping queue %s: site %s not in the mask" % (queueName, siteName) )
-        continue
+    if self.rssFlag:
+      # Check the status of the Site
+      if cycleInfo['SiteStatus'].get( siteName ) not in ( 'Active', 'Degraded' ):
+        self.log.verbose( "Skipping site %s: site not usable" % siteName )
+        return S_OK()
+
+      # Check the status of the ComputingElement
+      if cycleInfo['CEStatus'].get( ceName ) not in ( 'Active', 'Degraded' ):
+        self.log.verbose( "Skipping computing element %s at %s: resource not usable" % (ceName, siteName) )
+        return S_OK()
+
+    if not cycleInfo['AnySite'] and siteName not in cycleInfo['JobSites']:
+      self.log.verbose( "Skipping queue %s at %s: no workload expected" % (queueName, siteName) )
+      return S_OK()
+    if not siteMask and siteName not in cycleInfo['TestSites']:
+      self.log.verbose( "Skipping queue %s: site %s not in the mask" % (queueName, siteName) )
+      return S_OK()
 
-      if 'CPUTime' in self.queueDict[queue]['ParametersDict'] :
-        queueCPUTime = int( self.queueDict[queue]['ParametersDict']['CPUTime'] )
-      else:
-        self.log.warn( 'CPU time limit is not specified for queue %s, skipping...' % queue )
-        continue
-      if queueCPUTime > self.maxQueueLength:
-        queueCPUTime = self.maxQueueLength
-
-      # Prepare the queue description to look for eligible jobs
-      ceDict = ce.getParameterDict()
-      ceDict[ 'GridCE' ] = ceName
-      #if not siteMask and 'Site' in ceDict:
-      #  self.log.info( 'Site not in the mask %s' % siteName )
-      #  self.log.info( 'Removing "Site" from matching Dict' )
-      #  del ceDict[ 'Site' ]
-      if not siteMask:
-        ceDict['JobType'] = "Test"
-      if self.vo:
-        ceDict['Community'] = self.vo
-      if self.voGroups:
-        ceDict['OwnerGroup'] = self.voGroups
+    if 'CPUTime' in self.queueDict[queue]['ParametersDict'] :
+      queueCPUTime = int( self.queueDict[queue]['ParametersDict']['CPUTime'] )
+    else:
+      self.log.warn( 'CPU time limit is not specified for queue %s, skipping...' % queue )
+      return S_OK()
+    if queueCPUTime > self.maxQueueLength:
+      queueCPUTime = self.maxQueueLength
+
+    # Prepare the queue description to look for eligible jobs
+    ceDict = ce.getParameterDict()
+    ceDict[ 'GridCE' ] = ceName
+    if not siteMask:
+      ceDict['JobType'] = "Test"
+    if self.vo:
+      ceDict['Community'] = self.vo
+    if self.voGroups:
+      ceDict['OwnerGroup'] = self.voGroups
 
-      # This is a hack to get rid of !
-      ceDict['SubmitPool'] = self.defaultSubmitPools
+    # This is a hack to get rid of !
+    ceDict['SubmitPool'] = self.defaultSubmitPools
 
-      result = Resources.getCompatiblePlatforms( platform )
-      if not result['OK']:
-        continue
-      ceDict['Platform'] = result['Value']
+    if platform not in cycleInfo['CompatiblePlatforms']:
+      cycleInfo['CompatiblePlatforms'][platform] = Resources.getCompatiblePlatforms( platform )
+    result = cycleInfo['CompatiblePlatforms'][platform]
+    if not result['OK']:
+      return S_OK()
+    ceDict['Platform'] = result['Value']
 
-      # Get the number of eligible jobs for the target site/queue
-      result = rpcMatcher.getMatchingTaskQueues( ceDict )
-      if not result['OK']:
-        self.log.error( 'Could not retrieve TaskQueues from TaskQueueDB', result['Message'] )
-        return result
-      taskQueueDict = result['Value']
-      if not taskQueueDict:
-        self.log.verbose( 'No matching TQs found for %s' % queue )
-        continue
+    # Get the number of eligible jobs for the target site/queue
+    result = cycleInfo['Matcher'].getMatchingTaskQueues( ceDict )
+    if not result['OK']:
+      self.log.error( 'Could not retrieve TaskQueues from TaskQueueDB', result['Message'] )
+      return result
+    taskQueueDict = result['Value']
+    if not taskQueueDict:
+      self.log.verbose( 'No matching TQs found for %s' % queue )
+      return S_OK()
 
-      matchedQueues += 1
-      totalTQJobs = 0
-      tqIDList = taskQueueDict.keys()
-      for tq in taskQueueDict:
-        totalTQJobs += taskQueueDict[tq]['Jobs']
-
-      self.log.verbose( '%d job(s) from %d task queue(s) are eligible for %s queue' % (totalTQJobs, len( tqIDList ), queue) )
-
-      # Get the number of already waiting pilots for these task queues
-      totalWaitingPilots = 0
-      manyWaitingPilotsFlag = False
-      if self.pilotWaitingFlag:
-        lastUpdateTime = dateTime() - self.pilotWaitingTime * second
-        result = pilotAgentsDB.countPilots( { 'TaskQueueID': tqIDList,
-                                              'Status': WAITING_PILOT_STATUS },
-                                            None, lastUpdateTime )
-        if not result['OK']:
-          self.log.error( 'Failed to get Number of Waiting pilots', result['Message'] )
-          totalWaitingPilots = 0
-        else:
-          totalWaitingPilots = result['Value']
-          self.log.verbose( 'Waiting Pilots for TaskQueue %s:' % tqIDList, totalWaitingPilots )
-      if totalWaitingPilots >= totalTQJobs:
-        self.log.verbose( "%d waiting pilots already for all the available jobs" % totalWaitingPilots )
-        manyWaitingPilotsFlag = True
-        if not self.addPilotsToEmptySites:
-          continue
+    totalTQJobs = 0
+    tqIDList = taskQueueDict.keys()
+    for tq in taskQueueDict:
+      totalTQJobs += taskQueueDict[tq]['Jobs']
 
-      self.log.verbose( "%d waiting pilots for the total of %d eligible jobs for %s" % (totalWaitingPilots, totalTQJobs, queue) )
+    self.log.verbose( '%d job(s) from %d task queue(s) are eligible for %s queue' % (totalTQJobs, len( tqIDList ), queue) )
 
-      # Get the working proxy
-      cpuTime = queueCPUTime + 86400
+    # Get the number of already waiting pilots for these task queues
+    totalWaitingPilots = 0
+    manyWaitingPilotsFlag = False
+    if self.pilotWaitingFlag:
+      lastUpdateTime = dateTime() - self.pilotWaitingTime * second
+      result = pilotAgentsDB.countPilots( { 'TaskQueueID': tqIDList,
+                                            'Status': WAITING_PILOT_STATUS },
+                                          None, lastUpdateTime )
+      if not result['OK']:
+        self.log.error( 'Failed to get Number of Waiting pilots', result['Message'] )
+        totalWaitingPilots = 0
+      else:
+        totalWaitingPilots = result['Value']
+        self.log.verbose( 'Waiting Pilots for TaskQueue %s:' % tqIDList, totalWaitingPilots )
+    if totalWaitingPilots >= totalTQJobs:
+      self.log.verbose( "%d waiting pilots already for all the available jobs" % totalWaitingPilots )
+      manyWaitingPilotsFlag = True
+      if not self.addPilotsToEmptySites:
+        return S_OK()
+
+    self.log.verbose( "%d waiting pilots for the total of %d eligible jobs for %s" % (totalWaitingPilots, totalTQJobs, queue) )
+
+    # Get the working proxy, once per requested length in the cycle
+    cpuTime = queueCPUTime + 86400
+    if cpuTime not in cycleInfo['Proxies']:
       self.log.verbose( "Getting pilot proxy for %s/%s %d long" % ( self.pilotDN, self.pilotGroup, cpuTime ) )
       result = gProxyManager.getPilotProxyFromDIRACGroup( self.pilotDN, self.pilotGroup, cpuTime )
       if not result['OK']:
         return result
-      self.proxy = result['Value']
+      proxy = result['Value']
       # Check returned proxy lifetime
-      result = self.proxy.getRemainingSecs() #pylint: disable=no-member
+      result = proxy.getRemainingSecs() #pylint: disable=no-member
       if not result['OK']:
         return result
-      lifetime_secs = result['Value']
-      ce.setProxy( self.proxy, lifetime_secs )
+      cycleInfo['Proxies'][cpuTime] = ( proxy, result['Value'] )
+    proxy, lifetime_secs = cycleInfo['Proxies'][cpuTime]
+    self.proxy = proxy
+    ce.setProxy( proxy, lifetime_secs )
+
+    return S_OK( { 'TaskQueues' : taskQueueDict,
+                   'TotalTQJobs' : totalTQJobs,
+                   'WaitingPilots' : totalWaitingPilots,
+                   'ManyWaitingPilots' : manyWaitingPilotsFlag,
+                   'Proxy' : proxy } )
+
+  def _submitPilotsToQueue( self, queue, submission ):
+    """ Check the available slots of the queue, submit the pilots and register them.
+        This is executed in the submission threads.
+
+    :param str queue: queue name
+    :param dict submission: dictionary prepared by _prepareQueueSubmission
+    :return: S_OK( number of submitted pilots )
+    """
+    ce = self.queueDict[queue]['CE']
+    ceName = self.queueDict[queue]['CEName']
+    ceType = self.queueDict[queue]['CEType']
+    queueName = self.queueDict[queue]['QueueName']
+    siteName = self.queueDict[queue]['Site']
+    taskQueueDict = submission['TaskQueues']
+    totalTQJobs = submission['TotalTQJobs']
+    totalWaitingPilots = submission['WaitingPilots']
+    manyWaitingPilotsFlag = submission['ManyWaitingPilots']
+
+    # Get the number of available slots on the target site/queue
+    totalSlots = self.getQueueSlots( queue, manyWaitingPilotsFlag )
+    if totalSlots == 0:
+      self.log.debug( '%s: No slots available' % queue )
+      return S_OK( 0 )
 
-      # Get the number of available slots on the target site/queue
-      totalSlots = self.getQueueSlots( queue, manyWaitingPilotsFlag )
-      if totalSlots == 0:
-        self.log.debug( '%s: No slots available' % queue )
-        continue
+    if manyWaitingPilotsFlag:
+      # Throttle submission of extra pilots to empty sites
+      pilotsToSubmit = self.maxPilotsToSubmit/10 + 1
+    else:
+      pilotsToSubmit = max( 0, min( totalSlots, totalTQJobs - totalWaitingPilots ) )
+      self.log.info( '%s: Slots=%d, TQ jobs=%d, Pilots: waiting %d, to submit=%d' % \
+                              ( queue, totalSlots, totalTQJobs, totalWaitingPilots, pilotsToSubmit ) )
 
-      if manyWaitingPilotsFlag:
-        # Throttle submission of extra pilots to empty sites
-        pilotsToSubmit = self.maxPilotsToSubmit/10 + 1
-      else:
-        pilotsToSubmit = max( 0, min( totalSlots, totalTQJobs - totalWaitingPilots ) )
-        self.log.info( '%s: Slots=%d, TQ jobs=%d, Pilots: waiting %d, to submit=%d' % \
-                                ( queue, totalSlots, totalTQJobs, totalWaitingPilots, pilotsToSubmit ) )
+    # Limit the number of pilots to submit to MAX_PILOTS_TO_SUBMIT
+    pilotsToSubmit = min( self.maxPilotsToSubmit, pilotsToSubmit )
 
-      # Limit the number of pilots to submit to MAX_PILOTS_TO_SUBMIT
-      pilotsToSubmit = min( self.maxPilotsToSubmit, pilotsToSubmit )
+    submittedPilots = 0
+    while pilotsToSubmit > 0:
+      self.log.info( 'Going to submit %d pilots to %s queue' % ( pilotsToSubmit, queue ) )
 
-      while pilotsToSubmit > 0:
-        self.log.info( 'Going to submit %d pilots to %s queue' % ( pilotsToSubmit, queue ) )
+      bundleProxy = self.queueDict[queue].get( 'BundleProxy', False )
+      jobExecDir = ''
+      jobExecDir = self.queueDict[queue]['ParametersDict'].get( 'JobExecDir', jobExecDir )
+      httpProxy = self.queueDict[queue]['ParametersDict'].get( 'HttpProxy', '' )
 
-        bundleProxy = self.queueDict[queue].get( 'BundleProxy', False )
-        jobExecDir = ''
-        jobExecDir = self.queueDict[queue]['ParametersDict'].get( 'JobExecDir', jobExecDir )
-        httpProxy = self.queueDict[queue]['ParametersDict'].get( 'HttpProxy', '' )
+      result = self.getExecutable( queue, pilotsToSubmit, bundleProxy, httpProxy, jobExecDir,
+                                   proxy = submission['Proxy'] )
+      if not result['OK']:
+        return result
 
-        result = self.getExecutable( queue, pilotsToSubmit, bundleProxy, httpProxy, jobExecDir )
-        if not result['OK']:
-          return result
+      executable, pilotSubmissionChunk = result['Value']
+      result = ce.submitJob( executable, '', pilotSubmissionChunk )
+      ### FIXME: The condor thing only transfers the file with some
+      ### delay, so when we unlink here the script is gone
+      ### FIXME 2: but at some time we need to clean up the pilot wrapper scripts...
+      if ceType != 'HTCondorCE':
+        os.unlink( executable )
+      if not result['OK']:
+        self.log.error( 'Failed submission to queue %s:\n' % queue, result['Message'] )
+        pilotsToSubmit = 0
+        self.failedQueues[queue] += 1
+        continue
 
-        executable, pilotSubmissionChunk = result['Value']
-        result = ce.submitJob( executable, '', pilotSubmissionChunk )
-        ### FIXME: The condor thing only transfers the file with some
-        ### delay, so when we unlink here the script is gone
-        ### FIXME 2: but at some time we need to clean up the pilot wrapper scripts...
-        if ceType != 'HTCondorCE':
-          os.unlink( executable )
+      pilotsToSubmit = pilotsToSubmit - pilotSubmissionChunk
+      # Add pilots to the PilotAgentsDB assign pilots to TaskQueue proportionally to the
+      # task queue priorities
+      pilotList = result['Value']
+      self.queueSlots[queue]['AvailableSlots'] -= len( pilotList )
+      submittedPilots += len( pilotList )
+      self.log.info( 'Submitted %d pilots to %s@%s' % ( len( pilotList ), queueName, ceName ) )
+      stampDict = {}
+      if result.has_key( 'PilotStampDict' ):
+        stampDict = result['PilotStampDict']
+      tqPriorityList = []
+      sumPriority = 0.
+      for tq in taskQueueDict:
+        sumPriority += taskQueueDict[tq]['Priority']
+        tqPriorityList.append( ( tq, sumPriority ) )
+      tqDict = {}
+      for pilotID in pilotList:
+        rndm = random.random() * sumPriority
+        for tq, prio in tqPriorityList:
+          if rndm < prio:
+            tqID = tq
+            break
+        if not tqDict.has_key( tqID ):
+          tqDict[tqID] = []
+        tqDict[tqID].append( pilotID )
+
+      for tqID, pilotList in tqDict.items():
+        result = pilotAgentsDB.addPilotTQReference( pilotList,
+                                                    tqID,
+                                                    self.pilotDN,
+                                                    self.pilotGroup,
+                                                    self.localhost,
+                                                    ceType,
+                                                    '',
+                                                    stampDict )
         if not result['OK']:
-          self.log.error( 'Failed submission to queue %s:\n' % queue, result['Message'] )
-          pilotsToSubmit = 0
-          self.failedQueues[queue] += 1
+          self.log.error( 'Failed add pilots to the PilotAgentsDB: ', result['Message'] )
           continue
-
-        pilotsToSubmit = pilotsToSubmit - pilotSubmissionChunk
-        # Add pilots to the PilotAgentsDB assign pilots to TaskQueue proportionally to the
-        # task queue priorities
-        pilotList = result['Value']
-        self.queueSlots[queue]['AvailableSlots'] -= len( pilotList )
-        totalSubmittedPilots += len( pilotList )
-        self.log.info( 'Submitted %d pilots to %s@%s' % ( len( pilotList ), queueName, ceName ) )
-        stampDict = {}
-        if result.has_key( 'PilotStampDict' ):
-          stampDict = result['PilotStampDict']
-        tqPriorityList = []
-        sumPriority = 0.
-        for tq in taskQueueDict:
-          sumPriority += taskQueueDict[tq]['Priority']
-          tqPriorityList.append( ( tq, sumPriority ) )
-        tqDict = {}
-        for pilotID in pilotList:
-          rndm = random.random() * sumPriority
-          for tq, prio in tqPriorityList:
-            if rndm < prio:
-              tqID = tq
-              break
-          if not tqDict.has_key( tqID ):
-            tqDict[tqID] = []
-          tqDict[tqID].append( pilotID )
-
-        for tqID, pilotList in tqDict.items():
-          result = pilotAgentsDB.addPilotTQReference( pilotList,
-                                                      tqID,
-                                                      self.pilotDN,
-                                                      self.pilotGroup,
-                                                      self.localhost,
-                                                      ceType,
-                                                      '',
-                                                      stampDict )
+        for pilot in pilotList:
+          result = pilotAgentsDB.setPilotStatus(pilot, 'Submitted', ceName,
+                                                'Successfully submitted by the SiteDirector',
+                                                siteName, queueName )
           if not result['OK']:
-            self.log.error( 'Failed add pilots to the PilotAgentsDB: ', result['Message'] )
+            self.log.error( 'Failed to set pilot status: ', result['Message'] )
             continue
-          for pilot in pilotList:
-            result = pilotAgentsDB.setPilotStatus(pilot, 'Submitted', ceName,
-                                                  'Successfully submitted by the SiteDirector',
-                                                  siteName, queueName )
-            if not result['OK']:
-              self.log.error( 'Failed to set pilot status: ', result['Message'] )
-              continue
 
-    self.log.info( "%d pilots submitted in total in this cycle, %d matched queues" % ( totalSubmittedPilots, matchedQueues ) )
-    return S_OK()
+    return S_OK( submittedPilots )
+
+  def _executeSubmissions( self, submissionDict ):
+    """ Submit to the queues concurrently
+
+    :param dict submissionDict: { queue: submission dictionary }
+    :return: number of submitted pilots
+    """
+    if not submissionDict:
+      return 0
+
+    resultDict = self._executeInQueueThreads( self._submitPilotsToQueue, submissionDict, self.queueSubmissionTimeout )
+    totalSubmittedPilots = 0
+    for queue, ( result, submitTime ) in resultDict.items():
+      self.queueSubmitTimes[queue] = submitTime
+      if result['OK']:
+        totalSubmittedPilots += result['Value']
+        self.log.verbose( 'Submission to %s done in %.1f seconds: %d pilots' % ( queue, submitTime, result['Value'] ) )
+      else:
+        self.log.error( 'Submission to %s failed after %.1f seconds:' % ( queue, submitTime ), result['Message'] )
+
+    slowestQueues = sorted( resultDict, key = lambda queue: resultDict[queue][1], reverse = True )
+    self.log.info( 'Slowest queues: %s' % ', '.join( '%s (%.1fs)' % ( queue, resultDict[queue][1] )
+                                                     for queue in slowestQueues[:5] ) )
+    return totalSubmittedPilots
+
+  def _executeInQueueThreads( self, method, argsDict, timeout ):
+    """ Call method( queue, args ) for all the queues concurrently, with at most
+        submissionThreadsPerCEType threads per CE type. The agent waits at most timeout
+        seconds for each queue: a queue taking longer is counted as failed and its thread
+        is abandoned, told to stop once the queue is over, and a new one takes over the
+        queues left for the CE type. Queues are
+        considered busy, and are skipped by the following cycles, until their thread is over.
+
+    :param method: function executed in the threads, returning S_OK/S_ERROR
+    :param dict argsDict: { queue: argument of the method }
+    :param int timeout: seconds allowed for each queue
+    :return: { queue: ( result, seconds spent ) }
+    """
+    resultQueue = Queue.Queue()
+    ceTypeQueues = {}
+    for queue in argsDict:
+      ceType = self.queueDict[queue]['CEType']
+      ceTypeQueues.setdefault( ceType, Queue.Queue() ).put( queue )
+    with self.submissionLock:
+      self.busyQueues.update( argsDict )
+
+    # queue : stop event of the worker processing it
+    stopEvents = {}
+
+    def startWorker( ceType ):
+      worker = threading.Thread( target = self.__queueWorker,
+                                 args = ( method, ceTypeQueues[ceType], argsDict, resultQueue,
+                                          stopEvents, threading.Event() ),
+                                 name = "SiteDirector-%s" % ceType )
+      worker.setDaemon( True )
+      worker.start()
+
+    for ceType, ceTypeQueue in ceTypeQueues.items():
+      for _i in xrange( min( self.submissionThreadsPerCEType, ceTypeQueue.qsize() ) ):
+        startWorker( ceType )
+
+    startTimes = {}
+    resultDict = {}
+    pendingQueues = set( argsDict )
+    while pendingQueues:
+      try:
+        queue, startTime, result = resultQueue.get( timeout = 1 )
+        if result is None:
+          startTimes[queue] = startTime
+        elif queue in pendingQueues:
+          pendingQueues.discard( queue )
+          resultDict[queue] = ( result, time.time() - startTime )
+      except Queue.Empty:
+        pass
+      now = time.time()
+      for queue in [ queue for queue in pendingQueues
+                     if queue in startTimes and now - startTimes[queue] > timeout ]:
+        self.log.error( 'Queue %s timed out after %d seconds' % ( queue, timeout ) )
+        pendingQueues.discard( queue )
+        resultDict[queue] = ( S_ERROR( 'Timeout after %d seconds' % timeout ), now - startTimes[queue] )
+        self.failedQueues[queue] += 1
+        # The worker is abandoned, it must not take other queues once it is over
+        stopEvents[queue].set()
+        ceType = self.queueDict[queue]['CEType']
+        if not ceTypeQueues[ceType].empty():
+          startWorker( ceType )
+
+    return resultDict
+
+  def __queueWorker( self, method, ceTypeQueue, argsDict, resultQueue, stopEvents, stopEvent ):
+    """ Thread taking queues of a given CE type until there are none left or it is told to stop
+    """
+    while not stopEvent.isSet():
+      try:
+        queue = ceTypeQueue.get_nowait()
+      except Queue.Empty:
+        return
+      stopEvents[queue] = stopEvent
+      startTime = time.time()
+      resultQueue.put( ( queue, startTime, None ) )
+      try:
+        result = method( queue, argsDict[queue] )
+      except Exception as x: #pylint: disable=broad-except
+        self.log.exception( 'Exception while processing queue %s' % queue, lException = x )
+        self.failedQueues[queue] += 1
+        result = S_ERROR( 'Exception while processing queue %s: %s' % ( queue, str( x ) ) )
+      finally:
+        with self.submissionLock:
+          self.busyQueues.discard( queue )
+      resultQueue.put( ( queue, startTime, result ) )
 
   def getQueueSlots( self, queue, manyWaitingPilotsFlag ):
     """ Get the number of available slots in the queue
@@ -723,13 +917,15 @@ class SiteDirector( AgentModule ):
       return totalSlots
 
 #####################################################################################
-  def getExecutable( self, queue, pilotsToSubmit, bundleProxy = True, httpProxy = '', jobExecDir = '', processors = 1 ):
-    """ Prepare the full executable for queue
+  def getExecutable( self, queue, pilotsToSubmit, bundleProxy = True, httpProxy = '', jobExecDir = '', processors = 1,
+                     proxy = None ):
+    """ Prepare the full executable for queue. The proxy to bundle defaults to self.proxy
     """
 
-    proxy = None
     if bundleProxy:
-      proxy = self.proxy
+      proxy = proxy if proxy is not None else self.proxy
+    else:
+      proxy = None
     pilotOptions, pilotsToSubmit = self._getPilotOptions( queue, pilotsToSubmit, processors )
     if pilotOptions is None:
       self.log.error( "Pilot options empty, error in compilation" )
@@ -947,33 +1143,105 @@ EOF
 
   def updatePilotStatus( self ):
     """ Update status of pilots in transient states
+
+        The CEs are polled concurrently, the status changes are then written in bulk
+        to the PilotAgentsDB and the accounting records of all the queues are sent in
+        a single commit
     """
-    for queue in self.queueDict:
+    # This proxy is used for checking the pilot status and renewals
+    # We really need at least a few hours otherwise the renewed
+    # proxy may expire before we check again...
+    with self.submissionLock:
+      queues = [ queue for queue in self.queueDict if queue not in self.busyQueues ]
+    for queue in queues:
       ce = self.queueDict[queue]['CE']
-      ceName = self.queueDict[queue]['CEName']
-      queueName = self.queueDict[queue]['QueueName']
-      ceType = self.queueDict[queue]['CEType']
-      siteName = self.queueDict[queue]['Site']
-      abortedPilots = 0
+      result = ce.isProxyValid( 3*3600 )
+      if not result['OK']:
+        if not self.proxy or self.proxy.getRemainingSecs().get( 'Value', 0 ) < 23300: #pylint: disable=no-member
+          result = gProxyManager.getPilotProxyFromDIRACGroup( self.pilotDN, self.pilotGroup, 23400 )
+          if not result['OK']:
+            return result
+          self.proxy = result['Value']
+        ce.setProxy( self.proxy, 23300 )
 
-      result = pilotAgentsDB.selectPilots( {'DestinationSite':ceName,
-                                            'Queue':queueName,
-                                            'GridType':ceType,
-                                            'GridSite':siteName,
-                                            'Status':TRANSIENT_PILOT_STATUS,
-                                            'OwnerDN': self.pilotDN,
-                                            'OwnerGroup': self.pilotGroup } )
+    resultDict = self._executeInQueueThreads( self._updateQueuePilotStatus, dict.fromkeys( queues ),
+                                              self.queueSubmissionTimeout )
+    pilotStatusDict = {}
+    for queue, ( result, pollTime ) in resultDict.items():
       if not result['OK']:
-        self.log.error( 'Failed to select pilots: %s' % result['Message'] )
-        continue
-      pilotRefs = result['Value']
-      if not pilotRefs:
+        self.log.error( 'Failed to update the pilot status of queue %s' % queue, result['Message'] )
         continue
+      self.log.verbose( 'Pilot status of queue %s polled in %.1f seconds' % ( queue, pollTime ) )
+      queueStatusDict = result['Value']
+      # If something wrong in the queue, make a pause for the job submission
+      if 'Aborted' in queueStatusDict.values():
+        self.failedQueues[queue] += 1
+      pilotStatusDict.update( queueStatusDict )
+
+    if pilotStatusDict:
+      result = pilotAgentsDB.setPilotsStatus( pilotStatusDict, 'Updated by SiteDirector' )
+      if not result['OK']:
+        self.log.error( 'Failed to update the pilot statuses', result['Message'] )
+      else:
+        self.log.info( 'Status updated for %d pilots' % len( pilotStatusDict ) )
+
+    # Check if the accounting is to be sent
+    if self.sendAccounting:
+      accountingDict = {}
+      for queue in queues:
+        result = pilotAgentsDB.selectPilots( {'DestinationSite':self.queueDict[queue]['CEName'],
+                                              'Queue':self.queueDict[queue]['QueueName'],
+                                              'GridType':self.queueDict[queue]['CEType'],
+                                              'GridSite':self.queueDict[queue]['Site'],
+                                              'AccountingSent':'False',
+                                              'Status':FINAL_PILOT_STATUS} )
+
+        if not result['OK']:
+          self.log.error( 'Failed to select pilots', result['Message'] )
+          continue
+        pilotRefs = result['Value']
+        if not pilotRefs:
+          continue
+        result = pilotAgentsDB.getPilotInfo( pilotRefs )
+        if not result['OK']:
+          self.log.error( 'Failed to get pilots info from DB', result['Message'] )
+          continue
+        accountingDict.update( result['Value'] )
+      if accountingDict:
+        result = self.sendPilotAccounting( accountingDict )
+        if not result['OK']:
+          self.log.error( 'Failed to send pilot agent accounting' )
 
+    return S_OK()
+
+  def _updateQueuePilotStatus( self, queue, _args = None ):
+    """ Get the status of the pilots of a queue from its CE and retrieve the output of
+        the finished pilots. This is executed in the queue threads.
+
+    :param str queue: queue name
+    :return: S_OK( { pilotRef: new status } )
+    """
+    ce = self.queueDict[queue]['CE']
+    ceName = self.queueDict[queue]['CEName']
+    queueName = self.queueDict[queue]['QueueName']
+    ceType = self.queueDict[queue]['CEType']
+    siteName = self.queueDict[queue]['Site']
+    pilotStatusDict = {}
+
+    result = pilotAgentsDB.selectPilots( {'DestinationSite':ceName,
+                                          'Queue':queueName,
+                                          'GridType':ceType,
+                                          'GridSite':siteName,
+                                          'Status':TRANSIENT_PILOT_STATUS,
+                                          'OwnerDN': self.pilotDN,
+                                          'OwnerGroup': self.pilotGroup } )
+    if not result['OK']:
+      return result
+    pilotRefs = result['Value']
+    if pilotRefs:
       result = pilotAgentsDB.getPilotInfo( pilotRefs )
       if not result['OK']:
-        self.log.error( 'Failed to get pilots info from DB', result['Message'] )
-        continue
+        return result
       pilotDict = result['Value']
 
       stampedPilotRefs = []
@@ -984,21 +1252,9 @@ EOF
           stampedPilotRefs = list( pilotRefs )
           break
 
-      # This proxy is used for checking the pilot status and renewals
-      # We really need at least a few hours otherwise the renewed
-      # proxy may expire before we check again...
-      result = ce.isProxyValid( 3*3600 )
-      if not result['OK']:
-        result = gProxyManager.getPilotProxyFromDIRACGroup( self.pilotDN, self.pilotGroup, 23400 )
-        if not result['OK']:
-          return result
-        self.proxy = result['Value']
-        ce.setProxy( self.proxy, 23300 )
-
       result = ce.getJobStatus( stampedPilotRefs )
       if not result['OK']:
-        self.log.error( 'Failed to get pilots status from CE', '%s: %s' % ( ceName, result['Message'] ) )
-        continue
+        return S_ERROR( 'Failed to get pilots status from CE %s: %s' % ( ceName, result['Message'] ) )
       pilotCEDict = result['Value']
 
       for pRef in pilotRefs:
@@ -1026,109 +1282,57 @@ EOF
 
         if newStatus:
           self.log.info( 'Updating status to %s for pilot %s' % ( newStatus, pRef ) )
-          result = pilotAgentsDB.setPilotStatus( pRef, newStatus, '', 'Updated by SiteDirector' )
-          if newStatus == "Aborted":
-            abortedPilots += 1
+          pilotStatusDict[pRef] = newStatus
         # Retrieve the pilot output now
         if newStatus in FINAL_PILOT_STATUS:
           if pilotDict[pRef]['OutputReady'].lower() == 'false' and self.getOutput:
-            self.log.info( 'Retrieving output for pilot %s' % pRef )
-            pilotStamp = pilotDict[pRef]['PilotStamp']
-            pRefStamp = pRef
-            if pilotStamp:
-              pRefStamp = pRef + ':::' + pilotStamp
-            result = ce.getJobOutput( pRefStamp )
-            if not result['OK']:
-              self.log.error( 'Failed to get pilot output', '%s: %s' % ( ceName, result['Message'] ) )
-            else:
-              output, error = result['Value']
-              if output:
-                result = pilotAgentsDB.storePilotOutput( pRef, output, error )
-                if not result['OK']:
-                  self.log.error( 'Failed to store pilot output', result['Message'] )
-              else:
-                self.log.warn( 'Empty pilot output not stored to PilotDB' )
-
-      # If something wrong in the queue, make a pause for the job submission
-      if abortedPilots:
-        self.failedQueues[queue] += 1
+            self.__retrievePilotOutput( ce, pRef, pilotDict[pRef]['PilotStamp'], storeEmpty = False )
 
     # The pilot can be in Done state set by the job agent check if the output is retrieved
-    for queue in self.queueDict:
-      ce = self.queueDict[queue]['CE']
-
-      if not ce.isProxyValid( 120 ):
-        result = gProxyManager.getPilotProxyFromDIRACGroup( self.pilotDN, self.pilotGroup, 1000 )
-        if not result['OK']:
-          return result
-        ce.setProxy( self.proxy, 940 )
-
-      ceName = self.queueDict[queue]['CEName']
-      queueName = self.queueDict[queue]['QueueName']
-      ceType = self.queueDict[queue]['CEType']
-      siteName = self.queueDict[queue]['Site']
+    if self.getOutput:
       result = pilotAgentsDB.selectPilots( {'DestinationSite':ceName,
                                             'Queue':queueName,
                                             'GridType':ceType,
                                             'GridSite':siteName,
                                             'OutputReady':'False',
                                             'Status':FINAL_PILOT_STATUS} )
-
       if not result['OK']:
         self.log.error( 'Failed to select pilots', result['Message'] )
-        continue
-      pilotRefs = result['Value']
+        return S_OK( pilotStatusDict )
+      pilotRefs = [ pRef for pRef in result['Value'] if pRef not in pilotStatusDict ]
       if not pilotRefs:
-        continue
+        return S_OK( pilotStatusDict )
       result = pilotAgentsDB.getPilotInfo( pilotRefs )
       if not result['OK']:
         self.log.error( 'Failed to get pilots info from DB', result['Message'] )
-        continue
+        return S_OK( pilotStatusDict )
       pilotDict = result['Value']
-      if self.getOutput:
-        for pRef in pilotRefs:
-          self.log.info( 'Retrieving output for pilot %s' % pRef )
-          pilotStamp = pilotDict[pRef]['PilotStamp']
-          pRefStamp = pRef
-          if pilotStamp:
-            pRefStamp = pRef + ':::' + pilotStamp
-          result = ce.getJobOutput( pRefStamp )
-          if not result['OK']:
-            self.log.error( 'Failed to get pilot output', '%s: %s' % ( ceName, result['Message'] ) )
-          else:
-            output, error = result['Value']
-            result = pilotAgentsDB.storePilotOutput( pRef, output, error )
-            if not result['OK']:
-              self.log.error( 'Failed to store pilot output', result['Message'] )
+      for pRef in pilotRefs:
+        self.__retrievePilotOutput( ce, pRef, pilotDict[pRef]['PilotStamp'] )
 
-      # Check if the accounting is to be sent
-      if self.sendAccounting:
-        result = pilotAgentsDB.selectPilots( {'DestinationSite':ceName,
-                                              'Queue':queueName,
-                                              'GridType':ceType,
-                                              'GridSite':siteName,
-                                              'AccountingSent':'False',
-                                              'Status':FINAL_PILOT_STATUS} )
+    return S_OK( pilotStatusDict )
 
-        if not result['OK']:
-          self.log.error( 'Failed to select pilots', result['Message'] )
-          continue
-        pilotRefs = result['Value']
-        if not pilotRefs:
-          continue
-        result = pilotAgentsDB.getPilotInfo( pilotRefs )
-        if not result['OK']:
-          self.log.error( 'Failed to get pilots info from DB', result['Message'] )
-          continue
-        pilotDict = result['Value']
-        result = self.sendPilotAccounting( pilotDict )
-        if not result['OK']:
-          self.log.error( 'Failed to send pilot agent accounting' )
-
-    return S_OK()
+  def __retrievePilotOutput( self, ce, pRef, pilotStamp, storeEmpty = True ):
+    """ Get the output of a pilot from its CE and store it in the PilotAgentsDB
+    """
+    self.log.info( 'Retrieving output for pilot %s' % pRef )
+    pRefStamp = pRef
+    if pilotStamp:
+      pRefStamp = pRef + ':::' + pilotStamp
+    result = ce.getJobOutput( pRefStamp )
+    if not result['OK']:
+      self.log.error( 'Failed to get pilot output', '%s: %s' % ( pRef, result['Message'] ) )
+      return
+    output, error = result['Value']
+    if not output and not storeEmpty:
+      self.log.warn( 'Empty pilot output not stored to PilotDB' )
+      return
+    result = pilotAgentsDB.storePilotOutput( pRef, output, error )
+    if not result['OK']:
+      self.log.error( 'Failed to store pilot output', result['Message'] )
 
   def sendPilotAccounting( self, pilotDict ):
-    """ Send pilot accounting record
+    """ Send the accounting records of the pilots in a single commit and flag them as sent
     """
     for pRef in pilotDict:
       self.log.verbose( 'Preparing accounting record for pilot %s' % pRef )
@@ -1160,21 +1364,13 @@ EOF
       retVal = gDataStoreClient.addRegister( pA )
       if not retVal[ 'OK' ]:
         self.log.error( 'Failed to send accounting info for pilot ', pRef )
-      else:
-        # Set up AccountingSent flag
-        result = pilotAgentsDB.setAccountingFlag( pRef )
-        if not result['OK']:
-          self.log.error( 'Failed to set accounting flag for pilot ', pRef )
 
     self.log.info( 'Committing accounting records for %d pilots' % len( pilotDict ) )
     result = gDataStoreClient.commit()
-    if result['OK']:
-      for pRef in pilotDict:
-        self.log.verbose( 'Setting AccountingSent flag for pilot %s' % pRef )
-        result = pilotAgentsDB.setAccountingFlag( pRef )
-        if not result['OK']:
-          self.log.error( 'Failed to set accounting flag for pilot ', pRef )
-    else:
+    if not result['OK']:
       return result
 
+    result = pilotAgentsDB.setAccountingFlag( pilotDict.keys() )
+    if not result['OK']:
+      self.log.error( 'Failed to set accounting flag for pilots', result['Message'] )
     return S_OK()
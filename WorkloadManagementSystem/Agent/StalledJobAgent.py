@@ -15,6 +15,8 @@ from DIRAC.Core.Utilities.Time import fromString, toEpoch, dateTime, second
 from DIRAC import S_OK, S_ERROR, gConfig
 from DIRAC.Core.DISET.RPCClient import RPCClient
 from DIRAC.AccountingSystem.Client.Types.Job import Job
+from DIRAC.AccountingSystem.Client.DataStoreClient import gDataStoreClient
+from DIRAC.Core.Utilities.List import breakListIntoChunks
 from DIRAC.Core.Utilities.ClassAd.ClassAdLight import ClassAd
 from DIRAC.ConfigurationSystem.Client.Helpers import cfgPath
 from DIRAC.ConfigurationSystem.Client.PathFinder import getSystemInstance
@@ -36,6 +38,7 @@ for the agent restart
   matchedTime = 7200
   rescheduledTime = 600
   completedTime = 86400
+  bulkQuerySize = 1000
 
   #############################################################################
   def initialize( self ):
@@ -67,6 +70,7 @@ for the agent restart
     self.matchedTime = self.am_getOption( 'MatchedTime', self.matchedTime )
     self.rescheduledTime = self.am_getOption( 'RescheduledTime', self.rescheduledTime )
     self.completedTime = self.am_getOption( 'CompletedTime', self.completedTime )
+    self.bulkQuerySize = self.am_getOption( 'BulkQuerySize', self.bulkQuerySize )
 
     self.log.verbose( 'StalledTime = %s cycles' % ( stalledTime ) )
     self.log.verbose( 'FailedTime = %s cycles' % ( failedTime ) )
@@ -111,23 +115,39 @@ for the agent restart
       return result
     if not result['Value']:
       return S_OK()
-    jobs = result['Value']
+    jobs = sorted( [ int( job ) for job in result['Value'] ] )
     self.log.info( '%s Running jobs will be checked for being stalled' % ( len( jobs ) ) )
-    jobs.sort()
-# jobs = jobs[:10] #for debugging
-    for job in jobs:
-      site = self.jobDB.getJobAttribute( job, 'site' )['Value']
-      if site in self.stalledJobsTolerantSites:
-        result = self.__getStalledJob( job, stalledTime + self.stalledJobsToleranceTime )
-      else:
-        result = self.__getStalledJob( job, stalledTime )
-      if result['OK']:
-        self.log.verbose( 'Updating status to Stalled for job %s' % ( job ) )
-        self.__updateJobStatus( job, 'Stalled' )
-        stalledCounter += 1
-      else:
-        self.log.verbose( result['Message'] )
-        runningCounter += 1
+
+    # The jobs are grouped by minor status, which is retained in the logging record
+    stalledJobs = {}
+    currentTime = toEpoch()
+    for jobChunk in breakListIntoChunks( jobs, self.bulkQuerySize ):
+      result = self.jobDB.getAttributesForJobList( jobChunk, ['Site', 'MinorStatus', 'HeartBeatTime', 'LastUpdateTime'] )
+      if not result['OK']:
+        self.log.error( 'Failed to get job attributes', result['Message'] )
+        continue
+      for job in jobChunk:
+        jobDict = result['Value'].get( job )
+        if not jobDict:
+          self.log.error( 'Could not get attributes for job', '%s' % job )
+          continue
+        latestUpdate = self.__getLatestUpdateTime( job, jobDict )
+        if not latestUpdate:
+          continue
+        jobStalledTime = stalledTime
+        if jobDict['Site'] in self.stalledJobsTolerantSites:
+          jobStalledTime += self.stalledJobsToleranceTime
+        elapsedTime = currentTime - latestUpdate
+        if elapsedTime > jobStalledTime:
+          self.log.info( 'Job %s is identified as stalled with last update > %s secs ago' % ( job, elapsedTime ) )
+          stalledJobs.setdefault( jobDict['MinorStatus'], [] ).append( job )
+          stalledCounter += 1
+        else:
+          runningCounter += 1
+
+    for minorStatus, jobIDs in stalledJobs.items():
+      self.log.verbose( 'Updating status to Stalled for jobs %s' % jobIDs )
+      self.__updateJobStatus( jobIDs, 'Stalled', retainedMinorStatus = minorStatus )
 
     self.log.info( 'Total jobs: %s, Stalled job count: %s, Running job count: %s' %
                    ( len( jobs ), stalledCounter, runningCounter ) )
@@ -141,7 +161,7 @@ for the agent restart
     result = self.jobDB.selectJobs( {'Status':'Stalled'} )
     if not result['OK']:
       return result
-    jobs = result['Value']
+    jobs = [ int( job ) for job in result['Value'] ]
 
     failedCounter = 0
     minorStalledStatuses = ( "Job stalled: pilot not running", 'Stalling for more than %d sec' % failedTime )
@@ -149,35 +169,44 @@ for the agent restart
     if jobs:
       self.log.info( '%s Stalled jobs will be checked for failure' % ( len( jobs ) ) )
 
-      for job in jobs:
-        setFailed = False
-        # Check if the job pilot is lost
-        result = self.__getJobPilotStatus( job )
+      failedJobs = dict( ( minor, [] ) for minor in minorStalledStatuses )
+      currentTime = toEpoch()
+      for jobChunk in breakListIntoChunks( jobs, self.bulkQuerySize ):
+        # Check if the job pilots are lost
+        result = self.__getJobPilotStatus( jobChunk )
         if not result['OK']:
           self.log.error( 'Failed to get pilot status', result['Message'] )
           continue
-        pilotStatus = result['Value']
-        if pilotStatus != "Running":
-          setFailed = minorStalledStatuses[0]
-        else:
+        pilotStatusDict = result['Value']
+        result = self.jobDB.getAttributesForJobList( jobChunk, ['HeartBeatTime', 'LastUpdateTime'] )
+        if not result['OK']:
+          self.log.error( 'Failed to get job update time', result['Message'] )
+          continue
+        jobsDict = result['Value']
 
-          result = self.__getLatestUpdateTime( job )
-          if not result['OK']:
-            self.log.error( 'Failed to get job update time', result['Message'] )
+        for job in jobChunk:
+          if job not in pilotStatusDict:
+            continue
+          if pilotStatusDict[job] != "Running":
+            failedJobs[minorStalledStatuses[0]].append( job )
             continue
-          elapsedTime = toEpoch() - result['Value']
-          if elapsedTime > failedTime:
-            setFailed = minorStalledStatuses[1]
-
-        # Set the jobs Failed, send them a kill signal in case they are not really dead and send accounting info
-        if setFailed:
-          # Send a kill signal to the job such that it cannot continue running
-          WMSClient().killJob( job )
-          self.__updateJobStatus( job, 'Failed', setFailed )
-          failedCounter += 1
-          result = self.__sendAccounting( job )
-          if not result['OK']:
-            self.log.error( 'Failed to send accounting', result['Message'] )
+          latestUpdate = self.__getLatestUpdateTime( job, jobsDict.get( job, {} ) )
+          if not latestUpdate:
+            continue
+          if currentTime - latestUpdate > failedTime:
+            failedJobs[minorStalledStatuses[1]].append( job )
+
+      # Set the jobs Failed, send them a kill signal in case they are not really dead and send accounting info
+      for minorStatus, jobIDs in failedJobs.items():
+        if not jobIDs:
+          continue
+        # Send a kill signal to the jobs such that they cannot continue running
+        WMSClient().killJob( jobIDs )
+        self.__updateJobStatus( jobIDs, 'Failed', minorStatus )
+        failedCounter += len( jobIDs )
+        result = self.__sendAccounting( jobIDs )
+        if not result['OK']:
+          self.log.error( 'Failed to send accounting', result['Message'] )
 
     recoverCounter = 0
 
@@ -188,15 +217,11 @@ for the agent restart
       if result['Value']:
         jobs = result['Value']
         self.log.info( '%s Stalled jobs will be Accounted' % ( len( jobs ) ) )
-        for job in jobs:
-          result = self.__sendAccounting( job )
-          if not result['OK']:
-            self.log.error( 'Failed to send accounting', result['Message'] )
-            continue
-
-          recoverCounter += 1
-      if not result['OK']:
-        break
+        result = self.__sendAccounting( jobs )
+        if not result['OK']:
+          self.log.error( 'Failed to send accounting', result['Message'] )
+          break
+        recoverCounter += result['Value']
 
     if failedCounter:
       self.log.info( '%d jobs set to Failed' % failedCounter )
@@ -205,151 +230,200 @@ for the agent restart
     return S_OK( failedCounter )
 
   #############################################################################
-  def __getJobPilotStatus( self, jobID ):
-    """ Get the job pilot status
-"""
-    result = self.jobDB.getJobParameter( jobID, 'Pilot_Reference' )
-    if not result['OK']:
-      return result
-    if not result['Value']:
-      return S_ERROR( 'Failed to get the pilot reference' )
+  def __getJobPilotStatus( self, jobIDs ):
+    """ Get the pilot status of a list of jobs
 
-    pilotReference = result['Value']
-    wmsAdminClient = RPCClient( 'WorkloadManagement/WMSAdministrator' )
-    result = wmsAdminClient.getPilotInfo( pilotReference )
-    if not result['OK']:
-      if "No pilots found" in result['Message']:
-        self.log.warn( result['Message'] )
-        return S_OK( 'NoPilot' )
-      self.log.error( 'Failed to get pilot information', result['Message'] )
-      return S_ERROR( 'Failed to get the pilot status' )
-    pilotStatus = result['Value'][pilotReference]['Status']
-
-    return S_OK( pilotStatus )
-
-
-  #############################################################################
-  def __getStalledJob( self, job, stalledTime ):
-    """ Compares the most recent of LastUpdateTime and HeartBeatTime against
-the stalledTime limit.
+    :return: S_OK( { jobID : pilotStatus } ), jobs without pilot reference are not included
 """
-    result = self.__getLatestUpdateTime( job )
+    result = self.jobDB.getJobParametersForJobList( jobIDs, ['Pilot_Reference'] )
     if not result['OK']:
       return result
 
-    currentTime = toEpoch()
-    lastUpdate = result['Value']
+    pilotReferences = {}
+    for jobID in jobIDs:
+      pilotReference = result['Value'].get( int( jobID ), {} ).get( 'Pilot_Reference' )
+      if not pilotReference:
+        self.log.error( 'Failed to get the pilot reference', 'for job %s' % jobID )
+        continue
+      pilotReferences[jobID] = pilotReference
+    if not pilotReferences:
+      return S_OK( {} )
 
-    elapsedTime = currentTime - lastUpdate
-    self.log.verbose( '(CurrentTime-LastUpdate) = %s secs' % ( elapsedTime ) )
-    if elapsedTime > stalledTime:
-      self.log.info( 'Job %s is identified as stalled with last update > %s secs ago' % ( job, elapsedTime ) )
-      return S_OK( 'Stalled' )
+    wmsAdminClient = RPCClient( 'WorkloadManagement/WMSAdministrator' )
+    result = wmsAdminClient.getPilotInfo( list( set( pilotReferences.values() ) ) )
+    if not result['OK']:
+      if "No pilots found" not in result['Message']:
+        self.log.error( 'Failed to get pilot information', result['Message'] )
+        return S_ERROR( 'Failed to get the pilot status' )
+      self.log.warn( result['Message'] )
+      pilotsDict = {}
+    else:
+      pilotsDict = result['Value']
 
-    return S_ERROR( 'Job %s is running and will be ignored' % job )
+    pilotStatusDict = {}
+    for jobID, pilotReference in pilotReferences.items():
+      if pilotReference in pilotsDict:
+        pilotStatusDict[jobID] = pilotsDict[pilotReference]['Status']
+      else:
+        pilotStatusDict[jobID] = 'NoPilot'
+    return S_OK( pilotStatusDict )
 
   #############################################################################
-  def __getLatestUpdateTime( self, job ):
-    """ Returns the most recent of HeartBeatTime and LastUpdateTime
+  def __getLatestUpdateTime( self, job, jobDict ):
+    """ Returns the most recent of HeartBeatTime and LastUpdateTime taken from the
+job attributes, 0 if both are null
 """
-    result = self.jobDB.getJobAttributes( job, ['HeartBeatTime', 'LastUpdateTime'] )
-    if not result['OK']:
-      self.log.error( 'Failed to get job attributes', result['Message'] )
-    if not result['OK'] or not result['Value']:
-      self.log.error( 'Could not get attributes for job', '%s' % job )
-      return S_ERROR( 'Could not get attributes for job' )
-
-    self.log.verbose( result )
     latestUpdate = 0
-    if not result['Value']['HeartBeatTime'] or result['Value']['HeartBeatTime'] == 'None':
+    if not jobDict.get( 'HeartBeatTime' ) or jobDict['HeartBeatTime'] == 'None':
       self.log.verbose( 'HeartBeatTime is null for job %s' % job )
     else:
-      latestUpdate = toEpoch( fromString( result['Value']['HeartBeatTime'] ) )
+      latestUpdate = toEpoch( fromString( jobDict['HeartBeatTime'] ) )
 
-    if not result['Value']['LastUpdateTime'] or result['Value']['LastUpdateTime'] == 'None':
+    if not jobDict.get( 'LastUpdateTime' ) or jobDict['LastUpdateTime'] == 'None':
       self.log.verbose( 'LastUpdateTime is null for job %s' % job )
     else:
-      lastUpdate = toEpoch( fromString( result['Value']['LastUpdateTime'] ) )
+      lastUpdate = toEpoch( fromString( jobDict['LastUpdateTime'] ) )
       if latestUpdate < lastUpdate:
         latestUpdate = lastUpdate
 
     if not latestUpdate:
-      return S_ERROR( 'LastUpdate and HeartBeat times are null for job %s' % job )
+      self.log.error( 'LastUpdate and HeartBeat times are null for job %s' % job )
     else:
       self.log.verbose( 'Latest update time from epoch for job %s is %s' % ( job, latestUpdate ) )
-      return S_OK( latestUpdate )
+    return latestUpdate
 
   #############################################################################
-  def __updateJobStatus( self, job, status, minorstatus = None ):
-    """ This method updates the job status in the JobDB, this should only be
-used to fail jobs due to the optimizer chain.
+  def __updateJobStatus( self, jobIDs, status, minorstatus = None, retainedMinorStatus = 'idem' ):
+    """ This method updates the status of a list of jobs in the JobDB with a single
+update and adds their logging records with a single insertion. If no minor status
+is given, the retained one is used for the logging records.
 """
-    self.log.verbose( "self.jobDB.setJobAttribute(%s,'Status','%s',update=True)" % ( job, status ) )
+    self.log.verbose( "self.jobDB.setJobAttributes(%s,['Status'],['%s'],update=True)" % ( jobIDs, status ) )
 
-    if self.am_getOption( 'Enable', True ):
-      result = self.jobDB.setJobAttribute( job, 'Status', status, update = True )
+    attrNames = ['Status']
+    attrValues = [status]
+    if minorstatus:
+      attrNames.append( 'MinorStatus' )
+      attrValues.append( minorstatus )
     else:
-      result = S_OK( 'DisabledMode' )
-
-    if result['OK']:
-      if minorstatus:
-        self.log.verbose( "self.jobDB.setJobAttribute(%s,'MinorStatus','%s',update=True)" % ( job, minorstatus ) )
-        result = self.jobDB.setJobAttribute( job, 'MinorStatus', minorstatus, update = True )
+      minorstatus = retainedMinorStatus
 
-    if not minorstatus:  # Retain last minor status for stalled jobs
-      result = self.jobDB.getJobAttributes( job, ['MinorStatus'] )
-      if result['OK']:
-        minorstatus = result['Value']['MinorStatus']
+    if self.am_getOption( 'Enable', True ):
+      result = self.jobDB.setJobAttributes( jobIDs, attrNames, attrValues, update = True )
+      if not result['OK']:
+        self.log.error( 'Failed to update job status', result['Message'] )
+        return result
 
-    logStatus = status
-    result = self.logDB.addLoggingRecord( job, status = logStatus, minor = minorstatus, source = 'StalledJobAgent' )
+    result = self.logDB.addLoggingRecord( jobIDs, status = status, minor = minorstatus, source = 'StalledJobAgent' )
     if not result['OK']:
       self.log.warn( result )
 
     return result
 
-  def __getProcessingType( self, jobID ):
+  def __getProcessingType( self, jdl ):
     """ Get the Processing Type from the JDL, until it is promoted to a real Attribute
 """
     processingType = 'unknown'
-    result = self.jobDB.getJobJDL( jobID, original = True )
-    if not result['OK']:
+    if not jdl:
       return processingType
-    classAdJob = ClassAd( result['Value'] )
+    classAdJob = ClassAd( jdl )
     if classAdJob.lookupAttribute( 'ProcessingType' ):
       processingType = classAdJob.getAttributeString( 'ProcessingType' )
     return processingType
 
 
   #############################################################################
-  def __sendAccounting( self, jobID ):
-    """ Send WMS accounting data for the given job
+  def __sendAccounting( self, jobIDs ):
+    """ Send WMS accounting data for the given jobs with a single commit. The job
+information is retrieved with a few queries per chunk of jobs
+
+    :return: S_OK( number of accounted jobs )
+"""
+    accountedJobs = []
+    for jobChunk in breakListIntoChunks( [ int( jobID ) for jobID in jobIDs ], self.bulkQuerySize ):
+      result = self.__getAccountingInfo( jobChunk )
+      if not result['OK']:
+        return result
+      jobsDict, loggingDict, heartBeatDict, parametersDict, jdlDict = result['Value']
+
+      for jobID in jobChunk:
+        jobDict = jobsDict.get( jobID )
+        if not jobDict:
+          self.log.error( 'Could not get attributes for job', '%s' % jobID )
+          continue
+        cpuNormalization = parametersDict.get( jobID, {} ).get( 'CPUNormalizationFactor' )
+        result = self.__getAccountingReport( jobID, jobDict, loggingDict.get( jobID, [] ),
+                                             heartBeatDict.get( jobID, [] ), cpuNormalization,
+                                             jdlDict.get( jobID ) )
+        if not result['OK']:
+          continue
+        gDataStoreClient.addRegister( result['Value'] )
+        accountedJobs.append( jobID )
+    if not accountedJobs:
+      return S_OK( 0 )
+
+    result = gDataStoreClient.commit()
+    if not result['OK']:
+      self.log.error( 'Failed to send accounting report', 'Jobs: %s, Error: %s' % ( accountedJobs, result['Message'] ) )
+      return result
+    result = self.jobDB.setJobAttributes( accountedJobs, ['AccountedFlag'], ['True'] )
+    if not result['OK']:
+      return result
+    return S_OK( len( accountedJobs ) )
+
+  def __getAccountingInfo( self, jobIDs ):
+    """ Get the attributes, logging records, heart beat data, CPU normalization factors and
+original JDLs needed to build the accounting reports of the jobs, with one query each
+"""
+    result = self.jobDB.getAttributesForJobList( jobIDs )
+    if not result['OK']:
+      return result
+    jobsDict = result['Value']
+
+    result = self.logDB.getJobLoggingInfoForJobList( jobIDs )
+    if not result['OK']:
+      self.log.warn( 'Failed to get the logging records', result['Message'] )
+    loggingDict = result.get( 'Value', {} )
+
+    result = self.jobDB.getHeartBeatDataForJobList( jobIDs )
+    if not result['OK']:
+      self.log.warn( 'Failed to get the heart beat data', result['Message'] )
+    heartBeatDict = result.get( 'Value', {} )
+
+    result = self.jobDB.getJobParametersForJobList( jobIDs, ['CPUNormalizationFactor'] )
+    if not result['OK']:
+      self.log.warn( 'Failed to get the CPU normalization factors', result['Message'] )
+    parametersDict = result.get( 'Value', {} )
+
+    result = self.jobDB.getJobJDLs( jobIDs, original = True )
+    if not result['OK']:
+      self.log.warn( 'Failed to get the job JDLs', result['Message'] )
+    jdlDict = result.get( 'Value', {} )
+
+    return S_OK( ( jobsDict, loggingDict, heartBeatDict, parametersDict, jdlDict ) )
+
+  def __getAccountingReport( self, jobID, jobDict, logList, heartBeatData, cpuNormalization, jdl ):
+    """ Build the WMS accounting report for the given job
 """
     try:
       accountingReport = Job()
       endTime = 'Unknown'
       lastHeartBeatTime = 'Unknown'
 
-      result = self.jobDB.getJobAttributes( jobID )
-      if not result['OK']:
-        return result
-      jobDict = result['Value']
-
-      startTime, endTime = self.__checkLoggingInfo( jobID, jobDict )
-      lastCPUTime, lastWallTime, lastHeartBeatTime = self.__checkHeartBeat( jobID, jobDict )
+      startTime, endTime = self.__checkLoggingInfo( jobID, jobDict, logList )
+      lastCPUTime, lastWallTime, lastHeartBeatTime = self.__checkHeartBeat( jobID, jobDict, heartBeatData )
       lastHeartBeatTime = fromString( lastHeartBeatTime )
       if lastHeartBeatTime is not None and lastHeartBeatTime > endTime:
         endTime = lastHeartBeatTime
 
-      cpuNormalization = self.jobDB.getJobParameter( jobID, 'CPUNormalizationFactor' )
-      if not cpuNormalization['OK'] or not cpuNormalization['Value']:
+      if not cpuNormalization:
         cpuNormalization = 0.0
       else:
-        cpuNormalization = float( cpuNormalization['Value'] )
+        cpuNormalization = float( cpuNormalization )
     except Exception:
-      self.log.exception( "Exception in __sendAccounting for job %s: endTime=%s, lastHBTime %s" % ( str( jobID ), str( endTime ), str( lastHeartBeatTime ) ), '' , False )
+      self.log.exception( "Exception in __getAccountingReport for job %s: endTime=%s, lastHBTime %s" % ( str( jobID ), str( endTime ), str( lastHeartBeatTime ) ), '' , False )
       return S_ERROR( "Exception" )
-    processingType = self.__getProcessingType( jobID )
+    processingType = self.__getProcessingType( jdl )
 
     accountingReport.setStartTime( startTime )
     accountingReport.setEndTime( endTime )
@@ -386,26 +460,19 @@ used to fail jobs due to the optimizer chain.
     self.log.verbose( 'Accounting Report is:' )
     self.log.verbose( acData )
     accountingReport.setValuesFromDict( acData )
+    return S_OK( accountingReport )
 
-    result = accountingReport.commit()
-    if result['OK']:
-      self.jobDB.setJobAttribute( jobID, 'AccountedFlag', 'True' )
-    else:
-      self.log.error( 'Failed to send accounting report', 'Job: %d, Error: %s' % ( int( jobID ), result['Message'] ) )
-    return result
-
-  def __checkHeartBeat( self, jobID, jobDict ):
+  def __checkHeartBeat( self, jobID, jobDict, heartBeatData ):
     """ Get info from HeartBeat
 """
-    result = self.jobDB.getHeartBeatData( jobID )
     lastCPUTime = 0
     lastWallTime = 0
     lastHeartBeatTime = jobDict['StartExecTime']
     if lastHeartBeatTime == "None":
       lastHeartBeatTime = 0
 
-    if result['OK']:
-      for name, value, heartBeatTime in result['Value']:
+    if heartBeatData:
+      for name, value, heartBeatTime in heartBeatData:
         if 'CPUConsumed' == name:
           try:
             value = int( float( value ) )
@@ -425,14 +492,9 @@ used to fail jobs due to the optimizer chain.
 
     return lastCPUTime, lastWallTime, lastHeartBeatTime
 
-  def __checkLoggingInfo( self, jobID, jobDict ):
+  def __checkLoggingInfo( self, jobID, jobDict, logList ):
     """ Get info from JobLogging
 """
-    logList = []
-    result = self.logDB.getJobLoggingInfo( jobID )
-    if result['OK']:
-      logList = result['Value']
-
     startTime = jobDict['StartExecTime']
     if not startTime or startTime == 'None':
       # status, minor, app, stime, source
@@ -476,9 +538,9 @@ used to fail jobs due to the optimizer chain.
     jobIDs = result['Value']
     if jobIDs:
       self.log.info( 'Rescheduling %d jobs stuck in Matched status' % len( jobIDs ) )
-      result = self.jobDB.rescheduleJobs( jobIDs )
-      if 'FailedJobs' in result:
-        message = 'Failed to reschedule %d jobs stuck in Matched status' % len( result['FailedJobs'] )
+      failedJobs = self.__rescheduleJobs( jobIDs )
+      if failedJobs:
+        message = 'Failed to reschedule %d jobs stuck in Matched status' % len( failedJobs )
 
     checkTime = str( dateTime() - self.rescheduledTime * second )
     result = self.jobDB.selectJobs( {'Status':'Rescheduled'}, older = checkTime )
@@ -489,17 +551,28 @@ used to fail jobs due to the optimizer chain.
     jobIDs = result['Value']
     if jobIDs:
       self.log.info( 'Rescheduling %d jobs stuck in Rescheduled status' % len( jobIDs ) )
-      result = self.jobDB.rescheduleJobs( jobIDs )
-      if 'FailedJobs' in result:
+      failedJobs = self.__rescheduleJobs( jobIDs )
+      if failedJobs:
         if message:
           message += '\n'
-        message += 'Failed to reschedule %d jobs stuck in Rescheduled status' % len( result['FailedJobs'] )
+        message += 'Failed to reschedule %d jobs stuck in Rescheduled status' % len( failedJobs )
 
     if message:
       return S_ERROR( message )
     else:
       return S_OK()
 
+  def __rescheduleJobs( self, jobIDs ):
+    """ Reschedule the jobs in chunks
+
+    :return: list of jobs that could not be rescheduled
+    """
+    failedJobs = []
+    for jobChunk in breakListIntoChunks( jobIDs, self.bulkQuerySize ):
+      result = self.jobDB.rescheduleJobs( jobChunk )
+      failedJobs += result.get( 'FailedJobs', [] )
+    return failedJobs
+
   def __failCompletedJobs( self ):
     """ Failed Jobs stuck in Completed Status for a long time.
       They are due to pilots being killed during the
@@ -513,27 +586,27 @@ used to fail jobs due to the optimizer chain.
       self.log.error( 'Failed to select jobs', result['Message'] )
       return result
 
-    jobIDs = result['Value']
+    jobIDs = [ int( jobID ) for jobID in result['Value'] ]
     if not jobIDs:
       return S_OK()
 
-    # Remove those with Minor Status "Pending Requests"
-    for jobID in jobIDs:
-      result = self.jobDB.getJobAttributes( jobID, ['Status', 'MinorStatus'] )
+    for jobChunk in breakListIntoChunks( jobIDs, self.bulkQuerySize ):
+      result = self.jobDB.getAttributesForJobList( jobChunk, ['Status', 'MinorStatus'] )
       if not result['OK']:
         self.log.error( 'Failed to get job attributes', result['Message'] )
         continue
-      if result['Value']['Status'] != "Completed":
-        continue
-      if result['Value']['MinorStatus'] == "Pending Requests":
+      # Remove those with Minor Status "Pending Requests"
+      failedJobs = [ jobID for jobID in jobChunk
+                     if jobID in result['Value']
+                     and result['Value'][jobID]['Status'] == "Completed"
+                     and result['Value'][jobID]['MinorStatus'] != "Pending Requests" ]
+      if not failedJobs:
         continue
 
-      result = self.__updateJobStatus( jobID, 'Failed',
-                                       "Job died during finalization" )
-      result = self.__sendAccounting( jobID )
+      result = self.__updateJobStatus( failedJobs, 'Failed', "Job died during finalization" )
+      result = self.__sendAccounting( failedJobs )
       if not result['OK']:
         self.log.error( 'Failed to send accounting', result['Message'] )
-        continue
 
     return S_OK()
 
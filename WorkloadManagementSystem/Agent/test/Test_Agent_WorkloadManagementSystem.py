@@ -2,13 +2,15 @@
 """
 
 # imports
-import unittest, importlib
-from mock import MagicMock
+import unittest, importlib, time, datetime, threading
+from mock import MagicMock, patch
 
-from DIRAC import gLogger
+from DIRAC import gLogger, S_OK, S_ERROR
 
 # sut
 from DIRAC.WorkloadManagementSystem.Agent.SiteDirector import SiteDirector
+from DIRAC.WorkloadManagementSystem.Agent.StalledJobAgent import StalledJobAgent
+from DIRAC.WorkloadManagementSystem.Agent.JobAgent import JobAgent
 
 class AgentsTestCase( unittest.TestCase ):
   """ Base class for the Agents test cases
@@ -36,6 +38,218 @@ class SiteDirectorBaseSuccess( AgentsTestCase ):
     self.sd.queueDict['aQueue']['ParametersDict'] = {}
     _res = self.sd._getPilotOptions( 'aQueue', 10 )
 
+  def test__executeSubmissions( self ):
+    self.sd.queueDict = { 'fast_q%d' % i : { 'CEType' : 'Fast' } for i in range( 6 ) }
+    self.sd.queueDict['slow_q'] = { 'CEType' : 'Slow' }
+    self.sd.submissionThreadsPerCEType = 2
+    self.sd.queueSubmissionTimeout = 1
+    running = { 'Fast' : 0, 'Max' : 0 }
+
+    def submitPilots( queue, _submission ):
+      if queue == 'slow_q':
+        time.sleep( 5 )
+        return S_OK( 100 )
+      with self.sd.submissionLock:
+        running['Fast'] += 1
+        running['Max'] = max( running['Max'], running['Fast'] )
+      time.sleep( 0.1 )
+      with self.sd.submissionLock:
+        running['Fast'] -= 1
+      return S_OK( 1 )
+
+    self.sd._submitPilotsToQueue = submitPilots
+    startTime = time.time()
+    res = self.sd._executeSubmissions( dict( ( queue, {} ) for queue in self.sd.queueDict ) )
+    self.assert_( time.time() - startTime < 4 )
+    self.assertEqual( res, 6 )
+    self.assertEqual( running['Max'], 2 )
+    self.assertEqual( self.sd.failedQueues['slow_q'], 1 )
+    self.assertEqual( self.sd.busyQueues, set( [ 'slow_q' ] ) )
+
+  def test__executeInQueueThreads( self ):
+    self.sd.queueDict = dict( ( queue, { 'CEType' : 'Slow' } ) for queue in ( 'q1', 'q2', 'q3' ) )
+    self.sd.submissionThreadsPerCEType = 1
+    takenOver = threading.Event()
+    calls = []
+
+    def submitPilots( queue, _submission ):
+      calls.append( ( queue, threading.current_thread() ) )
+      if len( calls ) == 1:
+        # Over as soon as the worker is replaced
+        takenOver.wait( 10 )
+      elif len( calls ) == 2:
+        takenOver.set()
+        time.sleep( 0.5 )
+      return S_OK( 1 )
+
+    res = self.sd._executeInQueueThreads( submitPilots, { 'q1' : 1, 'q2' : 2, 'q3' : 3 }, 1 )
+    self.assertEqual( len( calls ), 3 )
+    self.assertFalse( res[calls[0][0]][0]['OK'] )
+    self.assertTrue( res[calls[1][0]][0]['OK'] )
+    self.assertTrue( res[calls[2][0]][0]['OK'] )
+    # The abandoned worker did not take the last queue
+    self.assertFalse( calls[0][1] is calls[1][1] )
+    self.assertTrue( calls[2][1] is calls[1][1] )
+
+  def test_updatePilotStatus( self ):
+    pilotDBMock = MagicMock()
+    self.sd_m.pilotAgentsDB = pilotDBMock
+    self.sd.getOutput = False
+    self.sd.sendAccounting = True
+    self.sd.queueDict = {}
+    for i in range( 2 ):
+      ceMock = MagicMock()
+      ceMock.isProxyValid.return_value = S_OK()
+      ceMock.getJobStatus.return_value = S_OK( { 'pilot%d_1' % i : 'Running', 'pilot%d_2' % i : 'Done' } )
+      self.sd.queueDict['queue%d' % i] = { 'CE' : ceMock, 'CEName' : 'ce%d' % i, 'QueueName' : 'queue',
+                                           'CEType' : 'Type%d' % i, 'Site' : 'Some.Site' }
+    pilotDBMock.selectPilots.side_effect = lambda condDict: S_OK( [ 'pilot%s_1' % condDict['DestinationSite'][-1],
+                                                                    'pilot%s_2' % condDict['DestinationSite'][-1] ] )
+    pilotDBMock.getPilotInfo.side_effect = lambda pilotRefs: S_OK( dict( ( pRef, { 'Status' : 'Submitted',
+                                                                                    'PilotStamp' : '',
+                                                                                    'LastUpdateTime' : datetime.datetime.utcnow(),
+                                                                                    'OutputReady' : 'False' } )
+                                                                         for pRef in pilotRefs ) )
+    pilotDBMock.setPilotsStatus.return_value = S_OK( 4 )
+    self.sd.sendPilotAccounting = MagicMock( return_value = S_OK() )
+
+    res = self.sd.updatePilotStatus()
+    self.assert_( res['OK'] )
+    pilotDBMock.setPilotStatus.assert_not_called()
+    self.assertEqual( pilotDBMock.setPilotsStatus.call_count, 1 )
+    self.assertEqual( pilotDBMock.setPilotsStatus.call_args[0][0], { 'pilot0_1' : 'Running', 'pilot0_2' : 'Done',
+                                                                     'pilot1_1' : 'Running', 'pilot1_2' : 'Done' } )
+    self.assertEqual( self.sd.sendPilotAccounting.call_count, 1 )
+    self.assertEqual( sorted( self.sd.sendPilotAccounting.call_args[0][0] ),
+                      [ 'pilot0_1', 'pilot0_2', 'pilot1_1', 'pilot1_2' ] )
+
+class StalledJobAgentSuccess( AgentsTestCase ):
+
+  def test__markStalledJobs( self ):
+    sja = StalledJobAgent.__new__( StalledJobAgent )
+    sja.log = gLogger
+    sja.am_getOption = MagicMock( return_value = True )
+    sja.stalledJobsTolerantSites = ['Tolerant.Site']
+    sja.stalledJobsToleranceTime = 7200
+    sja.jobDB = MagicMock()
+    sja.logDB = MagicMock()
+    sja.jobDB.selectJobs.return_value = S_OK( [ '3', '1', '2' ] )
+    sja.jobDB.getAttributesForJobList.return_value = S_OK( {
+        1 : { 'Site' : 'Some.Site', 'MinorStatus' : 'Application', 'HeartBeatTime' : '2000-01-01 00:00:00',
+              'LastUpdateTime' : 'None' },
+        2 : { 'Site' : 'Tolerant.Site', 'MinorStatus' : 'Application', 'HeartBeatTime' : 'None',
+              'LastUpdateTime' : '2000-01-01 00:00:00' },
+        3 : { 'Site' : 'Tolerant.Site', 'MinorStatus' : 'Uploading', 'HeartBeatTime' : '2000-01-01 00:00:00',
+              'LastUpdateTime' : '2000-01-01 00:00:00' } } )
+    sja.jobDB.setJobAttributes.return_value = S_OK()
+    sja.logDB.addLoggingRecord.return_value = S_OK()
+
+    res = sja._StalledJobAgent__markStalledJobs( 3600 )
+    self.assert_( res['OK'] )
+    self.assertEqual( sja.jobDB.getAttributesForJobList.call_count, 1 )
+    updatedJobs = sorted( sum( [ call[0][0] for call in sja.jobDB.setJobAttributes.call_args_list ], [] ) )
+    self.assertEqual( updatedJobs, [ 1, 2, 3 ] )
+    loggedMinors = sorted( call[1]['minor'] for call in sja.logDB.addLoggingRecord.call_args_list )
+    self.assertEqual( loggedMinors, [ 'Application', 'Uploading' ] )
+
+  def test__sendAccounting( self ):
+    sja = StalledJobAgent.__new__( StalledJobAgent )
+    sja.log = gLogger
+    sja.bulkQuerySize = 2
+    sja.jobDB = MagicMock()
+    sja.logDB = MagicMock()
+    jobDict = { 'Site' : 'Some.Site', 'Owner' : 'user', 'OwnerGroup' : 'group', 'JobGroup' : 'jobGroup',
+                'JobType' : 'User', 'JobSplitType' : 'Single', 'StartExecTime' : '2000-01-01 00:00:00',
+                'SubmissionTime' : '2000-01-01 00:00:00' }
+    sja.jobDB.getAttributesForJobList.side_effect = lambda jobIDs: S_OK( dict( ( jobID, dict( jobDict ) )
+                                                                               for jobID in jobIDs ) )
+    sja.logDB.getJobLoggingInfoForJobList.return_value = S_OK( { 1 : [ ( 'Running', 'Application', 'Unknown',
+                                                                         '2000-01-01 00:10:00', 'JobWrapper' ),
+                                                                       ( 'Stalled', 'Application', 'Unknown',
+                                                                         '2000-01-01 05:00:00', 'StalledJobAgent' ) ] } )
+    sja.jobDB.getHeartBeatDataForJobList.return_value = S_OK( { 1 : [ ( 'CPUConsumed', '100.0', '2000-01-01 01:00:00' ),
+                                                                      ( 'CPUConsumed', '200.0', '2000-01-01 02:00:00' ),
+                                                                      ( 'WallClockTime', '50.0', '2000-01-01 02:00:00' ) ] } )
+    sja.jobDB.getJobParametersForJobList.return_value = S_OK( { 1 : { 'CPUNormalizationFactor' : '2.0' } } )
+    sja.jobDB.getJobJDLs.return_value = S_OK( { 1 : '[ ProcessingType = "Simulation"; ]' } )
+    sja.jobDB.setJobAttributes.return_value = S_OK()
+
+    sa_m = importlib.import_module( 'DIRAC.WorkloadManagementSystem.Agent.StalledJobAgent' )
+    dataStoreClient = sa_m.gDataStoreClient
+    sa_m.gDataStoreClient = MagicMock()
+    sa_m.gDataStoreClient.commit.return_value = S_OK()
+    try:
+      res = sja._StalledJobAgent__sendAccounting( [ '1', '2', '3' ] )
+      registers = [ call[0][0] for call in sa_m.gDataStoreClient.addRegister.call_args_list ]
+    finally:
+      sa_m.gDataStoreClient = dataStoreClient
+
+    self.assert_( res['OK'] )
+    self.assertEqual( res['Value'], 3 )
+    # One query of each kind per chunk, nothing per job
+    self.assertEqual( sja.jobDB.getAttributesForJobList.call_count, 2 )
+    self.assertEqual( sja.logDB.getJobLoggingInfoForJobList.call_count, 2 )
+    self.assertEqual( sja.jobDB.getHeartBeatDataForJobList.call_count, 2 )
+    self.assertFalse( sja.jobDB.getHeartBeatData.called )
+    self.assertFalse( sja.logDB.getJobLoggingInfo.called )
+    self.assertFalse( sja.jobDB.getJobParameter.called )
+    self.assertFalse( sja.jobDB.getJobJDL.called )
+    self.assertEqual( sja.jobDB.setJobAttributes.call_args[0][0], [ 1, 2, 3 ] )
+    acData = registers[0].getContents()
+    self.assertEqual( acData['CPUTime'], 200 )
+    self.assertEqual( acData['NormCPUTime'], 400.0 )
+    self.assertEqual( acData['ExecTime'], 200 )
+    self.assertEqual( acData['ProcessingType'], 'Simulation' )
+    self.assertEqual( registers[1].getContents()['ProcessingType'], 'unknown' )
+
+  def test__rescheduleJobs( self ):
+    sja = StalledJobAgent.__new__( StalledJobAgent )
+    sja.log = gLogger
+    sja.bulkQuerySize = 2
+    sja.jobDB = MagicMock()
+    sja.logDB = MagicMock()
+    result = S_ERROR( 'JobDB.rescheduleJobs: Not all the jobs were rescheduled' )
+    result['FailedJobs'] = [ 2 ]
+    sja.jobDB.rescheduleJobs.side_effect = [ result, S_OK() ]
+
+    failedJobs = sja._StalledJobAgent__rescheduleJobs( [ 1, 2, 3 ] )
+    self.assertEqual( failedJobs, [ 2 ] )
+    self.assertEqual( sja.jobDB.rescheduleJobs.call_count, 2 )
+    self.assertFalse( sja.logDB.addLoggingRecord.called )
+
+class JobAgentSuccess( AgentsTestCase ):
+
+  def test__processMatchedJobs( self ):
+    ja = JobAgent.__new__( JobAgent )
+    ja.log = gLogger
+    alive = [ True ]
+    ja.am_getModuleParam = lambda param: alive[0]
+
+    def processMatchedJob( matcherInfo, _ceDict, _matchTime ):
+      if matcherInfo['JobID'] == 2:
+        # Payload failure stopping the agent
+        alive[0] = False
+        return S_ERROR( 'Payload execution failed' )
+      return S_OK( 'Job Agent cycle complete' )
+    ja._JobAgent__processMatchedJob = MagicMock( side_effect = processMatchedJob )
+
+    jobManager = MagicMock()
+    jobManager.rescheduleJob.return_value = S_OK()
+    with patch( 'DIRAC.WorkloadManagementSystem.Agent.JobAgent.RPCClient', return_value = jobManager ):
+      res = ja._JobAgent__processMatchedJobs( [ { 'JobID' : jobID } for jobID in [ 1, 2, 3, 4 ] ], {}, 0.1 )
+    self.assertFalse( res['OK'] )
+    self.assertEqual( ja._JobAgent__processMatchedJob.call_count, 2 )
+    jobManager.rescheduleJob.assert_called_once_with( [ 3, 4 ] )
+
+    # Nothing to reschedule when all the jobs are processed
+    alive[0] = True
+    ja._JobAgent__processMatchedJob.reset_mock()
+    jobManager.reset_mock()
+    with patch( 'DIRAC.WorkloadManagementSystem.Agent.JobAgent.RPCClient', return_value = jobManager ):
+      res = ja._JobAgent__processMatchedJobs( [ { 'JobID' : 1 }, { 'JobID' : 3 } ], {}, 0.1 )
+    self.assertTrue( res['OK'] )
+    self.assertEqual( ja._JobAgent__processMatchedJob.call_count, 2 )
+    self.assertFalse( jobManager.rescheduleJob.called )
 
 #############################################################################
 # Test Suite run
@@ -44,6 +258,8 @@ class SiteDirectorBaseSuccess( AgentsTestCase ):
 if __name__ == '__main__':
   suite = unittest.defaultTestLoader.loadTestsFromTestCase( AgentsTestCase )
   suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( SiteDirectorBaseSuccess ) )
+  suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( StalledJobAgentSuccess ) )
+  suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( JobAgentSuccess ) )
   testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
 
 # EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#
@@ -4,15 +4,24 @@
 import types
 import copy
 import time
+import zlib
 
 from DIRAC.Core.Utilities import Time, DEncode
 from DIRAC import S_OK, S_ERROR, gLogger
 from DIRAC.WorkloadManagementSystem.Client.JobState.JobState import JobState
 from DIRAC.WorkloadManagementSystem.Client.JobState.JobManifest import JobManifest
 
+#Version of the compact serialization format
+STUB_VERSION = 2
+#Serialized states bigger than this are compressed
+STUB_COMPRESSION_THRESHOLD = 4096
+#Prefix of the compressed stubs, not used by DEncode
+STUB_COMPRESSED_PREFIX = "Z"
+
 class CachedJobState( object ):
 
   log = gLogger.getSubLogger( "CachedJobState" )
+  stateKeys = ( "Status", "MinorStatus", "LastUpdateTime" )
 
   def __init__( self, jid, skipInitState = False ):
     self.dOnlyCache = False
@@ -29,7 +38,7 @@ class CachedJobState( object ):
     self.__initState = None
     self.__lastValidState = time.time()
     if not skipInitState:
-      result = self.getAttributes( [ "Status", "MinorStatus", "LastUpdateTime" ] )
+      result = self.getAttributes( list( self.stateKeys ) )
       if result[ 'OK' ]:
         self.__initState = result[ 'Value' ]
       else:
@@ -39,7 +48,7 @@ class CachedJobState( object ):
     now = time.time()
     if graceTime <= 0 or now - self.__lastValidState > graceTime:
       self.__lastValidState = now
-      result = self.__jobState.getAttributes( [ "Status", "MinorStatus", "LastUpdateTime" ] )
+      result = self.__jobState.getAttributes( list( self.stateKeys ) )
       if not result[ 'OK' ]:
         return result
       currentState = result[ 'Value' ]
@@ -76,7 +85,11 @@ class CachedJobState( object ):
     if not result[ 'Value' ]:
       self.cleanState()
       return S_ERROR( "Initial state was different" )
-    newState = result[ 'Value' ]
+    return self.__commitDone( result[ 'Value' ] )
+
+  def __commitDone( self, newState ):
+    """ Save the manifest and insert into the TQ once the cache has been committed
+    """
     self.__jobLog = []
     self.__dirtyKeys.clear()
     #Save manifest
@@ -104,17 +117,135 @@ class CachedJobState( object ):
     self.__lastValidState = time.time()
     return S_OK()
 
+  @classmethod
+  def commitChangesBulk( cls, cjsList ):
+    """ Commit the changes of many jobs, writing the dirty keys and the logging records
+        of all of them with grouped statements. Without local access to the DBs each job
+        is committed on its own.
+
+    :return: S_OK( { 'Successful' : [ jid ], 'Failed' : { jid : error message } } )
+    """
+    successful = []
+    failed = {}
+    if not JobState.hasLocalAccess():
+      for cjs in cjsList:
+        result = cjs.commitChanges()
+        if result[ 'OK' ]:
+          successful.append( cjs.jid )
+        else:
+          failed[ cjs.jid ] = result[ 'Message' ]
+      return S_OK( { 'Successful' : successful, 'Failed' : failed } )
+
+    toCommit = []
+    jobCaches = {}
+    for cjs in cjsList:
+      if cjs.__initState == None:
+        failed[ cjs.jid ] = "CachedJobState( %d ) is not valid" % cjs.jid
+        continue
+      toCommit.append( cjs )
+      changes = dict( ( k, cjs.__cache[ k ] ) for k in cjs.__dirtyKeys )
+      jobCaches[ cjs.jid ] = ( cjs.__initState, changes, cjs.__jobLog )
+    result = JobState.commitCacheBulk( jobCaches )
+    if not result[ 'OK' ]:
+      for cjs in toCommit:
+        cjs.cleanState()
+        failed[ cjs.jid ] = result[ 'Message' ]
+      return S_OK( { 'Successful' : successful, 'Failed' : failed } )
+    newStates = result[ 'Value' ][ 'Successful' ]
+    commitErrors = result[ 'Value' ][ 'Failed' ]
+    for cjs in toCommit:
+      if cjs.jid not in newStates:
+        cjs.cleanState()
+        failed[ cjs.jid ] = commitErrors.get( cjs.jid, "Job not committed" )
+        continue
+      result = cjs.__commitDone( newStates[ cjs.jid ] )
+      if result[ 'OK' ]:
+        successful.append( cjs.jid )
+      else:
+        failed[ cjs.jid ] = result[ 'Message' ]
+    return S_OK( { 'Successful' : successful, 'Failed' : failed } )
+
+  @classmethod
+  def loadBulk( cls, jidList, loadManifest = True ):
+    """ Create the CachedJobStates of many jobs, filling their caches with all the
+        attributes, optimizer parameters and manifests using one query per table.
+        Without local access to the DBs each job is loaded on its own.
+
+    :return: S_OK( [ CachedJobState ] ) in the order of jidList. As for single jobs,
+             the states of the jobs not found are not valid
+    """
+    if not JobState.hasLocalAccess():
+      return S_OK( [ cls( jid ) for jid in jidList ] )
+    result = JobState.getStatesBulk( jidList, loadManifest = loadManifest )
+    if not result[ 'OK' ]:
+      return result
+    states = result[ 'Value' ]
+    cjsList = []
+    for jid in jidList:
+      cjs = cls( jid, skipInitState = True )
+      if jid in states:
+        cjs.__preload( *states[ jid ] )
+      cjsList.append( cjs )
+    return S_OK( cjsList )
+
+  def __preload( self, attDict, optDict, jdl ):
+    for key in attDict:
+      self.__cache[ "att.%s" % key ] = attDict[ key ]
+    for key in optDict:
+      self.__cache[ "optp.%s" % key ] = optDict[ key ]
+    self.__initState = dict( ( key, attDict[ key ] ) for key in self.stateKeys )
+    if jdl:
+      manifest = JobManifest()
+      result = manifest.loadJDL( jdl )
+      if result[ 'OK' ]:
+        manifest.clearDirty()
+        self.__manifest = manifest
+      else:
+        self.log.warn( "Could not load the manifest of job %s: %s" % ( self.__jid, result[ 'Message' ] ) )
+
   def serialize( self ):
+    """ Compact serialization to send the state between the mind and the executors:
+        the cached keys are grouped by prefix and big states are compressed
+    """
     if self.__manifest:
       manifest = ( self.__manifest.dumpAsCFG(), self.__manifest.isDirty() )
     else:
       manifest = None
-    return DEncode.encode( ( self.__jid, self.__cache, self.__jobLog, manifest,
+    cache = {}
+    for key in self.__cache:
+      if key.find( "." ) > -1:
+        prefix, name = key.split( ".", 1 )
+      else:
+        prefix, name = "", key
+      cache.setdefault( prefix, {} )[ name ] = self.__cache[ key ]
+    stub = DEncode.encode( ( STUB_VERSION, self.__jid, cache, self.__jobLog, manifest,
                              self.__initState, self.__insertIntoTQ, tuple( self.__dirtyKeys ) ) )
+    if len( stub ) > STUB_COMPRESSION_THRESHOLD:
+      stub = STUB_COMPRESSED_PREFIX + zlib.compress( stub )
+    return stub
 
   @staticmethod
   def deserialize( stub ):
-    dataTuple, _slen = DEncode.decode( stub )
+    """ Load a state serialized with serialize, or with the previous uncompressed format
+    """
+    try:
+      if stub[ :len( STUB_COMPRESSED_PREFIX ) ] == STUB_COMPRESSED_PREFIX:
+        stub = zlib.decompress( stub[ len( STUB_COMPRESSED_PREFIX ): ] )
+      dataTuple, _slen = DEncode.decode( stub )
+    except Exception as excp:
+      return S_ERROR( "Invalid stub: %s" % str( excp ) )
+    if type( dataTuple ) != types.TupleType:
+      return S_ERROR( "Invalid stub" )
+    if len( dataTuple ) == 8 and dataTuple[0] == STUB_VERSION:
+      if type( dataTuple[2] ) != types.DictType:
+        return S_ERROR( "Invalid stub 1" )
+      cache = {}
+      for prefix, values in dataTuple[2].items():
+        if type( values ) != types.DictType:
+          return S_ERROR( "Invalid stub 1" )
+        for name in values:
+          cache[ "%s.%s" % ( prefix, name ) if prefix else name ] = values[ name ]
+      dataTuple = ( dataTuple[1], cache ) + dataTuple[3:]
     if len( dataTuple ) != 7:
       return S_ERROR( "Invalid stub" )
     #jid
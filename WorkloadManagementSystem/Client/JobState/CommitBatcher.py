@@ -0,0 +1,88 @@
+""" CommitBatcher groups the commits of the CachedJobStates done concurrently by
+    different threads, so that they are written with CachedJobState.commitChangesBulk.
+
+    The first thread committing while no batch is being collected becomes the leader:
+    it waits up to maxWait seconds, or until maxBatchSize states are queued, then
+    commits the whole batch and hands each thread the result of its own job. The
+    threads arriving while the leader commits start the next batch.
+"""
+
+__RCSID__ = "$Id$"
+
+import time
+import threading
+
+from DIRAC import gLogger, S_OK, S_ERROR
+from DIRAC.WorkloadManagementSystem.Client.JobState.CachedJobState import CachedJobState
+
+class CommitBatcher( object ):
+
+  def __init__( self, maxBatchSize = 100, maxWait = 0.05 ):
+    """ c'tor
+
+    :param int maxBatchSize: maximum number of job states committed together
+    :param float maxWait: maximum number of seconds the leader waits for other commits
+    """
+    self.log = gLogger.getSubLogger( "CommitBatcher" )
+    self.maxBatchSize = max( 1, maxBatchSize )
+    self.maxWait = max( 0, maxWait )
+    self.__cond = threading.Condition( threading.Lock() )
+    # [ ( cachedJobState, event, [ result ] ) ]
+    self.__pending = []
+    self.__collecting = False
+
+  def commit( self, cachedJobState ):
+    """ Commit the changes of a job state together with the concurrent ones
+
+    :return: S_OK() / S_ERROR() as CachedJobState.commitChanges
+    """
+    entry = ( cachedJobState, threading.Event(), [] )
+    with self.__cond:
+      self.__pending.append( entry )
+      isLeader = not self.__collecting
+      if isLeader:
+        self.__collecting = True
+      elif len( self.__pending ) >= self.maxBatchSize:
+        self.__cond.notify()
+    while True:
+      if isLeader:
+        self.__commitBatch()
+      entry[1].wait()
+      if entry[2]:
+        return entry[2][0]
+      # Left over from a full batch: lead the next one
+      entry[1].clear()
+      isLeader = True
+
+  def __commitBatch( self ):
+    with self.__cond:
+      deadline = time.time() + self.maxWait
+      while len( self.__pending ) < self.maxBatchSize:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+          break
+        self.__cond.wait( remaining )
+      batch = self.__pending[ :self.maxBatchSize ]
+      self.__pending = self.__pending[ self.maxBatchSize: ]
+      if self.__pending:
+        # Wake up the first thread left over to lead the next batch
+        self.__pending[0][1].set()
+      else:
+        self.__collecting = False
+
+    results = {}
+    try:
+      result = CachedJobState.commitChangesBulk( [ cjs for cjs, _event, _result in batch ] )
+      if result[ 'OK' ]:
+        for jid in result[ 'Value' ][ 'Successful' ]:
+          results[ jid ] = S_OK()
+        for jid, errMsg in result[ 'Value' ][ 'Failed' ].items():
+          results[ jid ] = S_ERROR( errMsg )
+      else:
+        self.log.error( "Failed to commit job states", result[ 'Message' ] )
+    except Exception as excp:
+      self.log.exception( "Exception while committing job states", lException = excp )
+    self.log.verbose( "Committed %s job states" % len( batch ) )
+    for cjs, event, entryResult in batch:
+      entryResult.append( results.get( cjs.jid, S_ERROR( "Could not commit job %s" % cjs.jid ) ) )
+      event.set()
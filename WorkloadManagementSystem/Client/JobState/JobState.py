@@ -99,6 +99,12 @@ class JobState( object ):
       return True
     return False
 
+  @classmethod
+  def hasLocalAccess( cls ):
+    """ Whether the bulk methods, which need direct access to the DBs, can be used
+    """
+    return not JobState._sDisableLocal and bool( JobState.__db.job )
+
   def __getDB( self ):
     return JobState.__db.job
 
@@ -134,7 +140,8 @@ class JobState( object ):
 
 #Execute traces
 
-  def __retryFunction( self, retries, functor, args = False, kwargs = False ):
+  @staticmethod
+  def __retryFunction( retries, functor, args = False, kwargs = False ):
     retries = max( 1, retries )
     if not args:
       args = tuple()
@@ -165,11 +172,7 @@ class JobState( object ):
       return S_OK( False )
     gLogger.verbose( "Job %s: About to execute trace. Current state %s" % ( self.__jid, initialState ) )
 
-    data = { 'att': [], 'jobp': [], 'optp': [] }
-    for key in cache:
-      for dk in data:
-        if key.find( "%s." % dk ) == 0:
-          data[ dk ].append( ( key[ len( dk ) + 1:], cache[ key ] ) )
+    data = self.__splitCache( cache )
 
     jobDB = JobState.__db.job
     if data[ 'att' ]:
@@ -208,6 +211,130 @@ class JobState( object ):
     gLogger.info( "Job %s: Ended trace execution" % self.__jid )
     #We return a new initial state
     return self.getAttributes( initialState.keys() )
+
+  @staticmethod
+  def __splitCache( cache ):
+    data = { 'att': [], 'jobp': [], 'optp': [] }
+    for key in cache:
+      for dk in data:
+        if key.find( "%s." % dk ) == 0:
+          data[ dk ].append( ( key[ len( dk ) + 1:], cache[ key ] ) )
+    return data
+
+  @classmethod
+  def getStatesBulk( cls, jidList, loadManifest = True ):
+    """ Get the attributes, the optimizer parameters and the JDLs of many jobs
+        with one query per table. Requires local access to the DBs.
+
+    :return: S_OK( { jid : ( attDict, optParamDict, jdl ) } ) for the jobs found, the jdl
+             being None if not loaded
+    """
+    jobDB = JobState.__db.job
+    result = jobDB.getAttributesForJobList( jidList )
+    if not result[ 'OK' ]:
+      return result
+    attributes = result[ 'Value' ]
+    if not attributes:
+      return S_OK( {} )
+    jids = attributes.keys()
+    result = jobDB.getJobsOptParameters( jids )
+    if not result[ 'OK' ]:
+      return result
+    optParams = result[ 'Value' ]
+    jdls = {}
+    if loadManifest:
+      result = jobDB.getJobJDLs( jids )
+      if not result[ 'OK' ]:
+        return result
+      jdls = result[ 'Value' ]
+    states = {}
+    for jid, attDict in attributes.items():
+      attDict.pop( 'JobID', None )
+      states[ jid ] = ( attDict, optParams.get( jid, {} ), jdls.get( jid ) )
+    return S_OK( states )
+
+  @classmethod
+  def commitCacheBulk( cls, jobCaches ):
+    """ Same as commitCache for many jobs at once. Requires local access to the DBs.
+        The attribute changes are grouped by identical changes, and the parameters,
+        optimizer parameters and logging records of all the jobs are written with
+        one statement per table.
+
+    :param dict jobCaches: { jid : ( initialState, cache, jobLog ) }
+    :return: S_OK( { 'Successful' : { jid : new initial state }, 'Failed' : { jid : error message } } ),
+             jobs whose initial state was different or whose input data could not be set are not
+             changed
+    """
+    if not jobCaches:
+      return S_OK( { 'Successful' : {}, 'Failed' : {} } )
+    stateKeys = set()
+    for initialState, _cache, _jobLog in jobCaches.values():
+      stateKeys.update( initialState )
+    stateKeys = sorted( stateKeys )
+    jobDB = JobState.__db.job
+    result = jobDB.getAttributesForJobList( jobCaches.keys(), stateKeys )
+    if not result[ 'OK' ]:
+      return result
+    currentStates = result[ 'Value' ]
+
+    committed = []
+    failed = {}
+    attGroups = {}
+    jobParams = {}
+    optParams = {}
+    logRecords = []
+    for jid, ( initialState, cache, jobLog ) in jobCaches.items():
+      currentState = currentStates.get( jid, {} )
+      if dict( ( key, currentState.get( key ) ) for key in initialState ) != initialState:
+        failed[ jid ] = "Initial state was different"
+        continue
+      if 'inputData' in cache:
+        # Not grouped: set first, so that the other changes of the job are not done if it fails
+        result = cls.__retryFunction( 5, jobDB.setInputData, ( jid, cache[ 'inputData' ] ) )
+        if not result[ 'OK' ]:
+          gLogger.error( "Failed to set the input data of job %s" % jid, result[ 'Message' ] )
+          failed[ jid ] = result[ 'Message' ]
+          continue
+      committed.append( jid )
+      data = cls.__splitCache( cache )
+      if data[ 'att' ]:
+        attGroups.setdefault( tuple( sorted( data[ 'att' ] ) ), [] ).append( jid )
+      if data[ 'jobp' ]:
+        jobParams[ jid ] = data[ 'jobp' ]
+      if data[ 'optp' ]:
+        optParams[ jid ] = dict( data[ 'optp' ] )
+      for record, updateTime, source in jobLog:
+        logRecords.append( ( jid, record.get( 'status' ), record.get( 'minor' ), record.get( 'application' ),
+                             updateTime, source ) )
+
+    for attItems, jids in attGroups.items():
+      result = cls.__retryFunction( 5, jobDB.setJobAttributes,
+                                    ( jids, [ t[0] for t in attItems ], [ t[1] for t in attItems ] ),
+                                    { 'update' : True } )
+      if not result[ 'OK' ]:
+        return result
+    result = cls.__retryFunction( 5, jobDB.setJobsParameters, ( jobParams, ) )
+    if not result[ 'OK' ]:
+      return result
+    result = cls.__retryFunction( 5, jobDB.setJobsOptParameters, ( optParams, ) )
+    if not result[ 'OK' ]:
+      return result
+    result = cls.__retryFunction( 5, JobState.__db.log.addLoggingRecords, ( logRecords, ) )
+    if not result[ 'OK' ]:
+      return result
+
+    gLogger.info( "Ended trace execution of %s jobs in %s attribute updates" % ( len( committed ),
+                                                                                 len( attGroups ) ) )
+    newStates = {}
+    if committed:
+      result = jobDB.getAttributesForJobList( committed, stateKeys )
+      if not result[ 'OK' ]:
+        return result
+      for jid in committed:
+        currentState = result[ 'Value' ].get( jid, {} )
+        newStates[ jid ] = dict( ( key, currentState.get( key ) ) for key in jobCaches[ jid ][0] )
+    return S_OK( { 'Successful' : newStates, 'Failed' : failed } )
+
 #
 # Status
 #
@@ -5,6 +5,9 @@
 
 __RCSID__ = "$Id"
 
+import time
+import threading
+
 from DIRAC import S_OK, S_ERROR
 from DIRAC import gLogger
 
@@ -12,6 +15,123 @@ from DIRAC.Core.Utilities.DictCache import DictCache
 from DIRAC.ConfigurationSystem.Client.Helpers.Operations import Operations
 from DIRAC.WorkloadManagementSystem.DB.JobDB import JobDB
 
+RUNNING_STATES = ( 'Running', 'Matched', 'Stalled' )
+
+
+class RunningJobsCache( object ):
+  """ Counters of the jobs in RUNNING_STATES per site, attribute and value shared by all
+      the Limiter instances of the process.
+
+      All the attributes limited so far are refreshed together with one grouped
+      getCounters query when the counters are older than refreshPeriod seconds.
+      In between, only the jobs matched by this process are accounted for, with
+      jobStatusChanged: the jobs finishing, killed or rescheduled change status in other
+      services and are only seen at the next refresh, so the counters may overestimate
+      the running jobs for at most refreshPeriod seconds.
+      The JobDB is given by the caller, so that the process wide instance does not keep
+      the one of the first Limiter.
+  """
+
+  def __init__( self, refreshPeriod = 10 ):
+    self.refreshPeriod = refreshPeriod
+    self.__lock = threading.Lock()
+    self.__attributes = set()
+    # { attName : { siteName : { attValue : count } } }
+    self.__counters = {}
+    self.__lastRefresh = 0
+    self.hits = 0
+    self.misses = 0
+    self.log = gLogger.getSubLogger( "RunningJobsCache" )
+
+  def __refresh( self, jobDB, attNames ):
+    """ Get the counters for all the attributes in one query. Has to be called with the lock held
+    """
+    result = jobDB.getCounters( 'Jobs', [ 'Site' ] + list( attNames ), { 'Status' : list( RUNNING_STATES ) } )
+    if not result[ 'OK' ]:
+      return result
+    counters = dict( [ ( attName, {} ) for attName in attNames ] )
+    for attDict, count in result[ 'Value' ]:
+      siteName = attDict[ 'Site' ]
+      for attName in attNames:
+        siteCounters = counters[ attName ].setdefault( siteName, {} )
+        attValue = attDict[ attName ]
+        siteCounters[ attValue ] = siteCounters.get( attValue, 0 ) + count
+    self.__counters = counters
+    self.__attributes = set( attNames )
+    self.__lastRefresh = time.time()
+    return S_OK()
+
+  def getCounters( self, jobDB, siteName, attName ):
+    """ Get the running counters for an attribute at a site, refreshing them from jobDB if needed
+
+        :return: S_OK( { attValue : count } )
+    """
+    self.__lock.acquire()
+    try:
+      if attName in self.__attributes and time.time() - self.__lastRefresh < self.refreshPeriod:
+        self.hits += 1
+      else:
+        self.misses += 1
+        result = self.__refresh( jobDB, self.__attributes | set( [ attName ] ) )
+        if not result[ 'OK' ]:
+          return result
+      return S_OK( dict( self.__counters[ attName ].get( siteName, {} ) ) )
+    finally:
+      self.__lock.release()
+
+  def jobStatusChanged( self, siteName, jobAttributes, oldStatus, newStatus ):
+    """ Adjust the counters for a status change made by this process (the Matcher), without
+        waiting for the next refresh
+
+        :param dict jobAttributes: values of (at least) the limited attributes for the job
+    """
+    delta = int( newStatus in RUNNING_STATES ) - int( oldStatus in RUNNING_STATES )
+    if not delta:
+      return
+    self.__lock.acquire()
+    try:
+      for attName in self.__attributes:
+        if attName not in jobAttributes:
+          continue
+        siteCounters = self.__counters[ attName ].setdefault( siteName, {} )
+        attValue = jobAttributes[ attName ]
+        siteCounters[ attValue ] = max( 0, siteCounters.get( attValue, 0 ) + delta )
+    finally:
+      self.__lock.release()
+
+  def getLimitedAttributes( self ):
+    return list( self.__attributes )
+
+  def getStats( self ):
+    """ Hit rate and age of the counters, to be published as metrics
+    """
+    requests = self.hits + self.misses
+    stats = { 'Hits' : self.hits,
+              'Misses' : self.misses,
+              'HitRate' : float( self.hits ) / requests if requests else 0.,
+              'Staleness' : time.time() - self.__lastRefresh if self.__lastRefresh else 0. }
+    return stats
+
+gRunningJobsCache = None
+gCacheLock = threading.Lock()
+gDelayMem = {}
+gDelayLock = threading.Lock()
+
+def getRunningJobsCache( refreshPeriod = None ):
+  """ Get the process wide RunningJobsCache, creating it if needed
+  """
+  global gRunningJobsCache
+  gCacheLock.acquire()
+  try:
+    if gRunningJobsCache is None:
+      gRunningJobsCache = RunningJobsCache()
+    if refreshPeriod is not None:
+      gRunningJobsCache.refreshPeriod = refreshPeriod
+    return gRunningJobsCache
+  finally:
+    gCacheLock.release()
+
+
 class Limiter( object ):
 
   def __init__( self, jobDB = None, opsHelper = None ):
@@ -21,7 +141,8 @@ class Limiter( object ):
     self.__matchingDelaySection = "JobScheduling/MatchingDelay"
     self.csDictCache = DictCache()
     self.condCache = DictCache()
-    self.delayMem = {}
+    # Matching delays have to be shared by all the Limiter instances of the process
+    self.delayMem = gDelayMem
 
     if jobDB:
       self.jobDB = jobDB
@@ -35,6 +156,8 @@ class Limiter( object ):
     else:
       self.__opsHelper = Operations()
 
+    self.runningCache = getRunningJobsCache( self.__opsHelper.getValue( "JobScheduling/RunningLimitCacheTime", 10 ) )
+
   def getNegativeCond( self ):
     """ Get negative condition for ALL sites
     """
@@ -158,15 +281,10 @@ class Limiter( object ):
       if attName not in self.jobDB.jobAttributeNames:
         self.log.error( "Attribute %s does not exist. Check the job limits" % attName )
         continue
-      cK = "Running:%s:%s" % ( siteName, attName )
-      data = self.condCache.get( cK )
-      if not data:
-        result = self.jobDB.getCounters( 'Jobs', [ attName ], { 'Site' : siteName, 'Status' : [ 'Running', 'Matched', 'Stalled' ] } )
-        if not result[ 'OK' ]:
-          return result
-        data = result[ 'Value' ]
-        data = dict( [ ( k[0][ attName ], k[1] )  for k in data ] )
-        self.condCache.add( cK, 10, data )
+      result = self.runningCache.getCounters( self.jobDB, siteName, attName )
+      if not result[ 'OK' ]:
+        return result
+      data = result[ 'Value' ]
       for attValue in limitsDict[ attName ]:
         limit = limitsDict[ attName ][ attValue ]
         running = data.get( attValue, 0 )
@@ -180,34 +298,49 @@ class Limiter( object ):
     return S_OK( negCond )
 
   def updateDelayCounters( self, siteName, jid ):
+    """ Update the matching delay counters and the running jobs counters with a just matched job
+    """
     # Get the info from the CS
     siteSection = "%s/%s" % ( self.__matchingDelaySection, siteName )
     result = self.__extractCSData( siteSection )
     if not result['OK']:
       return result
     delayDict = result[ 'Value' ]
-    # limitsDict is something like { 'JobType' : { 'Merge' : 20, 'MCGen' : 1000 } }
-    if not delayDict:
+    # delayDict is something like { 'JobType' : { 'Merge' : 20, 'MCGen' : 1000 } }
+    result = self.__extractCSData( "%s/%s" % ( self.__runningLimitSection, siteName ) )
+    if not result['OK']:
+      return result
+    # Only the counters of the attributes limited at the site are worth adjusting
+    cachedAtts = self.runningCache.getLimitedAttributes()
+    attNames = [ attName for attName in result[ 'Value' ] if attName in cachedAtts ]
+    if not delayDict and not attNames:
       return S_OK()
-    attNames = []
     for attName in delayDict:
       if attName not in self.jobDB.jobAttributeNames:
         self.log.error( "Attribute %s does not exist in the JobDB. Please fix it!" % attName )
-      else:
+      elif attName not in attNames:
         attNames.append( attName )
     result = self.jobDB.getJobAttributes( jid, attNames )
     if not result[ 'OK' ]:
       self.log.error( "While retrieving attributes coming from %s: %s" % ( siteSection, result[ 'Message' ] ) )
       return result
     atts = result[ 'Value' ]
+    # The job is now Matched at the site
+    self.runningCache.jobStatusChanged( siteName, atts, 'Waiting', 'Matched' )
+    if not delayDict:
+      return S_OK()
     # Create the DictCache if not there
-    if siteName not in self.delayMem:
-      self.delayMem[ siteName ] = DictCache()
+    gDelayLock.acquire()
+    try:
+      if siteName not in self.delayMem:
+        self.delayMem[ siteName ] = DictCache()
+      delayCounter = self.delayMem[ siteName ]
+    finally:
+      gDelayLock.release()
     # Update the counters
-    delayCounter = self.delayMem[ siteName ]
     for attName in atts:
       attValue = atts[ attName ]
-      if attValue in delayDict[ attName ]:
+      if attName in delayDict and attValue in delayDict[ attName ]:
         delayTime = delayDict[ attName ][ attValue ]
         self.log.notice( "Adding delay for %s/%s=%s of %s secs" % ( siteName, attName,
                                                                    attValue, delayTime ) )
@@ -217,9 +350,14 @@ class Limiter( object ):
   def __getDelayCondition( self, siteName ):
     """ Get extra conditions allowing matching delay
     """
-    if siteName not in self.delayMem:
+    gDelayLock.acquire()
+    try:
+      delayCounter = self.delayMem.get( siteName )
+    finally:
+      gDelayLock.release()
+    if delayCounter is None:
       return S_OK( {} )
-    lastRun = self.delayMem[ siteName ].getKeys()
+    lastRun = delayCounter.getKeys()
     negCond = {}
     for attName, attValue in lastRun:
       if attName not in negCond:
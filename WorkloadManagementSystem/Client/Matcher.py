@@ -3,6 +3,7 @@
     Utilities and classes here are used by MatcherHandler
 """
 
+import re
 import time
 
 from DIRAC import gLogger
@@ -25,6 +26,9 @@ from DIRAC.ResourceStatusSystem.Client.SiteStatus   import SiteStatus
 
 __RCSID__ = "$Id"
 
+PROCESSORS_TAG_RE = re.compile( r'^(\d+)Processors$' )
+RAM_TAG_RE = re.compile( r'^(\d+)GB$' )
+
 
 class Matcher( object ):
   """ Logic for matching
@@ -148,6 +152,171 @@ class Matcher( object ):
     return resultDict
 
 
+  def selectJobs( self, resourceDescription, credDict, maxJobs = 1, resourceBudget = None ):
+    """ Select up to maxJobs jobs that fit together in the resource budget, for pilots
+        running several payloads. The credentials, pilot version, site mask and limits
+        are checked once, and the job information is retrieved with bulk queries. The jobs
+        themselves are matched one at a time, with one matchAndGetJob call each.
+
+        :param dict resourceDescription: as for selectJob
+        :param dict credDict: credentials of the requester
+        :param int maxJobs: maximum number of jobs to match
+        :param dict resourceBudget: NumberOfProcessors and MaxRAM to share among the jobs,
+                                    taken from the resourceDescription if not given
+        :return: list of dicts as returned by selectJob
+    """
+    startTime = time.time()
+
+    resourceDict = self._getResourceDict( resourceDescription, credDict )
+    budget = self._getResourceBudget( resourceDescription, resourceBudget )
+    gLogger.info( 'Resource budget for matching %d jobs' % maxJobs, printDict( budget ) )
+
+    checkDelay = self.opsHelper.getValue( "JobScheduling/CheckMatchingDelay", True )
+    negativeCond = self.limiter.getNegativeCondForSite( resourceDict['Site'] )
+    tqTags = {}
+    matchedJobs = []
+    while len( matchedJobs ) < maxJobs and budget['NumberOfProcessors'] > 0:
+      matchDict = self._applyResourceBudget( resourceDict, budget, wholeNodeAllowed = not matchedJobs )
+      result = self.tqDB.matchAndGetJob( matchDict, negativeCond = negativeCond )
+      if not result['OK']:
+        if not matchedJobs:
+          raise RuntimeError( result['Message'] )
+        self.log.warn( "Failed to match more jobs", result['Message'] )
+        break
+      result = result['Value']
+      if not result['matchFound']:
+        break
+      jobID = result['jobId']
+      tqID = result['taskQueueId']
+      if tqID not in tqTags:
+        resTags = self.tqDB.getTaskQueueTags( [ tqID ] )
+        tqTags[tqID] = resTags['Value'].get( tqID, [] ) if resTags['OK'] else []
+      processors, ram = self._getJobNeeds( tqTags[tqID], budget )
+      budget['NumberOfProcessors'] -= processors
+      budget['MaxRAM'] = max( 0, budget['MaxRAM'] - ram )
+      matchedJobs.append( jobID )
+      if checkDelay:
+        self.limiter.updateDelayCounters( resourceDict['Site'], jobID )
+        negativeCond = self.limiter.getNegativeCondForSite( resourceDict['Site'] )
+
+    if not matchedJobs:
+      self.log.info( "No match found" )
+      return []
+
+    resAtt = self.jobDB.getAttributesForJobList( matchedJobs, ['OwnerDN', 'OwnerGroup', 'Status'] )
+    if not resAtt['OK']:
+      raise RuntimeError( 'Could not retrieve job attributes' )
+    jobAttributes = resAtt['Value']
+    jobIDs = []
+    for jobID in matchedJobs:
+      if jobID not in jobAttributes:
+        self.log.error( 'No attributes returned for job', str( jobID ) )
+        continue
+      if jobAttributes[jobID]['Status'] != 'Waiting':
+        self.log.error( 'Job matched by the TQ is not in Waiting state', str( jobID ) )
+        result = self.tqDB.deleteJob( jobID )
+        if not result[ 'OK' ]:
+          self.log.error( "Failed to delete job from the TQ", "%s: %s" % ( jobID, result['Message'] ) )
+        continue
+      jobIDs.append( jobID )
+    if not jobIDs:
+      raise RuntimeError( "Matched jobs are not in Waiting state" )
+
+    self._reportStatus( resourceDict, jobIDs )
+
+    result = self.jobDB.getJobJDLs( jobIDs )
+    if not result['OK']:
+      raise RuntimeError( "Failed to get the job JDLs" )
+    jdls = result['Value']
+    resOpt = self.jobDB.getJobsOptParameters( jobIDs )
+    optParameters = resOpt['Value'] if resOpt['OK'] else {}
+
+    pilotInfoReportedFlag = resourceDict.get( 'PilotInfoReportedFlag', False )
+    if not pilotInfoReportedFlag:
+      self._updatePilotInfo( resourceDict )
+
+    resultList = []
+    for jobID in jobIDs:
+      if not jdls.get( jobID ):
+        self.log.error( "Failed to get the job JDL", str( jobID ) )
+        continue
+      resultDict = dict( optParameters.get( jobID, {} ) )
+      resultDict['JDL'] = jdls[jobID]
+      resultDict['JobID'] = jobID
+      resultDict['DN'] = jobAttributes[jobID]['OwnerDN']
+      resultDict['Group'] = jobAttributes[jobID]['OwnerGroup']
+      resultDict['PilotInfoReportedFlag'] = True
+      self._updatePilotJobMapping( resourceDict, jobID )
+      resultList.append( resultDict )
+
+    matchTime = time.time() - startTime
+    self.log.info( "Match time for %d jobs: [%s]" % ( len( resultList ), str( matchTime ) ) )
+    gMonitor.addMark( "matchTime", matchTime )
+
+    return resultList
+
+  def _getResourceBudget( self, resourceDescription, resourceBudget = None ):
+    """ Processors and RAM (MB) available to be shared among the matched jobs
+    """
+    budget = {}
+    for param, default in ( ( 'NumberOfProcessors', 1 ), ( 'MaxRAM', 0 ) ):
+      value = default
+      if resourceBudget and param in resourceBudget:
+        value = resourceBudget[param]
+      elif param in resourceDescription:
+        value = resourceDescription[param]
+      try:
+        budget[param] = int( value )
+      except ( ValueError, TypeError ):
+        budget[param] = default
+    return budget
+
+  def _applyResourceBudget( self, resourceDict, budget, wholeNodeAllowed = True ):
+    """ Copy of the resource dict with the processors and RAM tags of what is left in the budget
+    """
+    matchDict = dict( resourceDict )
+    tags = resourceDict.get( 'Tag', [] )
+    if isinstance( tags, basestring ):
+      tags = [ tags ]
+    tags = [ tag for tag in tags
+             if not PROCESSORS_TAG_RE.match( tag ) and not RAM_TAG_RE.match( tag ) ]
+    if not wholeNodeAllowed and 'WholeNode' in tags:
+      tags.remove( 'WholeNode' )
+    tags.extend( self._getResourceTags( budget['MaxRAM'] / 1000, budget['NumberOfProcessors'] ) )
+    if tags:
+      matchDict['Tag'] = list( set( tags ) )
+    else:
+      matchDict.pop( 'Tag', None )
+    return matchDict
+
+  @staticmethod
+  def _getJobNeeds( tqTags, budget ):
+    """ Processors and RAM (MB) taken by a job given the Tags of its task queue
+    """
+    if 'WholeNode' in tqTags:
+      return budget['NumberOfProcessors'], budget['MaxRAM']
+    processors = 1
+    ram = 0
+    for tag in tqTags:
+      match = PROCESSORS_TAG_RE.match( tag )
+      if match:
+        processors = max( processors, int( match.group( 1 ) ) )
+      match = RAM_TAG_RE.match( tag )
+      if match:
+        ram = max( ram, int( match.group( 1 ) ) * 1000 )
+    return processors, ram
+
+  @staticmethod
+  def _getResourceTags( maxRAM, nProcessors ):
+    """ Convert the MaxRAM (GB) and NumberOfProcessors parameters into a list of tags
+    """
+    resourceTags = []
+    for param, key in [ ( maxRAM, 'GB' ), ( nProcessors, 'Processors' ) ]:
+      if param and param <= 128 :
+        paramList = range( 2, param + 1 )
+        resourceTags.extend( [ '%d%s' % ( par, key ) for par in paramList ] )
+    return resourceTags
+
   def _getResourceDict( self, resourceDescription, credDict ):
     """ from resourceDescription to resourceDict (just various mods)
     """
@@ -202,12 +371,9 @@ class Matcher( object ):
         nProcessors = int( nProcessors )
       except ValueError:
         nProcessors = None
-    for param, key in [ ( maxRAM, 'GB' ), ( nProcessors, 'Processors' ) ]:
-      if param and param <= 128 :
-        paramList = range( 2, param + 1 )
-        paramTags = [ '%d%s' % ( par, key ) for par in paramList ]
-        if paramTags:
-          resourceDict.setdefault( "Tag", [] ).extend( paramTags )
+    paramTags = self._getResourceTags( maxRAM, nProcessors )
+    if paramTags:
+      resourceDict.setdefault( "Tag", [] ).extend( paramTags )
 
     if 'Tag' in resourceDict:
       resourceDict['Tag'] = list( set( resourceDict['Tag'] ) )
@@ -222,7 +388,8 @@ class Matcher( object ):
 
 
   def _reportStatus( self, resourceDict, jobID ):
-    """ Reports the status of the matched job in jobDB and jobLoggingDB
+    """ Reports the status of the matched job in jobDB and jobLoggingDB.
+        jobID can be a list of jobs matched together
 
         Do not fail if errors happen here
     """
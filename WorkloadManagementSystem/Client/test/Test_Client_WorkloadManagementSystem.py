@@ -5,13 +5,19 @@ import os
 import unittest
 import importlib
 import StringIO
+import threading
 
-from mock import MagicMock
+from mock import MagicMock, patch
 
-from DIRAC import S_OK
+from DIRAC import S_OK, S_ERROR
+from DIRAC.Core.Utilities import DEncode
 from DIRAC.WorkloadManagementSystem.Client.DownloadInputData import DownloadInputData
 from DIRAC.WorkloadManagementSystem.Client.Matcher import Matcher
+from DIRAC.WorkloadManagementSystem.Client.Limiter import Limiter, RunningJobsCache
 from DIRAC.WorkloadManagementSystem.Client.SandboxStoreClient import SandboxStoreClient
+from DIRAC.WorkloadManagementSystem.Client.JobState.JobState import JobState
+from DIRAC.WorkloadManagementSystem.Client.JobState.CachedJobState import CachedJobState
+from DIRAC.WorkloadManagementSystem.Client.JobState.CommitBatcher import CommitBatcher
 
 class ClientsTestCase( unittest.TestCase ):
   """ Base class for the clients test cases
@@ -149,6 +155,254 @@ class MatcherTestCase( ClientsTestCase ):
 
     self.assertEqual( res, resExpected )
 
+  def test__applyResourceBudget( self ):
+
+    resourceDict = {'Site': 'DIRAC.Jenkins.ch',
+                    'Tag': ['GPU', 'WholeNode', '2Processors', '3Processors', '4Processors', '2GB']}
+
+    budget = self.matcher._getResourceBudget( {'NumberOfProcessors': 4, 'MaxRAM': 2500},
+                                              {'NumberOfProcessors': 3} )
+    self.assertEqual( budget, {'NumberOfProcessors': 3, 'MaxRAM': 2500} )
+
+    res = self.matcher._applyResourceBudget( resourceDict, budget, wholeNodeAllowed = False )
+    self.assertEqual( sorted( res['Tag'] ), ['2GB', '2Processors', '3Processors', 'GPU'] )
+    self.assertEqual( res['Site'], 'DIRAC.Jenkins.ch' )
+
+    res = self.matcher._applyResourceBudget( resourceDict, {'NumberOfProcessors': 1, 'MaxRAM': 0} )
+    self.assertEqual( sorted( res['Tag'] ), ['GPU', 'WholeNode'] )
+
+  def test__getJobNeeds( self ):
+
+    budget = {'NumberOfProcessors': 8, 'MaxRAM': 16000}
+    self.assertEqual( self.matcher._getJobNeeds( [], budget ), ( 1, 0 ) )
+    self.assertEqual( self.matcher._getJobNeeds( ['2Processors', '4Processors', '2GB', 'GPU'], budget ), ( 4, 2000 ) )
+    self.assertEqual( self.matcher._getJobNeeds( ['WholeNode'], budget ), ( 8, 16000 ) )
+
+  def test_selectJobs( self ):
+
+    self.matcher._getResourceDict = MagicMock( return_value = {'Site': 'DIRAC.Jenkins.ch', 'Setup': 'aSetup'} )
+    self.matcher.limiter = MagicMock()
+    self.matcher.limiter.getNegativeCondForSite.return_value = {}
+    self.opsHelperMock.getValue.return_value = False
+    self.tqDBMock.matchAndGetJob.side_effect = [ S_OK( {'matchFound': True, 'jobId': 1, 'taskQueueId': 10} ),
+                                                 S_OK( {'matchFound': True, 'jobId': 2, 'taskQueueId': 11} ),
+                                                 S_OK( {'matchFound': True, 'jobId': 3, 'taskQueueId': 10} ) ]
+    self.tqDBMock.getTaskQueueTags.side_effect = [ S_OK( {10: []} ), S_OK( {11: ['2Processors']} ) ]
+    self.jobDBMock.getAttributesForJobList.return_value = S_OK( {1: {'OwnerDN': 'dn', 'OwnerGroup': 'g', 'Status': 'Waiting'},
+                                                                 2: {'OwnerDN': 'dn', 'OwnerGroup': 'g', 'Status': 'Waiting'},
+                                                                 3: {'OwnerDN': 'dn', 'OwnerGroup': 'g', 'Status': 'Waiting'}} )
+    self.jobDBMock.getJobJDLs.return_value = S_OK( {1: '[JDL1]', 2: '[JDL2]', 3: '[JDL3]'} )
+    self.jobDBMock.getJobsOptParameters.return_value = S_OK( {2: {'OptParam': 'x'}} )
+
+    res = self.matcher.selectJobs( {'NumberOfProcessors': 4}, {}, maxJobs = 5 )
+    # 1 + 2 + 1 processors used: the budget is exhausted after the third job
+    self.assertEqual( [ jobDict['JobID'] for jobDict in res ], [1, 2, 3] )
+    self.assertEqual( res[1]['OptParam'], 'x' )
+    self.assertEqual( res[2]['JDL'], '[JDL3]' )
+    self.assertEqual( self.tqDBMock.matchAndGetJob.call_count, 3 )
+    self.jobDBMock.getJobJDLs.assert_called_once_with( [1, 2, 3] )
+
+#############################################################################
+
+class RunningJobsCacheTestCase( ClientsTestCase ):
+
+  def test_getCounters( self ):
+
+    self.jobDBMock.getCounters.return_value = S_OK( [ ( {'Site': 'S1', 'JobType': 'MC'}, 3 ),
+                                                      ( {'Site': 'S1', 'JobType': 'User'}, 2 ),
+                                                      ( {'Site': 'S2', 'JobType': 'MC'}, 1 ) ] )
+    cache = RunningJobsCache( refreshPeriod = 100 )
+
+    self.assertEqual( cache.getCounters( self.jobDBMock, 'S1', 'JobType' )['Value'], {'MC': 3, 'User': 2} )
+    self.assertEqual( cache.getCounters( self.jobDBMock, 'S2', 'JobType' )['Value'], {'MC': 1} )
+    self.assertEqual( cache.getCounters( self.jobDBMock, 'S3', 'JobType' )['Value'], {} )
+    # Only one grouped query for all the sites
+    self.assertEqual( self.jobDBMock.getCounters.call_count, 1 )
+    self.assertEqual( cache.getStats()['Hits'], 2 )
+
+    cache.jobStatusChanged( 'S1', {'JobType': 'MC'}, 'Waiting', 'Matched' )
+    cache.jobStatusChanged( 'S1', {'JobType': 'User'}, 'Running', 'Done' )
+    cache.jobStatusChanged( 'S1', {'JobType': 'User'}, 'Matched', 'Running' )
+    self.assertEqual( cache.getCounters( self.jobDBMock, 'S1', 'JobType' )['Value'], {'MC': 4, 'User': 1} )
+    self.assertEqual( self.jobDBMock.getCounters.call_count, 1 )
+
+    # A new attribute triggers a refresh including all the known attributes
+    self.jobDBMock.getCounters.return_value = S_OK( [ ( {'Site': 'S1', 'JobType': 'MC', 'Owner': 'me'}, 3 ) ] )
+    self.assertEqual( cache.getCounters( self.jobDBMock, 'S1', 'Owner' )['Value'], {'me': 3} )
+    self.assertEqual( sorted( self.jobDBMock.getCounters.call_args[0][1] ), ['JobType', 'Owner', 'Site'] )
+    self.assertEqual( cache.getCounters( self.jobDBMock, 'S1', 'JobType' )['Value'], {'MC': 3} )
+
+  def test_jobFinished( self ):
+
+    self.jobDBMock.getCounters.return_value = S_OK( [ ( {'Site': 'S1', 'JobType': 'MC'}, 3 ) ] )
+    cache = RunningJobsCache( refreshPeriod = 100 )
+    self.assertEqual( cache.getCounters( self.jobDBMock, 'S1', 'JobType' )['Value'], {'MC': 3} )
+
+    # A job finished in another service: the counter is decreased at the next refresh
+    self.jobDBMock.getCounters.return_value = S_OK( [ ( {'Site': 'S1', 'JobType': 'MC'}, 2 ) ] )
+    self.assertEqual( cache.getCounters( self.jobDBMock, 'S1', 'JobType' )['Value'], {'MC': 3} )
+    cache.refreshPeriod = 0
+    self.assertEqual( cache.getCounters( self.jobDBMock, 'S1', 'JobType' )['Value'], {'MC': 2} )
+    self.assertEqual( self.jobDBMock.getCounters.call_count, 2 )
+
+    # The last running job of the type finished
+    self.jobDBMock.getCounters.return_value = S_OK( [] )
+    self.assertEqual( cache.getCounters( self.jobDBMock, 'S1', 'JobType' )['Value'], {} )
+
+  def test_updateDelayCounters( self ):
+
+    sections = { 'JobScheduling/MatchingDelay/Site.Delay': ['JobType'] }
+    opsHelper = MagicMock()
+    opsHelper.getValue.side_effect = lambda option, default: default
+    opsHelper.getSections.side_effect = lambda section: S_OK( sections.get( section, [] ) )
+    opsHelper.getOptionsDict.return_value = S_OK( {'MC': '60'} )
+    self.jobDBMock.jobAttributeNames = ['JobType']
+    self.jobDBMock.getJobAttributes.return_value = S_OK( {'JobType': 'MC'} )
+    limiter = Limiter( jobDB = self.jobDBMock, opsHelper = opsHelper )
+
+    # No delay nor running limit at the site: the job attributes are not even read
+    self.assertTrue( limiter.updateDelayCounters( 'Site.NoLimit', 1 )['OK'] )
+    self.assertFalse( self.jobDBMock.getJobAttributes.called )
+    self.assertEqual( limiter.getNegativeCondForSite( 'Site.NoLimit' ), {} )
+
+    self.assertTrue( limiter.updateDelayCounters( 'Site.Delay', 2 )['OK'] )
+    self.jobDBMock.getJobAttributes.assert_called_once_with( 2, ['JobType'] )
+    self.assertEqual( limiter.getNegativeCondForSite( 'Site.Delay' ), {'JobType': ['MC']} )
+
+#############################################################################
+
+class CachedJobStateTestCase( ClientsTestCase ):
+
+  def setUp( self ):
+    super( CachedJobStateTestCase, self ).setUp()
+    dbHold = JobState._JobState__db
+    dbHold.checked = True
+    dbHold.job = self.jobDBMock
+    dbHold.log = self.jlDBMock
+    dbHold.tq = self.tqDBMock
+    self.jobDBMock.getAttributesForJobList.return_value = S_OK( {
+        1: {'JobID': 1, 'Status': 'Checking', 'MinorStatus': 'JobSanity', 'LastUpdateTime': 'T1', 'Owner': 'me'},
+        3: {'JobID': 3, 'Status': 'Checking', 'MinorStatus': 'JobSanity', 'LastUpdateTime': 'T3', 'Owner': 'you'} } )
+    self.jobDBMock.getJobsOptParameters.return_value = S_OK( {1: {'OptimizerChain': 'JobSanity,JobScheduling'},
+                                                              3: {}} )
+    self.jobDBMock.getJobJDLs.return_value = S_OK( {1: '[ Executable = "a.sh"; ]', 3: '[ Executable = "b.sh"; ]'} )
+
+  def tearDown( self ):
+    super( CachedJobStateTestCase, self ).tearDown()
+    JobState._JobState__db.reset()
+    JobState._JobState__db.checked = False
+
+  def test_loadBulk( self ):
+    res = CachedJobState.loadBulk( [1, 2, 3] )
+    self.assertTrue( res['OK'] )
+    cjs1, cjs2, cjs3 = res['Value']
+    self.assertEqual( self.jobDBMock.getAttributesForJobList.call_count, 1 )
+    self.jobDBMock.getJobJDLs.assert_called_once_with( [1, 3] )
+    self.assertTrue( cjs1.valid )
+    self.assertFalse( cjs2.valid )
+    self.assertEqual( cjs3.jid, 3 )
+    # Everything is served from the cache
+    cjs1.dOnlyCache = True
+    self.assertEqual( cjs1.getAttribute( 'Owner' )['Value'], 'me' )
+    self.assertEqual( cjs1.getStatus()['Value'], ( 'Checking', 'JobSanity' ) )
+    self.assertEqual( cjs1.getOptParameter( 'OptimizerChain' )['Value'], 'JobSanity,JobScheduling' )
+    self.assertEqual( cjs1.getManifest()['Value'].getOption( 'Executable' ), 'a.sh' )
+    self.assertFalse( cjs1.getDirtyKeys() )
+    self.assertFalse( self.jobDBMock.getJobAttributes.called )
+
+  def test_serialize( self ):
+    cjs = CachedJobState.loadBulk( [1] )['Value'][0]
+    cjs.setStatus( 'Checking', 'JobScheduling', source = 'JobSanity' )
+    cjs.setOptParameter( 'Big', 'x' * 10000 )
+    stub = cjs.serialize()
+    self.assertEqual( stub[0], 'Z' )
+    res = CachedJobState.deserialize( stub )
+    self.assertTrue( res['OK'] )
+    self.assertEqual( res['Value']._internals, cjs._internals )
+
+    # Stubs of the previous format are still understood
+    oldStub = DEncode.encode( ( 1, {'att.Status': 'Checking', 'inputData': []}, [], None,
+                                {'Status': 'Checking'}, False, ( 'att.Status', ) ) )
+    res = CachedJobState.deserialize( oldStub )
+    self.assertTrue( res['OK'] )
+    self.assertEqual( res['Value']._inspectCache(), {'att.Status': 'Checking', 'inputData': []} )
+    self.assertEqual( res['Value'].getDirtyKeys(), set( ['att.Status'] ) )
+    self.assertFalse( CachedJobState.deserialize( 'garbage' )['OK'] )
+
+  def test_commitChangesBulk( self ):
+    cjs1, cjs3 = CachedJobState.loadBulk( [1, 3] )['Value']
+    for cjs in ( cjs1, cjs3 ):
+      cjs.setStatus( 'Checking', 'JobScheduling', source = 'JobSanity' )
+    cjs1.setOptParameter( 'OptimizerChain', 'JobScheduling' )
+    cjs3.setParameter( 'Param', 'value' )
+    for method in ( 'setJobAttributes', 'setJobsParameters', 'setJobsOptParameters' ):
+      getattr( self.jobDBMock, method ).return_value = S_OK()
+    self.jlDBMock.addLoggingRecords.return_value = S_OK()
+
+    res = CachedJobState.commitChangesBulk( [cjs1, cjs3] )
+    self.assertTrue( res['OK'] )
+    self.assertEqual( sorted( res['Value']['Successful'] ), [1, 3] )
+    # The same attribute changes are done with a single statement
+    self.assertEqual( self.jobDBMock.setJobAttributes.call_count, 1 )
+    self.assertEqual( sorted( self.jobDBMock.setJobAttributes.call_args[0][0] ), [1, 3] )
+    self.jobDBMock.setJobsParameters.assert_called_once_with( {3: [( 'Param', 'value' )]} )
+    self.jobDBMock.setJobsOptParameters.assert_called_once_with( {1: {'OptimizerChain': 'JobScheduling'}} )
+    self.assertEqual( len( self.jlDBMock.addLoggingRecords.call_args[0][0] ), 2 )
+    self.assertFalse( cjs1.getDirtyKeys() )
+
+    # Jobs changed by someone else are not committed
+    cjs1.setMinorStatus( 'JobPath' )
+    self.jobDBMock.getAttributesForJobList.return_value = S_OK( {
+        1: {'JobID': 1, 'Status': 'Killed', 'MinorStatus': 'JobSanity', 'LastUpdateTime': 'T4'} } )
+    self.jobDBMock.getJobAttributes.return_value = S_OK( {'Status': 'Killed'} )
+    res = CachedJobState.commitChangesBulk( [cjs1] )
+    self.assertEqual( res['Value']['Failed'], {1: 'Initial state was different'} )
+    self.assertEqual( self.jobDBMock.setJobAttributes.call_count, 1 )
+
+  def test_commitChangesBulkInputData( self ):
+    cjs1, cjs3 = CachedJobState.loadBulk( [1, 3] )['Value']
+    for cjs in ( cjs1, cjs3 ):
+      cjs.setStatus( 'Checking', 'JobScheduling', source = 'JobSanity' )
+      # The input data are set by the optimizers through the cache
+      cjs._CachedJobState__cacheAdd( 'inputData', {'/vo/f%d' % cjs.jid: {}} )
+    for method in ( 'setJobAttributes', 'setJobsParameters', 'setJobsOptParameters' ):
+      getattr( self.jobDBMock, method ).return_value = S_OK()
+    self.jlDBMock.addLoggingRecords.return_value = S_OK()
+    self.jobDBMock.setInputData.side_effect = lambda jid, inputData: S_ERROR( 'Bad LFN' ) if jid == 1 else S_OK()
+
+    res = CachedJobState.commitChangesBulk( [cjs1, cjs3] )
+    self.assertTrue( res['OK'] )
+    # Only the job whose input data could not be set failed
+    self.assertEqual( res['Value']['Successful'], [3] )
+    self.assertEqual( res['Value']['Failed'], {1: 'Bad LFN'} )
+    self.assertEqual( self.jobDBMock.setJobAttributes.call_args[0][0], [3] )
+    self.assertEqual( [record[0] for record in self.jlDBMock.addLoggingRecords.call_args[0][0]], [3] )
+    self.assertFalse( cjs3.getDirtyKeys() )
+    # The changes of the failed job are discarded
+    self.assertFalse( cjs1.getDirtyKeys() )
+
+  def test_commitBatcher( self ):
+    batches = []
+    def commitChangesBulk( cjsList ):
+      batches.append( len( cjsList ) )
+      return S_OK( {'Successful': [cjs.jid for cjs in cjsList if cjs.jid != 5],
+                    'Failed': {5: 'Initial state was different'}} )
+    batcher = CommitBatcher( maxBatchSize = 4, maxWait = 0.2 )
+    results = {}
+    def commit( jid ):
+      results[jid] = batcher.commit( CachedJobState( jid, skipInitState = True ) )
+    with patch.object( CachedJobState, 'commitChangesBulk', side_effect = commitChangesBulk ):
+      threads = [threading.Thread( target = commit, args = ( jid, ) ) for jid in range( 10 )]
+      for thread in threads:
+        thread.start()
+      for thread in threads:
+        thread.join()
+    self.assertEqual( sum( batches ), 10 )
+    self.assertTrue( max( batches ) <= 4 )
+    self.assertTrue( len( batches ) < 10 )
+    self.assertFalse( results.pop( 5 )['OK'] )
+    self.assertTrue( all( result['OK'] for result in results.values() ) )
+
 #############################################################################
 
 class SandboxStoreTestCaseSuccess( ClientsTestCase ):
@@ -170,6 +424,8 @@ class SandboxStoreTestCaseSuccess( ClientsTestCase ):
 if __name__ == '__main__':
   suite = unittest.defaultTestLoader.loadTestsFromTestCase( ClientsTestCase )
   suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( MatcherTestCase ) )
+  suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( RunningJobsCacheTestCase ) )
+  suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( CachedJobStateTestCase ) )
   suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( DownloadInputDataSuccess ) )
   suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( SandboxStoreTestCaseSuccess ) )
   testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
@@ -14,6 +14,7 @@
     getAllJobParameters()
     getInputData()
     getJobJDL()
+    getJobJDLs()
 
     selectJobs()
     selectJobsWithStatus()
@@ -22,6 +23,8 @@
     setJobAttributes()
     setJobParameter()
     setJobParameters()
+    setJobsParameters()
+    setJobsOptParameters()
     setJobJDL()
     setJobStatus()
     setInputData()
@@ -43,6 +46,7 @@
 __RCSID__ = "$Id$"
 
 import sys
+import time
 import operator
 
 from DIRAC.Core.Utilities                                    import DErrno
@@ -308,6 +312,38 @@ class JobDB( DB ):
 
         return S_OK( resultDict )
 
+#############################################################################
+  def getJobParametersForJobList( self, jobIDList, paramList ):
+    """ Get the given Job Parameters for all the jobs in jobIDList with a single query.
+        Returns an S_OK structure with a dictionary of dictionaries as its Value:
+        ValueDict[jobID][parameter_name] = parameter_value
+    """
+    if not jobIDList or not paramList:
+      return S_OK( {} )
+
+    paramNameList = []
+    for x in paramList:
+      ret = self._escapeString( x )
+      if not ret['OK']:
+        return ret
+      paramNameList.append( ret['Value'] )
+    jobList = ','.join( [ str( int( x ) ) for x in jobIDList ] )
+
+    cmd = "SELECT JobID, Name, Value FROM JobParameters WHERE JobID IN (%s) AND Name IN (%s)" % ( jobList,
+                                                                                             ','.join( paramNameList ) )
+    result = self._query( cmd )
+    if not result['OK']:
+      return S_ERROR( 'JobDB.getJobParametersForJobList: failed to retrieve parameters' )
+
+    resultDict = {}
+    for jobID, name, value in result['Value']:
+      try:
+        value = value.tostring()
+      except Exception:
+        pass
+      resultDict.setdefault( int( jobID ), {} )[name] = value
+    return S_OK( resultDict )
+
 #############################################################################
   def getAtticJobParameters( self, jobID, paramList = None, rescheduleCounter = -1 ):
     """ Get Attic Job Parameters defined for a job with jobID.
@@ -480,6 +516,35 @@ class JobDB( DB ):
     else:
       return S_ERROR( 'JobDB.getJobOptParameters: failed to retrieve parameters' )
 
+#############################################################################
+  def getJobsOptParameters( self, jobIDList, paramList = None ):
+    """ Get optimizer parameters for a list of jobs with a single query.
+        Returns a dictionary { jobID : { name : value } }
+    """
+    if not jobIDList:
+      return S_OK( {} )
+    jobList = ','.join( [ str( int( jobID ) ) for jobID in jobIDList ] )
+    cmd = "SELECT JobID, Name, Value from OptimizerParameters WHERE JobID in (%s)" % jobList
+    if paramList:
+      paramNameList = []
+      for x in paramList:
+        ret = self._escapeString( x )
+        if not ret['OK']:
+          return ret
+        paramNameList.append( ret['Value'] )
+      cmd += " and Name in (%s)" % ','.join( paramNameList )
+
+    result = self._query( cmd )
+    if not result['OK']:
+      return S_ERROR( 'JobDB.getJobsOptParameters: failed to retrieve parameters' )
+    resultDict = dict( [ ( int( jobID ), {} ) for jobID in jobIDList ] )
+    for jobID, name, value in result['Value']:
+      try:
+        resultDict[int( jobID )][name] = value.tostring()
+      except Exception:
+        resultDict[int( jobID )][name] = value
+    return S_OK( resultDict )
+
 #############################################################################
 
   def getInputData( self, jobID ):
@@ -625,13 +690,25 @@ class JobDB( DB ):
 #############################################################################
   def setJobAttributes( self, jobID, attrNames, attrValues, update = False, myDate = None ):
     """ Set an attribute value for job specified by jobID.
+        jobID can also be a list of job IDs to set the same values to all of them at once.
         The LastUpdate time stamp is refreshed if explicitely requested
     """
 
-    ret = self._escapeString( jobID )
-    if not ret['OK']:
-      return ret
-    jobID = ret['Value']
+    if isinstance( jobID, ( list, tuple ) ):
+      if not jobID:
+        return S_ERROR( 'JobDB.setAttributes: Nothing to do' )
+      jobIDList = []
+      for jID in jobID:
+        ret = self._escapeString( jID )
+        if not ret['OK']:
+          return ret
+        jobIDList.append( ret['Value'] )
+      jobCond = 'JobID IN (%s)' % ','.join( jobIDList )
+    else:
+      ret = self._escapeString( jobID )
+      if not ret['OK']:
+        return ret
+      jobCond = 'JobID=%s' % ret['Value']
 
     if len( attrNames ) != len( attrValues ):
       return S_ERROR( 'JobDB.setAttributes: incompatible Argument length' )
@@ -649,7 +726,7 @@ class JobDB( DB ):
     if len( attr ) == 0:
       return S_ERROR( 'JobDB.setAttributes: Nothing to do' )
 
-    cmd = 'UPDATE Jobs SET %s WHERE JobID=%s' % ( ', '.join( attr ), jobID )
+    cmd = 'UPDATE Jobs SET %s WHERE %s' % ( ', '.join( attr ), jobCond )
 
     if myDate:
       cmd += ' AND LastUpdateTime < %s' % myDate
@@ -805,6 +882,48 @@ class JobDB( DB ):
 
     return S_OK()
 
+#############################################################################
+  def setJobsParameters( self, parametersDict ):
+    """ Set the parameters of many jobs with a single statement.
+        parametersDict is a dictionary { jobID : [ ( name, value ) ] }
+    """
+    insertValueList = []
+    for jobID, parameters in parametersDict.items():
+      for name, value in parameters:
+        result = self.__escapePair( name, value )
+        if not result['OK']:
+          return result
+        insertValueList.append( '(%d,%s,%s)' % ( ( int( jobID ), ) + result['Value'] ) )
+    if not insertValueList:
+      return S_OK()
+
+    cmd = 'REPLACE JobParameters (JobID,Name,Value) VALUES %s' % ', '.join( insertValueList )
+    result = self._update( cmd )
+    if not result['OK']:
+      return S_ERROR( 'JobDB.setJobsParameters: operation failed.' )
+    return result
+
+#############################################################################
+  def setJobsOptParameters( self, parametersDict ):
+    """ Set the optimizer parameters of many jobs with a single statement.
+        parametersDict is a dictionary { jobID : { name : value } }
+    """
+    insertValueList = []
+    for jobID, parameters in parametersDict.items():
+      for name, value in parameters.items():
+        result = self.__escapePair( name, value )
+        if not result['OK']:
+          return result
+        insertValueList.append( '(%d,%s,%s)' % ( ( int( jobID ), ) + result['Value'] ) )
+    if not insertValueList:
+      return S_OK()
+
+    cmd = 'REPLACE OptimizerParameters (JobID,Name,Value) VALUES %s' % ', '.join( insertValueList )
+    result = self._update( cmd )
+    if not result['OK']:
+      return S_ERROR( 'JobDB.setJobsOptParameters: operation failed.' )
+    return result
+
 #############################################################################
   def removeJobOptParameter( self, jobID, name ):
     """ Remove the specified optimizer parameter for jobID
@@ -976,6 +1095,24 @@ class JobDB( DB ):
     else:
       return result
 
+#############################################################################
+  def getJobJDLs( self, jobIDList, original = False ):
+    """ Get the JDLs of a list of jobs with a single query.
+        Returns a dictionary { jobID : jdl } for the jobs found
+    """
+    if not jobIDList:
+      return S_OK( {} )
+    jobList = ','.join( [ str( int( jobID ) ) for jobID in jobIDList ] )
+    if original:
+      cmd = "SELECT JobID, OriginalJDL FROM JobJDLs WHERE JobID in (%s)" % jobList
+    else:
+      cmd = "SELECT JobID, JDL FROM JobJDLs WHERE JobID in (%s)" % jobList
+
+    result = self._query( cmd )
+    if not result['OK']:
+      return result
+    return S_OK( dict( [ ( int( jobID ), jdl ) for jobID, jdl in result['Value'] ] ) )
+
 #############################################################################
   def insertNewJobIntoDB( self, jdl, owner, ownerDN, ownerGroup, diracSetup ):
     """ Insert the initial JDL into the Job database,
@@ -1281,18 +1418,46 @@ class JobDB( DB ):
     return result
 
 #################################################################
+  __rescheduleAttributes = [ 'Status', 'MinorStatus', 'VerifiedFlag', 'RescheduleCounter',
+                             'Owner', 'OwnerDN', 'OwnerGroup', 'DIRACSetup' ]
+
   def rescheduleJobs( self, jobIDs ):
-    """ Reschedule all the jobs in the given list
+    """ Reschedule all the jobs in the given list. The job attributes and JDLs are
+        retrieved and the job parameters moved to the attic for all the jobs at once
     """
+    jobIDs = [ int( jobID ) for jobID in jobIDs ]
+    result = self.getAttributesForJobList( jobIDs, self.__rescheduleAttributes )
+    if not result['OK']:
+      self.log.error( 'JobDB.rescheduleJobs: can not retrieve job attributes', result['Message'] )
+      attrDict = {}
+    else:
+      attrDict = result['Value']
 
-    result = S_OK()
+    rescheduleCounters = {}
+    for jobID in attrDict:
+      result = self.__checkRescheduling( jobID, attrDict[jobID] )
+      if result['OK']:
+        rescheduleCounters[jobID] = result['Value']
+    failedJobs = [ jobID for jobID in jobIDs if jobID not in rescheduleCounters ]
 
-    failedJobs = []
-    for jobID in jobIDs:
-      result = self.rescheduleJob( jobID )
+    if rescheduleCounters:
+      result = self.__resetJobParameters( rescheduleCounters.keys() )
+      if result['OK']:
+        result = self.getJobJDLs( rescheduleCounters.keys(), original = True )
       if not result['OK']:
-        failedJobs.append( jobID )
+        self.log.error( 'JobDB.rescheduleJobs: can not prepare the jobs', result['Message'] )
+        failedJobs += rescheduleCounters.keys()
+      else:
+        jdlDict = result['Value']
+        for jobID in rescheduleCounters:
+          if not jdlDict.get( jobID ):
+            failedJobs.append( jobID )
+            continue
+          result = self.__rescheduleJobFromJDL( jobID, jdlDict[jobID], attrDict[jobID], rescheduleCounters[jobID] )
+          if not result['OK']:
+            failedJobs.append( jobID )
 
+    result = S_OK()
     if failedJobs:
       result = S_ERROR( 'JobDB.rescheduleJobs: Not all the jobs were rescheduled' )
       result['FailedJobs'] = failedJobs
@@ -1305,13 +1470,34 @@ class JobDB( DB ):
         defined parameters in the parameter Attic
     """
     # Check Verified Flag
-    result = self.getJobAttributes( jobID, ['Status', 'MinorStatus', 'VerifiedFlag', 'RescheduleCounter',
-                                            'Owner', 'OwnerDN', 'OwnerGroup', 'DIRACSetup'] )
+    result = self.getJobAttributes( jobID, self.__rescheduleAttributes )
     if result['OK']:
       resultDict = result['Value']
     else:
       return S_ERROR( 'JobDB.getJobAttributes: can not retrieve job attributes' )
 
+    result = self.__checkRescheduling( jobID, resultDict )
+    if not result['OK']:
+      return result
+    rescheduleCounter = result['Value']
+
+    # Save the job parameters for later debugging
+    result = self.__resetJobParameters( [ jobID ] )
+    if not result['OK']:
+      return result
+
+    # the Jobreceiver needs to know if there is InputData ??? to decide which optimizer to call
+    # proposal: - use the getInputData method
+    res = self.getJobJDL( jobID, original = True )
+    if not res['OK']:
+      return res
+
+    return self.__rescheduleJobFromJDL( jobID, res['Value'], resultDict, rescheduleCounter )
+
+  def __checkRescheduling( self, jobID, resultDict ):
+    """ Check that the job can be rescheduled, fail it if it has reached the maximum
+        number of reschedulings. Returns the new reschedule counter
+    """
     if not 'VerifiedFlag' in resultDict:
       return S_ERROR( 'Job ' + str( jobID ) + ' not found in the system' )
 
@@ -1321,7 +1507,6 @@ class JobDB( DB ):
           resultDict['Status'],
           resultDict['MinorStatus'] ) )
 
-
     # Check the Reschedule counter first
     rescheduleCounter = int( resultDict['RescheduleCounter'] ) + 1
 
@@ -1333,43 +1518,41 @@ class JobDB( DB ):
       self.setJobStatus( jobID, status = 'Failed', minor = 'Maximum of reschedulings reached' )
       return S_ERROR( 'Maximum number of reschedulings is reached: %s' % self.maxRescheduling )
 
-    jobAttrNames = []
-    jobAttrValues = []
-
-    jobAttrNames.append( 'RescheduleCounter' )
-    jobAttrValues.append( rescheduleCounter )
+    return S_OK( rescheduleCounter )
 
-    # Save the job parameters for later debugging
-    result = self.getJobParameters( jobID )
-    if result['OK']:
-      parDict = result['Value']
-      for key, value in parDict.items():
-        result = self.setAtticJobParameter( jobID, key, value, rescheduleCounter - 1 )
-        if not result['OK']:
-          break
+  def __resetJobParameters( self, jobIDList ):
+    """ Move the job parameters to the attic, with the current reschedule counter as cycle,
+        and delete the optimizer parameters of the jobs
+    """
+    jobList = ','.join( [ str( int( jobID ) ) for jobID in jobIDList ] )
 
-    ret = self._escapeString( jobID )
-    if not ret['OK']:
-      return ret
-    e_jobID = ret['Value']
+    cmd = 'INSERT IGNORE INTO AtticJobParameters (JobID,RescheduleCycle,Name,Value) ' \
+          'SELECT p.JobID, j.RescheduleCounter, p.Name, p.Value FROM JobParameters p, Jobs j ' \
+          'WHERE p.JobID = j.JobID AND p.JobID IN (%s)' % jobList
+    result = self._update( cmd )
+    if not result['OK']:
+      self.log.warn( 'JobDB: can not save the job parameters in the attic', result['Message'] )
 
-    cmd = 'DELETE FROM JobParameters WHERE JobID=%s' % e_jobID
+    cmd = 'DELETE FROM JobParameters WHERE JobID IN (%s)' % jobList
     res = self._update( cmd )
     if not res['OK']:
       return res
 
     # Delete optimizer parameters
-    cmd = 'DELETE FROM OptimizerParameters WHERE JobID=%s' % ( e_jobID )
+    cmd = 'DELETE FROM OptimizerParameters WHERE JobID IN (%s)' % jobList
     if not self._update( cmd )['OK']:
       return S_ERROR( 'JobDB.removeJobOptParameter: operation failed.' )
+    return S_OK()
 
-    # the Jobreceiver needs to know if there is InputData ??? to decide which optimizer to call
-    # proposal: - use the getInputData method
-    res = self.getJobJDL( jobID, original = True )
-    if not res['OK']:
-      return res
+  def __rescheduleJobFromJDL( self, jobID, jdl, resultDict, rescheduleCounter ):
+    """ Reset the JDL, the initial parameters and the attributes of a job to be rescheduled
+    """
+    jobAttrNames = []
+    jobAttrValues = []
+
+    jobAttrNames.append( 'RescheduleCounter' )
+    jobAttrValues.append( rescheduleCounter )
 
-    jdl = res['Value']
     # Fix the possible lack of the brackets in the JDL
     if jdl.strip()[0].find( '[' ) != 0 :
       jdl = '[' + jdl + ']'
@@ -1939,6 +2122,92 @@ class JobDB( DB ):
     else:
       return S_ERROR( 'Failed to store some or all the parameters' )
 
+#####################################################################################
+  def setHeartBeatDataBulk( self, heartBeatDict ):
+    """ Add the heart beat data of many jobs to the database with one statement per table.
+
+        heartBeatDict is a dictionary { jobID : ( staticDataDict, dynamicDataList ) } where
+        dynamicDataList is a list of ( heartBeatTime, dynamicDataDict ) tuples, the heart beat
+        times being the epoch times at which the heart beats were received. They are stored
+        as the UTC time of the DB server minus the time spent in the buffer, as the heart beats
+        written synchronously, so that the service host clock does not matter.
+
+        The jobs already in a final state keep their status: a buffered heart beat can be
+        written after the job wrapper has set it.
+    """
+    if not heartBeatDict:
+      return S_OK()
+
+    def dbTime( heartBeatTime ):
+      """ UTC time of the heart beat on the DB server clock """
+      return 'UTC_TIMESTAMP() - INTERVAL %d SECOND' % max( 0, int( now - heartBeatTime ) )
+
+    now = time.time()
+    timeCases = []
+    updatedJobs = []
+    parameterValues = []
+    loggingValues = []
+    for jobID, ( staticDataDict, dynamicDataList ) in heartBeatDict.items():
+      jobID = int( jobID )
+      if not dynamicDataList:
+        continue
+      latestTime = max( [ heartBeatTime for heartBeatTime, _dynamicData in dynamicDataList ] )
+      timeCases.append( "WHEN %d THEN %s" % ( jobID, dbTime( latestTime ) ) )
+      updatedJobs.append( str( jobID ) )
+      for name, value in staticDataDict.items():
+        result = self.__escapePair( name, value )
+        if not result['OK']:
+          continue
+        parameterValues.append( '(%d,%s,%s)' % ( ( jobID, ) + result['Value'] ) )
+      for heartBeatTime, dynamicDataDict in dynamicDataList:
+        for key, value in dynamicDataDict.items():
+          result = self.__escapePair( key, value )
+          if not result['OK']:
+            continue
+          loggingValues.append( "(%d,%s,%s,%s)" % ( ( jobID, ) + result['Value'] + ( dbTime( heartBeatTime ), ) ) )
+
+    if not timeCases:
+      return S_OK()
+    finalStates = ','.join( [ "'%s'" % status for status in self.JOB_FINAL_STATES + [ 'Killed', 'Deleted' ] ] )
+    req = "UPDATE Jobs SET HeartBeatTime=CASE JobID %s END, " % ' '.join( timeCases )
+    req += "Status=CASE WHEN Status IN (%s) THEN Status ELSE 'Running' END " % finalStates
+    req += "WHERE JobID IN (%s)" % ','.join( updatedJobs )
+    result = self._update( req )
+    if not result['OK']:
+      return S_ERROR( 'Failed to set the heart beat time: ' + result['Message'] )
+
+    ok = True
+    if parameterValues:
+      req = 'REPLACE JobParameters (JobID,Name,Value) VALUES %s' % ','.join( parameterValues )
+      result = self._update( req )
+      if not result['OK']:
+        ok = False
+        self.log.warn( result['Message'] )
+
+    if loggingValues:
+      req = "INSERT INTO HeartBeatLoggingInfo (JobID,Name,Value,HeartBeatTime) VALUES %s" % ','.join( loggingValues )
+      result = self._update( req )
+      if not result['OK']:
+        ok = False
+        self.log.warn( result['Message'] )
+
+    if ok:
+      return S_OK()
+    else:
+      return S_ERROR( 'Failed to store some or all the parameters' )
+
+  def __escapePair( self, key, value ):
+    """ Escape a name/value pair of parameter or heart beat data
+    """
+    escaped = []
+    for item in ( key, value ):
+      result = self._escapeString( item )
+      if not result['OK']:
+        self.log.warn( 'Failed to escape string ' + str( item ) )
+        return result
+      escaped.append( result['Value'] )
+    return S_OK( tuple( escaped ) )
+
 #####################################################################################
   def getHeartBeatData( self, jobID ):
     """ Retrieve the job's heart beat data
@@ -1963,6 +2232,27 @@ class JobDB( DB ):
 
     return S_OK( result )
 
+#####################################################################################
+  def getHeartBeatDataForJobList( self, jobIDList ):
+    """ Retrieve the heart beat data of a list of jobs with a single query.
+        Returns a dictionary { jobID : [ records as returned by getHeartBeatData ] },
+        jobs without heart beat data are not included
+    """
+    if not jobIDList:
+      return S_OK( {} )
+    jobList = ','.join( [ str( int( jobID ) ) for jobID in jobIDList ] )
+
+    cmd = 'SELECT JobID,Name,Value,HeartBeatTime from HeartBeatLoggingInfo WHERE JobID IN (%s)' % jobList
+    res = self._query( cmd )
+    if not res['OK']:
+      return res
+
+    result = {}
+    for jobID, name, value, heartBeatTime in res['Value']:
+      result.setdefault( int( jobID ), [] ).append( ( str( name ), '%.01f' % ( float( value.replace( '"', '' ) ) ),
+                                                      str( heartBeatTime ) ) )
+    return S_OK( result )
+
 #####################################################################################
   def setJobCommand( self, jobID, command, arguments = None ):
     """ Store a command to be passed to the job together with the
@@ -2,6 +2,7 @@
     The following methods are provided
 
     addLoggingRecord()
+    addLoggingRecords()
     getJobLoggingInfo()
     getWMSTimeStamps()
 """
@@ -42,12 +43,31 @@ class JobLoggingDB( DB ):
         components can be specified. Optionaly the time stamp of the status can
         be provided in a form of a string in a format '%Y-%m-%d %H:%M:%S' or
         as datetime.datetime object. If the time stamp is not provided the current
-        UTC time is used.
+        UTC time is used. jobID can also be a list of job IDs to add the same record
+        to all of them with a single statement.
     """
 
     event = 'status/minor/app=%s/%s/%s' % ( status, minor, application )
     self.gLogger.info( "Adding record for job " + str( jobID ) + ": '" + event + "' from " + source )
 
+    _date, time_order = self.__getDateAndOrder( date )
+
+    if not isinstance( jobID, ( list, tuple ) ):
+      jobID = [ jobID ]
+    if not jobID:
+      return S_OK()
+    cmd = "INSERT INTO LoggingInfo (JobId, Status, MinorStatus, ApplicationStatus, " + \
+          "StatusTime, StatusTimeOrder, StatusSource) VALUES "
+    cmd += ",".join( [ "(%d,'%s','%s','%s','%s',%f,'%s')" % ( int( jID ), status, minor, application,
+                                                            str( _date ), time_order, source ) for jID in jobID ] )
+
+    return self._update( cmd )
+
+#############################################################################
+  def __getDateAndOrder( self, date ):
+    """ Get the UTC datetime of a logging record and its time order from the date
+        provided as a string, a datetime.datetime object or nothing for the current time
+    """
     if not date:
       # Make the UTC datetime string and float
       _date = Time.dateTime()
@@ -74,11 +94,25 @@ class JobLoggingDB( DB ):
         _date = Time.dateTime()
         epoc = time.mktime( _date.timetuple() ) - MAGIC_EPOC_NUMBER
         time_order = round( epoc, 3 )
+    return _date, time_order
 
+#############################################################################
+  def addLoggingRecords( self, records ):
+    """ Add many entries with a single statement. records is a list of
+        ( jobID, status, minor, application, date, source ) tuples, with the same
+        meaning and defaults as the addLoggingRecord arguments
+    """
+    if not records:
+      return S_OK()
+    values = []
+    for jobID, status, minor, application, date, source in records:
+      _date, time_order = self.__getDateAndOrder( date )
+      values.append( "(%d,'%s','%s','%s','%s',%f,'%s')" % ( int( jobID ), status or 'idem', minor or 'idem',
+                                                           application or 'idem', str( _date ), time_order,
+                                                           source or 'Unknown' ) )
+    self.gLogger.info( "Adding %d logging records" % len( values ) )
     cmd = "INSERT INTO LoggingInfo (JobId, Status, MinorStatus, ApplicationStatus, " + \
-          "StatusTime, StatusTimeOrder, StatusSource) VALUES (%d,'%s','%s','%s','%s',%f,'%s')" % \
-           ( int( jobID ), status, minor, application, str( _date ), time_order, source )
-
+          "StatusTime, StatusTimeOrder, StatusSource) VALUES " + ",".join( values )
     return self._update( cmd )
 
 #############################################################################
@@ -96,11 +130,17 @@ class JobLoggingDB( DB ):
     if result['OK'] and not result['Value']:
       return S_ERROR( 'No Logging information for job %d' % int( jobID ) )
 
+    return S_OK( self.__resolveLoggingRows( result['Value'] ) )
+
+  @staticmethod
+  def __resolveLoggingRows( rows ):
+    """ Replace the 'idem' values of the logging records of a job by the previous ones
+    """
     return_value = []
-    status, minor, app = result['Value'][0][:3]
+    status, minor, app = rows[0][:3]
     if app == "idem":
       app = "Unknown"
-    for row in result['Value']:
+    for row in rows:
       if row[0] != "idem":
         status = row[0]
       if row[1] != "idem":
@@ -108,8 +148,28 @@ class JobLoggingDB( DB ):
       if row[2] != "idem":
         app = row[2]
       return_value.append( ( status, minor, app, str( row[3] ), row[4] ) )
+    return return_value
+
+#############################################################################
+  def getJobLoggingInfoForJobList( self, jobIDList ):
+    """ Get the logging records of a list of jobs with a single query.
+        Returns a dictionary { jobID : [ records as returned by getJobLoggingInfo ] },
+        jobs without logging records are not included
+    """
+    if not jobIDList:
+      return S_OK( {} )
+    jobList = ','.join( [ str( int( jobID ) ) for jobID in jobIDList ] )
+    cmd = 'SELECT JobId,Status,MinorStatus,ApplicationStatus,StatusTime,StatusSource FROM' \
+          ' LoggingInfo WHERE JobId IN (%s) ORDER BY JobId,StatusTimeOrder,StatusTime' % jobList
 
-    return S_OK( return_value )
+    result = self._query( cmd )
+    if not result['OK']:
+      return result
+
+    jobRows = {}
+    for row in result['Value']:
+      jobRows.setdefault( int( row[0] ), [] ).append( row[1:] )
+    return S_OK( dict( [ ( jobID, self.__resolveLoggingRows( rows ) ) for jobID, rows in jobRows.items() ] ) )
 
 #############################################################################
   def deleteJob( self, jobID ):
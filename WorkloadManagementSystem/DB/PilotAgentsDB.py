@@ -7,6 +7,7 @@
 
     addPilotTQReference()
     setPilotStatus()
+    setPilotsStatus()
     deletePilot()
     clearPilots()
     setPilotDestinationSite()
@@ -25,10 +26,13 @@ from DIRAC.Core.Utilities.SiteCEMapping import getSiteForCE, getCESiteMapping
 import DIRAC.Core.Utilities.Time as Time
 from DIRAC.Core.DISET.RPCClient import RPCClient
 from DIRAC.ConfigurationSystem.Client.Helpers.Registry import getUsernameForDN, getDNForUsername
+from DIRAC.Core.Utilities.List import breakListIntoChunks, stringListToString
 from types import IntType, LongType, ListType
 import threading
 
 DEBUG = 1
+# Maximum number of pilots updated by a single statement
+MAX_PILOTS_PER_UPDATE = 1000
 
 #############################################################################
 class PilotAgentsDB( DB ):
@@ -121,6 +125,49 @@ class PilotAgentsDB( DB ):
 
     return S_OK()
 
+##########################################################################################
+  def setPilotsStatus( self, pilotStatusDict, statusReason = None, conn = False ):
+    """ Set the status of many pilots at once. The pilots are grouped by status, destination
+        and status reason and every group is updated by a single statement per chunk of pilots.
+
+        :param dict pilotStatusDict: { pilotRef: status } or { pilotRef: { 'Status': status,
+                                     'DestinationSite': destination, 'UpdateTime': time,
+                                     'StatusReason': reason } }, all the keys but Status being optional
+        :param str statusReason: status reason of the pilots not defining one
+        :return: S_OK( number of updated pilots )
+    """
+    groupDict = {}
+    for pilotRef, pilotStatus in pilotStatusDict.items():
+      if not isinstance( pilotStatus, dict ):
+        pilotStatus = { 'Status' : pilotStatus }
+      groupKey = ( pilotStatus['Status'], pilotStatus.get( 'DestinationSite' ),
+                   pilotStatus.get( 'StatusReason', statusReason ) or "Not given" )
+      groupDict.setdefault( groupKey, {} )[pilotRef] = pilotStatus.get( 'UpdateTime' )
+
+    updated = 0
+    for ( status, destination, reason ), updateTimeDict in groupDict.items():
+      setList = [ "Status='%s'" % status, "StatusReason='%s'" % reason ]
+      if destination:
+        setList.append( "DestinationSite='%s'" % destination )
+        result = getSiteForCE( destination )
+        if result['OK'] and result['Value']:
+          setList.append( "GridSite='%s'" % result['Value'] )
+      for pilotRefs in breakListIntoChunks( updateTimeDict.keys(), MAX_PILOTS_PER_UPDATE ):
+        timeCases = [ "WHEN '%s' THEN '%s'" % ( pilotRef, updateTimeDict[pilotRef] )
+                      for pilotRef in pilotRefs if updateTimeDict[pilotRef] ]
+        if timeCases:
+          updateTime = "CASE PilotJobReference %s ELSE UTC_TIMESTAMP() END" % ' '.join( timeCases )
+        else:
+          updateTime = "UTC_TIMESTAMP()"
+        req = "UPDATE PilotAgents SET %s, LastUpdateTime=%s WHERE PilotJobReference IN ( %s )" % \
+              ( ','.join( setList ), updateTime, stringListToString( pilotRefs ) )
+        result = self._update( req, conn = conn )
+        if not result['OK']:
+          return result
+        updated += len( pilotRefs )
+
+    return S_OK( updated )
+
 ##########################################################################################
   def selectPilots( self, condDict, older = None, newer = None, timeStamp = 'SubmissionTime',
                         orderAttribute = None, limit = None ):
@@ -341,12 +388,20 @@ class PilotAgentsDB( DB ):
 
 ##########################################################################################
   def setAccountingFlag( self, pilotRef, mark = 'True' ):
-    """ Set the pilot AccountingSent flag
+    """ Set the pilot AccountingSent flag of a pilot or of a list of pilots
     """
 
-    req = "UPDATE PilotAgents SET AccountingSent='%s' WHERE PilotJobReference='%s'" % ( mark, pilotRef )
-    result = self._update( req )
-    return result
+    if isinstance( pilotRef, basestring ):
+      req = "UPDATE PilotAgents SET AccountingSent='%s' WHERE PilotJobReference='%s'" % ( mark, pilotRef )
+      return self._update( req )
+
+    for pilotRefs in breakListIntoChunks( pilotRef, MAX_PILOTS_PER_UPDATE ):
+      req = "UPDATE PilotAgents SET AccountingSent='%s' WHERE PilotJobReference IN ( %s )" % \
+            ( mark, stringListToString( pilotRefs ) )
+      result = self._update( req )
+      if not result['OK']:
+        return result
+    return S_OK()
 
 ##########################################################################################
   def setPilotRequirements( self, pilotRef, requirements ):
@@ -5,6 +5,8 @@ __RCSID__ = "$Id"
 
 import types
 import random
+import time
+import threading
 from DIRAC  import gConfig, gLogger, S_OK, S_ERROR
 from DIRAC.WorkloadManagementSystem.private.SharesCorrector import SharesCorrector
 from DIRAC.WorkloadManagementSystem.private.Queues import maxCPUSegments
@@ -29,6 +31,287 @@ strictRequireMatchFields = ( 'SubmitPool', 'Platform', 'PilotType', 'Tag' )
 mandatoryMatchFields = ( 'Setup', 'CPUTime' )
 priorityIgnoredFields = ( 'Sites', 'BannedSites' )
 
+
+def _toList( value ):
+  """ Return value as a list of stripped strings/values
+  """
+  if type( value ) not in ( types.ListType, types.TupleType ):
+    value = [ value ]
+  return [ v.strip() if isinstance( v, basestring ) else v for v in value ]
+
+
+class TaskQueueMatchIndex( object ):
+  """ In-memory copy of the task queue definitions with inverted lists per match attribute
+
+      It allows to select the task queues matching a resource without running the full
+      match SQL. The values kept are the raw (not escaped) ones as stored in the DB.
+      The contents are kept in sync by the TaskQueueDB methods modifying the task queues
+      of this process and fully reloaded every refreshPeriod seconds to catch the changes
+      done by other processes.
+  """
+
+  def __init__( self, refreshPeriod = 60, forcedRefreshPeriod = 5 ):
+    self.__lock = threading.RLock()
+    self.__refreshLock = threading.Lock()
+    self.refreshPeriod = refreshPeriod
+    # Minimum age of the index for a forced reload, not to reload it on each failed match
+    self.forcedRefreshPeriod = forcedRefreshPeriod
+    self.__lastLoad = 0
+    self.__tqs = {}
+    self.__setupIndex = {}
+    self.__groupIndex = {}
+    # { multiValueDefField : { value : set( tqIds ) } }
+    self.__valueIndex = dict( [ ( field, {} ) for field in multiValueDefFields ] )
+    # { multiValueDefField : set( tqIds without any value defined ) }
+    self.__emptyIndex = dict( [ ( field, set() ) for field in multiValueDefFields ] )
+
+  def needsRefresh( self, force = False ):
+    """ Has the index to be reloaded from the DB?
+    """
+    if force:
+      return time.time() - self.__lastLoad > self.forcedRefreshPeriod
+    return time.time() - self.__lastLoad > self.refreshPeriod
+
+  def invalidate( self ):
+    """ Force a reload at the next check
+    """
+    self.__lastLoad = 0
+
+  def acquireRefresh( self ):
+    """ Only one thread has to reload the index at a time. Returns True if the caller has to do it
+    """
+    return self.__refreshLock.acquire( False )
+
+  def releaseRefresh( self ):
+    self.__refreshLock.release()
+
+  def __len__( self ):
+    return len( self.__tqs )
+
+  def load( self, tqData ):
+    """ Replace the contents of the index
+
+        :param dict tqData: task queues info as returned by TaskQueueDB.retrieveTaskQueues
+    """
+    self.__lock.acquire()
+    try:
+      self.__tqs = {}
+      self.__setupIndex = {}
+      self.__groupIndex = {}
+      self.__valueIndex = dict( [ ( field, {} ) for field in multiValueDefFields ] )
+      self.__emptyIndex = dict( [ ( field, set() ) for field in multiValueDefFields ] )
+      for tqId in tqData:
+        self.__addTaskQueue( tqId, tqData[ tqId ] )
+      self.__lastLoad = time.time()
+    finally:
+      self.__lock.release()
+
+  def addTaskQueue( self, tqId, tqDef ):
+    """ Add or replace a task queue definition
+    """
+    self.__lock.acquire()
+    try:
+      self.__addTaskQueue( tqId, tqDef )
+    finally:
+      self.__lock.release()
+
+  def __addTaskQueue( self, tqId, tqDef ):
+    if tqId in self.__tqs:
+      self.__removeTaskQueue( tqId )
+    tq = { 'Priority' : float( tqDef.get( 'Priority', 1 ) ),
+           'Jobs' : int( tqDef.get( 'Jobs', 0 ) ) }
+    for field in singleValueDefFields:
+      tq[ field ] = tqDef[ field ]
+    for field in multiValueDefFields:
+      tq[ field ] = frozenset( [ v for v in _toList( tqDef.get( field, [] ) ) if v ] )
+      if tq[ field ]:
+        for value in tq[ field ]:
+          self.__valueIndex[ field ].setdefault( value, set() ).add( tqId )
+      else:
+        self.__emptyIndex[ field ].add( tqId )
+    self.__setupIndex.setdefault( tq[ 'Setup' ], set() ).add( tqId )
+    self.__groupIndex.setdefault( tq[ 'OwnerGroup' ], set() ).add( tqId )
+    self.__tqs[ tqId ] = tq
+
+  def removeTaskQueue( self, tqId ):
+    """ Remove a task queue from the index
+    """
+    self.__lock.acquire()
+    try:
+      self.__removeTaskQueue( tqId )
+    finally:
+      self.__lock.release()
+
+  def __removeTaskQueue( self, tqId ):
+    tq = self.__tqs.pop( tqId, None )
+    if not tq:
+      return
+    for field in multiValueDefFields:
+      self.__emptyIndex[ field ].discard( tqId )
+      for value in tq[ field ]:
+        tqIds = self.__valueIndex[ field ].get( value )
+        if tqIds is not None:
+          tqIds.discard( tqId )
+          if not tqIds:
+            self.__valueIndex[ field ].pop( value )
+    for index, key in ( ( self.__setupIndex, tq[ 'Setup' ] ), ( self.__groupIndex, tq[ 'OwnerGroup' ] ) ):
+      tqIds = index.get( key )
+      if tqIds is not None:
+        tqIds.discard( tqId )
+        if not tqIds:
+          index.pop( key )
+
+  def hasTaskQueue( self, tqId ):
+    return tqId in self.__tqs
+
+  def setPriorities( self, prioDict ):
+    """ Update the priorities of the task queues
+
+        :param dict prioDict: { tqId : priority }
+    """
+    self.__lock.acquire()
+    try:
+      for tqId in prioDict:
+        if tqId in self.__tqs:
+          self.__tqs[ tqId ][ 'Priority' ] = float( prioDict[ tqId ] )
+    finally:
+      self.__lock.release()
+
+  def updateJobCount( self, tqId, delta = 0, absolute = None ):
+    """ Keep track of the (approximate) number of jobs in a task queue
+    """
+    self.__lock.acquire()
+    try:
+      if tqId not in self.__tqs:
+        return
+      if absolute is not None:
+        self.__tqs[ tqId ][ 'Jobs' ] = absolute
+      else:
+        self.__tqs[ tqId ][ 'Jobs' ] = max( 0, self.__tqs[ tqId ][ 'Jobs' ] + delta )
+    finally:
+      self.__lock.release()
+
+  def __valuesCandidates( self, field, values ):
+    """ TQs without restriction on field plus those containing any of the values
+    """
+    candidates = set( self.__emptyIndex[ field ] )
+    valueIndex = self.__valueIndex[ field ]
+    for value in values:
+      candidates.update( valueIndex.get( value, () ) )
+    return candidates
+
+  def match( self, tqMatchDict, numQueuesToGet = 1, negativeCond = None ):
+    """ Get the task queues matching the resource description, sorted by random / priority
+        as the match SQL does
+
+        :param dict tqMatchDict: raw (not escaped) match definition
+        :return: list of ( tqId, ownerDN, ownerGroup )
+    """
+    self.__lock.acquire()
+    try:
+      candidates = self.__getCandidates( tqMatchDict )
+      selected = []
+      for tqId in candidates:
+        tq = self.__tqs[ tqId ]
+        if self.__checkTaskQueue( tq, tqMatchDict ) and not self.__isNegated( tq, negativeCond ):
+          # Empty TQs go last, the count is only a hint between reloads
+          sortKey = ( tq[ 'Jobs' ] <= 0, random.random() / max( tq[ 'Priority' ], TQ_MIN_SHARE ) )
+          selected.append( ( sortKey, ( tqId, tq[ 'OwnerDN' ], tq[ 'OwnerGroup' ] ) ) )
+    finally:
+      self.__lock.release()
+    selected.sort()
+    if numQueuesToGet:
+      selected = selected[ :numQueuesToGet ]
+    return [ tqTuple for _sortKey, tqTuple in selected ]
+
+  def __getCandidates( self, tqMatchDict ):
+    """ Prune the TQs using the inverted lists
+    """
+    if 'Setup' in tqMatchDict:
+      candidates = set()
+      for setup in _toList( tqMatchDict[ 'Setup' ] ):
+        candidates.update( self.__setupIndex.get( setup, () ) )
+    else:
+      candidates = set( self.__tqs )
+    if 'OwnerGroup' in tqMatchDict:
+      groupTQs = set()
+      for group in _toList( tqMatchDict[ 'OwnerGroup' ] ):
+        groupTQs.update( self.__groupIndex.get( group, () ) )
+      candidates &= groupTQs
+    for field in multiValueMatchFields:
+      if not candidates:
+        break
+      defField = "%ss" % field
+      values = tqMatchDict.get( field )
+      if values:
+        if field in tagMatchFields:
+          # Tags have to be a subset of the resource ones. This is checked for each TQ later on
+          continue
+        candidates &= self.__valuesCandidates( defField, _toList( values ) )
+      elif field in strictRequireMatchFields:
+        candidates &= self.__emptyIndex[ defField ]
+    return candidates
+
+  def __checkTaskQueue( self, tq, tqMatchDict ):
+    """ Check the conditions that can not be resolved with the inverted lists
+    """
+    if 'CPUTime' in tqMatchDict:
+      if not [ cpuTime for cpuTime in _toList( tqMatchDict[ 'CPUTime' ] ) if tq[ 'CPUTime' ] <= cpuTime ]:
+        return False
+    # Owner conditions
+    if 'OwnerDN' in tqMatchDict and 'OwnerGroup' in tqMatchDict:
+      if tq[ 'OwnerGroup' ] not in _toList( tqMatchDict[ 'OwnerGroup' ] ):
+        return False
+      if Properties.JOB_SHARING not in CS.getPropertiesForGroup( tq[ 'OwnerGroup' ] ):
+        if tq[ 'OwnerDN' ] not in _toList( tqMatchDict[ 'OwnerDN' ] ):
+          return False
+    elif 'OwnerDN' in tqMatchDict:
+      if tq[ 'OwnerDN' ] not in _toList( tqMatchDict[ 'OwnerDN' ] ):
+        return False
+    for field in multiValueMatchFields:
+      defField = "%ss" % field
+      values = tqMatchDict.get( field )
+      if values:
+        values = _toList( values )
+        if field in tagMatchFields:
+          if tqMatchDict[ field ] != 'Any' and not tq[ defField ].issubset( values ):
+            return False
+          requiredTags = tqMatchDict.get( "Required%s" % field )
+          if requiredTags and not set( _toList( requiredTags ) ).issubset( tq[ defField ] ):
+            return False
+        # Resource not banned by the job
+        if field in bannedJobMatchFields:
+          if not [ value for value in values if value not in tq[ "Banned%s" % defField ] ]:
+            return False
+      # Job not banned by the resource
+      bannedValues = tqMatchDict.get( "Banned%s" % field )
+      if bannedValues:
+        if not [ value for value in _toList( bannedValues ) if value not in tq[ defField ] ]:
+          return False
+    return True
+
+  def __isNegated( self, tq, negativeCond ):
+    """ Evaluate the negative conditions. Same logic as TaskQueueDB.__generateNotSQL
+    """
+    if not negativeCond:
+      return False
+    if type( negativeCond ) in ( types.ListType, types.TupleType ):
+      return not [ cD for cD in negativeCond if self.__isDictAllowed( tq, cD ) ]
+    return not self.__isDictAllowed( tq, negativeCond )
+
+  def __isDictAllowed( self, tq, negativeCond ):
+    for field in negativeCond:
+      if field in multiValueMatchFields:
+        tqValues = tq[ "%ss" % field ]
+        if not [ value for value in _toList( negativeCond[ field ] ) if value in tqValues ]:
+          return True
+      elif field in singleValueDefFields:
+        for value in negativeCond[ field ]:
+          if value != tq[ field ]:
+            return True
+    return False
+
+
 class TaskQueueDB( DB ):
 
   def __init__( self ):
@@ -43,10 +326,40 @@ class TaskQueueDB( DB ):
     self.__opsHelper = Operations()
     self.__ensureInsertionIsSingle = False
     self.__sharesCorrector = SharesCorrector( self.__opsHelper )
+    self.__matchIndex = None
     result = self.__initializeDB()
     if not result[ 'OK' ]:
       raise Exception( "Can't create tables: %s" % result[ 'Message' ] )
 
+  def enableMatchIndex( self, refreshPeriod = 60 ):
+    """ Keep an in-memory index of the task queue definitions and use it to select
+        the candidate task queues in matchAndGetJob instead of the match SQL
+    """
+    self.__matchIndex = TaskQueueMatchIndex( refreshPeriod )
+    return self.__refreshMatchIndex( force = True )
+
+  def isMatchIndexEnabled( self ):
+    return self.__matchIndex is not None
+
+  def __refreshMatchIndex( self, force = False ):
+    """ Reload the match index from the DB if it is too old
+    """
+    if not self.__matchIndex.needsRefresh( force = force ):
+      return S_OK()
+    if not self.__matchIndex.acquireRefresh():
+      # Another thread is already reloading it
+      return S_OK()
+    try:
+      result = self.retrieveTaskQueues()
+      if not result[ 'OK' ]:
+        self.log.error( "Can't reload the TQ match index", result[ 'Message' ] )
+        return result
+      self.__matchIndex.load( result[ 'Value' ] )
+      self.log.verbose( "Reloaded the TQ match index with %s TQs" % len( self.__matchIndex ) )
+    finally:
+      self.__matchIndex.releaseRefresh()
+    return S_OK()
+
   def enableAllTaskQueues( self ):
     """ Enable all Task queues
     """
@@ -309,6 +622,8 @@ class TaskQueueDB( DB ):
                              conn = connObj )
       if not result[ 'OK' ]:
         return result
+    if self.__matchIndex:
+      self.__matchIndex.invalidate()
     return S_OK()
 
   def __setTaskQueueEnabled( self, tqId, enabled = True, connObj = False ):
@@ -378,10 +693,27 @@ class TaskQueueDB( DB ):
         return result
       if newTQ:
         self.recalculateTQSharesForEntity( tqDefDict[ 'OwnerDN' ], tqDefDict[ 'OwnerGroup' ], connObj = connObj )
+      if self.__matchIndex:
+        self.__updateMatchIndexForJob( tqId, newTQ )
     finally:
       self.__setTaskQueueEnabled( tqId, True )
     return S_OK()
 
+  def __updateMatchIndexForJob( self, tqId, newTQ ):
+    """ Reflect a job insertion in the match index
+    """
+    if newTQ or not self.__matchIndex.hasTaskQueue( tqId ):
+      # Take the definition from the DB to have the same values as a full reload
+      result = self.retrieveTaskQueues( [ tqId ] )
+      if not result[ 'OK' ]:
+        self.log.warn( "Can't add TQ to the match index", "%s: %s" % ( tqId, result[ 'Message' ] ) )
+        self.__matchIndex.invalidate()
+        return
+      if tqId in result[ 'Value' ]:
+        self.__matchIndex.addTaskQueue( tqId, result[ 'Value' ][ tqId ] )
+    else:
+      self.__matchIndex.updateJobCount( tqId, 1 )
+
   def __insertJobInTaskQueue( self, jobId, tqId, jobPriority, checkTQExists = True, connObj = False ):
     """
     Insert a job in a given task queue
@@ -476,6 +808,7 @@ class TaskQueueDB( DB ):
     Match a job
     """
     #Make a copy to avoid modification of original if escaping needs to be done
+    rawMatchDict = tqMatchDict
     tqMatchDict = dict( tqMatchDict )
     retVal = self._checkMatchDefinition( tqMatchDict )
     if not retVal[ 'OK' ]:
@@ -485,6 +818,10 @@ class TaskQueueDB( DB ):
     if not retVal[ 'OK' ]:
       return S_ERROR( "Can't connect to DB: %s" % retVal[ 'Message' ] )
     connObj = retVal[ 'Value' ]
+    if self.__matchIndex and 'JobID' not in tqMatchDict:
+      return self.__matchAndGetJobFromIndex( rawMatchDict, tqMatchDict, numJobsPerTry = numJobsPerTry,
+                                             numQueuesPerTry = numQueuesPerTry, negativeCond = negativeCond,
+                                             connObj = connObj )
     preJobSQL = "SELECT `tq_Jobs`.JobId, `tq_Jobs`.TQId FROM `tq_Jobs` WHERE `tq_Jobs`.TQId = %s AND `tq_Jobs`.Priority = %s"
     prioSQL = "SELECT `tq_Jobs`.Priority FROM `tq_Jobs` WHERE `tq_Jobs`.TQId = %s ORDER BY RAND() / `tq_Jobs`.RealPriority ASC LIMIT 1"
     postJobSQL = " ORDER BY `tq_Jobs`.JobId ASC LIMIT %s" % numJobsPerTry
@@ -544,6 +881,56 @@ class TaskQueueDB( DB ):
       self.log.info( "Could not find a match after %s match retries" % self.__maxMatchRetry )
       return S_ERROR( "Could not find a match after %s match retries" % self.__maxMatchRetry )
 
+  def __matchAndGetJobFromIndex( self, rawMatchDict, tqMatchDict, numJobsPerTry = 50, numQueuesPerTry = 10,
+                                 negativeCond = {}, connObj = False ):
+    """ Match a job selecting the candidate TQs with the match index.
+        The job is claimed by deleting it from tq_Jobs, the row lock makes sure only one
+        pilot gets it.
+    """
+    rawMatchDict = dict( rawMatchDict )
+    # Same legacy options as in _checkMatchDefinition
+    for legacyField in ( 'LHCbPlatform', 'SystemConfig' ):
+      if legacyField in rawMatchDict and "Platform" not in rawMatchDict:
+        rawMatchDict[ 'Platform' ] = rawMatchDict[ legacyField ]
+    jobSQL = "SELECT j.JobId FROM `tq_Jobs` j, ( SELECT `tq_Jobs`.Priority FROM `tq_Jobs` WHERE `tq_Jobs`.TQId = %s"
+    jobSQL += " ORDER BY RAND() / `tq_Jobs`.RealPriority ASC LIMIT 1 ) p WHERE j.TQId = %s AND j.Priority = p.Priority"
+    jobSQL += " ORDER BY j.JobId ASC LIMIT %s" % numJobsPerTry
+    # A second try is done with a freshly loaded index in case it was outdated
+    for forceRefresh in ( False, True ):
+      retVal = self.__refreshMatchIndex( force = forceRefresh )
+      if not retVal[ 'OK' ]:
+        return retVal
+      tqList = self.__matchIndex.match( rawMatchDict, numQueuesToGet = numQueuesPerTry, negativeCond = negativeCond )
+      if not tqList:
+        self.log.info( "No TQ matches requirements" )
+        continue
+      for tqId, tqOwnerDN, tqOwnerGroup in tqList:
+        self.log.info( "Trying to extract jobs from TQ %s" % tqId )
+        retVal = self._query( jobSQL % ( tqId, tqId ), conn = connObj )
+        if not retVal[ 'OK' ]:
+          return S_ERROR( "Can't retrieve jobs for matching: %s" % retVal[ 'Message' ] )
+        jobList = [ row[0] for row in retVal[ 'Value' ] ]
+        if not jobList:
+          gLogger.info( "Task queue %s seems to be empty, triggering a cleaning" % tqId )
+          self.__matchIndex.updateJobCount( tqId, absolute = 0 )
+          self.__deleteTQWithDelay.add( tqId, 300, ( tqId, tqOwnerDN, tqOwnerGroup ) )
+          continue
+        random.shuffle( jobList )
+        for jobId in jobList:
+          retVal = self._update( "DELETE FROM `tq_Jobs` WHERE JobId = %s AND TQId = %s" % ( jobId, tqId ), conn = connObj )
+          if not retVal[ 'OK' ]:
+            msgFix = "Could not take job"
+            msgVar = " %s out from the TQ %s: %s" % ( jobId, tqId, retVal[ 'Message' ] )
+            self.log.error( msgFix, msgVar )
+            return S_ERROR( msgFix + msgVar )
+          if retVal[ 'Value' ] > 0:
+            self.log.info( "Extracted job %s from TQ %s" % ( jobId, tqId ) )
+            self.__matchIndex.updateJobCount( tqId, -1 )
+            self.__deleteTQWithDelay.add( tqId, 300, ( tqId, tqOwnerDN, tqOwnerGroup ) )
+            return S_OK( { 'matchFound' : True, 'jobId' : jobId, 'taskQueueId' : tqId, 'tqMatch' : tqMatchDict } )
+        self.log.info( "No jobs could be extracted from TQ %s" % tqId )
+    return S_OK( { 'matchFound' : False, 'tqMatch' : tqMatchDict } )
+
   def matchAndGetTaskQueue( self, tqMatchDict, numQueuesToGet = 1, skipMatchDictDef = False,
                             negativeCond = {}, connObj = False ):
     """ Get a queue that matches the requirements
@@ -777,6 +1164,8 @@ class TaskQueueDB( DB ):
     if retVal['Value'] == 0:
       #No job deleted
       return S_OK( False )
+    if self.__matchIndex:
+      self.__matchIndex.updateJobCount( tqId, -1 )
     #Always return S_OK() because job has already been taken out from the TQ
     self.__deleteTQWithDelay.add( tqId, 300, ( tqId, tqOwnerDN, tqOwnerGroup ) )
     return S_OK( True )
@@ -827,6 +1216,22 @@ class TaskQueueDB( DB ):
 
     return S_OK( resultDict )
 
+  def getTaskQueueTags( self, tqIdList, connObj = False ):
+    """
+    Return the Tags required by a list of task queues
+    Return S_OK( { TaskQueueID : [ tags ] } ) / S_ERROR
+    """
+    if not tqIdList:
+      return S_OK( {} )
+    tqString = ','.join( [ str( int( tqId ) ) for tqId in tqIdList ] )
+    retVal = self._query( 'SELECT TQId, Value FROM `tq_TQToTags` WHERE TQId in (%s)' % tqString, conn = connObj )
+    if not retVal[ 'OK' ]:
+      return retVal
+    resultDict = dict( [ ( int( tqId ), [] ) for tqId in tqIdList ] )
+    for tqId, tag in retVal[ 'Value' ]:
+      resultDict[ int( tqId ) ].append( tag )
+    return S_OK( resultDict )
+
   def __getOwnerForTaskQueue( self, tqId, connObj = False ):
     retVal = self._query( "SELECT OwnerDN, OwnerGroup from `tq_TaskQueues` WHERE TQId=%s" % tqId, conn = connObj )
     if not retVal[ 'OK' ]:
@@ -871,6 +1276,8 @@ class TaskQueueDB( DB ):
       return S_ERROR( "Could not delete task queue %s: %s" % ( tqId, retVal[ 'Message' ] ) )
     delTQ = retVal[ 'Value' ]
     if delTQ > 0:
+      if self.__matchIndex:
+        self.__matchIndex.removeTaskQueue( tqId )
       for mvField in multiValueDefFields:
         retVal = self._update( "DELETE FROM `tq_TQTo%s` WHERE TQId = %s" % ( mvField, tqId ), conn = connObj )
         if not retVal[ 'OK' ]:
@@ -903,6 +1310,8 @@ class TaskQueueDB( DB ):
     if not retVal[ 'OK' ]:
       return S_ERROR( "Could not delete task queue %s: %s" % ( tqId, retVal[ 'Message' ] ) )
     delTQ = retVal[ 'Value' ]
+    if self.__matchIndex:
+      self.__matchIndex.removeTaskQueue( tqId )
     sqlCmd = "DELETE FROM `tq_Jobs` WHERE `tq_Jobs`.TQId = %s" % tqId
     retVal = self._update( sqlCmd, conn = connObj )
     if not retVal[ 'OK' ]:
@@ -1159,6 +1568,8 @@ class TaskQueueDB( DB ):
       tqList = ", ".join( [ str( tqId ) for tqId in prioDict[ prio ] ] )
       updateSQL = "UPDATE `tq_TaskQueues` SET Priority=%.4f WHERE TQId in ( %s )" % ( prio, tqList )
       self._update( updateSQL, conn = connObj )
+    if self.__matchIndex:
+      self.__matchIndex.setPriorities( tqDict )
     return S_OK()
 
   def getGroupShares( self ):
@@ -0,0 +1,78 @@
+""" Test class for the bulk updates of the PilotAgentsDB
+"""
+
+# imports
+import unittest
+from mock import MagicMock, patch
+
+from DIRAC import S_OK, S_ERROR
+from DIRAC.Core.Utilities.List import stringListToString
+
+# sut
+import DIRAC.WorkloadManagementSystem.DB.PilotAgentsDB as moduleTested
+from DIRAC.WorkloadManagementSystem.DB.PilotAgentsDB import PilotAgentsDB
+
+class PilotAgentsDBTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    self.pilotDB = PilotAgentsDB.__new__( PilotAgentsDB )
+    self.pilotDB._update = MagicMock( return_value = S_OK() )
+    for name, value in ( ( 'getSiteForCE', lambda ce: S_OK( { 'ce1' : 'Site.One' }.get( ce, '' ) ) ),
+                         ( 'MAX_PILOTS_PER_UPDATE', 2 ) ):
+      patcher = patch.object( moduleTested, name, value )
+      patcher.start()
+      self.addCleanup( patcher.stop )
+
+  def statements( self ):
+    return sorted( call[0][0] for call in self.pilotDB._update.call_args_list )
+
+  def test_setPilotsStatus( self ):
+    result = self.pilotDB.setPilotsStatus( { 'p1' : 'Running',
+                                             'p2' : 'Running',
+                                             'p3' : { 'Status' : 'Done', 'StatusReason' : 'Finished' },
+                                             'p4' : { 'Status' : 'Running', 'DestinationSite' : 'ce1',
+                                                      'UpdateTime' : '2016-01-01 00:00:00' },
+                                             'p5' : { 'Status' : 'Running', 'DestinationSite' : 'ce2' } },
+                                           statusReason = 'Updated by agent' )
+    self.assertEqual( result, S_OK( 5 ) )
+    self.assertEqual( self.statements(), [
+      "UPDATE PilotAgents SET Status='Done',StatusReason='Finished', LastUpdateTime=UTC_TIMESTAMP() "
+      "WHERE PilotJobReference IN ( 'p3' )",
+      "UPDATE PilotAgents SET Status='Running',StatusReason='Updated by agent', LastUpdateTime=UTC_TIMESTAMP() "
+      "WHERE PilotJobReference IN ( %s )" % stringListToString( dict.fromkeys( [ 'p1', 'p2' ] ).keys() ),
+      "UPDATE PilotAgents SET Status='Running',StatusReason='Updated by agent',DestinationSite='ce1',"
+      "GridSite='Site.One', LastUpdateTime=CASE PilotJobReference WHEN 'p4' THEN '2016-01-01 00:00:00' "
+      "ELSE UTC_TIMESTAMP() END WHERE PilotJobReference IN ( 'p4' )",
+      # No site known for the CE: the grid site is left as it is
+      "UPDATE PilotAgents SET Status='Running',StatusReason='Updated by agent',DestinationSite='ce2', "
+      "LastUpdateTime=UTC_TIMESTAMP() WHERE PilotJobReference IN ( 'p5' )" ] )
+
+  def test_chunks( self ):
+    result = self.pilotDB.setPilotsStatus( dict( ( 'p%d' % i, 'Aborted' ) for i in range( 5 ) ) )
+    self.assertEqual( result, S_OK( 5 ) )
+    statements = self.statements()
+    self.assertEqual( len( statements ), 3 )
+    self.assertTrue( all( "Status='Aborted',StatusReason='Not given'" in req for req in statements ) )
+    self.assertEqual( sum( req.count( "'p" ) for req in statements ), 5 )
+
+    self.pilotDB._update.return_value = S_ERROR( 'Lost connection' )
+    self.assertFalse( self.pilotDB.setPilotsStatus( { 'p1' : 'Done' } )['OK'] )
+
+  def test_setAccountingFlag( self ):
+    self.assertTrue( self.pilotDB.setAccountingFlag( 'p1' )['OK'] )
+    self.assertEqual( self.statements(),
+                      [ "UPDATE PilotAgents SET AccountingSent='True' WHERE PilotJobReference='p1'" ] )
+
+    self.pilotDB._update.reset_mock()
+    self.assertTrue( self.pilotDB.setAccountingFlag( [ 'p1', 'p2', 'p3' ], mark = 'False' )['OK'] )
+    self.assertEqual( self.statements(), [
+      "UPDATE PilotAgents SET AccountingSent='False' WHERE PilotJobReference IN ( 'p1','p2' )",
+      "UPDATE PilotAgents SET AccountingSent='False' WHERE PilotJobReference IN ( 'p3' )" ] )
+
+    self.pilotDB._update.return_value = S_ERROR( 'Lost connection' )
+    self.assertFalse( self.pilotDB.setAccountingFlag( [ 'p1', 'p2', 'p3' ] )['OK'] )
+    self.assertFalse( self.pilotDB.setAccountingFlag( 'p1' )['OK'] )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( PilotAgentsDBTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
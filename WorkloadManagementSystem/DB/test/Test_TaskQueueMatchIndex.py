@@ -0,0 +1,122 @@
+""" Test class for the in-memory match index of the TaskQueueDB
+"""
+
+# imports
+import unittest
+from mock import MagicMock
+
+from DIRAC import S_OK
+
+# sut
+from DIRAC.WorkloadManagementSystem.DB.TaskQueueDB import TaskQueueDB, TaskQueueMatchIndex
+
+def tqDefinition( **kwargs ):
+  tqDef = { 'OwnerDN' : '/DN/user', 'OwnerGroup' : 'user_group', 'Setup' : 'Test',
+            'CPUTime' : 1000, 'Priority' : 1, 'Jobs' : 1 }
+  tqDef.update( kwargs )
+  return tqDef
+
+class TaskQueueMatchIndexTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    self.matchIndex = TaskQueueMatchIndex()
+    self.matchIndex.load( { 1 : tqDefinition(),
+                            2 : tqDefinition( Sites = [ 'Site.A' ], CPUTime = 5000 ),
+                            3 : tqDefinition( Setup = 'Other' ),
+                            4 : tqDefinition( BannedSites = [ 'Site.A' ], Platforms = [ 'x86_64' ] ) } )
+
+  def matchIds( self, matchDict, **kwargs ):
+    return sorted( [ tqId for tqId, _ownerDN, _ownerGroup in self.matchIndex.match( matchDict,
+                                                                                    numQueuesToGet = 0,
+                                                                                    **kwargs ) ] )
+
+  def test_load( self ):
+    self.assertEqual( len( self.matchIndex ), 4 )
+    self.assertFalse( self.matchIndex.needsRefresh() )
+    self.matchIndex.invalidate()
+    self.assertTrue( self.matchIndex.needsRefresh() )
+
+  def test_match( self ):
+    self.assertEqual( self.matchIds( { 'Setup' : 'Test', 'CPUTime' : 2000 } ), [ 1 ] )
+    self.assertEqual( self.matchIds( { 'Setup' : 'Test', 'CPUTime' : 6000, 'Site' : 'Site.A' } ), [ 1, 2 ] )
+    self.assertEqual( self.matchIds( { 'Setup' : 'Test', 'CPUTime' : 6000, 'Site' : 'Site.B',
+                                       'Platform' : 'x86_64' } ), [ 1, 4 ] )
+    self.assertEqual( self.matchIds( { 'Setup' : 'Test', 'CPUTime' : 6000, 'Site' : 'Site.A',
+                                       'Platform' : 'x86_64' } ), [ 1, 2 ] )
+    self.assertEqual( self.matchIds( { 'Setup' : 'Other', 'CPUTime' : 6000 } ), [ 3 ] )
+    self.assertEqual( self.matchIds( { 'Setup' : 'Test', 'CPUTime' : 6000, 'Site' : 'Site.A' },
+                                     negativeCond = { 'Site' : 'Site.A' } ), [ 1 ] )
+
+  def test_changes( self ):
+    self.matchIndex.removeTaskQueue( 1 )
+    self.assertEqual( self.matchIds( { 'Setup' : 'Test', 'CPUTime' : 6000, 'Site' : 'Site.A' } ), [ 2 ] )
+    self.matchIndex.addTaskQueue( 5, tqDefinition( Sites = [ 'Site.B' ] ) )
+    self.assertEqual( self.matchIds( { 'Setup' : 'Test', 'CPUTime' : 6000, 'Site' : 'Site.B' } ), [ 5 ] )
+    # Replacing a definition drops the old inverted list entries
+    self.matchIndex.addTaskQueue( 5, tqDefinition( Sites = [ 'Site.C' ] ) )
+    self.assertEqual( self.matchIds( { 'Setup' : 'Test', 'CPUTime' : 6000, 'Site' : 'Site.B' } ), [] )
+    self.assertEqual( len( self.matchIndex ), 4 )
+
+  def test_jobCount( self ):
+    # Empty TQs are returned last
+    self.matchIndex.addTaskQueue( 5, tqDefinition( Priority = 1000 ) )
+    self.matchIndex.updateJobCount( 5, -1 )
+    for _i in range( 10 ):
+      tqList = self.matchIndex.match( { 'Setup' : 'Test', 'CPUTime' : 2000 }, numQueuesToGet = 2 )
+      self.assertEqual( [ tqTuple[0] for tqTuple in tqList ], [ 1, 5 ] )
+    self.matchIndex.updateJobCount( 5, absolute = 3 )
+    self.matchIndex.updateJobCount( 1, absolute = 0 )
+    tqList = self.matchIndex.match( { 'Setup' : 'Test', 'CPUTime' : 2000 }, numQueuesToGet = 1 )
+    self.assertEqual( tqList[0][0], 5 )
+
+  def test_forcedRefresh( self ):
+    self.assertFalse( self.matchIndex.needsRefresh( force = True ) )
+    self.matchIndex.forcedRefreshPeriod = -1
+    self.assertTrue( self.matchIndex.needsRefresh( force = True ) )
+    self.assertFalse( self.matchIndex.needsRefresh() )
+
+class TaskQueueDBMatchTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    self.tqDB = TaskQueueDB.__new__( TaskQueueDB )
+    self.tqDB.log = MagicMock()
+    self.tqDB._TaskQueueDB__deleteTQWithDelay = MagicMock()
+    self.tqDB._TaskQueueDB__matchIndex = TaskQueueMatchIndex( forcedRefreshPeriod = -1 )
+    self.tqDB._TaskQueueDB__matchIndex.load( {} )
+    self.tqDB.retrieveTaskQueues = MagicMock( return_value = S_OK( { 7 : tqDefinition() } ) )
+    self.tqDB._query = MagicMock( return_value = S_OK( ( ( 123, ), ) ) )
+    self.tqDB._update = MagicMock( return_value = S_OK( 1 ) )
+
+  def test_refreshOnNoMatch( self ):
+    """ A TQ created by another process has to be found after the forced reload
+    """
+    matchDict = { 'Setup' : 'Test', 'CPUTime' : 2000 }
+    res = self.tqDB._TaskQueueDB__matchAndGetJobFromIndex( matchDict, matchDict )
+    self.assertTrue( res['OK'] )
+    self.assertTrue( res['Value']['matchFound'] )
+    self.assertEqual( res['Value']['jobId'], 123 )
+    self.assertEqual( res['Value']['taskQueueId'], 7 )
+    self.assertEqual( self.tqDB.retrieveTaskQueues.call_count, 1 )
+
+  def test_noMatch( self ):
+    matchDict = { 'Setup' : 'Other', 'CPUTime' : 2000 }
+    res = self.tqDB._TaskQueueDB__matchAndGetJobFromIndex( matchDict, matchDict )
+    self.assertTrue( res['OK'] )
+    self.assertFalse( res['Value']['matchFound'] )
+    self.assertEqual( self.tqDB.retrieveTaskQueues.call_count, 1 )
+    self.assertFalse( self.tqDB._query.called )
+
+  def test_recentReload( self ):
+    """ No reload if the index has just been loaded
+    """
+    self.tqDB._TaskQueueDB__matchIndex.forcedRefreshPeriod = 5
+    matchDict = { 'Setup' : 'Test', 'CPUTime' : 2000 }
+    res = self.tqDB._TaskQueueDB__matchAndGetJobFromIndex( matchDict, matchDict )
+    self.assertTrue( res['OK'] )
+    self.assertFalse( res['Value']['matchFound'] )
+    self.assertFalse( self.tqDB.retrieveTaskQueues.called )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( TaskQueueMatchIndexTestCase )
+  suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( TaskQueueDBMatchTestCase ) )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
@@ -13,6 +13,7 @@ import sys
 import time
 import shutil
 import threading
+import Queue
 import tarfile
 import glob
 import urllib
@@ -110,6 +111,7 @@ class JobWrapper( object ):
     self.defaultCatalog = gConfig.getValue( self.section + '/DefaultCatalog', [] )
     self.masterCatalogOnlyFlag = gConfig.getValue( self.section + '/MasterCatalogOnlyFlag', True )
     self.defaultFailoverSE = gConfig.getValue( '/Resources/StorageElementGroups/Tier1-Failover', [] )
+    self.transfersPerSE = max( 1, gConfig.getValue( self.section + '/ParallelTransfersPerSE', 2 ) )
     self.defaultOutputPath = ''
     self.dm = DataManager()
     self.fc = FileCatalog()
@@ -863,6 +865,7 @@ class JobWrapper( object ):
     else:
       pfnGUID = result['Value']
 
+    uploads = []
     for outputFile in outputData:
       ( lfn, localfile ) = self.__getLFNfromOutputFile( outputFile, outputPath )
       if not os.path.exists( localfile ):
@@ -872,53 +875,60 @@ class JobWrapper( object ):
       # # file size
       localfileSize = getGlobbedTotalSize( localfile )
 
-      self.outputDataSize += getGlobbedTotalSize( localfile )
-
-      outputFilePath = os.path.join( os.getcwd(), localfile )
+      self.outputDataSize += localfileSize
 
       # # file GUID
       fileGUID = pfnGUID[localfile] if localfile in pfnGUID else None
       if fileGUID:
         self.log.verbose( 'Found GUID for file from POOL XML catalogue %s' % localfile )
 
-      # #  file checksum
-      cksm = fileAdler( outputFilePath )
-
-      fileMetaDict = { "Size": localfileSize,
-                       "LFN" : lfn,
-                       "ChecksumType" : "Adler32",
-                       "Checksum": cksm,
-                       "GUID" : fileGUID }
-
-      outputSEList = self.__getSortedSEList( outputSE )
-      upload = self.failoverTransfer.transferAndRegisterFile( fileName = localfile,
-                                                              localPath = outputFilePath,
-                                                              lfn = lfn,
-                                                              destinationSEList = outputSEList,
-                                                              fileMetaDict = fileMetaDict,
-                                                              fileCatalog = self.defaultCatalog,
-                                                              masterCatalogOnly = self.masterCatalogOnlyFlag )
-      if upload['OK']:
+      uploads.append( { 'OutputFile' : outputFile,
+                        'LFN' : lfn,
+                        'LocalFile' : localfile,
+                        'LocalPath' : os.path.join( os.getcwd(), localfile ),
+                        'Size' : localfileSize,
+                        'GUID' : fileGUID,
+                        'SEList' : self.__getSortedSEList( outputSE ),
+                        'Result' : S_ERROR( 'Failed to upload output data file' ),
+                        'Operations' : [] } )
+
+    # # concurrent upload to the output SEs
+    self.__uploadOutputDataFiles( uploads )
+
+    # # the results are handled in the order of the files, the files not uploaded are sent to the failover SEs
+    for upload in uploads:
+      outputFile = upload['OutputFile']
+      lfn = upload['LFN']
+      localfile = upload['LocalFile']
+      outputSEList = upload['SEList']
+      for operation in upload['Operations']:
+        self.failoverTransfer.request.addOperation( operation )
+
+      if upload['Result']['OK']:
         self.log.info( '"%s" successfully uploaded to "%s" as "LFN:%s"' % ( localfile,
-                                                                            upload['Value']['uploadedSE'],
+                                                                            upload['Result']['Value']['uploadedSE'],
                                                                             lfn ) )
         uploaded.append( lfn )
         continue
 
       self.log.error( 'Could not putAndRegister file',
-                      '%s with LFN %s to %s with GUID %s trying failover storage' % ( localfile, lfn,
-                                                                                      ', '.join( outputSEList ),
-                                                                                      fileGUID ) )
+                      '%s with LFN %s to %s with GUID %s trying failover storage: %s' % ( localfile, lfn,
+                                                                                          ', '.join( outputSEList ),
+                                                                                          upload['GUID'],
+                                                                                          upload['Result']['Message'] ) )
       if not self.defaultFailoverSE:
         self.log.info( 'No failover SEs defined for JobWrapper,',
                        'cannot try to upload output file %s anywhere else.' % outputFile )
         missing.append( outputFile )
         continue
 
+      fileMetaDict = upload.get( 'FileMetaDict' )
+      if not fileMetaDict:
+        fileMetaDict = self.__getFileMetaDict( upload )
       failoverSEs = self.__getSortedSEList( self.defaultFailoverSE )
       targetSE = outputSEList[0]
       result = self.failoverTransfer.transferAndRegisterFileFailover( fileName = localfile,
-                                                                      localPath = outputFilePath,
+                                                                      localPath = upload['LocalPath'],
                                                                       lfn = lfn,
                                                                       targetSE = targetSE,
                                                                       failoverSEList = failoverSEs,
@@ -932,7 +942,6 @@ class JobWrapper( object ):
         self.log.info( 'File %s successfully uploaded to failover storage element' % lfn )
         uploaded.append( lfn )
 
-
     # For files correctly uploaded must report LFNs to job parameters
     if uploaded:
       report = ', '.join( uploaded )
@@ -955,6 +964,84 @@ class JobWrapper( object ):
     self.__report( 'Completed', 'Output Data Uploaded' )
     return S_OK( 'OutputData uploaded successfully' )
 
+  #############################################################################
+  def __getFileMetaDict( self, upload ):
+    """ Get the metadata of an output data file, the checksum is computed in a single read of the file
+    """
+    return { "Size": upload['Size'],
+             "LFN" : upload['LFN'],
+             "ChecksumType" : "Adler32",
+             "Checksum": fileAdler( upload['LocalPath'] ),
+             "GUID" : upload['GUID'] }
+
+  #############################################################################
+  def __uploadOutputDataFiles( self, uploads ):
+    """ Upload the output data files to their output SEs with a pool of threads, with at most
+        transfersPerSE concurrent transfers to each SE. Each thread computes the checksum of
+        its file just before uploading it, so that it overlaps with the transfers of the other files
+    """
+    if not uploads:
+      return
+    seSemaphores = {}
+    for upload in uploads:
+      for se in upload['SEList']:
+        if se not in seSemaphores:
+          seSemaphores[se] = threading.BoundedSemaphore( self.transfersPerSE )
+
+    uploadQueue = Queue.Queue()
+    for upload in uploads:
+      uploadQueue.put( upload )
+    nThreads = min( len( uploads ), max( 1, self.transfersPerSE * len( seSemaphores ) ) )
+    self.log.verbose( 'Uploading %d output data files with %d threads' % ( len( uploads ), nThreads ) )
+
+    threads = []
+    for _i in xrange( nThreads ):
+      thread = threading.Thread( target = self.__uploadOutputDataWorker, args = ( uploadQueue, seSemaphores ) )
+      thread.setDaemon( True )
+      thread.start()
+      threads.append( thread )
+    for thread in threads:
+      thread.join()
+
+  def __uploadOutputDataWorker( self, uploadQueue, seSemaphores ):
+    """ Upload the files of the queue until it is empty
+    """
+    while True:
+      try:
+        upload = uploadQueue.get_nowait()
+      except Queue.Empty:
+        return
+      try:
+        self.__uploadOutputDataFile( upload, seSemaphores )
+      except Exception as x:  # pylint: disable=broad-except
+        self.log.exception( 'Exception while uploading output data file', upload['LFN'], lException = x )
+        upload['Result'] = S_ERROR( 'Exception while uploading %s: %s' % ( upload['LFN'], str( x ) ) )
+
+  def __uploadOutputDataFile( self, upload, seSemaphores ):
+    """ Upload and register a file, trying its output SEs in turn. The FailoverTransfer is private
+        to the file: its operations are merged in the job request once all the uploads are done.
+        If all the SEs fail, the Result gives the error of each of them
+    """
+    upload['FileMetaDict'] = self.__getFileMetaDict( upload )
+    failoverTransfer = FailoverTransfer()
+    errors = []
+    for se in upload['SEList']:
+      with seSemaphores[se]:
+        result = failoverTransfer.transferAndRegisterFile( fileName = upload['LocalFile'],
+                                                           localPath = upload['LocalPath'],
+                                                           lfn = upload['LFN'],
+                                                           destinationSEList = [ se ],
+                                                           fileMetaDict = upload['FileMetaDict'],
+                                                           fileCatalog = self.defaultCatalog,
+                                                           masterCatalogOnly = self.masterCatalogOnlyFlag )
+      if result['OK']:
+        upload['Result'] = result
+        break
+      errors.append( '%s: %s' % ( se, result['Message'] ) )
+    if errors and not upload['Result']['OK']:
+      upload['Result'] = S_ERROR( 'Failed to upload output data file to %s' % '; '.join( errors ) )
+    upload['Operations'] = list( failoverTransfer.request )
+
   #############################################################################
   def __getSortedSEList( self, seList ):
     """ Randomize SE, putting first those that are Local/Close to the Site
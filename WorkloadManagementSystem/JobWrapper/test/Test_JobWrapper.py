@@ -7,10 +7,14 @@
 import unittest
 import importlib
 import os
+import shutil
+import tempfile
+import threading
+import time
 
 from mock import MagicMock
 
-from DIRAC import gLogger
+from DIRAC import gLogger, S_OK, S_ERROR
 
 from DIRAC.DataManagementSystem.Client.test.mock_DM import dm_mock
 from DIRAC.Resources.Catalog.test.mock_FC import fc_mock
@@ -62,6 +66,78 @@ class JobWrapperTestCaseSuccess( JobWrapperTestCase ):
     res = wd._performChecks()
     self.assert_( res['OK'] )
 
+  def test_transferOutputDataFiles( self ):
+    myJW = importlib.import_module( 'DIRAC.WorkloadManagementSystem.JobWrapper.JobWrapper' )
+    myJW.getSystemSection = MagicMock()
+    myJW.ModuleFactory = MagicMock()
+    myJW.RPCClient = MagicMock()
+    # SE1, local to the site, is always tried first
+    myJW.getSEsForSite = MagicMock( return_value = S_OK( [ 'SE1' ] ) )
+
+    lock = threading.Lock()
+    active = {}
+    maxActive = {}
+    failoverCalls = []
+
+    class FakeFailoverTransfer( object ):
+      """ Fails the uploads to SE1 and of f3 """
+      def __init__( self ):
+        self.request = []
+
+      def transferAndRegisterFile( self, fileName, localPath, lfn, destinationSEList, fileMetaDict, fileCatalog, masterCatalogOnly ):
+        se = destinationSEList[0]
+        with lock:
+          active[se] = active.get( se, 0 ) + 1
+          maxActive[se] = max( maxActive.get( se, 0 ), active[se] )
+        self.request.append( 'op-%s-%s' % ( fileName, se ) )
+        # Hold the SE slot long enough for the other threads to compete for it
+        time.sleep( 0.1 )
+        with lock:
+          active[se] -= 1
+        if se == 'SE1' or fileName == 'f3':
+          return S_ERROR( 'Upload to %s failed' % se )
+        return S_OK( { 'uploadedSE' : se } )
+
+    myJW.FailoverTransfer = FakeFailoverTransfer
+
+    workDir = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    try:
+      os.chdir( workDir )
+      for i in range( 5 ):
+        with open( 'f%d' % i, 'w' ) as outFile:
+          outFile.write( 'data%d' % i )
+
+      jw = JobWrapper()
+      jw.jobID = 1
+      jw.transfersPerSE = 2
+      jw.log = MagicMock()
+      jw.jobReport = MagicMock()
+      jw.failoverTransfer = MagicMock()
+      jw.failoverTransfer.transferAndRegisterFileFailover.side_effect = lambda **kwargs: failoverCalls.append( kwargs ) or S_OK()
+      jw.defaultFailoverSE = [ 'Failover-SE' ]
+      res = jw._JobWrapper__transferOutputDataFiles( [ 'LFN:/vo/f%d' % i for i in range( 5 ) ], [ 'SE1', 'SE2' ], '' )
+    finally:
+      os.chdir( cwd )
+      shutil.rmtree( workDir )
+
+    self.assert_( res['OK'] )
+    self.assertEqual( jw.outputDataSize, 25 )
+    # All the files are tried first on SE1, with at most 2 transfers at a time
+    self.assertEqual( maxActive['SE1'], 2 )
+    self.assertTrue( maxActive['SE2'] <= 2 )
+    # Only the file failing everywhere is sent to the failover SEs, with its checksum
+    self.assertEqual( [ call['lfn'] for call in failoverCalls ], [ '/vo/f3' ] )
+    self.assertEqual( failoverCalls[0]['fileMetaDict']['ChecksumType'], 'Adler32' )
+    # The error of each SE is reported
+    errorMessage = [ call[0][1] for call in jw.log.error.call_args_list if call[0][0] == 'Could not putAndRegister file' ][0]
+    self.assertTrue( 'SE1: Upload to SE1 failed; SE2: Upload to SE2 failed' in errorMessage )
+    # The operations of the uploads are merged in the job request in the order of the files
+    operations = [ call[0][0] for call in jw.failoverTransfer.request.addOperation.call_args_list ]
+    self.assertEqual( [ operation.split( '-' )[1] for operation in operations ],
+                      sorted( operation.split( '-' )[1] for operation in operations ) )
+    self.assertEqual( len( operations ), 10 )
+
 
 
 #############################################################################
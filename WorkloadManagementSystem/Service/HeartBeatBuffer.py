@@ -0,0 +1,157 @@
+""" HeartBeatBuffer keeps the job heart beats received by the JobStateUpdate service
+    in memory and writes them to the JobDB in bulk.
+
+    Heart beats of the same job are merged: the static data is coalesced, the latest
+    value of each parameter being kept, while all the dynamic data records are kept
+    with the time they were received. The loss in case of a service crash is bounded
+    by the flush period and by the maximum number of buffered heart beats: when that
+    number is reached the heart beats are flushed synchronously by the caller. After a
+    failed write the buffer is not flushed by the callers for retryDelay seconds, the
+    oldest heart beats are dropped instead to make room for the new ones.
+"""
+
+__RCSID__ = "$Id$"
+
+import time
+import heapq
+import threading
+
+from DIRAC import gLogger, S_OK
+from DIRAC.Core.Utilities.List import breakListIntoChunks
+
+class HeartBeatBuffer( object ):
+
+  def __init__( self, jobDB, maxBufferedHeartBeats = 10000, jobsPerStatement = 1000, retryDelay = 10 ):
+    """ c'tor
+
+    :param jobDB: JobDB instance used to write the heart beats
+    :param int maxBufferedHeartBeats: number of heart beats triggering a synchronous flush
+    :param int jobsPerStatement: maximum number of jobs written by a single DB statement
+    :param int retryDelay: seconds without synchronous flush after a failed write
+    """
+    self.jobDB = jobDB
+    self.log = gLogger.getSubLogger( "HeartBeatBuffer" )
+    self.maxBufferedHeartBeats = max( 1, maxBufferedHeartBeats )
+    self.jobsPerStatement = max( 1, jobsPerStatement )
+    self.retryDelay = retryDelay
+    # Heart beats dropped at once when the buffer is full and can not be flushed
+    self.__dropBatchSize = max( 1, self.maxBufferedHeartBeats // 10 )
+    self.__nextFlushTime = 0
+    self.__bufferLock = threading.Lock()
+    self.__flushLock = threading.Lock()
+    # jobID -> ( staticDataDict, [ ( heartBeatTime, dynamicDataDict ) ] )
+    self.__heartBeats = {}
+    self.__numHeartBeats = 0
+    self.__resetStats()
+
+  def __resetStats( self ):
+    self.__stats = { 'Received' : 0, 'Flushed' : 0, 'Coalesced' : 0, 'Dropped' : 0,
+                     'Flushes' : 0, 'FlushTime' : 0.0 }
+
+  def addHeartBeat( self, jobID, staticData, dynamicData ):
+    """ Buffer the heart beat of a job
+    """
+    heartBeatTime = time.time()
+    with self.__bufferLock:
+      staticDataDict, dynamicDataList = self.__heartBeats.setdefault( int( jobID ), ( {}, [] ) )
+      self.__stats['Coalesced'] += len( set( staticDataDict ) & set( staticData ) )
+      staticDataDict.update( staticData )
+      dynamicDataList.append( ( heartBeatTime, dict( dynamicData ) ) )
+      self.__numHeartBeats += 1
+      self.__stats['Received'] += 1
+      bufferFull = self.__numHeartBeats >= self.maxBufferedHeartBeats
+      if bufferFull and heartBeatTime < self.__nextFlushTime:
+        # The last write failed, do not hold the caller with another one
+        self.__dropOldest( self.__numHeartBeats - self.maxBufferedHeartBeats + self.__dropBatchSize )
+        bufferFull = False
+    if bufferFull:
+      return self.flush()
+    return S_OK()
+
+  def __dropOldest( self, numToDrop ):
+    """ Drop the oldest buffered heart beats. Has to be called with the buffer lock held
+    """
+    oldest = heapq.nsmallest( numToDrop, ( ( heartBeatTime, jobID )
+                                           for jobID, ( _staticDataDict, dynamicDataList ) in self.__heartBeats.iteritems()
+                                           for heartBeatTime, _dynamicData in dynamicDataList ) )
+    numDropped = {}
+    for _heartBeatTime, jobID in oldest:
+      numDropped[jobID] = numDropped.get( jobID, 0 ) + 1
+    for jobID, num in numDropped.items():
+      # The heart beats of a job are ordered by time
+      dynamicDataList = self.__heartBeats[jobID][1]
+      del dynamicDataList[:num]
+      if not dynamicDataList:
+        del self.__heartBeats[jobID]
+    self.__numHeartBeats -= len( oldest )
+    self.__stats['Dropped'] += len( oldest )
+
+  def getNumPendingHeartBeats( self ):
+    """ Number of heart beats not written yet
+    """
+    return self.__numHeartBeats
+
+  def flush( self ):
+    """ Write all the buffered heart beats to the JobDB
+
+    :return: S_OK( number of heart beats written )
+    """
+    with self.__flushLock:
+      with self.__bufferLock:
+        heartBeats = self.__heartBeats
+        numHeartBeats = self.__numHeartBeats
+        self.__heartBeats = {}
+        self.__numHeartBeats = 0
+      if not heartBeats:
+        return S_OK( 0 )
+
+      startTime = time.time()
+      failedHeartBeats = {}
+      for jobChunk in breakListIntoChunks( heartBeats.keys(), self.jobsPerStatement ):
+        chunkDict = dict( ( jobID, heartBeats[jobID] ) for jobID in jobChunk )
+        result = self.jobDB.setHeartBeatDataBulk( chunkDict )
+        if not result['OK']:
+          self.log.error( 'Failed to write heart beats', result['Message'] )
+          failedHeartBeats.update( chunkDict )
+      flushTime = time.time() - startTime
+
+      numFailed = self.__requeue( failedHeartBeats )
+      with self.__bufferLock:
+        self.__nextFlushTime = time.time() + self.retryDelay if failedHeartBeats else 0
+        self.__stats['Flushed'] += numHeartBeats - numFailed
+        self.__stats['Flushes'] += 1
+        self.__stats['FlushTime'] += flushTime
+      self.log.verbose( 'Heart beats flushed', '%d jobs in %.3f seconds' % ( len( heartBeats ), flushTime ) )
+      return S_OK( numHeartBeats - numFailed )
+
+  def __requeue( self, failedHeartBeats ):
+    """ Put back in the buffer the heart beats that could not be written, as long as
+        there is room for them. Those received meanwhile are more recent.
+
+    :return: number of heart beats not written
+    """
+    numFailed = 0
+    with self.__bufferLock:
+      for jobID, ( staticDataDict, dynamicDataList ) in failedHeartBeats.items():
+        numFailed += len( dynamicDataList )
+        if self.__numHeartBeats + len( dynamicDataList ) > self.maxBufferedHeartBeats:
+          self.__stats['Dropped'] += len( dynamicDataList )
+          continue
+        newStaticDataDict, newDynamicDataList = self.__heartBeats.get( jobID, ( {}, [] ) )
+        staticDataDict.update( newStaticDataDict )
+        self.__heartBeats[jobID] = ( staticDataDict, dynamicDataList + newDynamicDataList )
+        self.__numHeartBeats += len( dynamicDataList )
+    if numFailed:
+      self.log.warn( 'Heart beats not written', '%d will be retried in the next flush' % numFailed )
+    return numFailed
+
+  def getStats( self ):
+    """ Get the buffer statistics accumulated since the previous call
+    """
+    with self.__bufferLock:
+      stats = self.__stats
+      self.__resetStats()
+    stats['Pending'] = self.__numHeartBeats
+    if stats['Flushes']:
+      stats['FlushTime'] /= stats['Flushes']
+    return stats
@@ -15,6 +15,7 @@ from DIRAC.WorkloadManagementSystem.DB.JobLoggingDB import JobLoggingDB
 from DIRAC.WorkloadManagementSystem.Service.JobPolicy import JobPolicy, RIGHT_GET_INFO
 import DIRAC.Core.Utilities.Time as Time
 from DIRAC.ConfigurationSystem.Client.Helpers.Operations import Operations
+from DIRAC.Core.Utilities.ChunkedResult import streamResult
 
 # These are global instances of the DB classes
 gJobDB = False
@@ -139,7 +140,7 @@ class JobMonitoringHandler( RequestHandler ):
 
     print attrDict
 
-    return gJobDB.selectJobs( attrDict, newer = cutDate )
+    return streamResult( gJobDB.selectJobs( attrDict, newer = cutDate ) )
 
 ##############################################################################
   types_getCounters = [ ListType ]
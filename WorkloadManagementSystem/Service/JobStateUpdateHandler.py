@@ -9,17 +9,23 @@
 
 # from types import *
 import time
-from DIRAC.Core.DISET.RequestHandler import RequestHandler
+import atexit
+from DIRAC.Core.DISET.RequestHandler import RequestHandler, getServiceOption
 from DIRAC.Core.Utilities import Time
+from DIRAC.Core.Utilities.ThreadScheduler import gThreadScheduler
 from DIRAC import gLogger, S_OK, S_ERROR
+from DIRAC.FrameworkSystem.Client.MonitoringClient import gMonitor
 from DIRAC.WorkloadManagementSystem.DB.JobDB import JobDB
 from DIRAC.WorkloadManagementSystem.DB.JobLoggingDB import JobLoggingDB
+from DIRAC.WorkloadManagementSystem.Service.HeartBeatBuffer import HeartBeatBuffer
 
 __RCSID__ = "$Id$"
 
 # This is a global instance of the JobDB class
 jobDB = False
 logDB = False
+# Write-behind buffer of the heart beats, None if they are written synchronously
+gHeartBeatBuffer = None
 
 JOB_FINAL_STATES = ['Done', 'Completed', 'Failed']
 
@@ -27,10 +33,40 @@ def initializeJobStateUpdateHandler( serviceInfo ):
 
   global jobDB
   global logDB
+  global gHeartBeatBuffer
   jobDB = JobDB()
   logDB = JobLoggingDB()
+
+  flushPeriod = getServiceOption( serviceInfo, 'HeartBeatFlushPeriod', 5 )
+  if flushPeriod > 0:
+    gHeartBeatBuffer = HeartBeatBuffer( jobDB, getServiceOption( serviceInfo, 'MaxBufferedHeartBeats', 10000 ) )
+    gMonitor.registerActivity( 'heartBeatsFlushed', "Heart beats written to the JobDB",
+                               'JobStateUpdate', "heartbeats", gMonitor.OP_SUM )
+    gMonitor.registerActivity( 'heartBeatsPending', "Heart beats waiting to be written",
+                               'JobStateUpdate', "heartbeats", gMonitor.OP_MEAN )
+    gMonitor.registerActivity( 'heartBeatsDropped', "Heart beats lost after failed writes",
+                               'JobStateUpdate', "heartbeats", gMonitor.OP_SUM )
+    gMonitor.registerActivity( 'heartBeatsCoalesced', "Static heart beat parameters coalesced",
+                               'JobStateUpdate', "parameters", gMonitor.OP_SUM )
+    gMonitor.registerActivity( 'heartBeatFlushTime', "Heart beat flush time",
+                               'JobStateUpdate', "secs", gMonitor.OP_MEAN )
+    gThreadScheduler.addPeriodicTask( flushPeriod, flushHeartBeats )
+    # Do not lose the buffered heart beats when the service is stopped
+    atexit.register( gHeartBeatBuffer.flush )
   return S_OK()
 
+def flushHeartBeats():
+  """ Write the buffered heart beats and report the buffer activity
+  """
+  gHeartBeatBuffer.flush()
+  stats = gHeartBeatBuffer.getStats()
+  gMonitor.addMark( 'heartBeatsFlushed', stats['Flushed'] )
+  gMonitor.addMark( 'heartBeatsPending', stats['Pending'] )
+  gMonitor.addMark( 'heartBeatsDropped', stats['Dropped'] )
+  gMonitor.addMark( 'heartBeatsCoalesced', stats['Coalesced'] )
+  if stats['Flushes']:
+    gMonitor.addMark( 'heartBeatFlushTime', stats['FlushTime'] )
+
 class JobStateUpdateHandler( RequestHandler ):
 
   ###########################################################################
@@ -308,7 +344,10 @@ class JobStateUpdateHandler( RequestHandler ):
     """ Send a heart beat sign of life for a job jobID
     """
 
-    result = jobDB.setHeartBeatData( int( jobID ), staticData, dynamicData )
+    if gHeartBeatBuffer:
+      result = gHeartBeatBuffer.addHeartBeat( int( jobID ), staticData, dynamicData )
+    else:
+      result = jobDB.setHeartBeatData( int( jobID ), staticData, dynamicData )
     if not result['OK']:
       gLogger.warn( 'Failed to set the heart beat data for job %d ' % int( jobID ) )
 
@@ -6,12 +6,12 @@
 
 __RCSID__ = "$Id$"
 
-from types import StringTypes, DictType, StringTypes
+from types import StringTypes, DictType, IntType, LongType
 
 from DIRAC                                               import gLogger, S_OK, S_ERROR
 
 from DIRAC.Core.Utilities.ThreadScheduler                import gThreadScheduler
-from DIRAC.Core.DISET.RequestHandler                     import RequestHandler
+from DIRAC.Core.DISET.RequestHandler                     import RequestHandler, getServiceOption
 
 from DIRAC.FrameworkSystem.Client.MonitoringClient       import gMonitor
 
@@ -21,11 +21,13 @@ from DIRAC.WorkloadManagementSystem.DB.JobLoggingDB      import JobLoggingDB
 from DIRAC.WorkloadManagementSystem.DB.PilotAgentsDB     import PilotAgentsDB
 
 from DIRAC.WorkloadManagementSystem.Client.Matcher       import Matcher
-from DIRAC.WorkloadManagementSystem.Client.Limiter       import Limiter
+from DIRAC.WorkloadManagementSystem.Client.Limiter       import Limiter, getRunningJobsCache
 from DIRAC.ConfigurationSystem.Client.Helpers.Operations import Operations
 
 gJobDB = False
 gTaskQueueDB = False
+# Maximum number of jobs served by a single requestJobs call
+gMaxJobsPerRequest = 10
 
 
 def initializeMatcherHandler( serviceInfo ):
@@ -36,6 +38,7 @@ def initializeMatcherHandler( serviceInfo ):
   global gTaskQueueDB
   global jlDB
   global pilotAgentsDB
+  global gMaxJobsPerRequest
 
   gJobDB = JobDB()
   gTaskQueueDB = TaskQueueDB()
@@ -50,10 +53,22 @@ def initializeMatcherHandler( serviceInfo ):
                              'Matching', "matches" , gMonitor.OP_RATE, 300 )
   gMonitor.registerActivity( 'numTQs', "Number of Task Queues",
                              'Matching', "tqsk queues" , gMonitor.OP_MEAN, 300 )
+  gMonitor.registerActivity( 'limiterCacheHitRate', "Limiter running jobs cache hit rate",
+                             'Matching', "ratio" , gMonitor.OP_MEAN, 300 )
+  gMonitor.registerActivity( 'limiterCacheStaleness', "Limiter running jobs cache age",
+                             'Matching', "secs" , gMonitor.OP_MEAN, 300 )
+
+  gMaxJobsPerRequest = max( 1, getServiceOption( serviceInfo, "MaxJobsPerRequest", gMaxJobsPerRequest ) )
+
+  if getServiceOption( serviceInfo, "UseMatchIndex", False ):
+    result = gTaskQueueDB.enableMatchIndex( getServiceOption( serviceInfo, "MatchIndexRefreshPeriod", 60 ) )
+    if not result[ 'OK' ]:
+      return result
 
   gTaskQueueDB.recalculateTQSharesForAll()
   gThreadScheduler.addPeriodicTask( 120, gTaskQueueDB.recalculateTQSharesForAll )
   gThreadScheduler.addPeriodicTask( 60, sendNumTaskQueues )
+  gThreadScheduler.addPeriodicTask( 60, sendLimiterCacheStats )
 
   sendNumTaskQueues()
 
@@ -66,6 +81,11 @@ def sendNumTaskQueues():
   else:
     gLogger.error( "Cannot get the number of task queues", result[ 'Message' ] )
 
+def sendLimiterCacheStats():
+  stats = getRunningJobsCache().getStats()
+  gMonitor.addMark( 'limiterCacheHitRate', stats[ 'HitRate' ] )
+  gMonitor.addMark( 'limiterCacheStaleness', stats[ 'Staleness' ] )
+
 class MatcherHandler( RequestHandler ):
 
   def initialize( self ):
@@ -102,6 +122,39 @@ class MatcherHandler( RequestHandler ):
       # FIXME: This is correctly interpreted by the JobAgent, but DErrno should be used instead
       return S_ERROR( "No match found" )
 
+##############################################################################
+  types_requestJobs = [ DictType, ( IntType, LongType ) ]
+  def export_requestJobs( self, resourceDescription, maxJobs, resourceBudget = None ):
+    """ Serve up to maxJobs jobs fitting together in the resource budget (NumberOfProcessors
+        and MaxRAM, taken from the resourceDescription by default) in a single call. maxJobs is
+        capped by the MaxJobsPerRequest option. Each job is still matched with its own queries
+        to the TaskQueueDB, only the checks and the retrieval of the job information are grouped
+    """
+
+    resourceDescription['Setup'] = self.serviceInfoDict['clientSetup']
+    credDict = self.getRemoteCredentials()
+    maxJobs = min( max( 1, maxJobs ), gMaxJobsPerRequest )
+
+    try:
+      opsHelper = Operations( group = credDict['group'] )
+      matcher = Matcher( pilotAgentsDB = pilotAgentsDB,
+                         jobDB = gJobDB,
+                         tqDB = gTaskQueueDB,
+                         jlDB = jlDB,
+                         opsHelper = opsHelper )
+      result = matcher.selectJobs( resourceDescription, credDict, maxJobs = maxJobs,
+                                   resourceBudget = resourceBudget )
+    except RuntimeError as rte:
+      self.log.error( "Error requesting jobs: ", rte )
+      return S_ERROR( "Error requesting job" )
+
+    gMonitor.addMark( "matchesDone" )
+    if result:
+      gMonitor.addMark( "matchesOK", len( result ) )
+      return S_OK( result )
+    else:
+      return S_ERROR( "No match found" )
+
 ##############################################################################
   types_getActiveTaskQueues = []
   def export_getActiveTaskQueues( self ):
@@ -6,33 +6,53 @@ from DIRAC.Core.Utilities import ThreadScheduler
 from DIRAC.Core.Base.ExecutorMindHandler import ExecutorMindHandler
 from DIRAC.WorkloadManagementSystem.Client.JobState.JobState import JobState
 from DIRAC.WorkloadManagementSystem.Client.JobState.CachedJobState import CachedJobState
+from DIRAC.WorkloadManagementSystem.Client.JobState.CommitBatcher import CommitBatcher
+from DIRAC.Core.Utilities.List import breakListIntoChunks
 
 class OptimizationMindHandler( ExecutorMindHandler ):
 
   __jobDB = False
   __optimizationStates = [ 'Received', 'Checking' ]
   __loadTaskId = False
+  __commitBatcher = False
 
   MSG_DEFINITIONS = { 'OptimizeJobs' : { 'jids' : ( types.ListType, types.TupleType ) } }
 
   auth_msg_OptimizeJobs = [ 'all' ]
   def msg_OptimizeJobs( self, msgObj ):
-    jids = msgObj.jids
-    for jid in jids:
+    jids = []
+    for jid in msgObj.jids:
       try:
-        jid = int( jid )
+        jids.append( int( jid ) )
       except ValueError:
         self.log.error( "Job ID %s has to be an integer" % jid )
-        continue
+    result = self.__loadStates( jids )
+    if not result[ 'OK' ]:
+      return result
+    for jobState in result[ 'Value' ]:
+      jid = jobState.jid
       #Forget and add task to ensure state is reset
       self.forgetTask( jid )
-      result = self.executeTask( jid, CachedJobState( jid ) )
+      result = self.executeTask( jid, jobState )
       if not result[ 'OK' ]:
-        self.log.error( "Could not add job %s to optimization: %s" % ( jid, result[ 'Value' ] ) )
+        self.log.error( "Could not add job %s to optimization: %s" % ( jid, result[ 'Message' ] ) )
       else:
         self.log.info( "Received new job %s" % jid )
     return S_OK()
 
+  @classmethod
+  def __loadStates( cls, jids ):
+    """ Load the states of the jobs with grouped queries, in chunks
+    """
+    jobStates = []
+    for jidChunk in breakListIntoChunks( jids, cls.srv_getCSOption( "JobLoadBulkSize", 1000 ) ):
+      result = CachedJobState.loadBulk( jidChunk )
+      if not result[ 'OK' ]:
+        cls.log.error( "Could not load the state of jobs", result[ 'Message' ] )
+        return result
+      jobStates.extend( result[ 'Value' ] )
+    return S_OK( jobStates )
+
   @classmethod
   def __loadJobs( cls, eTypes = None ):
     log = cls.log
@@ -67,14 +87,14 @@ class OptimizationMindHandler( ExecutorMindHandler ):
         return result
       jidList = result[ 'Value' ]
       knownJids = cls.getTaskIds()
-      added = 0
-      for jid in jidList:
-        jid = long( jid )
-        if jid not in knownJids:
-          #Same as before. Check that the state is ok.
-          cls.executeTask( jid, CachedJobState( jid ) )
-          added += 1
-      log.info( "Added %s/%s jobs for %s state" % ( added, len( jidList ), opState ) )
+      newJids = [ long( jid ) for jid in jidList if long( jid ) not in knownJids ]
+      result = cls.__loadStates( newJids )
+      if not result[ 'OK' ]:
+        return result
+      for jobState in result[ 'Value' ]:
+        #Same as before. Check that the state is ok.
+        cls.executeTask( jobState.jid, jobState )
+      log.info( "Added %s/%s jobs for %s state" % ( len( newJids ), len( jidList ), opState ) )
     return S_OK()
 
   @classmethod
@@ -88,6 +108,8 @@ class OptimizationMindHandler( ExecutorMindHandler ):
     cls.setFreezeOnFailedDispatch( False )
     cls.setFreezeOnUnknownExecutor( False )
     cls.setAllowedClients( "JobManager" )
+    cls.__commitBatcher = CommitBatcher( maxBatchSize = cls.srv_getCSOption( "CommitBatchSize", 100 ),
+                                         maxWait = cls.srv_getCSOption( "CommitBatchWait", 0.05 ) )
     JobState.checkDBAccess()
     JobState.cleanTaskQueues()
     period = cls.srv_getCSOption( "LoadJobPeriod", 60 )
@@ -104,7 +126,7 @@ class OptimizationMindHandler( ExecutorMindHandler ):
   @classmethod
   def exec_taskProcessed( cls, jid, jobState, eType ):
     cls.log.info( "Saving changes for job %s after %s" % ( jid, eType ) )
-    result = jobState.commitChanges()
+    result = cls.__commitBatcher.commit( jobState )
     if not result[ 'OK' ]:
       cls.log.error( "Could not save changes for job", "%s: %s" % ( jid, result[ 'Message' ] ) )
     return result
@@ -112,7 +134,7 @@ class OptimizationMindHandler( ExecutorMindHandler ):
   @classmethod
   def exec_taskFreeze( cls, jid, jobState, eType ):
     cls.log.info( "Saving changes for job %s before freezing from %s" % ( jid, eType ) )
-    result = jobState.commitChanges()
+    result = cls.__commitBatcher.commit( jobState )
     if not result[ 'OK' ]:
       cls.log.error( "Could not save changes for job", "%s: %s" % ( jid, result[ 'Message' ] ) )
     return result
@@ -580,9 +580,9 @@ class WMSAdministratorHandler(RequestHandler):
     return result
 
   ##########################################################################################
-  types_setAccountingFlag = [StringTypes]
+  types_setAccountingFlag = [ list( StringTypes ) + [ ListType ] ]
   def export_setAccountingFlag(self,pilotRef,mark='True'):
-    """ Set the pilot AccountingSent flag
+    """ Set the pilot AccountingSent flag of a pilot or of a list of pilots
     """
     result = pilotDB.setAccountingFlag(pilotRef,mark)
     return result
@@ -597,6 +597,14 @@ class WMSAdministratorHandler(RequestHandler):
                                     statusReason=reason,gridSite=gridSite,queue=queue)
     return result
 
+  ##########################################################################################
+  types_setPilotsStatus = [ DictType ]
+  def export_setPilotsStatus( self, pilotStatusDict, reason = None ):
+    """ Set the status of many pilots at once
+    """
+
+    return pilotDB.setPilotsStatus( pilotStatusDict, statusReason = reason )
+
   ##########################################################################################
   types_countPilots = [ DictType ]
   def export_countPilots(self,condDict, older=None, newer=None, timeStamp='SubmissionTime'):
@@ -0,0 +1,124 @@
+""" Test class for the HeartBeatBuffer of the JobStateUpdate service
+"""
+
+# imports
+import time
+import unittest
+from mock import MagicMock
+
+from DIRAC import S_OK, S_ERROR
+
+# sut
+from DIRAC.WorkloadManagementSystem.Service.HeartBeatBuffer import HeartBeatBuffer
+from DIRAC.WorkloadManagementSystem.DB.JobDB import JobDB
+
+class HeartBeatBufferTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    self.jobDB = MagicMock()
+    self.jobDB.setHeartBeatDataBulk.return_value = S_OK()
+
+  def test_coalesce( self ):
+    hbBuffer = HeartBeatBuffer( self.jobDB )
+    hbBuffer.addHeartBeat( 1, { 'Node' : 'a', 'CPU' : 'x' }, { 'LoadAverage' : 1.0 } )
+    hbBuffer.addHeartBeat( 1, { 'Node' : 'b' }, { 'LoadAverage' : 2.0 } )
+    hbBuffer.addHeartBeat( 2, {}, { 'LoadAverage' : 3.0 } )
+    self.assertFalse( self.jobDB.setHeartBeatDataBulk.called )
+
+    res = hbBuffer.flush()
+    self.assertEqual( res['Value'], 3 )
+    self.assertEqual( self.jobDB.setHeartBeatDataBulk.call_count, 1 )
+    heartBeats = self.jobDB.setHeartBeatDataBulk.call_args[0][0]
+    self.assertEqual( heartBeats[1][0], { 'Node' : 'b', 'CPU' : 'x' } )
+    self.assertEqual( [ dynamicData for _hbTime, dynamicData in heartBeats[1][1] ],
+                      [ { 'LoadAverage' : 1.0 }, { 'LoadAverage' : 2.0 } ] )
+    self.assertEqual( len( heartBeats[2][1] ), 1 )
+
+    stats = hbBuffer.getStats()
+    self.assertEqual( stats['Flushed'], 3 )
+    self.assertEqual( stats['Coalesced'], 1 )
+    self.assertEqual( stats['Pending'], 0 )
+
+  def test_boundedLoss( self ):
+    # Flushed by the callers even right after a failed write
+    hbBuffer = HeartBeatBuffer( self.jobDB, maxBufferedHeartBeats = 3, retryDelay = 0 )
+    hbBuffer.addHeartBeat( 1, {}, { 'LoadAverage' : 1.0 } )
+    hbBuffer.addHeartBeat( 2, {}, { 'LoadAverage' : 1.0 } )
+    self.assertFalse( self.jobDB.setHeartBeatDataBulk.called )
+    # The buffer is full, the heart beats are written synchronously
+    hbBuffer.addHeartBeat( 3, {}, { 'LoadAverage' : 1.0 } )
+    self.assertEqual( self.jobDB.setHeartBeatDataBulk.call_count, 1 )
+    self.assertEqual( hbBuffer.getNumPendingHeartBeats(), 0 )
+
+    # Failed writes are retried while there is room in the buffer
+    self.jobDB.setHeartBeatDataBulk.return_value = S_ERROR( 'DB down' )
+    hbBuffer.addHeartBeat( 1, {}, { 'LoadAverage' : 1.0 } )
+    hbBuffer.addHeartBeat( 1, {}, { 'LoadAverage' : 1.0 } )
+    res = hbBuffer.flush()
+    self.assertEqual( res['Value'], 0 )
+    self.assertEqual( hbBuffer.getNumPendingHeartBeats(), 2 )
+    # When the buffer is full again the heart beats that do not fit are dropped
+    hbBuffer.addHeartBeat( 2, {}, { 'LoadAverage' : 1.0 } )
+    self.assertEqual( hbBuffer.getNumPendingHeartBeats(), 3 )
+    hbBuffer.addHeartBeat( 2, {}, { 'LoadAverage' : 1.0 } )
+    stats = hbBuffer.getStats()
+    self.assertEqual( stats['Dropped'], 2 )
+    self.assertEqual( stats['Pending'], 2 )
+
+  def test_retryDelay( self ):
+    hbBuffer = HeartBeatBuffer( self.jobDB, maxBufferedHeartBeats = 10, retryDelay = 60 )
+    self.jobDB.setHeartBeatDataBulk.return_value = S_ERROR( 'DB down' )
+    for i in range( 10 ):
+      hbBuffer.addHeartBeat( i % 2, {}, { 'Index' : i } )
+    self.assertEqual( self.jobDB.setHeartBeatDataBulk.call_count, 1 )
+    self.assertEqual( hbBuffer.getNumPendingHeartBeats(), 10 )
+
+    # The buffer is full and the DB was down: the oldest heart beats are dropped instead of flushing
+    hbBuffer.addHeartBeat( 2, {}, { 'Index' : 10 } )
+    hbBuffer.addHeartBeat( 2, {}, { 'Index' : 11 } )
+    self.assertEqual( self.jobDB.setHeartBeatDataBulk.call_count, 1 )
+    self.assertEqual( hbBuffer.getNumPendingHeartBeats(), 9 )
+
+    # The periodic flush writes what is left
+    self.jobDB.setHeartBeatDataBulk.return_value = S_OK()
+    self.assertEqual( hbBuffer.flush()['Value'], 9 )
+    heartBeats = self.jobDB.setHeartBeatDataBulk.call_args[0][0]
+    indexes = sorted( dynamicData['Index'] for jobID in heartBeats for _hbTime, dynamicData in heartBeats[jobID][1] )
+    self.assertEqual( indexes, range( 3, 12 ) )
+    self.assertEqual( hbBuffer.getStats()['Dropped'], 3 )
+
+    # The callers flush again once the DB is back
+    for i in range( 10 ):
+      hbBuffer.addHeartBeat( 1, {}, { 'Index' : i } )
+    self.assertEqual( self.jobDB.setHeartBeatDataBulk.call_count, 3 )
+    self.assertEqual( hbBuffer.getNumPendingHeartBeats(), 0 )
+
+  def test_bulkStatement( self ):
+    # JobDB without connection, the statements are only recorded
+    jobDB = JobDB.__new__( JobDB )
+    jobDB.JOB_FINAL_STATES = [ 'Done', 'Completed', 'Failed' ]
+    jobDB.log = MagicMock()
+    jobDB._escapeString = lambda value: S_OK( "'%s'" % value )
+    jobDB._update = MagicMock( return_value = S_OK() )
+    hbBuffer = HeartBeatBuffer( jobDB )
+    hbBuffer.addHeartBeat( 1, { 'Node' : 'a' }, { 'LoadAverage' : 1.0 } )
+    hbBuffer.addHeartBeat( 2, {}, { 'LoadAverage' : 3.0 } )
+    self.assertEqual( hbBuffer.flush()['Value'], 2 )
+    statements = [ call[0][0] for call in jobDB._update.call_args_list ]
+    self.assertEqual( len( statements ), 3 )
+    # The jobs already in a final state keep their status
+    self.assertTrue( "WHEN Status IN ('Done','Completed','Failed','Killed','Deleted') THEN Status" in statements[0] )
+    # The heart beat time is taken on the DB clock, minus the time spent in the buffer
+    self.assertTrue( 'WHEN 1 THEN UTC_TIMESTAMP() - INTERVAL 0 SECOND' in statements[0] )
+    self.assertTrue( 'UTC_TIMESTAMP() - INTERVAL' in statements[2] )
+
+  def test_bufferedTime( self ):
+    hbBuffer = HeartBeatBuffer( self.jobDB )
+    hbBuffer.addHeartBeat( 1, {}, { 'LoadAverage' : 1.0 } )
+    hbBuffer.flush()
+    heartBeatTime = self.jobDB.setHeartBeatDataBulk.call_args[0][0][1][1][0][0]
+    self.assertTrue( abs( time.time() - heartBeatTime ) < 60 )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( HeartBeatBufferTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
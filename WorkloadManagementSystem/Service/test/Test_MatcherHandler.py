@@ -0,0 +1,41 @@
+""" Test class for the requestJobs call of the Matcher service
+"""
+
+# imports
+import unittest
+from mock import MagicMock, patch
+
+from DIRAC import S_OK
+
+# sut
+import DIRAC.WorkloadManagementSystem.Service.MatcherHandler as moduleTested
+
+class MatcherHandlerTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    self.handler = moduleTested.MatcherHandler.__new__( moduleTested.MatcherHandler )
+    self.handler.serviceInfoDict = { 'clientSetup' : 'aSetup' }
+    self.handler.getRemoteCredentials = MagicMock( return_value = { 'group' : 'pilot' } )
+    self.handler.log = MagicMock()
+    self.matcher = MagicMock()
+    self.matcher.selectJobs.return_value = [ { 'JobID' : 1 } ]
+    for name, value in [ ( 'pilotAgentsDB', MagicMock() ), ( 'jlDB', MagicMock() ),
+                         ( 'gMaxJobsPerRequest', 5 ) ]:
+      valuePatch = patch.object( moduleTested, name, value, create = True )
+      valuePatch.start()
+      self.addCleanup( valuePatch.stop )
+    for name, value in [ ( 'Matcher', MagicMock( return_value = self.matcher ) ),
+                         ( 'Operations', MagicMock() ), ( 'gMonitor', MagicMock() ) ]:
+      valuePatch = patch.object( moduleTested, name, value )
+      valuePatch.start()
+      self.addCleanup( valuePatch.stop )
+
+  def test_maxJobs( self ):
+    for requested, served in [ ( 3, 3 ), ( 5, 5 ), ( 1000, 5 ), ( 0, 1 ) ]:
+      res = self.handler.export_requestJobs( {}, requested )
+      self.assertEqual( res, S_OK( [ { 'JobID' : 1 } ] ) )
+      self.assertEqual( self.matcher.selectJobs.call_args[1]['maxJobs'], served )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( MatcherHandlerTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
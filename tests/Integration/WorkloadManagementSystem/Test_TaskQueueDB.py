@@ -73,9 +73,52 @@ class TQTests( TQDBTestCase ):
     self.assert_( result['OK'] )
 
 
+class TQMatchIndexTests( TQDBTestCase ):
+  """ Matching through the in-memory index
+  """
+
+  def test_matchIndex( self ):
+    """ the index selects the same TQs as the SQL match
+    """
+    result = self.tqDB.enableMatchIndex( 60 )
+    self.assert_( result['OK'] )
+    tqDefDict = {'OwnerDN': '/my/DN', 'OwnerGroup':'myGroup', 'Setup':'aSetup', 'CPUTime':50000,
+                 'Sites': ['Site.1', 'Site.2'], 'Tags': ['MultiProcessor']}
+    result = self.tqDB.insertJob( 321, tqDefDict, 10 )
+    self.assert_( result['OK'] )
+    tq = self.tqDB.getTaskQueueForJob( 321 )['Value']
+
+    for matchDict, matches in ( ( {'Setup': 'aSetup', 'CPUTime': 300000, 'Site': 'Site.1'}, False ),
+                                ( {'Setup': 'aSetup', 'CPUTime': 300000, 'Site': 'Site.3',
+                                   'Tag': ['MultiProcessor']}, False ),
+                                ( {'Setup': 'aSetup', 'CPUTime': 300000, 'Site': 'Site.1',
+                                   'Tag': ['MultiProcessor', 'GPU']}, True ) ):
+      result = self.tqDB.matchAndGetTaskQueue( matchDict, numQueuesToGet = 0 )
+      self.assert_( result['OK'] )
+      self.assertEqual( tq in [ tqTuple[0] for tqTuple in result['Value'] ], matches )
+
+    result = self.tqDB.matchAndGetJob( {'Setup': 'aSetup', 'CPUTime': 300000, 'Site': 'Site.1', 'Tag': 'MultiProcessor'},
+                                       negativeCond = {'Site': ['Site.1']} )
+    self.assert_( result['OK'] )
+    self.assertFalse( result['Value']['matchFound'] )
+
+    # this will also remove the job
+    result = self.tqDB.matchAndGetJob( {'Setup': 'aSetup', 'CPUTime': 300000, 'Site': 'Site.1', 'Tag': 'MultiProcessor'} )
+    self.assert_( result['OK'] )
+    self.assert_( result['Value']['matchFound'] )
+    self.assertEqual( result['Value']['jobId'], 321L )
+    self.assertEqual( result['Value']['taskQueueId'], tq )
+
+    result = self.tqDB.deleteTaskQueue( tq )
+    self.assert_( result['OK'] )
+    result = self.tqDB.matchAndGetJob( {'Setup': 'aSetup', 'CPUTime': 300000, 'Site': 'Site.1', 'Tag': 'MultiProcessor'} )
+    self.assert_( result['OK'] )
+    self.assertFalse( result['Value']['matchFound'] )
+
 
 if __name__ == '__main__':
   suite = unittest.defaultTestLoader.loadTestsFromTestCase(TQDBTestCase)
   suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( TQChain ) )
   suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( TQTests ) )
+  suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( TQMatchIndexTests ) )
   testResult = unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+""" Benchmark of the getReplicas response in the dictionary and in the compact format:
+    DEncode payload size, decoding time and memory of the decoded structure
+
+    Usage: python replicasBenchmark.py [<number of files>]
+"""
+
+import sys
+import time
+import random
+
+from DIRAC.Core.Utilities import DEncode
+from DIRAC.Resources.Catalog.CompactReplicas import compactReplicas, expandReplicas
+
+SES = [ 'CERN-RAW', 'CNAF-RAW', 'GRIDKA-RAW', 'IN2P3-RAW', 'PIC-RAW', 'RAL-RAW',
+        'CERN-DST', 'CNAF-DST', 'GRIDKA-DST', 'IN2P3-DST', 'PIC-DST', 'RAL-DST' ]
+
+def generateReplicas( nFiles ):
+  """ Files of 100 per directory, with 2 or 3 replicas and no PFN as in the DFC
+  """
+  replicas = {}
+  for i in xrange( nFiles ):
+    lfn = '/vo/data/2016/RAW/FULL/COLLISION16/%d/file_%06d.raw' % ( i // 100, i )
+    replicas[lfn] = dict.fromkeys( random.sample( SES, random.randint( 2, 3 ) ), '' )
+  return replicas
+
+def getDeepSize( obj, seen = None ):
+  """ Approximate memory size of a structure of containers and strings
+  """
+  if seen is None:
+    seen = set()
+  if id( obj ) in seen:
+    return 0
+  seen.add( id( obj ) )
+  size = sys.getsizeof( obj )
+  if isinstance( obj, dict ):
+    size += sum( getDeepSize( key, seen ) + getDeepSize( value, seen ) for key, value in obj.iteritems() )
+  elif isinstance( obj, ( list, tuple, set ) ):
+    size += sum( getDeepSize( item, seen ) for item in obj )
+  return size
+
+def measure( payload ):
+  """ Encoded size in MB, decoding time in seconds, decoded structure
+  """
+  encoded = DEncode.encode( payload )
+  start = time.time()
+  decoded = DEncode.decode( encoded )[0]
+  return len( encoded ) / 1024. / 1024., time.time() - start, decoded
+
+def main():
+  nFiles = 100000
+  if len( sys.argv ) > 1:
+    nFiles = int( sys.argv[1] )
+  random.seed( 1 )
+  replicas = generateReplicas( nFiles )
+
+  start = time.time()
+  compact = compactReplicas( replicas )
+  compactTime = time.time() - start
+  dictSize, dictDecode, dictDecoded = measure( replicas )
+  compactSize, compactDecode, compactDecoded = measure( compact )
+  start = time.time()
+  expandReplicas( compactDecoded )
+  expandTime = time.time() - start
+
+  print "getReplicas response for %d files, server side compaction in %.2f s" % ( nFiles, compactTime )
+  print "%10s %14s %12s %14s" % ( 'Format', 'Payload (MB)', 'Decode (s)', 'Memory (MB)' )
+  print "%10s %14.2f %12.2f %14.1f" % ( 'Dict', dictSize, dictDecode, getDeepSize( dictDecoded ) / 1024. / 1024. )
+  print "%10s %14.2f %12.2f %14.1f" % ( 'Compact', compactSize, compactDecode,
+                                        getDeepSize( compactDecoded ) / 1024. / 1024. )
+  print "Expansion of the compact format in %.2f s" % expandTime
+
+if __name__ == "__main__":
+  main()
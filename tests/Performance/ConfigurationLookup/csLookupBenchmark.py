@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+""" Microbenchmark comparing cached and uncached configuration lookups
+
+    Usage: python csLookupBenchmark.py [<number of lookups>]
+"""
+
+import sys
+import time
+
+from DIRAC.Core.Utilities import List
+from DIRAC.ConfigurationSystem.private.ConfigurationData import ConfigurationData
+from DIRAC.ConfigurationSystem.private import ConfigurationClient
+
+
+def generateCFG( nSystems = 20, nSections = 20, nOptions = 20 ):
+  """ Build a configuration of nSystems * nSections * nOptions options
+  """
+  lines = [ "Systems", "{" ]
+  for iSys in range( nSystems ):
+    lines.extend( [ "  System%d" % iSys, "  {" ] )
+    for iSec in range( nSections ):
+      lines.extend( [ "    Section%d" % iSec, "    {" ] )
+      for iOpt in range( nOptions ):
+        lines.append( "      Option%d = %d, %d" % ( iOpt, iOpt, iOpt + 1 ) )
+      lines.append( "    }" )
+    lines.append( "  }" )
+  lines.append( "}" )
+  return "\n".join( lines )
+
+def timeLookups( lookupFunction, paths, nLookups ):
+  start = time.time()
+  nPaths = len( paths )
+  for i in xrange( nLookups ):
+    lookupFunction( paths[ i % nPaths ] )
+  return time.time() - start
+
+def main():
+  nLookups = 100000
+  if len( sys.argv ) > 1:
+    nLookups = int( sys.argv[1] )
+
+  cfgData = ConfigurationData( False )
+  cfgData.loadRemoteCFGFromMem( generateCFG() )
+  paths = [ "/Systems/System%d/Section%d/Option%d" % ( i % 20, ( i * 7 ) % 20, ( i * 13 ) % 20 ) for i in range( 500 ) ]
+  # Make the client use the benchmark configuration
+  ConfigurationClient.gConfigurationData = cfgData
+  client = ConfigurationClient.ConfigurationClient()
+
+  uncached = timeLookups( cfgData.extractOptionFromCFG, paths, nLookups )
+  cached = timeLookups( cfgData.extractCachedOption, paths, nLookups )
+  uncachedList = timeLookups( lambda path: List.fromChar( cfgData.extractOptionFromCFG( path ), "," ), paths, nLookups )
+  cachedList = timeLookups( lambda path: client.getValue( path, [] ), paths, nLookups )
+
+  print "%d lookups over %d paths" % ( nLookups, len( paths ) )
+  print "Raw value:  uncached %.3f s, cached %.3f s (x%.1f)" % ( uncached, cached, uncached / cached )
+  print "List value: uncached %.3f s, cached %.3f s (x%.1f)" % ( uncachedList, cachedList, uncachedList / cachedList )
+
+if __name__ == "__main__":
+  main()
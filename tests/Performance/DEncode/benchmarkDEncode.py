@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+""" Benchmark of the DEncode encoding and decoding throughput over realistic payloads
+
+    Usage: python benchmarkDEncode.py [<number of repetitions>]
+"""
+
+import sys
+import time
+import datetime
+
+from DIRAC.Core.Utilities import DEncode
+
+
+def replicasPayload( nFiles = 20000 ):
+  """ Result of a getReplicas call
+  """
+  successful = {}
+  for i in xrange( nFiles ):
+    lfn = '/vo/data/2016/RAW/FULL/COLLISION16/%d/file_%06d.raw' % ( i // 100, i )
+    successful[ lfn ] = { 'CERN-RAW' : 'srm://srm.cern.ch/eos/vo%s' % lfn,
+                          'CNAF-RAW' : 'srm://storm-fe.cr.cnaf.infn.it/vo%s' % lfn }
+  return { 'OK' : True, 'Value' : { 'Successful' : successful, 'Failed' : {} } }
+
+def jobTablePayload( nJobs = 20000 ):
+  """ Result of a getJobPageSummaryWeb like call
+  """
+  now = datetime.datetime.utcnow()
+  parameters = [ 'JobID', 'Status', 'MinorStatus', 'Site', 'Owner', 'OwnerGroup', 'CPUTime', 'LastUpdateTime' ]
+  records = [ [ i, 'Running', 'Application', 'LCG.CERN.ch', 'user%d' % ( i % 50 ), 'vo_user',
+                1234.5 + i, now ] for i in xrange( nJobs ) ]
+  return { 'OK' : True, 'Value' : { 'ParameterNames' : parameters, 'Records' : records, 'TotalRecords' : nJobs } }
+
+def accountingPayload( nRecords = 20000 ):
+  """ Bundle of accounting records
+  """
+  now = datetime.datetime.utcnow()
+  return [ ( 'DataOperation', now, now, [ 'putAndRegister', 'user', 'DataManager', 'CERN-USER', 'LCG.CERN.ch',
+                                          'Successful', 1, 1, 1024 * i, 0.5, 0., 1, 1 ] ) for i in xrange( nRecords ) ]
+
+def benchmark( name, payload, repetitions ):
+  encoded = DEncode.encode( payload )
+  start = time.time()
+  for _i in xrange( repetitions ):
+    DEncode.encode( payload )
+  encodeTime = ( time.time() - start ) / repetitions
+  start = time.time()
+  for _i in xrange( repetitions ):
+    DEncode.decode( encoded )
+  decodeTime = ( time.time() - start ) / repetitions
+  sizeMB = len( encoded ) / 1024. / 1024.
+  print "%-12s %7.2f MB  encode %7.2f MB/s  decode %7.2f MB/s" % ( name, sizeMB,
+                                                                   sizeMB / encodeTime,
+                                                                   sizeMB / decodeTime )
+
+def main():
+  repetitions = 5
+  if len( sys.argv ) > 1:
+    repetitions = int( sys.argv[1] )
+  print "Using %s.encode" % DEncode.encode.__module__
+  benchmark( "Replicas", replicasPayload(), repetitions )
+  benchmark( "JobTable", jobTablePayload(), repetitions )
+  benchmark( "Accounting", accountingPayload(), repetitions )
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+""" Microbenchmark comparing the routing of files to transformations by metadata,
+    evaluating a MetaQuery per transformation or using the compiled filter index
+
+    Usage: python filterBenchmark.py [<number of files>]
+"""
+
+import sys
+import time
+import random
+
+from DIRAC.DataManagementSystem.Client.MetaQuery import MetaQuery
+from DIRAC.TransformationSystem.Client.MetadataFilterIndex import MetadataFilterIndex
+
+TYPE_DICT = { 'DataType' : 'VARCHAR(128)',
+              'ProcessingPass' : 'VARCHAR(128)',
+              'Run' : 'INT',
+              'Polarity' : 'VARCHAR(16)' }
+DATA_TYPES = [ 'RAW', 'FULL.DST', 'BHADRON.MDST', 'CHARM.MDST', 'LEPTONIC.MDST', 'EW.DST' ]
+
+def generateFilters( nTransformations ):
+  """ Filters on the processing pass and data type, with some run ranges
+  """
+  filters = []
+  for transID in xrange( nTransformations ):
+    query = { 'ProcessingPass' : 'Pass%d' % ( transID // 4 ),
+              'DataType' : random.sample( DATA_TYPES, 2 ) }
+    if transID % 3 == 0:
+      query['Run'] = { '>=' : transID * 10, '<' : transID * 10 + 1000 }
+    filters.append( ( transID, query ) )
+  return filters
+
+def generateFiles( nFiles, nTransformations ):
+  return [ { 'ProcessingPass' : 'Pass%d' % random.randint( 0, nTransformations // 4 ),
+             'DataType' : random.choice( DATA_TYPES ),
+             'Run' : random.randint( 0, nTransformations * 10 ),
+             'Polarity' : random.choice( [ 'Up', 'Down' ] ) } for _i in xrange( nFiles ) ]
+
+def routeWithMetaQuery( filters, files ):
+  for metadataDict in files:
+    [ transID for transID, query in filters if MetaQuery( query, TYPE_DICT ).applyQuery( metadataDict )['Value'] ]
+
+def routeWithIndex( filters, files ):
+  filterIndex = MetadataFilterIndex()
+  filterIndex.setFilters( filters, TYPE_DICT )
+  for metadataDict in files:
+    filterIndex.getTransformations( metadataDict )
+
+def main():
+  nFiles = 2000
+  if len( sys.argv ) > 1:
+    nFiles = int( sys.argv[1] )
+  random.seed( 1 )
+
+  print "Files routed per second for %d files" % nFiles
+  print "%16s %12s %12s" % ( 'Transformations', 'MetaQuery', 'Index' )
+  for nTransformations in ( 10, 100, 500, 1000 ):
+    filters = generateFilters( nTransformations )
+    files = generateFiles( nFiles, nTransformations )
+    start = time.time()
+    routeWithMetaQuery( filters, files )
+    metaQueryRate = nFiles / ( time.time() - start )
+    start = time.time()
+    routeWithIndex( filters, files )
+    indexRate = nFiles / ( time.time() - start )
+    print "%16d %12.0f %12.0f" % ( nTransformations, metaQueryRate, indexRate )
+
+if __name__ == "__main__":
+  main()